@@ -9,19 +9,43 @@ from typing import Dict, List, Optional, Any
 from datetime import datetime
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends, Query, Path
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends, Query, Path, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
+from bson import ObjectId
 from pydantic import BaseModel, Field
 import uvicorn
 
 from config import config
 from utils.logger import setup_logger, get_logger
-from utils.database import get_db, close_db
-from services.data_processor import DataProcessor
-from services.embedding_generator import EmbeddingGenerator, EmbeddingModel
-from services.vector_migrator import VectorMigrator, MigrationConfig, DataSource
-from services.analytics_ml import AnalyticsMLService, PredictionType
+from utils.database import get_db, close_db, db_manager
+from utils.profiling import get_startup_profiler
+from utils.wire_format import benchmark_wire_formats, dumps_json, negotiate_wire_format, render_embeddings
+from utils.columnar import ColumnarRequest, negotiate_columnar_format, render_table
+from utils.admission import AdmissionMiddleware, admission_controller
+
+startup_profiler = get_startup_profiler()
+
+with startup_profiler.stage("data_processor", "import"):
+    from services.data_processor import DataProcessor
+with startup_profiler.stage("embedding_generator", "import"):
+    from services.embedding_generator import EmbeddingGenerator, EmbeddingModel
+    from services.embedding_stream import NDJSON_MEDIA_TYPE, spool_ndjson, stream_batch_embeddings
+    from services.projectors import PROJECTOR_NAME_PATTERN
+with startup_profiler.stage("vector_migrator", "import"):
+    from services.vector_migrator import VectorMigrator, MigrationConfig, DataSource
+with startup_profiler.stage("analytics_ml", "import"):
+    from services.analytics_ml import AnalyticsMLService, PredictionType
+    from services.analysis_jobs import analysis_job_manager
+with startup_profiler.stage("vector_search", "import"):
+    from services.vector_search import two_stage_search
+    from services.lexical_search import hybrid_search
+    from services.semantic_search import semantic_search
+    from services.vector_compactor import vector_compactor
+    from services.vector_tiering import vector_tiering
+    from services.vectorization_worker import vectorization_worker
+    from services.embedding_job_worker import embedding_job_worker
 
 # Setup logging
 setup_logger(
@@ -44,16 +68,42 @@ async def lifespan(app: FastAPI):
     logger.info("Starting Cryptique Python API service")
     
     # Initialize services
-    await data_processor.initialize()
-    await embedding_generator.initialize()
-    await analytics_ml_service.initialize()
+    with startup_profiler.stage("data_processor", "init"):
+        await data_processor.initialize()
+    with startup_profiler.stage("embedding_generator", "init"):
+        await embedding_generator.initialize()
+    with startup_profiler.stage("analytics_ml", "init"):
+        await analytics_ml_service.initialize()
+        await analysis_job_manager.initialize(data_processor, analytics_ml_service)
+    with startup_profiler.stage("vector_search", "init"):
+        await two_stage_search.initialize()
+        await hybrid_search.initialize()
+        await semantic_search.initialize(embedding_generator)
+        await vector_compactor.initialize()
+        await vector_tiering.initialize()
+        await vectorization_worker.initialize(embedding_generator)
+        await embedding_job_worker.initialize(embedding_generator)
+    if config.get_embedding_config()['vectorization_enabled']:
+        await vectorization_worker.start()
+    if config.get_embedding_config()['job_worker_enabled']:
+        await embedding_job_worker.start()
+    await analysis_job_manager.start()
     
-    logger.info("All services initialized successfully")
+    logger.info(
+        f"All services initialized successfully "
+        f"(startup profile: {startup_profiler.get_report()['total_seconds']:.2f}s)"
+    )
     
     yield
     
     # Shutdown
     logger.info("Shutting down Cryptique Python API service")
+    if vectorization_worker.is_running:
+        await vectorization_worker.stop()
+    if embedding_job_worker.is_running:
+        await embedding_job_worker.stop()
+    await analysis_job_manager.stop()
+    await embedding_generator.shutdown()
     await close_db()
 
 # Create FastAPI app
@@ -64,6 +114,9 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Add admission control (inside CORS, so shed responses carry CORS headers)
+app.add_middleware(AdmissionMiddleware, controller=admission_controller)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -93,6 +146,7 @@ class GenerateEmbeddingRequest(BaseModel):
     model: str = Field(default="gemini", description="Embedding model to use")
     context: Optional[Dict[str, Any]] = Field(None, description="Additional context")
     use_cache: bool = Field(default=True, description="Whether to use cache")
+    encoding_format: str = Field(default="float", description="float, or base64 for little-endian float32")
 
 class GenerateEmbeddingResponse(BaseModel):
     success: bool
@@ -108,6 +162,7 @@ class BatchEmbeddingRequest(BaseModel):
     model: str = Field(default="gemini", description="Embedding model to use")
     batch_size: Optional[int] = Field(None, description="Batch size for processing")
     use_cache: bool = Field(default=True, description="Whether to use cache")
+    encoding_format: str = Field(default="float", description="float, or base64 for little-endian float32")
 
 class BatchEmbeddingResponse(BaseModel):
     success: bool
@@ -118,12 +173,61 @@ class BatchEmbeddingResponse(BaseModel):
     processing_time: Optional[float] = None
     errors: Optional[List[str]] = None
 
+class FitProjectorRequest(BaseModel):
+    name: str = Field(..., pattern=PROJECTOR_NAME_PATTERN)
+    target_dimensions: int = Field(default=256, gt=0)
+    sample_size: int = Field(default=20000, gt=0)
+    filters: Optional[Dict[str, Any]] = None
+
+class TwoStageSearchRequest(BaseModel):
+    query: Optional[str] = None
+    embedding: Optional[List[float]] = None
+    model: str = "gemini"
+    limit: int = Field(default=10, gt=0, le=1000)
+    num_candidates: Optional[int] = Field(default=None, gt=0)
+    fields: Optional[List[str]] = None
+    filters: Optional[Dict[str, Any]] = None
+
+class SemanticSearchRequest(BaseModel):
+    query: str = Field(..., min_length=1)
+    model: str = "gemini"
+    limit: int = Field(default=10, gt=0, le=1000)
+    num_candidates: Optional[int] = Field(default=None, gt=0)
+    diversity: Optional[float] = Field(default=None, ge=0, le=1)
+    include_archive: bool = Field(default=False, description="Also search archived (historical) vectors")
+    fields: Optional[List[str]] = None
+    filters: Optional[Dict[str, Any]] = None
+
+class HybridSearchRequest(BaseModel):
+    query: str
+    embedding: Optional[List[float]] = None
+    model: str = "gemini"
+    limit: int = Field(default=10, gt=0, le=1000)
+    num_candidates: int = Field(default=50, gt=0)
+    fields: Optional[List[str]] = None
+    filters: Optional[Dict[str, Any]] = None
+
+class VectorCompactionRequest(BaseModel):
+    remove_orphans: bool = True
+    merge_near_duplicates: bool = False
+    merge_threshold: float = Field(default=0.995, gt=0, le=1)
+    benchmark_queries: int = Field(default=20, ge=0)
+    dry_run: bool = False
+
+class VectorIndexEvaluateRequest(BaseModel):
+    query_count: int = Field(default=100, gt=0)
+    limit: int = Field(default=10, gt=0)
+    candidate_counts: Optional[List[int]] = None
+
 class MigrationRequest(BaseModel):
     site_ids: Optional[List[str]] = Field(None, description="Site IDs to migrate")
     team_ids: Optional[List[str]] = Field(None, description="Team IDs to migrate")
     source_types: List[str] = Field(..., description="Data source types to migrate")
     batch_size: int = Field(default=100, description="Batch size for migration")
     embedding_model: str = Field(default="gemini", description="Embedding model to use")
+    near_duplicate_threshold: Optional[float] = Field(
+        default=0.9, ge=0, le=1, description="Similarity above which records reuse an embedding (null disables)"
+    )
     start_date: Optional[datetime] = Field(None, description="Start date for migration")
     end_date: Optional[datetime] = Field(None, description="End date for migration")
 
@@ -150,6 +254,24 @@ class PredictionResponse(BaseModel):
     metadata: Optional[Dict[str, Any]] = None
     error: Optional[str] = None
 
+class AnalysisJobRequest(BaseModel):
+    analysis: str = Field(..., description="user_journeys, churn_prediction, conversion_prediction or user_segmentation")
+    site_id: str = Field(..., description="Site identifier")
+    time_window: int = Field(default=30, description="Time window in days")
+    retrain_model: Optional[bool] = Field(None, description="Whether to retrain the model (predictions)")
+    n_segments: Optional[int] = Field(None, gt=0, description="Number of segments (segmentation)")
+
+def columnar_output(
+    format: Optional[str] = Query(None, description="json (default), arrow or parquet for per-row results"),
+    columns: Optional[str] = Query(None, description="Comma-separated columns of an arrow/parquet response"),
+    accept: Optional[str] = Header(None)
+) -> Optional[ColumnarRequest]:
+    """Columnar output requested by the format parameter or the Accept header"""
+    try:
+        return negotiate_columnar_format(accept, format, columns)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # API Endpoints
 
 @app.get("/")
@@ -198,8 +320,11 @@ async def health_check():
 # Data Processing Endpoints
 
 @app.post("/api/process/analytics", response_model=ProcessAnalyticsResponse)
-async def process_analytics_data(request: ProcessAnalyticsRequest):
-    """Process analytics data for a site"""
+async def process_analytics_data(
+    request: ProcessAnalyticsRequest,
+    columnar: Optional[ColumnarRequest] = Depends(columnar_output)
+):
+    """Process analytics data for a site; arrow/parquet output returns the processed rows"""
     try:
         logger.info(f"Processing analytics data for site: {request.site_id}")
         
@@ -210,6 +335,12 @@ async def process_analytics_data(request: ProcessAnalyticsRequest):
             data_types=request.data_types
         )
         
+        if result.success and columnar and result.data is not None:
+            return render_table(result.data, columnar, {
+                "quality_score": result.quality_score,
+                "metadata": result.metadata,
+                "errors": result.errors
+            })
         if result.success:
             return ProcessAnalyticsResponse(
                 success=True,
@@ -227,6 +358,8 @@ async def process_analytics_data(request: ProcessAnalyticsRequest):
                 errors=result.errors
             )
             
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error processing analytics data: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -234,9 +367,10 @@ async def process_analytics_data(request: ProcessAnalyticsRequest):
 @app.post("/api/process/user-journeys")
 async def analyze_user_journeys(
     site_id: str = Query(..., description="Site identifier"),
-    time_window: int = Query(default=30, description="Time window in days")
+    time_window: int = Query(default=30, description="Time window in days"),
+    columnar: Optional[ColumnarRequest] = Depends(columnar_output)
 ):
-    """Analyze user journeys for a site"""
+    """Analyze user journeys for a site; arrow/parquet output returns the session rows"""
     try:
         logger.info(f"Analyzing user journeys for site: {site_id}")
         
@@ -246,19 +380,24 @@ async def analyze_user_journeys(
         )
         
         if result.success:
-            return {
+            response = {
                 "success": True,
                 "clusters": result.metadata.get('clusters', {}),
                 "patterns": result.metadata.get('patterns', {}),
                 "insights": result.metadata.get('insights', []),
                 "feature_importance": result.metadata.get('feature_importance', {})
             }
+            if columnar and result.data is not None:
+                return render_table(result.data, columnar, response)
+            return response
         else:
             return {
                 "success": False,
                 "errors": result.errors
             }
             
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error analyzing user journeys: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -267,9 +406,10 @@ async def analyze_user_journeys(
 async def analyze_time_series(
     site_id: str = Query(..., description="Site identifier"),
     metric: str = Query(..., description="Metric to analyze"),
-    time_window: int = Query(default=90, description="Time window in days")
+    time_window: int = Query(default=90, description="Time window in days"),
+    columnar: Optional[ColumnarRequest] = Depends(columnar_output)
 ):
-    """Analyze time series data for a metric"""
+    """Analyze time series data for a metric; arrow/parquet output returns the series rows"""
     try:
         logger.info(f"Analyzing time series for metric {metric} on site: {site_id}")
         
@@ -280,7 +420,7 @@ async def analyze_time_series(
         )
         
         if result.success:
-            return {
+            response = {
                 "success": True,
                 "trends": result.metadata.get('trends', {}),
                 "seasonality": result.metadata.get('seasonality', {}),
@@ -288,12 +428,17 @@ async def analyze_time_series(
                 "forecast": result.metadata.get('forecast', {}),
                 "statistics": result.metadata.get('statistics', {})
             }
+            if columnar and result.data is not None:
+                return render_table(result.data, columnar, response)
+            return response
         else:
             return {
                 "success": False,
                 "errors": result.errors
             }
             
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error analyzing time series: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -301,9 +446,10 @@ async def analyze_time_series(
 @app.post("/api/process/web3-patterns")
 async def analyze_web3_patterns(
     site_id: str = Query(..., description="Site identifier"),
-    time_window: int = Query(default=30, description="Time window in days")
+    time_window: int = Query(default=30, description="Time window in days"),
+    columnar: Optional[ColumnarRequest] = Depends(columnar_output)
 ):
-    """Analyze Web3 transaction patterns"""
+    """Analyze Web3 transaction patterns; arrow/parquet output returns the transaction rows"""
     try:
         logger.info(f"Analyzing Web3 patterns for site: {site_id}")
         
@@ -313,7 +459,7 @@ async def analyze_web3_patterns(
         )
         
         if result.success:
-            return {
+            response = {
                 "success": True,
                 "transaction_patterns": result.metadata.get('transaction_patterns', {}),
                 "wallet_behaviors": result.metadata.get('wallet_behaviors', {}),
@@ -321,12 +467,17 @@ async def analyze_web3_patterns(
                 "web3_metrics": result.metadata.get('web3_metrics', {}),
                 "insights": result.metadata.get('insights', [])
             }
+            if columnar and result.data is not None:
+                return render_table(result.data, columnar, response)
+            return response
         else:
             return {
                 "success": False,
                 "errors": result.errors
             }
             
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error analyzing Web3 patterns: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -334,10 +485,16 @@ async def analyze_web3_patterns(
 # Embedding Generation Endpoints
 
 @app.post("/api/embeddings/generate", response_model=GenerateEmbeddingResponse)
-async def generate_embedding(request: GenerateEmbeddingRequest):
-    """Generate embedding for a single text"""
+async def generate_embedding(request: GenerateEmbeddingRequest, accept: Optional[str] = Header(None)):
+    """
+    Generate embedding for a single text
+    
+    The vector format follows the Accept header (application/msgpack,
+    application/octet-stream) or encoding_format (float, base64)
+    """
     try:
         logger.info(f"Generating embedding for text (length: {len(request.text)})")
+        wire_format = negotiate_wire_format(accept, request.encoding_format)
         
         # Convert model string to enum
         model_enum = getattr(EmbeddingModel, request.model.upper(), EmbeddingModel.GEMINI)
@@ -350,29 +507,39 @@ async def generate_embedding(request: GenerateEmbeddingRequest):
         )
         
         if result.success:
-            return GenerateEmbeddingResponse(
-                success=True,
-                embedding=result.embedding.tolist(),
-                dimensions=result.dimensions,
-                model_used=result.model_used,
-                quality_score=result.quality_score,
-                processing_time=result.processing_time
-            )
+            # Rendered directly: pydantic validation of the vector costs more than the encoding
+            return render_embeddings({
+                'success': True,
+                'embedding': result.embedding,
+                'dimensions': result.dimensions,
+                'model_used': result.model_used,
+                'quality_score': result.quality_score,
+                'processing_time': result.processing_time,
+                'error': None
+            }, 'embedding', wire_format)
         else:
             return GenerateEmbeddingResponse(
                 success=False,
                 error=result.error
             )
             
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error generating embedding: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/embeddings/batch", response_model=BatchEmbeddingResponse)
-async def generate_batch_embeddings(request: BatchEmbeddingRequest):
-    """Generate embeddings for multiple texts"""
+async def generate_batch_embeddings(request: BatchEmbeddingRequest, accept: Optional[str] = Header(None)):
+    """
+    Generate embeddings for multiple texts
+    
+    The vector format follows the Accept header (application/msgpack,
+    application/octet-stream) or encoding_format (float, base64)
+    """
     try:
         logger.info(f"Generating batch embeddings for {len(request.texts)} texts")
+        wire_format = negotiate_wire_format(accept, request.encoding_format)
         
         # Convert model string to enum
         model_enum = getattr(EmbeddingModel, request.model.upper(), EmbeddingModel.GEMINI)
@@ -385,23 +552,16 @@ async def generate_batch_embeddings(request: BatchEmbeddingRequest):
         )
         
         if result.success:
-            # Convert embeddings to lists
-            embeddings_list = []
-            for emb in result.embeddings:
-                if emb is not None:
-                    embeddings_list.append(emb.tolist())
-                else:
-                    embeddings_list.append(None)
-            
-            return BatchEmbeddingResponse(
-                success=True,
-                embeddings=embeddings_list,
-                total_processed=result.total_processed,
-                successful_count=result.metadata.get('successful_count', 0),
-                failed_count=result.metadata.get('failed_count', 0),
-                processing_time=result.processing_time,
-                errors=result.errors
-            )
+            # Rendered directly: pydantic validation of the vectors costs more than the encoding
+            return render_embeddings({
+                'success': True,
+                'embeddings': result.embeddings,
+                'total_processed': result.total_processed,
+                'successful_count': result.metadata.get('successful_count', 0),
+                'failed_count': result.metadata.get('failed_count', 0),
+                'processing_time': result.processing_time,
+                'errors': result.errors
+            }, 'embeddings', wire_format)
         else:
             return BatchEmbeddingResponse(
                 success=False,
@@ -411,10 +571,60 @@ async def generate_batch_embeddings(request: BatchEmbeddingRequest):
                 errors=result.errors
             )
             
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error generating batch embeddings: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/embeddings/batch/stream")
+async def stream_batch_embeddings_ndjson(
+    request: Request,
+    model: str = Query("gemini", description="Embedding model to use"),
+    batch_size: Optional[int] = Query(None, gt=0, description="Texts embedded per batch"),
+    use_cache: bool = Query(True, description="Whether to use cache")
+):
+    """
+    Generate embeddings for an NDJSON body (one JSON string or {"text": ...} per line),
+    streaming NDJSON results back as each batch completes
+    """
+    try:
+        model_enum = getattr(EmbeddingModel, model.upper(), EmbeddingModel.GEMINI)
+        spool = await spool_ndjson(request.stream())
+        return StreamingResponse(
+            stream_batch_embeddings(embedding_generator, spool, model_enum, batch_size, use_cache),
+            media_type=NDJSON_MEDIA_TYPE
+        )
+        
+    except Exception as e:
+        logger.error(f"Error streaming batch embeddings: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/embeddings/wire-formats/benchmark")
+async def benchmark_embedding_wire_formats(
+    dimensions: int = Query(1536, gt=0, le=8192),
+    count: int = Query(100, gt=0, le=10000)
+):
+    """Serialisation time and size per vector of each embedding wire format"""
+    try:
+        def pydantic_json(rows):
+            response = BatchEmbeddingResponse(
+                success=True,
+                embeddings=[row.tolist() for row in rows],
+                total_processed=len(rows),
+                successful_count=len(rows),
+                failed_count=0
+            )
+            return JSONResponse(jsonable_encoder(response)).body
+        
+        return await asyncio.to_thread(
+            benchmark_wire_formats, dimensions, count, extra={'pydantic_json': pydantic_json}
+        )
+        
+    except Exception as e:
+        logger.error(f"Error benchmarking wire formats: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/api/embeddings/similarity")
 async def calculate_similarity(
     embedding1: List[float],
@@ -442,6 +652,292 @@ async def calculate_similarity(
         logger.error(f"Error calculating similarity: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/projectors")
+async def list_projectors():
+    """List fitted dimensionality-reduction projectors"""
+    return {"projectors": embedding_generator.projectors.list_projectors()}
+
+@app.post("/api/projectors/fit")
+async def fit_projector(request: FitProjectorRequest):
+    """Fit a projector on a sample of stored embeddings and persist it"""
+    try:
+        projector = await embedding_generator.projectors.fit_from_collection(
+            request.name,
+            request.target_dimensions,
+            filter_dict=request.filters,
+            sample_size=request.sample_size
+        )
+        return {"success": True, "projector": projector.get_info()}
+        
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error fitting projector: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Two-Stage Vector Search Endpoints
+
+@app.post("/api/vector-index/build")
+async def build_vector_index(filters: Optional[Dict[str, Any]] = None):
+    """Build the compact quantised index used for two-stage search"""
+    try:
+        stats = await two_stage_search.build_index(filters)
+        return {"success": True, "stats": stats}
+        
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error building vector index: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/vector-index/search")
+async def two_stage_vector_search(request: TwoStageSearchRequest):
+    """Search with compact-index recall and full-precision rerank"""
+    if request.embedding is None and not request.query:
+        raise HTTPException(status_code=400, detail="Either query or embedding is required")
+    
+    try:
+        import numpy as np
+        
+        if request.embedding is not None:
+            query_embedding = np.array(request.embedding)
+        else:
+            embedding_result = await embedding_generator.generate_embedding(
+                request.query, getattr(EmbeddingModel, request.model.upper(), EmbeddingModel.GEMINI)
+            )
+            if not embedding_result.success:
+                raise HTTPException(status_code=500, detail=embedding_result.error)
+            query_embedding = embedding_result.embedding
+        
+        result = await two_stage_search.search(
+            query_embedding,
+            request.limit,
+            request.num_candidates,
+            projection={field: 1 for field in request.fields or []},
+            filters=request.filters
+        )
+        if not result.success:
+            raise HTTPException(status_code=500, detail=result.error)
+        
+        return {
+            "success": True,
+            "results": [
+                {
+                    "id": str(hit.document_id),
+                    "score": hit.score,
+                    "document": jsonable_encoder(hit.document, custom_encoder={ObjectId: str})
+                }
+                for hit in result.hits
+            ],
+            "candidates": result.candidates,
+            "timings": result.timings
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in two-stage search: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/vector-index/evaluate")
+async def evaluate_vector_index(request: VectorIndexEvaluateRequest):
+    """Report recall and latency of two-stage search against exact search"""
+    try:
+        return await two_stage_search.evaluate(
+            request.query_count, request.limit, request.candidate_counts
+        )
+        
+    except (ValueError, RuntimeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error evaluating vector index: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/vector-index/compact")
+async def compact_vector_index(request: VectorCompactionRequest):
+    """Remove duplicate and orphaned vector documents and optionally merge near duplicates"""
+    try:
+        result = await vector_compactor.compact(
+            remove_orphans=request.remove_orphans,
+            merge_near_duplicates=request.merge_near_duplicates,
+            merge_threshold=request.merge_threshold,
+            benchmark_queries=request.benchmark_queries,
+            dry_run=request.dry_run
+        )
+        if not result.success:
+            raise HTTPException(status_code=500, detail=result.error)
+        
+        return {"success": True, "result": result.__dict__}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error compacting vector index: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/vector-tiering/archive")
+async def archive_cold_vectors(dry_run: bool = False):
+    """Move cold vector documents from the hot collection to archive segments"""
+    try:
+        result = await vector_tiering.archive_cold(dry_run=dry_run)
+        if not result.success:
+            raise HTTPException(status_code=500, detail=result.error)
+        
+        return {"success": True, "result": result.__dict__}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error archiving cold vectors: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Real-time Vectorization Endpoints
+
+@app.post("/api/vectorization/start")
+async def start_vectorization():
+    """Start tailing source collections and vectorizing changes"""
+    try:
+        await vectorization_worker.start()
+        return {"success": True, "stats": vectorization_worker.get_stats()}
+        
+    except Exception as e:
+        logger.error(f"Error starting vectorization worker: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/vectorization/stop")
+async def stop_vectorization():
+    """Stop the vectorization worker after writing pending changes"""
+    try:
+        await vectorization_worker.stop()
+        return {"success": True, "stats": vectorization_worker.get_stats()}
+        
+    except Exception as e:
+        logger.error(f"Error stopping vectorization worker: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Embedding Job Queue Endpoints
+
+@app.post("/api/embedding-jobs/worker/start")
+async def start_embedding_job_worker():
+    """Start consuming the embeddingjobs queue"""
+    try:
+        await embedding_job_worker.start()
+        return {"success": True, "stats": embedding_job_worker.get_stats()}
+        
+    except Exception as e:
+        logger.error(f"Error starting embedding job worker: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/embedding-jobs/worker/stop")
+async def stop_embedding_job_worker():
+    """Stop the embedding job consumers after their current jobs"""
+    try:
+        await embedding_job_worker.stop()
+        return {"success": True, "stats": embedding_job_worker.get_stats()}
+        
+    except Exception as e:
+        logger.error(f"Error stopping embedding job worker: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Search Endpoints
+
+@app.post("/api/search")
+async def semantic_vector_search(request: SemanticSearchRequest):
+    """Embed the query, retrieve filtered top-k and rerank for diversity in one call"""
+    try:
+        result = await semantic_search.search(
+            request.query,
+            request.limit,
+            request.num_candidates,
+            getattr(EmbeddingModel, request.model.upper(), EmbeddingModel.GEMINI),
+            filters=request.filters,
+            fields=request.fields,
+            diversity=request.diversity,
+            include_archive=request.include_archive
+        )
+        if not result.success:
+            raise HTTPException(status_code=500, detail=result.error)
+        
+        return {
+            "success": True,
+            "results": [
+                {
+                    "id": str(hit.document_id),
+                    "score": hit.score,
+                    "document": jsonable_encoder(hit.document, custom_encoder={ObjectId: str})
+                }
+                for hit in result.hits
+            ],
+            "candidates": result.candidates,
+            "timings": result.timings
+        }
+        
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in semantic search: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/lexical-index/build")
+async def build_lexical_index(filters: Optional[Dict[str, Any]] = None):
+    """Build the BM25 index over stored vector document content"""
+    try:
+        stats = await hybrid_search.build_index(filters)
+        return {"success": True, "stats": stats}
+        
+    except Exception as e:
+        logger.error(f"Error building lexical index: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/hybrid-search")
+async def hybrid_vector_search(request: HybridSearchRequest):
+    """Search with BM25 and vector rankings fused by reciprocal rank fusion"""
+    try:
+        import numpy as np
+        
+        if request.embedding is not None:
+            query_embedding = np.array(request.embedding)
+        else:
+            embedding_result = await embedding_generator.generate_embedding(
+                request.query, getattr(EmbeddingModel, request.model.upper(), EmbeddingModel.GEMINI)
+            )
+            if not embedding_result.success:
+                raise HTTPException(status_code=500, detail=embedding_result.error)
+            query_embedding = embedding_result.embedding
+        
+        result = await hybrid_search.search(
+            request.query,
+            query_embedding,
+            request.limit,
+            request.num_candidates,
+            filters=request.filters,
+            projection={field: 1 for field in request.fields} if request.fields else None
+        )
+        if not result.success:
+            raise HTTPException(status_code=500, detail=result.error)
+        
+        return {
+            "success": True,
+            "results": [
+                {
+                    "id": str(hit.document_id),
+                    "score": hit.score,
+                    "document": jsonable_encoder(hit.document, custom_encoder={ObjectId: str})
+                }
+                for hit in result.hits
+            ],
+            "candidates": result.candidates,
+            "timings": result.timings
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in hybrid search: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Migration Endpoints
 
 @app.post("/api/migration/start", response_model=MigrationResponse)
@@ -454,7 +950,8 @@ async def start_migration(request: MigrationRequest, background_tasks: Backgroun
         migration_config = MigrationConfig(
             source_types=[DataSource(source) for source in request.source_types],
             batch_size=request.batch_size,
-            embedding_model=getattr(EmbeddingModel, request.embedding_model.upper(), EmbeddingModel.GEMINI)
+            embedding_model=getattr(EmbeddingModel, request.embedding_model.upper(), EmbeddingModel.GEMINI),
+            near_duplicate_threshold=request.near_duplicate_threshold
         )
         
         # Create migrator
@@ -533,8 +1030,11 @@ async def validate_migration(sample_size: int = Query(default=100, description="
 # ML Prediction Endpoints
 
 @app.post("/api/ml/predict", response_model=PredictionResponse)
-async def make_prediction(request: PredictionRequest):
-    """Make ML predictions"""
+async def make_prediction(
+    request: PredictionRequest,
+    columnar: Optional[ColumnarRequest] = Depends(columnar_output)
+):
+    """Make ML predictions; arrow/parquet output has id, prediction and probability columns"""
     try:
         logger.info(f"Making {request.prediction_type} prediction for site: {request.site_id}")
         
@@ -554,6 +1054,17 @@ async def make_prediction(request: PredictionRequest):
         else:
             raise HTTPException(status_code=400, detail=f"Unsupported prediction type: {request.prediction_type}")
         
+        if result.success and columnar:
+            return render_table(
+                {"id": result.row_ids, "prediction": result.predictions, "probability": result.probabilities},
+                columnar,
+                {
+                    "prediction_type": result.prediction_type,
+                    "feature_importance": result.feature_importance,
+                    "model_metrics": result.model_metrics,
+                    "metadata": result.metadata
+                }
+            )
         if result.success:
             return PredictionResponse(
                 success=True,
@@ -571,6 +1082,10 @@ async def make_prediction(request: PredictionRequest):
                 error=result.error
             )
             
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error making prediction: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -579,9 +1094,10 @@ async def make_prediction(request: PredictionRequest):
 async def detect_anomalies(
     site_id: str = Query(..., description="Site identifier"),
     time_window: int = Query(default=30, description="Time window in days"),
-    contamination: float = Query(default=0.1, description="Expected proportion of anomalies")
+    contamination: float = Query(default=0.1, description="Expected proportion of anomalies"),
+    columnar: Optional[ColumnarRequest] = Depends(columnar_output)
 ):
-    """Detect anomalies in user behavior"""
+    """Detect anomalies in user behavior; arrow/parquet output has id, anomaly and confidence_score columns"""
     try:
         logger.info(f"Detecting anomalies for site: {site_id}")
         
@@ -591,6 +1107,12 @@ async def detect_anomalies(
             contamination=contamination
         )
         
+        if result.success and columnar:
+            return render_table(
+                {"id": result.row_ids, "anomaly": result.predictions, "confidence_score": result.confidence_scores},
+                columnar,
+                {"metadata": result.metadata}
+            )
         if result.success:
             return {
                 "success": True,
@@ -604,6 +1126,8 @@ async def detect_anomalies(
                 "error": result.error
             }
             
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error detecting anomalies: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -612,9 +1136,10 @@ async def detect_anomalies(
 async def segment_users(
     site_id: str = Query(..., description="Site identifier"),
     time_window: int = Query(default=30, description="Time window in days"),
-    n_segments: int = Query(default=5, description="Number of segments to create")
+    n_segments: int = Query(default=5, description="Number of segments to create"),
+    columnar: Optional[ColumnarRequest] = Depends(columnar_output)
 ):
-    """Segment users based on behavior patterns"""
+    """Segment users based on behavior patterns; arrow/parquet output has id and segment columns"""
     try:
         logger.info(f"Segmenting users for site: {site_id}")
         
@@ -624,6 +1149,12 @@ async def segment_users(
             n_segments=n_segments
         )
         
+        if result.success and columnar:
+            return render_table(
+                {"id": result.row_ids, "segment": result.predictions},
+                columnar,
+                {"metadata": result.metadata}
+            )
         if result.success:
             return {
                 "success": True,
@@ -636,6 +1167,8 @@ async def segment_users(
                 "error": result.error
             }
             
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error segmenting users: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -678,6 +1211,72 @@ async def get_predictive_insights(
         logger.error(f"Error generating insights: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Analysis Job Endpoints
+
+@app.post("/api/analysis-jobs", status_code=202)
+async def submit_analysis_job(request: AnalysisJobRequest):
+    """Queue a long-running analysis and return its job id at once"""
+    try:
+        params = {
+            name: value
+            for name, value in request.model_dump(include={'time_window', 'retrain_model', 'n_segments'}).items()
+            if value is not None
+        }
+        job, deduplicated = await analysis_job_manager.submit(request.analysis, request.site_id, **params)
+        
+        return {
+            "job_id": job.job_id,
+            "status": job.status,
+            "deduplicated": deduplicated,
+            "status_url": f"/api/analysis-jobs/{job.job_id}",
+            "events_url": f"/api/analysis-jobs/{job.job_id}/events"
+        }
+        
+    except asyncio.QueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error submitting analysis job: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/analysis-jobs/{job_id}")
+async def get_analysis_job(job_id: str = Path(..., description="Job identifier")):
+    """Get an analysis job's status, and its result once completed"""
+    try:
+        job = await analysis_job_manager.get_job(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Analysis job not found: {job_id}")
+        return job
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting analysis job {job_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/analysis-jobs/{job_id}/events")
+async def subscribe_analysis_job(
+    job_id: str = Path(..., description="Job identifier"),
+    heartbeat: float = Query(15.0, gt=0, le=300, description="Seconds between repeated states")
+):
+    """Follow an analysis job as server-sent events until it completes"""
+    try:
+        if await analysis_job_manager.get_job(job_id) is None:
+            raise HTTPException(status_code=404, detail=f"Analysis job not found: {job_id}")
+        
+        async def events():
+            async for state in analysis_job_manager.subscribe(job_id, heartbeat):
+                yield b"event: status\ndata: " + dumps_json(state) + b"\n\n"
+        
+        return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error subscribing to analysis job {job_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Utility Endpoints
 
 @app.get("/api/models")
@@ -708,6 +1307,20 @@ async def get_service_stats():
                 "embedding_generator_initialized": embedding_generator.db is not None,
                 "analytics_ml_initialized": analytics_ml_service.db is not None
             },
+            "local_inference": embedding_generator.get_local_inference_stats(),
+            "embedding_cache": embedding_generator.get_cache_stats(),
+            "embedding_providers": embedding_generator.get_resilience_stats(),
+            "embedding_routing": embedding_generator.router.get_stats(),
+            "compact_index": two_stage_search.get_stats(),
+            "lexical_index": hybrid_search.get_stats(),
+            "semantic_search": semantic_search.get_stats(),
+            "vector_compaction": vector_compactor.get_stats(),
+            "vector_tiering": vector_tiering.get_stats(),
+            "vectorization": vectorization_worker.get_stats(),
+            "embedding_jobs": embedding_job_worker.get_stats(),
+            "analysis_jobs": analysis_job_manager.get_stats(),
+            "admission": admission_controller.get_stats(),
+            "vector_search_candidates": db_manager.candidate_budget.get_stats(),
             "timestamp": datetime.now().isoformat()
         }
         
@@ -717,6 +1330,11 @@ async def get_service_stats():
         logger.error(f"Error getting service stats: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/stats/startup")
+async def get_startup_profile():
+    """Get import and initialisation time per component"""
+    return startup_profiler.get_report()
+
 # Error handlers
 
 @app.exception_handler(Exception)
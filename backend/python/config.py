@@ -3,7 +3,7 @@ Configuration module for Cryptique Python Data Processing Services
 """
 
 import os
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from pydantic_settings import BaseSettings
 from pydantic import Field
 from dotenv import load_dotenv
@@ -24,6 +24,20 @@ class DatabaseConfig(BaseSettings):
     # Vector database settings
     vector_collection: str = Field(default="vectordocuments", env="VECTOR_COLLECTION")
     vector_index_name: str = Field(default="vector_index", env="VECTOR_INDEX_NAME")
+    # Fields declared as "filter" paths in the vector index; filters on them are
+    # applied inside $vectorSearch instead of after it
+    vector_filter_fields: List[str] = Field(
+        default=["siteId", "teamId", "sourceType", "status", "metadata.timeframe"],
+        env="VECTOR_FILTER_FIELDS"
+    )
+    
+    # Adaptive numCandidates for $vectorSearch
+    vector_target_recall: float = Field(default=0.95, env="VECTOR_TARGET_RECALL")
+    vector_calibration_rate: float = Field(default=0.02, env="VECTOR_CALIBRATION_RATE")
+    vector_min_candidates_multiplier: float = Field(default=1.5, env="VECTOR_MIN_CANDIDATES_MULTIPLIER")
+    vector_max_candidates: int = Field(default=10000, env="VECTOR_MAX_CANDIDATES")
+    vector_selectivity_ttl: float = Field(default=300.0, env="VECTOR_SELECTIVITY_TTL")
+    vector_selectivity_max_time_ms: int = Field(default=100, env="VECTOR_SELECTIVITY_MAX_TIME_MS")
     
     # Connection settings
     max_pool_size: int = Field(default=50, env="DB_MAX_POOL_SIZE")
@@ -56,6 +70,87 @@ class AIConfig(BaseSettings):
     # Local model settings
     use_local_models: bool = Field(default=False, env="USE_LOCAL_MODELS")
     local_model_path: str = Field(default="./models", env="LOCAL_MODEL_PATH")
+    local_model_warmup: bool = Field(default=False, env="LOCAL_MODEL_WARMUP")
+    
+    # Local inference batching
+    local_batch_size: int = Field(default=32, env="LOCAL_BATCH_SIZE")
+    local_batch_max_tokens: int = Field(default=16384, env="LOCAL_BATCH_MAX_TOKENS")
+    local_batch_wait_ms: float = Field(default=5.0, env="LOCAL_BATCH_WAIT_MS")
+    local_inference_threads: int = Field(default=4, env="LOCAL_INFERENCE_THREADS")
+    
+    # Optimised CPU inference for local models
+    local_quantize: bool = Field(default=False, env="LOCAL_QUANTIZE")
+    local_quantization_min_agreement: float = Field(default=0.98, env="LOCAL_QUANTIZATION_MIN_AGREEMENT")
+    local_sequence_buckets: List[int] = Field(default=[32, 64, 128, 256, 512], env="LOCAL_SEQUENCE_BUCKETS")
+    
+    # Tiered embedding cache (L1 memory, L2 local disk, L3 MongoDB)
+    embedding_cache_memory_size: int = Field(default=10000, env="EMBEDDING_CACHE_MEMORY_SIZE")
+    embedding_cache_disk_enabled: bool = Field(default=True, env="EMBEDDING_CACHE_DISK_ENABLED")
+    embedding_cache_dir: str = Field(default="./cache/embeddings", env="EMBEDDING_CACHE_DIR")
+    embedding_cache_disk_size: int = Field(default=500000, env="EMBEDDING_CACHE_DISK_SIZE")
+    embedding_cache_prewarm: int = Field(default=5000, env="EMBEDDING_CACHE_PREWARM")
+    embedding_cache_filter_enabled: bool = Field(default=True, env="EMBEDDING_CACHE_FILTER_ENABLED")
+    embedding_cache_filter_capacity: int = Field(default=1000000, env="EMBEDDING_CACHE_FILTER_CAPACITY")
+    embedding_cache_filter_error_rate: float = Field(default=0.01, env="EMBEDDING_CACHE_FILTER_ERROR_RATE")
+    embedding_cache_filter_persist: bool = Field(default=True, env="EMBEDDING_CACHE_FILTER_PERSIST")
+    
+    # Persisted dimensionality-reduction projectors
+    projector_dir: str = Field(default="./cache/projectors", env="PROJECTOR_DIR")
+    
+    # Two-stage vector search (compact quantised index, full-precision rerank)
+    compact_index_dimensions: int = Field(default=256, env="COMPACT_INDEX_DIMENSIONS")
+    compact_index_projector: Optional[str] = Field(default=None, env="COMPACT_INDEX_PROJECTOR")
+    two_stage_candidates: int = Field(default=200, env="TWO_STAGE_CANDIDATES")
+    compact_index_partition_field: str = Field(default="siteId", env="COMPACT_INDEX_PARTITION_FIELD")
+    
+    # Hybrid lexical + vector search (reciprocal rank fusion constant)
+    hybrid_rrf_k: int = Field(default=60, env="HYBRID_RRF_K")
+    
+    # Semantic search endpoint (query vector cache and MMR diversity reranking)
+    search_query_cache_size: int = Field(default=1024, env="SEARCH_QUERY_CACHE_SIZE")
+    search_mmr_diversity: float = Field(default=0.5, env="SEARCH_MMR_DIVERSITY")
+    
+    # Hot/cold tiering of vector documents to local archive segments
+    tiering_archive_dir: str = Field(default="./cache/vector_archive", env="TIERING_ARCHIVE_DIR")
+    tiering_cold_after_days: int = Field(default=90, env="TIERING_COLD_AFTER_DAYS")
+    tiering_idle_days: int = Field(default=30, env="TIERING_IDLE_DAYS")
+    tiering_source_types: List[str] = Field(default=["session", "analytics"], env="TIERING_SOURCE_TYPES")
+    
+    # Change-stream vectorization worker
+    vectorization_enabled: bool = Field(default=False, env="VECTORIZATION_ENABLED")
+    vectorization_model: str = Field(default="gemini", env="VECTORIZATION_MODEL")
+    vectorization_debounce_seconds: float = Field(default=2.0, env="VECTORIZATION_DEBOUNCE_SECONDS")
+    vectorization_max_delay_seconds: float = Field(default=30.0, env="VECTORIZATION_MAX_DELAY_SECONDS")
+    vectorization_batch_size: int = Field(default=100, env="VECTORIZATION_BATCH_SIZE")
+    vectorization_max_attempts: int = Field(default=5, env="VECTORIZATION_MAX_ATTEMPTS")
+    
+    # embeddingjobs queue worker
+    job_worker_enabled: bool = Field(default=False, env="JOB_WORKER_ENABLED")
+    job_worker_concurrency: int = Field(default=2, env="JOB_WORKER_CONCURRENCY")
+    job_claim_batch_size: int = Field(default=20, env="JOB_CLAIM_BATCH_SIZE")
+    job_provider_batch_size: int = Field(default=256, env="JOB_PROVIDER_BATCH_SIZE")
+    job_lease_seconds: int = Field(default=300, env="JOB_LEASE_SECONDS")
+    job_poll_interval_seconds: float = Field(default=2.0, env="JOB_POLL_INTERVAL_SECONDS")
+    
+    # Streaming NDJSON batch embeddings
+    stream_spool_max_memory_bytes: int = Field(default=8 * 1024 * 1024, env="STREAM_SPOOL_MAX_MEMORY_BYTES")
+    
+    # Tail-latency hedging and failover for remote embedding providers
+    embedding_hedging_enabled: bool = Field(default=True, env="EMBEDDING_HEDGING_ENABLED")
+    embedding_hedge_percentile: float = Field(default=95.0, env="EMBEDDING_HEDGE_PERCENTILE")
+    embedding_hedge_min_samples: int = Field(default=20, env="EMBEDDING_HEDGE_MIN_SAMPLES")
+    embedding_fallback_models: Dict[str, str] = Field(default={}, env="EMBEDDING_FALLBACK_MODELS")
+    circuit_breaker_failure_threshold: int = Field(default=5, env="CIRCUIT_BREAKER_FAILURE_THRESHOLD")
+    circuit_breaker_reset_timeout: float = Field(default=30.0, env="CIRCUIT_BREAKER_RESET_TIMEOUT")
+    
+    # Model routing for EmbeddingModel.AUTO (one model pinned per vector space)
+    routing_premium_model: str = Field(default="gemini", env="ROUTING_PREMIUM_MODEL")
+    routing_economy_model: str = Field(default="sentence_transformer", env="ROUTING_ECONOMY_MODEL")
+    routing_importance_threshold: int = Field(default=7, env="ROUTING_IMPORTANCE_THRESHOLD")
+    routing_max_economy_tokens: int = Field(default=256, env="ROUTING_MAX_ECONOMY_TOKENS")
+    routing_max_queue_depth: int = Field(default=64, env="ROUTING_MAX_QUEUE_DEPTH")
+    routing_min_quota_headroom: float = Field(default=0.2, env="ROUTING_MIN_QUOTA_HEADROOM")
+    embedding_provider_quotas: Dict[str, int] = Field(default={}, env="EMBEDDING_PROVIDER_QUOTAS")
     
     class Config:
         env_file = ".env"
@@ -83,6 +178,11 @@ class ProcessingConfig(BaseSettings):
     test_size: float = Field(default=0.2, env="TEST_SIZE")
     cross_validation_folds: int = Field(default=5, env="CV_FOLDS")
     
+    # Asynchronous analysis jobs
+    analysis_job_workers: int = Field(default=2, env="ANALYSIS_JOB_WORKERS")
+    analysis_job_queue_size: int = Field(default=100, env="ANALYSIS_JOB_QUEUE_SIZE")
+    analysis_job_result_ttl_seconds: int = Field(default=86400, env="ANALYSIS_JOB_RESULT_TTL_SECONDS")
+    
     class Config:
         env_file = ".env"
 
@@ -101,6 +201,9 @@ class ServiceConfig(BaseSettings):
     # Performance
     max_concurrent_requests: int = Field(default=100, env="MAX_CONCURRENT_REQUESTS")
     request_timeout: int = Field(default=300, env="REQUEST_TIMEOUT")
+    heavy_concurrent_requests: int = Field(default=8, env="HEAVY_CONCURRENT_REQUESTS")
+    admission_queue_size: int = Field(default=50, env="ADMISSION_QUEUE_SIZE")
+    admission_max_wait: float = Field(default=5.0, env="ADMISSION_MAX_WAIT")
     
     # Monitoring
     enable_metrics: bool = Field(default=True, env="ENABLE_METRICS")
@@ -155,6 +258,62 @@ class Config:
             "batch_size": self.ai.batch_size,
             "max_retries": self.ai.max_retries,
             "rate_limit_delay": self.ai.rate_limit_delay,
+            "use_local_models": self.ai.use_local_models,
+            "local_model_warmup": self.ai.local_model_warmup,
+            "local_batch_size": self.ai.local_batch_size,
+            "local_batch_max_tokens": self.ai.local_batch_max_tokens,
+            "local_batch_wait_ms": self.ai.local_batch_wait_ms,
+            "local_inference_threads": self.ai.local_inference_threads,
+            "local_quantize": self.ai.local_quantize,
+            "local_quantization_min_agreement": self.ai.local_quantization_min_agreement,
+            "local_sequence_buckets": self.ai.local_sequence_buckets,
+            "cache_memory_size": self.ai.embedding_cache_memory_size,
+            "cache_disk_enabled": self.ai.embedding_cache_disk_enabled,
+            "cache_dir": self.ai.embedding_cache_dir,
+            "cache_disk_size": self.ai.embedding_cache_disk_size,
+            "cache_prewarm": self.ai.embedding_cache_prewarm,
+            "cache_filter_enabled": self.ai.embedding_cache_filter_enabled,
+            "cache_filter_capacity": self.ai.embedding_cache_filter_capacity,
+            "cache_filter_error_rate": self.ai.embedding_cache_filter_error_rate,
+            "cache_filter_persist": self.ai.embedding_cache_filter_persist,
+            "projector_dir": self.ai.projector_dir,
+            "compact_index_dimensions": self.ai.compact_index_dimensions,
+            "compact_index_projector": self.ai.compact_index_projector,
+            "two_stage_candidates": self.ai.two_stage_candidates,
+            "compact_index_partition_field": self.ai.compact_index_partition_field,
+            "hybrid_rrf_k": self.ai.hybrid_rrf_k,
+            "search_query_cache_size": self.ai.search_query_cache_size,
+            "search_mmr_diversity": self.ai.search_mmr_diversity,
+            "tiering_archive_dir": self.ai.tiering_archive_dir,
+            "tiering_cold_after_days": self.ai.tiering_cold_after_days,
+            "tiering_idle_days": self.ai.tiering_idle_days,
+            "tiering_source_types": self.ai.tiering_source_types,
+            "vectorization_enabled": self.ai.vectorization_enabled,
+            "vectorization_model": self.ai.vectorization_model,
+            "vectorization_debounce_seconds": self.ai.vectorization_debounce_seconds,
+            "vectorization_max_delay_seconds": self.ai.vectorization_max_delay_seconds,
+            "vectorization_batch_size": self.ai.vectorization_batch_size,
+            "vectorization_max_attempts": self.ai.vectorization_max_attempts,
+            "job_worker_enabled": self.ai.job_worker_enabled,
+            "job_worker_concurrency": self.ai.job_worker_concurrency,
+            "job_claim_batch_size": self.ai.job_claim_batch_size,
+            "job_provider_batch_size": self.ai.job_provider_batch_size,
+            "job_lease_seconds": self.ai.job_lease_seconds,
+            "job_poll_interval_seconds": self.ai.job_poll_interval_seconds,
+            "stream_spool_max_memory_bytes": self.ai.stream_spool_max_memory_bytes,
+            "hedging_enabled": self.ai.embedding_hedging_enabled,
+            "hedge_percentile": self.ai.embedding_hedge_percentile,
+            "hedge_min_samples": self.ai.embedding_hedge_min_samples,
+            "fallback_models": self.ai.embedding_fallback_models,
+            "circuit_breaker_failure_threshold": self.ai.circuit_breaker_failure_threshold,
+            "circuit_breaker_reset_timeout": self.ai.circuit_breaker_reset_timeout,
+            "routing_premium_model": self.ai.routing_premium_model,
+            "routing_economy_model": self.ai.routing_economy_model,
+            "routing_importance_threshold": self.ai.routing_importance_threshold,
+            "routing_max_economy_tokens": self.ai.routing_max_economy_tokens,
+            "routing_max_queue_depth": self.ai.routing_max_queue_depth,
+            "routing_min_quota_headroom": self.ai.routing_min_quota_headroom,
+            "provider_quotas": self.ai.embedding_provider_quotas,
         }
     
     def get_processing_config(self) -> Dict[str, Any]:
@@ -168,6 +327,9 @@ class Config:
             "outlier_detection": self.processing.outlier_detection,
             "outlier_threshold": self.processing.outlier_threshold,
             "random_state": self.processing.random_state,
+            "analysis_job_workers": self.processing.analysis_job_workers,
+            "analysis_job_queue_size": self.processing.analysis_job_queue_size,
+            "analysis_job_result_ttl_seconds": self.processing.analysis_job_result_ttl_seconds,
         }
 
 # Global configuration instance
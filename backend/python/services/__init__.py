@@ -1,19 +1,26 @@
 """
 Services package for Cryptique Python Data Processing
+
+Service modules are imported on first attribute access so that importing one
+service does not pull in the dependencies of all the others.
 """
 
-from .data_processor import DataProcessor
-from .embedding_generator import EmbeddingGenerator, EmbeddingModel
-from .vector_migrator import VectorMigrator, MigrationConfig, DataSource
-from .analytics_ml import AnalyticsMLService, PredictionType
+import importlib
+
+_EXPORTS = {
+    'DataProcessor': 'services.data_processor',
+    'EmbeddingGenerator': 'services.embedding_generator',
+    'EmbeddingModel': 'services.embedding_generator',
+    'VectorMigrator': 'services.vector_migrator',
+    'MigrationConfig': 'services.vector_migrator',
+    'DataSource': 'services.vector_migrator',
+    'AnalyticsMLService': 'services.analytics_ml',
+    'PredictionType': 'services.analytics_ml'
+}
+
+__all__ = list(_EXPORTS)
 
-__all__ = [
-    'DataProcessor',
-    'EmbeddingGenerator',
-    'EmbeddingModel',
-    'VectorMigrator',
-    'MigrationConfig',
-    'DataSource',
-    'AnalyticsMLService',
-    'PredictionType'
-] 
\ No newline at end of file
+def __getattr__(name):
+    if name in _EXPORTS:
+        return getattr(importlib.import_module(_EXPORTS[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,385 @@
+"""
+Asynchronous Analysis Jobs for Cryptique
+Runs long analyses (user journeys, predictions with retraining, segmentation) off the request path
+"""
+
+import asyncio
+import hashlib
+import json
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from config import config
+from utils.logger import get_logger
+from utils.database import get_db
+from utils.wire_format import dumps_json
+from services.data_processor import DataProcessor
+from services.analytics_ml import AnalyticsMLService, get_analytics_ml_service
+
+logger = get_logger(__name__)
+
+JOB_COLLECTION = "analysisjobs"
+
+# Analysis -> parameters (with defaults) that select its result
+ANALYSIS_PARAMETERS = {
+    'user_journeys': {'time_window': 30},
+    'churn_prediction': {'time_window': 30, 'retrain_model': False},
+    'conversion_prediction': {'time_window': 30, 'retrain_model': False},
+    'user_segmentation': {'time_window': 30, 'n_segments': 5}
+}
+
+TERMINAL_STATUSES = ("completed", "failed")
+
+@dataclass
+class AnalysisJob:
+    """A submitted analysis and its outcome"""
+    job_id: str
+    analysis: str
+    site_id: str
+    params: Dict[str, Any]
+    dedup_key: str
+    status: str = "queued"
+    submitted_at: datetime = field(default_factory=datetime.now)
+    started_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    updated: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Public view of the job"""
+        return {
+            'job_id': self.job_id,
+            'analysis': self.analysis,
+            'site_id': self.site_id,
+            'params': self.params,
+            'status': self.status,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'completed_at': self.completed_at,
+            'result': self.result,
+            'error': self.error
+        }
+
+class AnalysisJobManager:
+    """
+    Bounded pool of workers for analysis jobs.
+
+    Submitting an analysis returns its job id at once; up to queue_size jobs
+    wait for one of `workers` workers. Job state and results are written to
+    analysisjobs, whose documents expire result_ttl seconds after completion
+    through a TTL index. A submission matching a queued or running job (same
+    analysis, site and parameters) is attached to that job instead of running
+    the analysis again.
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        result_ttl: Optional[int] = None
+    ):
+        processing_config = config.get_processing_config()
+        self.workers = workers or processing_config['analysis_job_workers']
+        self.queue_size = queue_size or processing_config['analysis_job_queue_size']
+        self.result_ttl = result_ttl or processing_config['analysis_job_result_ttl_seconds']
+        self.db = None
+        self.data_processor: Optional[DataProcessor] = None
+        self.analytics_ml_service: Optional[AnalyticsMLService] = None
+
+        self.stats = {'submitted': 0, 'deduplicated': 0, 'rejected': 0, 'completed': 0, 'failed': 0}
+        self.is_running = False
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._active: Dict[str, AnalysisJob] = {}  # dedup key -> queued or running job
+        self._jobs: Dict[str, AnalysisJob] = {}  # job id -> queued or running job
+        # Serializes the dedup and capacity checks with the insert and enqueue that follow them
+        self._submit_lock = asyncio.Lock()
+
+    async def initialize(
+        self,
+        data_processor: Optional[DataProcessor] = None,
+        analytics_ml_service: Optional[AnalyticsMLService] = None
+    ):
+        """
+        Initialize the manager
+
+        Args:
+            data_processor: Processor for journey analysis; a new one if None
+            analytics_ml_service: ML service for predictions; the shared one if None
+        """
+        self.db = await get_db()
+        if data_processor is None:
+            data_processor = DataProcessor()
+            await data_processor.initialize()
+        self.data_processor = data_processor
+        self.analytics_ml_service = analytics_ml_service or await get_analytics_ml_service()
+
+        try:
+            await self.db.create_index(JOB_COLLECTION, [("expiresAt", 1)], expireAfterSeconds=0)
+        except Exception as e:
+            logger.warning(f"Could not create TTL index on {JOB_COLLECTION}: {e}")
+
+    async def start(self):
+        """Start the workers"""
+        if self.is_running:
+            return
+        self.is_running = True
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        logger.info(f"Analysis job manager started with {self.workers} workers")
+
+    async def stop(self):
+        """Stop the workers; queued and running jobs are marked failed"""
+        self.is_running = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for job in list(self._jobs.values()):
+            await self._finish(job, error="Service stopped before the analysis completed")
+        logger.info("Analysis job manager stopped")
+
+    async def submit(self, analysis: str, site_id: str, **params) -> Tuple[AnalysisJob, bool]:
+        """
+        Submit an analysis
+
+        Args:
+            analysis: One of ANALYSIS_PARAMETERS
+            site_id: Site identifier
+            **params: Analysis parameters (time_window, retrain_model, n_segments)
+
+        Returns:
+            The job, and whether it is an existing job the submission was attached to
+
+        Raises:
+            ValueError: Unknown analysis or parameter
+            asyncio.QueueFull: The job queue is full
+        """
+        if analysis not in ANALYSIS_PARAMETERS:
+            raise ValueError(f"Unsupported analysis: {analysis}")
+        unknown = set(params) - set(ANALYSIS_PARAMETERS[analysis])
+        if unknown:
+            raise ValueError(f"Unsupported parameters for {analysis}: {', '.join(sorted(unknown))}")
+        if not self.is_running:
+            raise RuntimeError("Analysis job manager is not running")
+
+        params = {**ANALYSIS_PARAMETERS[analysis], **params}
+        key = self._dedup_key(analysis, site_id, params)
+        async with self._submit_lock:
+            existing = self._active.get(key)
+            if existing is not None:
+                self.stats['deduplicated'] += 1
+                return existing, True
+
+            # Only submit enqueues, so the queue cannot fill up again before put_nowait below
+            if self._queue.full():
+                self.stats['rejected'] += 1
+                raise asyncio.QueueFull(f"Analysis job queue is full ({self.queue_size} jobs)")
+
+            job = AnalysisJob(job_id=uuid.uuid4().hex, analysis=analysis, site_id=site_id, params=params, dedup_key=key)
+            await self.db.insert_document(JOB_COLLECTION, {
+                "_id": job.job_id,
+                "analysis": analysis,
+                "siteId": site_id,
+                "params": params,
+                "dedupKey": key,
+                "status": job.status,
+                "submittedAt": job.submitted_at
+            })
+            self._active[key] = job
+            self._jobs[job.job_id] = job
+            self._queue.put_nowait(job)
+        self.stats['submitted'] += 1
+        logger.info(f"Queued {analysis} job {job.job_id} for site {site_id}")
+        return job, False
+
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a job's status, and its result once completed
+
+        Args:
+            job_id: Job identifier
+
+        Returns:
+            Job view, or None if unknown or expired
+        """
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        doc = await self.db.find_one_document(JOB_COLLECTION, {"_id": job_id})
+        return self._from_document(doc) if doc else None
+
+    async def subscribe(self, job_id: str, heartbeat: float = 15.0) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Follow a job until it completes
+
+        Args:
+            job_id: Job identifier
+            heartbeat: Seconds between repeated states while nothing changes
+
+        Yields:
+            Job view on every status change (and every heartbeat), ending with the final state
+        """
+        job = self._jobs.get(job_id)
+        if job is None:
+            # Finished, expired, or queued by another API process: follow the stored document
+            while True:
+                state = await self.get_job(job_id)
+                if state is None:
+                    return
+                yield state
+                if state['status'] in TERMINAL_STATUSES:
+                    return
+                await asyncio.sleep(heartbeat)
+
+        while True:
+            updated = job.updated
+            yield job.to_dict()
+            if job.status in TERMINAL_STATUSES:
+                return
+            try:
+                await asyncio.wait_for(updated.wait(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get job statistics"""
+        return {
+            **self.stats,
+            'is_running': self.is_running,
+            'workers': len(self._tasks),
+            'queued': self._queue.qsize() if self._queue is not None else 0,
+            'running': sum(1 for job in self._jobs.values() if job.status == "running")
+        }
+
+    # Private methods
+
+    async def _work(self):
+        while self.is_running:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: AnalysisJob):
+        job.started_at = datetime.now()
+        await self._set_status(job, "running", {"startedAt": job.started_at})
+        try:
+            result, error = await self._execute(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error running {job.analysis} job {job.job_id}: {e}")
+            result, error = None, str(e)
+        await self._finish(job, result, error)
+
+    async def _execute(self, job: AnalysisJob) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """Run the analysis; returns the response payload of the synchronous endpoint, or an error"""
+        params = job.params
+        if job.analysis == "user_journeys":
+            result = await self.data_processor.analyze_user_journeys(site_id=job.site_id, time_window=params['time_window'])
+            if not result.success:
+                return None, "; ".join(result.errors or []) or "Analysis failed"
+            return {
+                "success": True,
+                "clusters": result.metadata.get('clusters', {}),
+                "patterns": result.metadata.get('patterns', {}),
+                "insights": result.metadata.get('insights', []),
+                "feature_importance": result.metadata.get('feature_importance', {})
+            }, None
+
+        if job.analysis == "user_segmentation":
+            result = await self.analytics_ml_service.segment_users(
+                site_id=job.site_id,
+                time_window=params['time_window'],
+                n_segments=params['n_segments']
+            )
+            if not result.success:
+                return None, result.error
+            return {"success": True, "segments": result.predictions, "metadata": result.metadata}, None
+
+        predict = (
+            self.analytics_ml_service.predict_user_churn
+            if job.analysis == "churn_prediction"
+            else self.analytics_ml_service.predict_conversion_probability
+        )
+        result = await predict(site_id=job.site_id, time_window=params['time_window'], retrain_model=params['retrain_model'])
+        if not result.success:
+            return None, result.error
+        return {
+            "success": True,
+            "prediction_type": result.prediction_type,
+            "predictions": result.predictions,
+            "probabilities": result.probabilities,
+            "feature_importance": result.feature_importance,
+            "model_metrics": result.model_metrics,
+            "metadata": result.metadata
+        }, None
+
+    async def _finish(
+        self,
+        job: AnalysisJob,
+        result: Optional[Dict[str, Any]] = None,
+        error: Optional[str] = None
+    ):
+        job.completed_at = datetime.now()
+        job.error = error
+        # Plain JSON types, so the stored document and the in-memory view agree
+        job.result = json.loads(dumps_json(result)) if result is not None else None
+        status = "failed" if error is not None or result is None else "completed"
+        self.stats[status] += 1
+
+        self._jobs.pop(job.job_id, None)
+        if self._active.get(job.dedup_key) is job:
+            del self._active[job.dedup_key]
+        await self._set_status(job, status, {
+            "completedAt": job.completed_at,
+            "expiresAt": job.completed_at + timedelta(seconds=self.result_ttl),
+            "result": job.result,
+            "error": job.error
+        })
+        logger.info(f"{job.analysis} job {job.job_id} {status}")
+
+    async def _set_status(self, job: AnalysisJob, status: str, fields: Dict[str, Any]):
+        job.status = status
+        # Wake subscribers, then give later waiters a fresh event
+        updated, job.updated = job.updated, asyncio.Event()
+        updated.set()
+        try:
+            await self.db.update_document(JOB_COLLECTION, {"_id": job.job_id}, {"$set": {"status": status, **fields}})
+        except Exception as e:
+            logger.error(f"Error storing {status} state of analysis job {job.job_id}: {e}")
+
+    @staticmethod
+    def _dedup_key(analysis: str, site_id: str, params: Dict[str, Any]) -> str:
+        identity = json.dumps({"analysis": analysis, "site_id": site_id, "params": params}, sort_keys=True)
+        return hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _from_document(doc: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'job_id': doc['_id'],
+            'analysis': doc.get('analysis'),
+            'site_id': doc.get('siteId'),
+            'params': doc.get('params', {}),
+            'status': doc.get('status'),
+            'submitted_at': doc.get('submittedAt'),
+            'started_at': doc.get('startedAt'),
+            'completed_at': doc.get('completedAt'),
+            'result': doc.get('result'),
+            'error': doc.get('error')
+        }
+
+# Global analysis job manager instance
+analysis_job_manager = AnalysisJobManager()
+
+# Convenience functions
+async def get_analysis_job_manager() -> AnalysisJobManager:
+    """Get analysis job manager instance"""
+    if analysis_job_manager.db is None:
+        await analysis_job_manager.initialize()
+    return analysis_job_manager
@@ -25,11 +25,8 @@ from sklearn.model_selection import train_test_split, cross_val_score, GridSearc
 from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, roc_auc_score
 from sklearn.metrics import silhouette_score, adjusted_rand_score
 from sklearn.decomposition import PCA
-from sklearn.manifold import TSNE
 import scipy.stats as stats
 from scipy.stats import chi2_contingency
-import seaborn as sns
-import matplotlib.pyplot as plt
 
 from config import config
 from utils.logger import get_logger, log_async_performance, LogContext
@@ -64,6 +61,7 @@ class MLModelResult:
     predictions: Optional[np.ndarray] = None
     probabilities: Optional[np.ndarray] = None
     confidence_scores: Optional[np.ndarray] = None
+    row_ids: Optional[np.ndarray] = None  # User or session id of each prediction
     feature_importance: Optional[Dict[str, float]] = None
     model_metrics: Optional[Dict[str, float]] = None
     metadata: Optional[Dict[str, Any]] = None
@@ -199,6 +197,7 @@ class AnalyticsMLService:
                     prediction_type=PredictionType.CHURN_PREDICTION.value,
                     predictions=predictions,
                     probabilities=probabilities[:, 1],  # Probability of churn
+                    row_ids=self._row_ids(data, 'userId'),
                     feature_importance=feature_importance,
                     metadata={
                         'total_users': len(data),
@@ -273,6 +272,7 @@ class AnalyticsMLService:
                     model_type=MLModelType.REGRESSION.value,
                     prediction_type=PredictionType.CONVERSION_PREDICTION.value,
                     predictions=predictions,
+                    row_ids=self._row_ids(data, 'sessionId'),
                     feature_importance=feature_importance,
                     metadata={
                         'total_users': len(data),
@@ -329,7 +329,7 @@ class AnalyticsMLService:
                 )
                 
                 features = data[self.model_configs[PredictionType.ANOMALY_DETECTION]['features']]
-                predictions = model.fit_predict(features)
+                predictions = await asyncio.to_thread(model.fit_predict, features)
                 anomaly_scores = model.decision_function(features)
                 
                 # Convert predictions (-1 for anomaly, 1 for normal) to boolean
@@ -344,6 +344,7 @@ class AnalyticsMLService:
                     prediction_type=PredictionType.ANOMALY_DETECTION.value,
                     predictions=is_anomaly,
                     confidence_scores=np.abs(anomaly_scores),
+                    row_ids=self._row_ids(data, 'sessionId'),
                     metadata={
                         'total_records': len(data),
                         'anomalies_detected': np.sum(is_anomaly),
@@ -404,10 +405,10 @@ class AnalyticsMLService:
                 
                 # Perform clustering
                 kmeans = KMeans(n_clusters=optimal_k, random_state=42)
-                cluster_labels = kmeans.fit_predict(features_scaled)
+                cluster_labels = await asyncio.to_thread(kmeans.fit_predict, features_scaled)
                 
                 # Calculate silhouette score
-                silhouette_avg = silhouette_score(features_scaled, cluster_labels)
+                silhouette_avg = await asyncio.to_thread(silhouette_score, features_scaled, cluster_labels)
                 
                 # Generate segment profiles
                 segments = await self._generate_segment_profiles(data, cluster_labels, optimal_k)
@@ -420,6 +421,7 @@ class AnalyticsMLService:
                     model_type=MLModelType.CLUSTERING.value,
                     prediction_type=PredictionType.USER_SEGMENTATION.value,
                     predictions=cluster_labels,
+                    row_ids=self._row_ids(data, 'userId'),
                     metadata={
                         'total_users': len(data),
                         'n_segments': optimal_k,
@@ -636,6 +638,11 @@ class AnalyticsMLService:
     
     # Private methods
     
+    @staticmethod
+    def _row_ids(data: pd.DataFrame, column: str) -> Optional[np.ndarray]:
+        """Identifiers of the rows predictions were made for"""
+        return data[column].to_numpy() if column in data.columns else None
+    
     async def _prepare_churn_data(self, site_id: str, time_window: int) -> pd.DataFrame:
         """Prepare data for churn prediction"""
         # Get session data
@@ -794,7 +801,7 @@ class AnalyticsMLService:
             model = self.model_configs[PredictionType.CHURN_PREDICTION]['model_class'](
                 **self.model_configs[PredictionType.CHURN_PREDICTION]['params']
             )
-            model.fit(X_train, y_train)
+            await asyncio.to_thread(model.fit, X_train, y_train)
             
             # Evaluate model
             y_pred = model.predict(X_test)
@@ -840,7 +847,7 @@ class AnalyticsMLService:
             model = self.model_configs[PredictionType.CONVERSION_PREDICTION]['model_class'](
                 **self.model_configs[PredictionType.CONVERSION_PREDICTION]['params']
             )
-            model.fit(X_train, y_train)
+            await asyncio.to_thread(model.fit, X_train, y_train)
             
             # Evaluate model
             y_pred = model.predict(X_test)
@@ -880,7 +887,7 @@ class AnalyticsMLService:
         
         for k in k_range:
             kmeans = KMeans(n_clusters=k, random_state=42)
-            kmeans.fit(features)
+            await asyncio.to_thread(kmeans.fit, features)
             inertias.append(kmeans.inertia_)
         
         # Find elbow point
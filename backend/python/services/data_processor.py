@@ -631,10 +631,10 @@ class DataProcessor:
         
         # Perform clustering
         kmeans = KMeans(n_clusters=optimal_k, random_state=42)
-        clusters = kmeans.fit_predict(numeric_features)
+        clusters = await asyncio.to_thread(kmeans.fit_predict, numeric_features)
         
         # Calculate silhouette score
-        silhouette_avg = silhouette_score(numeric_features, clusters)
+        silhouette_avg = await asyncio.to_thread(silhouette_score, numeric_features, clusters)
         
         return {
             'clusters': clusters.tolist(),
@@ -654,7 +654,7 @@ class DataProcessor:
         
         for k in k_range:
             kmeans = KMeans(n_clusters=k, random_state=42)
-            kmeans.fit(features)
+            await asyncio.to_thread(kmeans.fit, features)
             inertias.append(kmeans.inertia_)
         
         # Find elbow point
@@ -739,7 +739,7 @@ class DataProcessor:
         
         # Use PCA to determine feature importance
         pca = PCA()
-        pca.fit(numeric_features)
+        await asyncio.to_thread(pca.fit, numeric_features)
         
         # Calculate feature importance based on first principal component
         feature_importance = {}
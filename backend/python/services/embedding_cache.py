@@ -0,0 +1,300 @@
+"""
+Local On-Disk Embedding Cache for Cryptique
+Memory-mapped vector slabs with a SQLite key index, used as the L2 tier
+between the in-memory cache and the MongoDB embedding_cache collection
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Any
+from dataclasses import dataclass
+import numpy as np
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+@dataclass
+class CachedEmbedding:
+    """Embedding entry read from the on-disk cache"""
+    cache_key: str
+    embedding: np.ndarray
+    model: Optional[str]
+    quality_score: Optional[float]
+    metadata: Dict[str, Any]
+    hits: int
+
+class DiskEmbeddingStore:
+    """
+    On-disk embedding store: one float32 memory-mapped slab per dimension plus a
+    SQLite index mapping cache keys to slab slots, hit counts and access times
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_entries: int = 500000,
+        initial_capacity: int = 1024
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.max_entries = max_entries
+        self.initial_capacity = initial_capacity
+        self.conn: Optional[sqlite3.Connection] = None
+        self.slabs: Dict[int, np.memmap] = {}
+        self.lock = threading.RLock()
+        self.entry_count = 0
+
+    def open(self):
+        """Open (or create) the index and slabs"""
+        with self.lock:
+            if self.conn is not None:
+                return
+
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self.conn = sqlite3.connect(
+                str(self.cache_dir / "index.sqlite"),
+                check_same_thread=False
+            )
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    cache_key TEXT PRIMARY KEY,
+                    dim INTEGER NOT NULL,
+                    slot INTEGER NOT NULL,
+                    model TEXT,
+                    quality_score REAL,
+                    metadata TEXT,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    last_access REAL NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_rank ON entries (hits, last_access)")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS free_slots (
+                    dim INTEGER NOT NULL,
+                    slot INTEGER NOT NULL,
+                    PRIMARY KEY (dim, slot)
+                )
+            """)
+            self.conn.commit()
+            self.entry_count = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            logger.info(f"Disk embedding cache opened at {self.cache_dir} ({self.entry_count} entries)")
+
+    def close(self):
+        """Flush slabs and close the index"""
+        with self.lock:
+            for slab in self.slabs.values():
+                slab.flush()
+            self.slabs = {}
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    def count(self) -> int:
+        """Number of cached embeddings (a running count, kept without scanning the index)"""
+        return self.entry_count
+
+    def get(self, cache_key: str) -> Optional[CachedEmbedding]:
+        """
+        Look up an embedding and record the hit
+
+        Args:
+            cache_key: Embedding cache key
+
+        Returns:
+            CachedEmbedding or None
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT dim, slot, model, quality_score, metadata, hits FROM entries WHERE cache_key = ?",
+                (cache_key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            dim, slot, model, quality_score, metadata, hits = row
+            embedding = np.array(self._get_slab(dim)[slot])
+            self.conn.execute(
+                "UPDATE entries SET hits = hits + 1, last_access = ? WHERE cache_key = ?",
+                (time.time(), cache_key)
+            )
+            self.conn.commit()
+
+            return CachedEmbedding(
+                cache_key=cache_key,
+                embedding=embedding,
+                model=model,
+                quality_score=quality_score,
+                metadata=json.loads(metadata) if metadata else {},
+                hits=hits + 1
+            )
+
+    def put(
+        self,
+        cache_key: str,
+        embedding: np.ndarray,
+        model: Optional[str] = None,
+        quality_score: Optional[float] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        hits: int = 0
+    ):
+        """
+        Store an embedding, evicting the least valuable entries if over capacity
+
+        Args:
+            cache_key: Embedding cache key
+            embedding: Embedding vector
+            model: Model that produced the embedding
+            quality_score: Embedding quality score
+            metadata: Embedding metadata (JSON-serialised)
+            hits: Initial hit count (used when promoting from the database)
+        """
+        embedding = np.asarray(embedding, dtype=np.float32)
+        dim = embedding.shape[0]
+        now = time.time()
+
+        with self.lock:
+            existing = self.conn.execute(
+                "SELECT dim, slot FROM entries WHERE cache_key = ?", (cache_key,)
+            ).fetchone()
+
+            if existing is None:
+                # Make room first so that the evicted slots can be reused
+                overflow = self.entry_count + 1 - self.max_entries
+                if overflow > 0:
+                    self.evict(overflow)
+                self.entry_count += 1
+
+            if existing and existing[0] == dim:
+                slot = existing[1]
+            else:
+                if existing:
+                    self._release_slot(*existing)
+                slot = self._allocate_slot(dim)
+
+            self._get_slab(dim, min_capacity=slot + 1)[slot] = embedding
+            self.conn.execute(
+                """
+                INSERT INTO entries (cache_key, dim, slot, model, quality_score, metadata, hits, last_access, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(cache_key) DO UPDATE SET
+                    dim = excluded.dim, slot = excluded.slot, model = excluded.model,
+                    quality_score = excluded.quality_score, metadata = excluded.metadata,
+                    last_access = excluded.last_access
+                """,
+                (cache_key, dim, slot, model, quality_score, json.dumps(metadata or {}, default=str), hits, now, now)
+            )
+            self.conn.commit()
+
+    def evict(self, count: int) -> int:
+        """
+        Demote the least valuable entries (fewest hits, then least recently used)
+
+        Args:
+            count: Number of entries to evict
+
+        Returns:
+            Number of entries evicted
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT cache_key, dim, slot FROM entries ORDER BY hits ASC, last_access ASC LIMIT ?",
+                (count,)
+            ).fetchall()
+            for cache_key, dim, slot in rows:
+                self.conn.execute("DELETE FROM entries WHERE cache_key = ?", (cache_key,))
+                self._release_slot(dim, slot)
+            self.conn.commit()
+            self.entry_count -= len(rows)
+            return len(rows)
+
+    def popular_entries(self, limit: int) -> List[CachedEmbedding]:
+        """
+        Get the most frequently hit entries, for pre-warming the in-memory cache
+
+        Args:
+            limit: Maximum number of entries
+
+        Returns:
+            Entries ordered by hits, most popular first
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                """
+                SELECT cache_key, dim, slot, model, quality_score, metadata, hits FROM entries
+                ORDER BY hits DESC, last_access DESC LIMIT ?
+                """,
+                (limit,)
+            ).fetchall()
+
+            return [
+                CachedEmbedding(
+                    cache_key=cache_key,
+                    embedding=np.array(self._get_slab(dim)[slot]),
+                    model=model,
+                    quality_score=quality_score,
+                    metadata=json.loads(metadata) if metadata else {},
+                    hits=hits
+                )
+                for cache_key, dim, slot, model, quality_score, metadata, hits in rows
+            ]
+
+    # Private methods
+
+    def _slab_path(self, dim: int) -> Path:
+        return self.cache_dir / f"vectors_{dim}.f32"
+
+    def _get_slab(self, dim: int, min_capacity: int = 0) -> np.memmap:
+        """Get the memory-mapped slab for a dimension, growing it if needed"""
+        slab = self.slabs.get(dim)
+        capacity = slab.shape[0] if slab is not None else 0
+
+        if slab is None:
+            path = self._slab_path(dim)
+            if path.exists() and path.stat().st_size >= dim * 4:
+                capacity = path.stat().st_size // (dim * 4)
+                slab = np.memmap(path, dtype=np.float32, mode='r+', shape=(capacity, dim))
+                self.slabs[dim] = slab
+
+        if slab is None or capacity < min_capacity:
+            new_capacity = max(self.initial_capacity, capacity)
+            while new_capacity < min_capacity:
+                new_capacity *= 2
+
+            if slab is not None:
+                slab.flush()
+                del self.slabs[dim]
+                del slab
+
+            path = self._slab_path(dim)
+            with open(path, 'ab') as f:
+                f.truncate(new_capacity * dim * 4)
+            slab = np.memmap(path, dtype=np.float32, mode='r+', shape=(new_capacity, dim))
+            self.slabs[dim] = slab
+
+        return slab
+
+    def _allocate_slot(self, dim: int) -> int:
+        """Reuse a freed slot, or append a new one"""
+        row = self.conn.execute(
+            "SELECT slot FROM free_slots WHERE dim = ? LIMIT 1", (dim,)
+        ).fetchone()
+        if row:
+            self.conn.execute("DELETE FROM free_slots WHERE dim = ? AND slot = ?", (dim, row[0]))
+            return row[0]
+
+        row = self.conn.execute("SELECT MAX(slot) FROM entries WHERE dim = ?", (dim,)).fetchone()
+        free_row = self.conn.execute("SELECT MAX(slot) FROM free_slots WHERE dim = ?", (dim,)).fetchone()
+        highest = max(
+            row[0] if row[0] is not None else -1,
+            free_row[0] if free_row[0] is not None else -1
+        )
+        return highest + 1
+
+    def _release_slot(self, dim: int, slot: int):
+        self.conn.execute("INSERT OR IGNORE INTO free_slots (dim, slot) VALUES (?, ?)", (dim, slot))
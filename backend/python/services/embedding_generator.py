@@ -5,29 +5,41 @@ Supports multiple embedding models with optimization and quality validation
 
 import asyncio
 import time
-from typing import Dict, List, Optional, Any, Tuple, Union
+from typing import Callable, Dict, List, Optional, Any, Tuple, Union
 from dataclasses import dataclass
 from enum import Enum
 import numpy as np
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 import hashlib
 import json
 import pickle
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
 from pathlib import Path
 
-# AI/ML imports
+# AI/ML imports (torch, transformers, sentence_transformers and umap are
+# imported on first use so that importing this module stays cheap)
 import openai
 import google.generativeai as genai
-from sentence_transformers import SentenceTransformer
-from transformers import AutoTokenizer, AutoModel
-import torch
 from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.decomposition import PCA
-import umap
 
 from config import config
 from utils.logger import get_logger, log_async_performance, LogContext
 from utils.database import get_db
+from utils.profiling import get_startup_profiler
+from utils.bloom_filter import BloomFilter
+from utils.resilience import LatencyTracker, CircuitBreaker, CircuitOpenError, CircuitState, hedged_request
+from services.embedding_cache import DiskEmbeddingStore
+from services.text_chunker import TextChunker, TextChunk
+from services.projectors import projector_registry
+from services.local_inference import (
+    LocalInferenceWorker,
+    HuggingFaceBackend,
+    SentenceTransformerBackend,
+    quantize_dynamic,
+    measure_agreement
+)
 
 logger = get_logger(__name__)
 
@@ -38,6 +50,10 @@ class EmbeddingModel(Enum):
     SENTENCE_TRANSFORMER = "sentence_transformer"
     HUGGINGFACE = "huggingface"
     LOCAL = "local"
+    AUTO = "auto"
+
+# Models served by remote APIs, where duplicate requests can cut tail latency
+REMOTE_MODELS = (EmbeddingModel.GEMINI, EmbeddingModel.OPENAI)
 
 class EmbeddingQuality(Enum):
     """Embedding quality levels"""
@@ -70,6 +86,20 @@ class BatchEmbeddingResult:
     metadata: Optional[Dict[str, Any]] = None
     errors: Optional[List[str]] = None
 
+@dataclass
+class ChunkedEmbeddingResult:
+    """Result of chunk-level embedding generation for long content"""
+    success: bool
+    chunks: Optional[List[TextChunk]] = None
+    embeddings: Optional[List[np.ndarray]] = None
+    document_embedding: Optional[np.ndarray] = None
+    model_used: Optional[str] = None
+    failed_indices: Optional[List[int]] = None
+    quality_score: Optional[float] = None
+    processing_time: Optional[float] = None
+    metadata: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
 class EmbeddingGenerator:
     """
     Advanced embedding generator with multi-model support and optimization
@@ -78,10 +108,43 @@ class EmbeddingGenerator:
     def __init__(self):
         self.db = None
         self.embedding_config = config.get_embedding_config()
-        self.cache = {}
+        self.cache = OrderedDict()
+        self.disk_cache: Optional[DiskEmbeddingStore] = None
+        self.cache_stats = {'memory_hits': 0, 'disk_hits': 0, 'database_hits': 0, 'misses': 0, 'filter_skips': 0}
+        self.known_cache_keys: Optional[BloomFilter] = None
+        self._cache_keys_backlog: Optional[List[str]] = None
+        self._cache_filter_task = None
         self.models = {}
+        self.inference_workers = {}
+        self._worker_lock = threading.Lock()
+        self._model_lock = threading.Lock()
+        self._warmup_task = None
+        self.quantization_reports = {}
         self.quality_validator = EmbeddingQualityValidator()
         self.optimizer = EmbeddingOptimizer()
+        self.chunker = TextChunker()
+        self.projectors = projector_registry
+        
+        # Per-provider latency and health, shared across the batch worker threads
+        self.latency_trackers = {
+            model: LatencyTracker(min_samples=self.embedding_config['hedge_min_samples'])
+            for model in EmbeddingModel
+        }
+        self.circuit_breakers = {
+            model: CircuitBreaker(
+                model.value,
+                failure_threshold=self.embedding_config['circuit_breaker_failure_threshold'],
+                reset_timeout=self.embedding_config['circuit_breaker_reset_timeout']
+            )
+            for model in EmbeddingModel
+        }
+        self.fallback_models = {
+            EmbeddingModel(primary): EmbeddingModel(fallback)
+            for primary, fallback in self.embedding_config['fallback_models'].items()
+        }
+        self.resilience_stats = {'hedged_requests': 0, 'hedge_wins': 0, 'fallback_requests': 0, 'circuit_rejections': 0}
+        self.in_flight = {model: 0 for model in EmbeddingModel}
+        self.router = EmbeddingRouter(self.embedding_config)
         
         # Initialize model configurations
         self.model_configs = {
@@ -112,6 +175,8 @@ class EmbeddingGenerator:
     async def initialize(self):
         """Initialize the embedding generator"""
         self.db = await get_db()
+        self.projectors.db = self.db
+        self.router.db = self.db
         
         # Initialize Gemini
         if self.model_configs[EmbeddingModel.GEMINI]['api_key']:
@@ -123,8 +188,19 @@ class EmbeddingGenerator:
             openai.api_key = self.model_configs[EmbeddingModel.OPENAI]['api_key']
             logger.info("OpenAI API initialized")
         
-        # Initialize local models
-        await self._initialize_local_models()
+        # Open the on-disk cache tier and pre-warm memory with its most popular entries
+        if self.embedding_config['cache_disk_enabled']:
+            with get_startup_profiler().stage("embedding_cache", "warmup"):
+                await asyncio.to_thread(self._open_disk_cache)
+        
+        # Build the negative cache for database lookups in the background;
+        # every lookup goes to the database until it is ready
+        if self.embedding_config['cache_filter_enabled']:
+            self._cache_filter_task = asyncio.create_task(self.rebuild_cache_filter())
+        
+        # Local models are loaded on first use; optionally warm them up in the background
+        if self.embedding_config['use_local_models'] and self.embedding_config['local_model_warmup']:
+            self._warmup_task = asyncio.create_task(self.warm_up_local_models())
         
         logger.info("Embedding generator initialized")
     
@@ -134,7 +210,8 @@ class EmbeddingGenerator:
         text: str,
         model: EmbeddingModel = EmbeddingModel.GEMINI,
         context: Optional[Dict[str, Any]] = None,
-        use_cache: bool = True
+        use_cache: bool = True,
+        defer_validation: bool = False
     ) -> EmbeddingResult:
         """
         Generate embedding for a single text
@@ -144,6 +221,8 @@ class EmbeddingGenerator:
             model: Embedding model to use
             context: Additional context for embedding
             use_cache: Whether to use cached embeddings
+            defer_validation: Leave quality_score unset and skip caching so the
+                caller can validate a whole batch at once (see _finalize_batch)
             
         Returns:
             EmbeddingResult with embedding and metadata
@@ -151,6 +230,9 @@ class EmbeddingGenerator:
         start_time = time.time()
         
         try:
+            if model == EmbeddingModel.AUTO:
+                model = await self.route_model(text, context)
+            
             # Check cache first
             if use_cache:
                 cached_result = await self._get_cached_embedding(text, model)
@@ -160,20 +242,11 @@ class EmbeddingGenerator:
             # Preprocess text
             processed_text = await self._preprocess_text(text, context)
             
-            # Generate embedding based on model
-            if model == EmbeddingModel.GEMINI:
-                embedding = await self._generate_gemini_embedding(processed_text)
-            elif model == EmbeddingModel.OPENAI:
-                embedding = await self._generate_openai_embedding(processed_text)
-            elif model == EmbeddingModel.SENTENCE_TRANSFORMER:
-                embedding = await self._generate_sentence_transformer_embedding(processed_text)
-            elif model == EmbeddingModel.HUGGINGFACE:
-                embedding = await self._generate_huggingface_embedding(processed_text)
-            else:
-                raise ValueError(f"Unsupported model: {model}")
+            # Generate embedding, hedging slow requests and failing over while a provider is degraded
+            embedding, served_by = await self._generate_with_failover(processed_text, model)
             
             # Validate embedding quality
-            quality_score = await self.quality_validator.validate_embedding(
+            quality_score = None if defer_validation else await self.quality_validator.validate_embedding(
                 embedding, text, model
             )
             
@@ -181,7 +254,7 @@ class EmbeddingGenerator:
             result = EmbeddingResult(
                 success=True,
                 embedding=embedding,
-                model_used=model.value,
+                model_used=served_by.value,
                 dimensions=len(embedding),
                 quality_score=quality_score,
                 processing_time=time.time() - start_time,
@@ -193,8 +266,9 @@ class EmbeddingGenerator:
             )
             
             # Cache result
-            if use_cache:
-                await self._cache_embedding(text, model, result)
+            if use_cache and not defer_validation:
+                # Key under the model that produced the vector so a fallback never answers for the primary
+                await self._cache_embedding(text, served_by, result)
             
             return result
             
@@ -239,6 +313,17 @@ class EmbeddingGenerator:
                     errors=["No texts provided"]
                 )
             
+            if model == EmbeddingModel.AUTO:
+                routed = [
+                    await self.route_model(text, context[i] if context else None)
+                    for i, text in enumerate(texts)
+                ]
+                if len(set(routed)) > 1:
+                    return await self._generate_routed_batch(
+                        texts, routed, batch_size, context, use_cache, max_workers
+                    )
+                model = routed[0]
+            
             batch_size = batch_size or self.embedding_config['batch_size']
             embeddings = []
             failed_indices = []
@@ -254,6 +339,7 @@ class EmbeddingGenerator:
                 batch_results = await self._process_batch(
                     batch_texts, model, batch_context, use_cache, max_workers
                 )
+                await self._finalize_batch(batch_texts, model, batch_results, use_cache)
                 
                 # Collect results
                 for j, result in enumerate(batch_results):
@@ -295,6 +381,88 @@ class EmbeddingGenerator:
                 processing_time=time.time() - start_time
             )
     
+    async def generate_chunked_embeddings(
+        self,
+        text: str,
+        model: EmbeddingModel = EmbeddingModel.GEMINI,
+        context: Optional[Dict[str, Any]] = None,
+        use_cache: bool = True
+    ) -> ChunkedEmbeddingResult:
+        """
+        Split long text into token-sized chunks and embed them in batches.
+        Each chunk is cached on its own, so re-embedding an edited document
+        only generates embeddings for the chunks that changed.
+        
+        Args:
+            text: Text to embed
+            model: Embedding model to use
+            context: Context applied to every chunk
+            use_cache: Whether to use cached embeddings
+            
+        Returns:
+            ChunkedEmbeddingResult with per-chunk embeddings and a
+            token-weighted document embedding
+        """
+        start_time = time.time()
+        
+        try:
+            if model == EmbeddingModel.AUTO:
+                model = await self.route_model(text, context)
+            
+            chunks = self.chunker.chunk(text)
+            if not chunks:
+                return ChunkedEmbeddingResult(success=False, error="No content to embed")
+            
+            batch_result = await self.generate_batch_embeddings(
+                [chunk.text for chunk in chunks],
+                model,
+                context=[context] * len(chunks) if context else None,
+                use_cache=use_cache
+            )
+            if not batch_result.success:
+                return ChunkedEmbeddingResult(
+                    success=False,
+                    chunks=chunks,
+                    failed_indices=batch_result.failed_indices,
+                    processing_time=time.time() - start_time,
+                    error="; ".join(str(e) for e in batch_result.errors or [])
+                )
+            
+            # Document embedding is the token-weighted mean of the chunks that succeeded
+            succeeded = [i for i, embedding in enumerate(batch_result.embeddings) if embedding is not None]
+            weights = np.array([chunks[i].token_count for i in succeeded], dtype=float)
+            stacked = np.vstack([batch_result.embeddings[i] for i in succeeded])
+            document_embedding = (stacked * weights[:, None]).sum(axis=0) / weights.sum()
+            norm = np.linalg.norm(document_embedding)
+            if norm > 0:
+                document_embedding = document_embedding / norm
+            
+            return ChunkedEmbeddingResult(
+                success=True,
+                chunks=chunks,
+                embeddings=batch_result.embeddings,
+                document_embedding=document_embedding,
+                model_used=model.value,
+                failed_indices=batch_result.failed_indices,
+                quality_score=float(np.mean([batch_result.quality_scores[i] for i in succeeded])),
+                processing_time=time.time() - start_time,
+                metadata={
+                    'chunk_count': len(chunks),
+                    'token_count': sum(chunk.token_count for chunk in chunks),
+                    'chunk_size': self.chunker.chunk_size,
+                    'chunk_overlap': self.chunker.chunk_overlap,
+                    'context': context
+                }
+            )
+            
+        except Exception as e:
+            logger.error(f"Error generating chunked embeddings: {e}")
+            return ChunkedEmbeddingResult(
+                success=False,
+                error=str(e),
+                processing_time=time.time() - start_time
+            )
+    
     async def calculate_similarity(
         self,
         embedding1: np.ndarray,
@@ -368,15 +536,23 @@ class EmbeddingGenerator:
         self,
         embeddings: List[np.ndarray],
         target_dimensions: int = 512,
-        method: str = "pca"
+        method: str = "pca",
+        projector_name: Optional[str] = None,
+        refit: bool = False
     ) -> List[np.ndarray]:
         """
         Reduce embedding dimensions
         
+        PCA uses a persisted projector from the registry, fitting it on these
+        embeddings only if it does not exist yet (or refit is set), so reduced
+        vectors are comparable across calls. UMAP is non-linear and is fitted per call.
+        
         Args:
             embeddings: List of embeddings to reduce
             target_dimensions: Target number of dimensions
             method: Reduction method (pca, umap)
+            projector_name: Registry name (defaults to pca_<source>_<target>)
+            refit: Fit a new projector even if one exists
             
         Returns:
             List of reduced embeddings
@@ -385,9 +561,15 @@ class EmbeddingGenerator:
             embeddings_array = np.array(embeddings)
             
             if method == "pca":
-                reducer = PCA(n_components=target_dimensions)
-                reduced = reducer.fit_transform(embeddings_array)
+                name = projector_name or f"pca_{embeddings_array.shape[1]}_{target_dimensions}"
+                projector = None if refit else self.projectors.get(name)
+                if projector is None:
+                    projector = await asyncio.to_thread(
+                        self.projectors.fit, name, embeddings_array, target_dimensions
+                    )
+                reduced = projector.transform(embeddings_array)
             elif method == "umap":
+                import umap
                 reducer = umap.UMAP(n_components=target_dimensions)
                 reduced = reducer.fit_transform(embeddings_array)
             else:
@@ -418,26 +600,167 @@ class EmbeddingGenerator:
     
     # Private methods
     
-    async def _initialize_local_models(self):
-        """Initialize local embedding models"""
-        try:
-            # Initialize Sentence Transformer
-            if EmbeddingModel.SENTENCE_TRANSFORMER not in self.models:
-                model_name = self.model_configs[EmbeddingModel.SENTENCE_TRANSFORMER]['model_name']
-                self.models[EmbeddingModel.SENTENCE_TRANSFORMER] = SentenceTransformer(model_name)
-                logger.info(f"Loaded Sentence Transformer model: {model_name}")
+    async def warm_up_local_models(self):
+        """Load local models and start their inference workers ahead of first use"""
+        profiler = get_startup_profiler()
+        for model in (EmbeddingModel.SENTENCE_TRANSFORMER, EmbeddingModel.HUGGINGFACE):
+            try:
+                with profiler.stage(f"embedding_generator.{model.value}", "warmup"):
+                    await asyncio.to_thread(self._get_inference_worker, model)
+            except Exception as e:
+                logger.warning(f"Error warming up local model {model.value}: {e}")
+    
+    def _load_local_model(self, model: EmbeddingModel):
+        """Load a local embedding model on first use"""
+        with self._model_lock:
+            if model in self.models:
+                return self.models[model]
+            
+            model_name = self.model_configs[model]['model_name']
             
-            # Initialize HuggingFace model
-            if EmbeddingModel.HUGGINGFACE not in self.models:
-                model_name = self.model_configs[EmbeddingModel.HUGGINGFACE]['model_name']
-                self.models[EmbeddingModel.HUGGINGFACE] = {
+            if model == EmbeddingModel.SENTENCE_TRANSFORMER:
+                from sentence_transformers import SentenceTransformer
+                self.models[model] = SentenceTransformer(model_name)
+                logger.info(f"Loaded Sentence Transformer model: {model_name}")
+            elif model == EmbeddingModel.HUGGINGFACE:
+                from transformers import AutoTokenizer, AutoModel
+                self.models[model] = {
                     'tokenizer': AutoTokenizer.from_pretrained(model_name),
                     'model': AutoModel.from_pretrained(model_name)
                 }
                 logger.info(f"Loaded HuggingFace model: {model_name}")
-                
+            else:
+                raise ValueError(f"Not a local model: {model}")
+            
+            return self.models[model]
+    
+    def _get_inference_worker(self, model: EmbeddingModel) -> LocalInferenceWorker:
+        """Get (or start) the batching inference worker that owns a local model"""
+        with self._worker_lock:
+            if model in self.inference_workers:
+                return self.inference_workers[model]
+            
+            self._load_local_model(model)
+            backend = self._create_local_backend(model)
+            
+            if self.embedding_config['local_quantize']:
+                backend = self._quantize_backend(model, backend)
+            
+            worker = LocalInferenceWorker(
+                name=model.value,
+                backend=backend,
+                max_batch_size=self.embedding_config['local_batch_size'],
+                max_batch_tokens=self.embedding_config['local_batch_max_tokens'],
+                max_wait_ms=self.embedding_config['local_batch_wait_ms'],
+                num_threads=self.embedding_config['local_inference_threads'],
+                sequence_buckets=self.embedding_config['local_sequence_buckets']
+            )
+            worker.start()
+            self.inference_workers[model] = worker
+            return worker
+    
+    def _create_local_backend(self, model: EmbeddingModel, quantized: bool = False):
+        """Create an inference backend for a loaded local model"""
+        if model == EmbeddingModel.SENTENCE_TRANSFORMER:
+            st_model = self.models[model]
+            return SentenceTransformerBackend(quantize_dynamic(st_model) if quantized else st_model)
+        elif model == EmbeddingModel.HUGGINGFACE:
+            tokenizer = self.models[model]['tokenizer']
+            hf_model = self.models[model]['model']
+            return HuggingFaceBackend(
+                tokenizer,
+                quantize_dynamic(hf_model) if quantized else hf_model,
+                max_length=min(self.model_configs[model]['max_tokens'], tokenizer.model_max_length)
+            )
+        else:
+            raise ValueError(f"No local inference backend for model: {model}")
+    
+    def _quantize_backend(self, model: EmbeddingModel, backend):
+        """
+        Swap a backend for an int8 quantised one if it agrees with fp32 closely enough
+        """
+        try:
+            quantized_backend = self._create_local_backend(model, quantized=True)
+            report = measure_agreement(backend, quantized_backend)
         except Exception as e:
-            logger.warning(f"Error initializing local models: {e}")
+            logger.warning(f"Error quantising {model.value}, using fp32: {e}")
+            self.quantization_reports[model.value] = {'enabled': False, 'error': str(e)}
+            return backend
+        
+        min_agreement = self.embedding_config['local_quantization_min_agreement']
+        report['enabled'] = report['mean_cosine'] >= min_agreement
+        report['min_agreement'] = min_agreement
+        self.quantization_reports[model.value] = report
+        
+        if not report['enabled']:
+            logger.warning(
+                f"Quantised {model.value} agreement {report['mean_cosine']:.4f} is below "
+                f"{min_agreement}, using fp32"
+            )
+            return backend
+        
+        logger.info(
+            f"Using int8 {model.value}: mean cosine {report['mean_cosine']:.4f}, "
+            f"speedup {report['speedup']:.2f}x"
+        )
+        return quantized_backend
+    
+    def verify_quantization(
+        self,
+        model: EmbeddingModel,
+        sample_texts: Optional[List[str]] = None
+    ) -> Dict[str, float]:
+        """
+        Compare int8 quantised outputs against fp32 outputs on a sample set
+        
+        Args:
+            model: Local model to check
+            sample_texts: Texts to compare on (defaults to a built-in sample set)
+            
+        Returns:
+            Cosine agreement statistics and relative speed
+        """
+        self._load_local_model(model)
+        return measure_agreement(
+            self._create_local_backend(model),
+            self._create_local_backend(model, quantized=True),
+            sample_texts
+        )
+    
+    async def _get_local_worker(self, model: EmbeddingModel) -> LocalInferenceWorker:
+        """Get a local inference worker, loading the model off the event loop if needed"""
+        worker = self.inference_workers.get(model)
+        if worker is None:
+            worker = await asyncio.to_thread(self._get_inference_worker, model)
+        return worker
+    
+    def get_local_inference_stats(self) -> Dict[str, Any]:
+        """Get per-batch latency and throughput statistics for local models"""
+        stats = {
+            model.value: worker.get_stats()
+            for model, worker in self.inference_workers.items()
+        }
+        for model_name, report in self.quantization_reports.items():
+            stats.setdefault(model_name, {})['quantization'] = report
+        return stats
+    
+    async def shutdown(self):
+        """Stop local inference workers"""
+        if self._warmup_task and not self._warmup_task.done():
+            self._warmup_task.cancel()
+        if self._cache_filter_task and not self._cache_filter_task.done():
+            self._cache_filter_task.cancel()
+        if self.known_cache_keys is not None and self.embedding_config['cache_filter_persist']:
+            try:
+                await asyncio.to_thread(self.known_cache_keys.save, str(self._cache_filter_path()))
+            except Exception as e:
+                logger.warning(f"Error persisting embedding cache filter: {e}")
+        for worker in self.inference_workers.values():
+            worker.stop()
+        self.inference_workers = {}
+        if self.disk_cache:
+            self.disk_cache.close()
+            self.disk_cache = None
     
     async def _preprocess_text(
         self,
@@ -453,9 +776,13 @@ class EmbeddingGenerator:
             context_str = self._format_context(context)
             processed_text = f"{context_str}\n\n{processed_text}"
         
-        # Truncate if too long
+        # Truncate if too long; long content should go through generate_chunked_embeddings
         max_tokens = 8000  # Conservative limit
         if len(processed_text) > max_tokens:
+            logger.warning(
+                f"Truncating {len(processed_text)} characters to {max_tokens}; "
+                f"use generate_chunked_embeddings to embed the full text"
+            )
             processed_text = processed_text[:max_tokens]
         
         return processed_text
@@ -478,6 +805,183 @@ class EmbeddingGenerator:
         
         return " | ".join(context_parts)
     
+    async def route_model(self, text: str, context: Optional[Dict[str, Any]] = None) -> EmbeddingModel:
+        """
+        Resolve EmbeddingModel.AUTO to the model pinned for the item's vector space
+        
+        Args:
+            text: Text to embed
+            context: Item context; 'vector_space' or 'source_type' selects the space
+            
+        Returns:
+            Concrete embedding model
+        """
+        return await self.router.route(
+            text,
+            context,
+            token_count=self.chunker.count_tokens,
+            in_flight=self.in_flight,
+            available=self._model_available
+        )
+    
+    def _model_available(self, model: EmbeddingModel) -> bool:
+        """Whether a model is configured and its provider is healthy"""
+        if model in REMOTE_MODELS:
+            configured = bool(self.model_configs[model]['api_key'])
+        else:
+            configured = model in self.model_configs and self.embedding_config['use_local_models']
+        return configured and self.circuit_breakers[model].state == CircuitState.CLOSED
+    
+    async def _generate_routed_batch(
+        self,
+        texts: List[str],
+        routed: List[EmbeddingModel],
+        batch_size: Optional[int],
+        context: Optional[List[Dict[str, Any]]],
+        use_cache: bool,
+        max_workers: int
+    ) -> BatchEmbeddingResult:
+        """Embed texts routed to different models, one batch call per model, in input order"""
+        start_time = time.time()
+        embeddings: List[Optional[np.ndarray]] = [None] * len(texts)
+        quality_scores = [0.0] * len(texts)
+        # Error per failed input index, so errors line up with the sorted failed_indices
+        errors_by_index: Dict[int, str] = {}
+        models_used = {}
+        
+        for model in dict.fromkeys(routed):
+            indices = [i for i, routed_model in enumerate(routed) if routed_model == model]
+            result = await self.generate_batch_embeddings(
+                [texts[i] for i in indices],
+                model,
+                batch_size=batch_size,
+                context=[context[i] for i in indices] if context else None,
+                use_cache=use_cache,
+                max_workers=max_workers
+            )
+            models_used[model.value] = len(indices)
+            
+            if result.embeddings is None:
+                error = "; ".join(str(e) for e in result.errors or []) or f"{model.value} batch failed"
+                errors_by_index.update((i, error) for i in indices)
+                continue
+            for position, i in enumerate(indices):
+                embeddings[i] = result.embeddings[position]
+                quality_scores[i] = result.quality_scores[position]
+            model_errors = result.errors or []
+            for k, position in enumerate(result.failed_indices or []):
+                errors_by_index[indices[position]] = model_errors[k] if k < len(model_errors) else f"{model.value} embedding failed"
+        
+        failed_indices = sorted(errors_by_index)
+        successful = [embedding for embedding in embeddings if embedding is not None]
+        return BatchEmbeddingResult(
+            success=len(successful) > 0,
+            embeddings=embeddings,
+            failed_indices=failed_indices,
+            total_processed=len(texts),
+            processing_time=time.time() - start_time,
+            quality_scores=quality_scores,
+            metadata={
+                'successful_count': len(successful),
+                'failed_count': len(failed_indices),
+                'average_quality': np.mean([q for q in quality_scores if q > 0]) if successful else 0,
+                'model_used': EmbeddingModel.AUTO.value,
+                'models_used': models_used,
+                'batch_size': batch_size or self.embedding_config['batch_size']
+            },
+            errors=[errors_by_index[i] for i in failed_indices]
+        )
+    
+    async def _generate_with_model(self, text: str, model: EmbeddingModel) -> np.ndarray:
+        """Generate an embedding with one specific model"""
+        if model == EmbeddingModel.GEMINI:
+            return await self._generate_gemini_embedding(text)
+        elif model == EmbeddingModel.OPENAI:
+            return await self._generate_openai_embedding(text)
+        elif model == EmbeddingModel.SENTENCE_TRANSFORMER:
+            return await self._generate_sentence_transformer_embedding(text)
+        elif model == EmbeddingModel.HUGGINGFACE:
+            return await self._generate_huggingface_embedding(text)
+        else:
+            raise ValueError(f"Unsupported model: {model}")
+    
+    async def _call_provider(self, text: str, model: EmbeddingModel) -> Tuple[np.ndarray, EmbeddingModel]:
+        """Generate an embedding, recording latency and outcome for the model's provider"""
+        start_time = time.time()
+        self.in_flight[model] += 1
+        self.router.record_request(model)
+        try:
+            embedding = await self._generate_with_model(text, model)
+        except asyncio.CancelledError:
+            # A losing hedge is still a slow request; record a censored sample so p95 keeps it
+            self.latency_trackers[model].record(time.time() - start_time)
+            raise
+        except Exception:
+            self.circuit_breakers[model].record_failure()
+            raise
+        finally:
+            self.in_flight[model] -= 1
+        
+        self.latency_trackers[model].record(time.time() - start_time)
+        self.circuit_breakers[model].record_success()
+        return embedding, model
+    
+    async def _generate_with_failover(
+        self,
+        text: str,
+        model: EmbeddingModel
+    ) -> Tuple[np.ndarray, EmbeddingModel]:
+        """
+        Generate an embedding with per-provider circuit breakers and hedging.
+        
+        While the model's circuit is open the request goes straight to its
+        configured fallback, or fails fast. Remote requests still running after
+        the provider's hedge percentile latency get a backup request (to the
+        fallback, else the same provider) and the first to succeed wins.
+        
+        Returns:
+            Tuple of (embedding, model that served it)
+        """
+        fallback = self.fallback_models.get(model)
+        
+        if not self.circuit_breakers[model].allow_request():
+            self.resilience_stats['circuit_rejections'] += 1
+            if fallback and self.circuit_breakers[fallback].allow_request():
+                self.resilience_stats['fallback_requests'] += 1
+                return await self._call_provider(text, fallback)
+            raise CircuitOpenError(f"Circuit for {model.value} is open")
+        
+        delay = self.latency_trackers[model].percentile(self.embedding_config['hedge_percentile'])
+        if not self.embedding_config['hedging_enabled'] or model not in REMOTE_MODELS or delay is None:
+            return await self._call_provider(text, model)
+        
+        def backup():
+            for backup_model in (fallback, model):
+                if backup_model and self.circuit_breakers[backup_model].allow_request():
+                    self.resilience_stats['hedged_requests'] += 1
+                    return self._call_provider(text, backup_model)
+            return None
+        
+        (embedding, served_by), backup_won = await hedged_request(
+            lambda: self._call_provider(text, model), backup, delay
+        )
+        if backup_won:
+            self.resilience_stats['hedge_wins'] += 1
+        return embedding, served_by
+    
+    def get_resilience_stats(self) -> Dict[str, Any]:
+        """Get hedging, failover and circuit breaker state per provider"""
+        return {
+            **self.resilience_stats,
+            'providers': {
+                model.value: {
+                    'circuit': self.circuit_breakers[model].get_stats(),
+                    'latency': self.latency_trackers[model].get_stats()
+                }
+                for model in self.circuit_breakers
+            }
+        }
+    
     async def _generate_gemini_embedding(self, text: str) -> np.ndarray:
         """Generate embedding using Gemini API"""
         try:
@@ -515,9 +1019,8 @@ class EmbeddingGenerator:
     async def _generate_sentence_transformer_embedding(self, text: str) -> np.ndarray:
         """Generate embedding using Sentence Transformer"""
         try:
-            model = self.models[EmbeddingModel.SENTENCE_TRANSFORMER]
-            embedding = await asyncio.to_thread(model.encode, text)
-            return np.array(embedding)
+            worker = await self._get_local_worker(EmbeddingModel.SENTENCE_TRANSFORMER)
+            return await worker.embed(text)
             
         except Exception as e:
             logger.error(f"Error generating Sentence Transformer embedding: {e}")
@@ -526,18 +1029,8 @@ class EmbeddingGenerator:
     async def _generate_huggingface_embedding(self, text: str) -> np.ndarray:
         """Generate embedding using HuggingFace model"""
         try:
-            tokenizer = self.models[EmbeddingModel.HUGGINGFACE]['tokenizer']
-            model = self.models[EmbeddingModel.HUGGINGFACE]['model']
-            
-            # Tokenize
-            inputs = tokenizer(text, return_tensors='pt', truncation=True, padding=True)
-            
-            # Generate embedding
-            with torch.no_grad():
-                outputs = model(**inputs)
-                embedding = outputs.last_hidden_state.mean(dim=1).squeeze()
-            
-            return embedding.numpy()
+            worker = await self._get_local_worker(EmbeddingModel.HUGGINGFACE)
+            return await worker.embed(text)
             
         except Exception as e:
             logger.error(f"Error generating HuggingFace embedding: {e}")
@@ -551,7 +1044,17 @@ class EmbeddingGenerator:
         use_cache: bool,
         max_workers: int
     ) -> List[EmbeddingResult]:
-        """Process a batch of texts"""
+        """Process a batch of texts; quality validation is left to _finalize_batch"""
+        # Local models batch inside their inference worker, so submit the whole
+        # batch concurrently instead of capping it at the thread pool size
+        if model in (EmbeddingModel.SENTENCE_TRANSFORMER, EmbeddingModel.HUGGINGFACE):
+            return list(await asyncio.gather(*[
+                self.generate_embedding(
+                    text, model, context[i] if context else None, use_cache, defer_validation=True
+                )
+                for i, text in enumerate(texts)
+            ]))
+        
         results = []
         
         # Use ThreadPoolExecutor for concurrent processing
@@ -562,12 +1065,12 @@ class EmbeddingGenerator:
                 text_context = context[i] if context else None
                 future = executor.submit(
                     asyncio.run,
-                    self.generate_embedding(text, model, text_context, use_cache)
+                    self.generate_embedding(text, model, text_context, use_cache, defer_validation=True)
                 )
                 futures.append(future)
             
-            # Collect results
-            for future in as_completed(futures):
+            # Collect results in submission order so they line up with texts
+            for future in futures:
                 try:
                     result = future.result()
                     results.append(result)
@@ -579,17 +1082,80 @@ class EmbeddingGenerator:
         
         return results
     
+    async def _finalize_batch(
+        self,
+        texts: List[str],
+        model: EmbeddingModel,
+        results: List[EmbeddingResult],
+        use_cache: bool
+    ):
+        """
+        Score freshly generated embeddings with one vectorised validation pass,
+        mark non-finite or zero-magnitude rows as failed, and cache the rest.
+        Cache hits already carry a quality score and are left as they are.
+        """
+        fresh_by_dimension: Dict[int, List[int]] = {}
+        for i, result in enumerate(results):
+            if result.success and result.quality_score is None:
+                fresh_by_dimension.setdefault(len(result.embedding), []).append(i)
+        
+        for indices in fresh_by_dimension.values():
+            matrix = np.vstack([results[i].embedding for i in indices])
+            scores, failures = self.quality_validator.validate_batch(
+                matrix, [texts[i] for i in indices], model
+            )
+            
+            for i, score, failed in zip(indices, scores, failures):
+                if failed:
+                    results[i] = EmbeddingResult(
+                        success=False,
+                        model_used=model.value,
+                        processing_time=results[i].processing_time,
+                        error="Embedding failed validation (non-finite values or zero magnitude)"
+                    )
+                    continue
+                
+                results[i].quality_score = float(score)
+                if use_cache:
+                    await self._cache_embedding(texts[i], EmbeddingModel(results[i].model_used), results[i])
+    
     async def _get_cached_embedding(
         self,
         text: str,
         model: EmbeddingModel
     ) -> Optional[EmbeddingResult]:
-        """Get cached embedding if available"""
+        """
+        Get cached embedding if available, checking memory, local disk, then the database.
+        Disk and database hits are promoted to the faster tiers.
+        """
         cache_key = self._generate_cache_key(text, model)
         
         if cache_key in self.cache:
+            self.cache.move_to_end(cache_key)
+            self.cache_stats['memory_hits'] += 1
             return self.cache[cache_key]
         
+        # Check local disk cache
+        if self.disk_cache:
+            try:
+                # SQLite and memmap I/O stay off the event loop
+                cached = await asyncio.to_thread(self.disk_cache.get, cache_key)
+            except Exception as e:
+                logger.warning(f"Error reading disk embedding cache: {e}")
+                cached = None
+            
+            if cached:
+                result = self._cached_result(model, cached.embedding, cached.quality_score, cached.metadata)
+                self._remember(cache_key, result)
+                self.cache_stats['disk_hits'] += 1
+                return result
+        
+        # Skip the database when the key is definitely not there
+        if self.known_cache_keys is not None and cache_key not in self.known_cache_keys:
+            self.cache_stats['filter_skips'] += 1
+            self.cache_stats['misses'] += 1
+            return None
+        
         # Check database cache
         cached_doc = await self.db.find_one_document(
             "embedding_cache",
@@ -597,21 +1163,20 @@ class EmbeddingGenerator:
         )
         
         if cached_doc:
-            embedding = np.array(cached_doc['embedding'])
-            result = EmbeddingResult(
-                success=True,
-                embedding=embedding,
-                model_used=model.value,
-                dimensions=len(embedding),
-                quality_score=cached_doc.get('quality_score', 0.8),
-                processing_time=0.0,
-                metadata=cached_doc.get('metadata', {})
+            result = self._cached_result(
+                model,
+                np.array(cached_doc['embedding']),
+                cached_doc.get('quality_score', 0.8),
+                cached_doc.get('metadata', {})
             )
             
-            # Cache in memory
-            self.cache[cache_key] = result
+            # Promote to local disk and memory
+            await self._store_on_disk(cache_key, result, hits=1)
+            self._remember(cache_key, result)
+            self.cache_stats['database_hits'] += 1
             return result
         
+        self.cache_stats['misses'] += 1
         return None
     
     async def _cache_embedding(
@@ -620,11 +1185,12 @@ class EmbeddingGenerator:
         model: EmbeddingModel,
         result: EmbeddingResult
     ):
-        """Cache embedding result"""
+        """Cache embedding result in every tier"""
         cache_key = self._generate_cache_key(text, model)
         
-        # Cache in memory
-        self.cache[cache_key] = result
+        # Cache in memory and on local disk
+        self._remember(cache_key, result)
+        await self._store_on_disk(cache_key, result)
         
         # Cache in database
         cache_doc = {
@@ -639,9 +1205,155 @@ class EmbeddingGenerator:
         
         try:
             await self.db.insert_document("embedding_cache", cache_doc)
+            self._add_known_cache_key(cache_key)
         except Exception as e:
             logger.warning(f"Error caching embedding: {e}")
     
+    def _add_known_cache_key(self, cache_key: str):
+        """Record a key written to the database cache in the negative cache"""
+        if self._cache_keys_backlog is not None:
+            self._cache_keys_backlog.append(cache_key)
+        if self.known_cache_keys is not None:
+            self.known_cache_keys.add(cache_key)
+    
+    def _cache_filter_path(self) -> Path:
+        return Path(self.embedding_config['cache_dir']) / "cache_keys.bloom.npz"
+    
+    async def rebuild_cache_filter(self):
+        """
+        Build the Bloom filter of embedding_cache keys from the collection.
+        A persisted filter is reused only if the collection still has the
+        document count and newest _id it was built from, so any insert since
+        (even one balanced by a delete) forces a rebuild. Keys inserted by other
+        instances after the build are treated as absent until the next rebuild,
+        which costs a regeneration rather than a wrong result.
+        """
+        try:
+            start_time = time.time()
+            total = await self.db.count_documents("embedding_cache", {})
+            newest = await self.db.find_documents("embedding_cache", {}, {"_id": 1}, limit=1, sort=[("_id", -1)])
+            source_version = f"{total}:{newest[0]['_id'] if newest else ''}"
+            path = self._cache_filter_path()
+            
+            if self.embedding_config['cache_filter_persist'] and path.exists():
+                try:
+                    bloom = await asyncio.to_thread(BloomFilter.load, str(path))
+                    if bloom.source_version == source_version:
+                        self.known_cache_keys = bloom
+                        logger.info(f"Loaded embedding cache filter with {total} keys from {path}")
+                        return
+                except Exception as e:
+                    logger.warning(f"Ignoring unreadable embedding cache filter {path}: {e}")
+            
+            # Keys cached while streaming may be missed by the cursor; replay them afterwards
+            self._cache_keys_backlog = []
+            bloom = BloomFilter(
+                capacity=max(self.embedding_config['cache_filter_capacity'], total * 2),
+                error_rate=self.embedding_config['cache_filter_error_rate']
+            )
+            # Taken before the scan, so documents inserted during it invalidate the saved filter
+            bloom.source_version = source_version
+            async for doc in self.db.stream_documents("embedding_cache", {}, {"cache_key": 1, "_id": 0}):
+                bloom.add(doc['cache_key'])
+            bloom.add_many(self._cache_keys_backlog)
+            self.known_cache_keys = bloom
+            
+            logger.info(
+                f"Built embedding cache filter with {bloom.count} keys in {time.time() - start_time:.2f}s "
+                f"(estimated false positive rate {bloom.estimated_error_rate():.4f})"
+            )
+            
+            if self.embedding_config['cache_filter_persist']:
+                await asyncio.to_thread(bloom.save, str(path))
+            
+        except Exception as e:
+            logger.error(f"Error building embedding cache filter: {e}")
+        finally:
+            self._cache_keys_backlog = None
+    
+    def _remember(self, cache_key: str, result: EmbeddingResult):
+        """Add to the in-memory LRU; entries evicted from memory remain on disk"""
+        self.cache[cache_key] = result
+        self.cache.move_to_end(cache_key)
+        while len(self.cache) > self.embedding_config['cache_memory_size']:
+            self.cache.popitem(last=False)
+    
+    async def _store_on_disk(self, cache_key: str, result: EmbeddingResult, hits: int = 0):
+        """Write to the local disk tier; the least-hit entries are demoted when it is full"""
+        if not self.disk_cache or result.embedding is None:
+            return
+        try:
+            await asyncio.to_thread(
+                self.disk_cache.put, cache_key, result.embedding, result.model_used,
+                result.quality_score, result.metadata, hits=hits
+            )
+        except Exception as e:
+            logger.warning(f"Error writing disk embedding cache: {e}")
+    
+    def _cached_result(
+        self,
+        model: EmbeddingModel,
+        embedding: np.ndarray,
+        quality_score: Optional[float],
+        metadata: Optional[Dict[str, Any]]
+    ) -> EmbeddingResult:
+        """Build an EmbeddingResult for a cache hit"""
+        return EmbeddingResult(
+            success=True,
+            embedding=embedding,
+            model_used=model.value,
+            dimensions=len(embedding),
+            quality_score=quality_score if quality_score is not None else 0.8,
+            processing_time=0.0,
+            metadata=metadata or {}
+        )
+    
+    def _open_disk_cache(self):
+        """Open the disk cache tier and load its most popular entries into memory"""
+        try:
+            disk_cache = DiskEmbeddingStore(
+                self.embedding_config['cache_dir'],
+                max_entries=self.embedding_config['cache_disk_size']
+            )
+            disk_cache.open()
+            
+            prewarm = min(self.embedding_config['cache_prewarm'], self.embedding_config['cache_memory_size'])
+            entries = disk_cache.popular_entries(prewarm) if prewarm > 0 else []
+            # Insert least popular first so the most popular end up most recently used
+            for entry in reversed(entries):
+                result = EmbeddingResult(
+                    success=True,
+                    embedding=entry.embedding,
+                    model_used=entry.model,
+                    dimensions=len(entry.embedding),
+                    quality_score=entry.quality_score if entry.quality_score is not None else 0.8,
+                    processing_time=0.0,
+                    metadata=entry.metadata
+                )
+                self._remember(entry.cache_key, result)
+            
+            self.disk_cache = disk_cache
+            logger.info(f"Pre-warmed embedding cache with {len(entries)} entries from disk")
+        except Exception as e:
+            logger.error(f"Error opening disk embedding cache: {e}")
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Get embedding cache hit rates per tier"""
+        lookups = sum(
+            self.cache_stats[name] for name in ('memory_hits', 'disk_hits', 'database_hits', 'misses')
+        )
+        return {
+            **self.cache_stats,
+            'lookups': lookups,
+            'hit_rate': (lookups - self.cache_stats['misses']) / lookups if lookups else 0.0,
+            'memory_entries': len(self.cache),
+            'disk_entries': self.disk_cache.count() if self.disk_cache else 0,
+            'filter_keys': self.known_cache_keys.count if self.known_cache_keys is not None else None,
+            'filter_error_rate': (
+                self.known_cache_keys.estimated_error_rate() if self.known_cache_keys is not None else None
+            )
+        }
+    
     def _generate_cache_key(self, text: str, model: EmbeddingModel) -> str:
         """Generate cache key for text and model"""
         content = f"{text}:{model.value}"
@@ -668,37 +1380,54 @@ class EmbeddingQualityValidator:
             Quality score (0-1)
         """
         try:
-            quality_score = 0.0
-            
-            # Check embedding dimensions
-            expected_dims = self._get_expected_dimensions(model)
-            if len(embedding) == expected_dims:
-                quality_score += 0.3
-            
-            # Check for NaN or infinite values
-            if not np.any(np.isnan(embedding)) and not np.any(np.isinf(embedding)):
-                quality_score += 0.2
-            
-            # Check embedding magnitude
-            magnitude = np.linalg.norm(embedding)
-            if 0.1 < magnitude < 10.0:
-                quality_score += 0.2
-            
-            # Check embedding variance
-            variance = np.var(embedding)
-            if variance > 0.001:
-                quality_score += 0.15
-            
-            # Check text length appropriateness
-            if len(original_text) > 10:
-                quality_score += 0.15
-            
-            return min(quality_score, 1.0)
+            scores, _ = self.validate_batch(np.asarray(embedding)[None, :], [original_text], model)
+            return float(scores[0])
             
         except Exception as e:
             logger.error(f"Error validating embedding quality: {e}")
             return 0.0
     
+    def validate_batch(
+        self,
+        embeddings: np.ndarray,
+        original_texts: List[str],
+        model: EmbeddingModel
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Validate the quality of many embeddings in one vectorised pass
+        
+        Args:
+            embeddings: Embedding matrix of shape (n, d)
+            original_texts: Original text for each row
+            model: Model used
+            
+        Returns:
+            (quality scores in 0-1, failure mask for non-finite or zero-magnitude rows)
+        """
+        matrix = np.asarray(embeddings, dtype=np.float64)
+        if matrix.ndim != 2:
+            raise ValueError(f"Expected an (n, d) embedding matrix, got shape {matrix.shape}")
+        
+        # Non-finite entries are zeroed so the remaining statistics stay defined;
+        # rows containing them score nothing for magnitude and variance
+        finite_values = np.isfinite(matrix)
+        finite = finite_values.all(axis=1)
+        safe = np.where(finite_values, matrix, 0.0)
+        magnitude = np.linalg.norm(safe, axis=1)
+        variance = safe.var(axis=1)
+        text_lengths = np.fromiter((len(text) for text in original_texts), dtype=np.int64, count=len(matrix))
+        
+        scores = (
+            0.3 * (matrix.shape[1] == self._get_expected_dimensions(model)) +
+            0.2 * finite +
+            0.2 * (finite & (magnitude > 0.1) & (magnitude < 10.0)) +
+            0.15 * (finite & (variance > 0.001)) +
+            0.15 * (text_lengths > 10)
+        )
+        failures = ~finite | (magnitude == 0)
+        
+        return np.minimum(scores, 1.0), failures
+    
     def _get_expected_dimensions(self, model: EmbeddingModel) -> int:
         """Get expected dimensions for model"""
         dimension_map = {
@@ -763,6 +1492,195 @@ class EmbeddingOptimizer:
         centered = embeddings_array - mean
         return [centered[i] for i in range(len(centered))]
 
+@dataclass
+class RoutingDecision:
+    """Model pinned to a vector space by the router"""
+    space: str
+    model: EmbeddingModel
+    reason: str
+    features: Dict[str, Any]
+    decided_at: datetime
+
+class EmbeddingRouter:
+    """
+    Chooses the model for EmbeddingModel.AUTO requests.
+    
+    Vectors from different models cannot be compared, so the router decides once
+    per vector space (context 'vector_space', else 'source_type') and pins that
+    decision in the embeddingroutes collection; later items in the space reuse it.
+    The decision keeps the premium remote model for important or long content and
+    sends the rest to the cheaper economy model, switching when the preferred
+    provider is short on quota headroom, has a full queue, or is unavailable.
+    Decisions driven by that load are pinned like any other, so a space never
+    holds vectors from two models.
+    """
+    
+    COLLECTION = "embeddingroutes"
+    
+    def __init__(self, embedding_config: Dict[str, Any]):
+        self.premium_model = EmbeddingModel(embedding_config['routing_premium_model'])
+        self.economy_model = EmbeddingModel(embedding_config['routing_economy_model'])
+        self.importance_threshold = embedding_config['routing_importance_threshold']
+        self.max_economy_tokens = embedding_config['routing_max_economy_tokens']
+        self.max_queue_depth = embedding_config['routing_max_queue_depth']
+        self.min_quota_headroom = embedding_config['routing_min_quota_headroom']
+        self.quotas = {
+            EmbeddingModel(model): requests_per_minute
+            for model, requests_per_minute in embedding_config['provider_quotas'].items()
+        }
+        self.request_times = {model: deque() for model in self.quotas}
+        self.routes: Dict[str, RoutingDecision] = {}
+        self.routed_items: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.db = None
+    
+    @staticmethod
+    def space_for(context: Optional[Dict[str, Any]]) -> str:
+        """Vector space an item belongs to"""
+        context = context or {}
+        return str(context.get('vector_space') or context.get('source_type') or 'default')
+    
+    def record_request(self, model: EmbeddingModel):
+        """Count a provider request against its per-minute quota"""
+        if model not in self.quotas:
+            return
+        with self._lock:
+            self.request_times[model].append(time.monotonic())
+    
+    def quota_headroom(self, model: EmbeddingModel) -> Optional[float]:
+        """Fraction of the provider's per-minute quota still unused, or None if unlimited"""
+        if model not in self.quotas:
+            return None
+        with self._lock:
+            times = self.request_times[model]
+            while times and time.monotonic() - times[0] > 60.0:
+                times.popleft()
+            return max(0.0, 1.0 - len(times) / self.quotas[model])
+    
+    async def route(
+        self,
+        text: str,
+        context: Optional[Dict[str, Any]],
+        token_count: Callable[[str], int],
+        in_flight: Dict[EmbeddingModel, int],
+        available: Callable[[EmbeddingModel], bool]
+    ) -> EmbeddingModel:
+        """
+        Get the model for an item, deciding and pinning it if its space is new
+        
+        Args:
+            text: Text to embed
+            context: Item context ('importance', 'source_type', 'vector_space')
+            token_count: Token counter for the text
+            in_flight: Requests currently running per model
+            available: Whether a model can serve requests now
+            
+        Returns:
+            Model to use
+        """
+        space = self.space_for(context)
+        self.routed_items[space] = self.routed_items.get(space, 0) + 1
+        if space in self.routes:
+            return self.routes[space].model
+        
+        # Another process may have pinned the space already
+        if self.db is not None:
+            stored = await self.db.find_one_document(self.COLLECTION, {'space': space})
+            if stored:
+                return self._remember(stored).model
+        
+        features = {
+            'importance': (context or {}).get('importance', 5),
+            'tokens': token_count(text),
+            'in_flight': {model.value: count for model, count in in_flight.items() if count},
+            'quota_headroom': {model.value: self.quota_headroom(model) for model in self.quotas}
+        }
+        model, reason = self._choose(features, in_flight, available)
+        decision = RoutingDecision(space, model, reason, features, datetime.now())
+        
+        if self.db is not None:
+            # First writer wins; read back so every process agrees on the pin
+            await self.db.update_document(
+                self.COLLECTION,
+                {'space': space},
+                {'$setOnInsert': {
+                    'space': space,
+                    'model': model.value,
+                    'reason': reason,
+                    'features': features,
+                    'decidedAt': decision.decided_at
+                }},
+                upsert=True
+            )
+            stored = await self.db.find_one_document(self.COLLECTION, {'space': space})
+            if stored:
+                return self._remember(stored).model
+        
+        self.routes[space] = decision
+        logger.info(f"Routed vector space {space} to {model.value} ({reason})")
+        return model
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get pinned routes and quota headroom"""
+        return {
+            'routes': {
+                space: {
+                    'model': decision.model.value,
+                    'reason': decision.reason,
+                    'features': decision.features,
+                    'decided_at': decision.decided_at.isoformat(),
+                    'routed_items': self.routed_items.get(space, 0)
+                }
+                for space, decision in self.routes.items()
+            },
+            'quota_headroom': {model.value: self.quota_headroom(model) for model in self.quotas}
+        }
+    
+    def _choose(
+        self,
+        features: Dict[str, Any],
+        in_flight: Dict[EmbeddingModel, int],
+        available: Callable[[EmbeddingModel], bool]
+    ) -> Tuple[EmbeddingModel, str]:
+        """Apply the routing policy to one item's features"""
+        premium_ok = available(self.premium_model)
+        economy_ok = available(self.economy_model)
+        if not premium_ok and not economy_ok:
+            raise ValueError("No embedding model available for routing")
+        if not economy_ok:
+            return self.premium_model, "economy_unavailable"
+        if not premium_ok:
+            return self.economy_model, "premium_unavailable"
+        
+        if features['tokens'] > self.max_economy_tokens:
+            preferred, reason = self.premium_model, "long_content"
+        elif features['importance'] >= self.importance_threshold:
+            preferred, reason = self.premium_model, "high_importance"
+        else:
+            return (
+                (self.premium_model, "economy_queue_full")
+                if in_flight.get(self.economy_model, 0) >= self.max_queue_depth
+                else (self.economy_model, "low_importance")
+            )
+        
+        headroom = self.quota_headroom(preferred)
+        if headroom is not None and headroom < self.min_quota_headroom:
+            return self.economy_model, "premium_quota_low"
+        if in_flight.get(preferred, 0) >= self.max_queue_depth:
+            return self.economy_model, "premium_queue_full"
+        return preferred, reason
+    
+    def _remember(self, stored: Dict[str, Any]) -> RoutingDecision:
+        decision = RoutingDecision(
+            space=stored['space'],
+            model=EmbeddingModel(stored['model']),
+            reason=stored.get('reason', ''),
+            features=stored.get('features', {}),
+            decided_at=stored.get('decidedAt') or datetime.now()
+        )
+        self.routes[decision.space] = decision
+        return decision
+
 # Global embedding generator instance
 embedding_generator = EmbeddingGenerator()
 
@@ -0,0 +1,479 @@
+"""
+Embedding Job Queue Worker for Cryptique
+Consumes the embeddingjobs queue written by the Node service and rolls throughput up into embeddingstats
+"""
+
+import asyncio
+import os
+import socket
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo import UpdateOne
+
+from config import config
+from utils.logger import get_logger
+from utils.database import get_db
+from utils.metrics import get_metrics_collector
+from services.embedding_generator import EmbeddingGenerator, EmbeddingModel, EmbeddingResult, get_embedding_generator
+from services.vector_migrator import MigrationConfig, VectorMigrator
+from services.vectorization_worker import WATCHED_SOURCES
+
+logger = get_logger(__name__)
+
+JOB_COLLECTION = "embeddingjobs"
+STATS_COLLECTION = "embeddingstats"
+
+# Job sourceType -> (source collection, content extractor, importance)
+JOB_SOURCES = {
+    source_type: (collection, extractor, importance)
+    for collection, (source_type, extractor, importance) in WATCHED_SOURCES.items()
+}
+
+# Final job status -> embeddingstats processing counter
+JOB_STATUS_STATS = {
+    'completed': 'jobsCompleted',
+    'failed': 'jobsFailed',
+    'retrying': 'totalRetries'
+}
+
+# embeddingstats periods the worker rolls up into
+STATS_PERIODS = {
+    'hourly': timedelta(hours=1),
+    'daily': timedelta(days=1)
+}
+
+@dataclass
+class _ClaimedJob:
+    """A claimed job and what happened to it in this round"""
+    job: Dict[str, Any]
+    worker_id: str
+    model: EmbeddingModel
+    started: float
+    items: List[Tuple[Dict[str, Any], str]] = field(default_factory=list)
+    created: int = 0
+    updated: int = 0
+    skipped: int = 0
+    failed: int = 0
+    tokens: int = 0
+    errors: List[Dict[str, Any]] = field(default_factory=list)
+    error: Optional[str] = None
+    status: Optional[str] = None
+
+class EmbeddingJobWorker:
+    """
+    Pool of queue consumers for embeddingjobs.
+
+    Each consumer claims up to claim_batch_size runnable jobs, highest priority
+    first, with atomic findOneAndUpdate calls that stamp its workerId and a
+    lease; jobs whose lease expires (a crashed worker) become claimable again.
+    The records of all claimed jobs are embedded together in provider batches
+    of up to provider_batch_size per model, written to vectordocuments with one
+    bulk write, and the jobs and the hourly/daily embeddingstats documents are
+    each updated with one more bulk write.
+    """
+
+    def __init__(self, concurrency: Optional[int] = None):
+        embedding_config = config.get_embedding_config()
+        self.concurrency = concurrency or embedding_config['job_worker_concurrency']
+        self.claim_batch_size = embedding_config['job_claim_batch_size']
+        self.provider_batch_size = embedding_config['job_provider_batch_size']
+        self.lease_seconds = embedding_config['job_lease_seconds']
+        self.poll_interval = embedding_config['job_poll_interval_seconds']
+        self.default_model = EmbeddingModel(embedding_config['vectorization_model'])
+        self.host = socket.gethostname()
+        self.db = None
+        self.embedding_generator: Optional[EmbeddingGenerator] = None
+        self.migrator: Optional[VectorMigrator] = None
+        self.metrics = get_metrics_collector()
+
+        self.stats = {'claimed': 0, 'completed': 0, 'failed': 0, 'retried': 0, 'documents': 0, 'api_calls': 0}
+        self.model_throughput: Dict[str, Dict[str, float]] = {}
+        self.is_running = False
+        self._tasks: List[asyncio.Task] = []
+
+    async def initialize(self, embedding_generator: Optional[EmbeddingGenerator] = None):
+        """
+        Initialize the worker
+
+        Args:
+            embedding_generator: Generator to embed with; the shared one if None
+        """
+        self.db = await get_db()
+        self.embedding_generator = embedding_generator or await get_embedding_generator()
+        # The migrator supplies content extraction and the vector document layout
+        self.migrator = VectorMigrator(MigrationConfig(embedding_model=self.default_model, near_duplicate_threshold=None))
+        self.migrator.db = self.db
+        self.migrator.embedding_generator = self.embedding_generator
+
+    async def start(self):
+        """Start the consumers"""
+        if self.is_running:
+            return
+        self.is_running = True
+        self._tasks = [asyncio.create_task(self._consume(self._worker_id(slot))) for slot in range(self.concurrency)]
+        logger.info(f"Embedding job worker started with {self.concurrency} consumers")
+
+    async def stop(self):
+        """Stop the consumers; a job being processed is finished first"""
+        self.is_running = False
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("Embedding job worker stopped")
+
+    async def claim_jobs(self, worker_id: str, limit: int) -> List[Dict[str, Any]]:
+        """
+        Atomically claim runnable jobs in priority order
+
+        Args:
+            worker_id: Claiming consumer
+            limit: Maximum number of jobs to claim
+
+        Returns:
+            Claimed job documents
+        """
+        jobs = []
+        while len(jobs) < limit:
+            now = datetime.now()
+            job = await self.db.find_one_and_update(
+                JOB_COLLECTION,
+                {"$or": [
+                    {"status": "pending", "scheduledFor": {"$lte": now}},
+                    {"status": "retrying", "retryConfig.nextRetryAt": {"$lte": now}},
+                    {"status": "processing", "leaseExpiresAt": {"$lte": now}}
+                ]},
+                {"$set": {
+                    "status": "processing",
+                    "startedAt": now,
+                    "workerId": worker_id,
+                    "workerHost": self.host,
+                    "leaseExpiresAt": now + timedelta(seconds=self.lease_seconds)
+                }},
+                sort=[("priority", -1), ("scheduledFor", 1)]
+            )
+            if job is None:
+                break
+            jobs.append(job)
+
+        self.stats['claimed'] += len(jobs)
+        return jobs
+
+    async def process_jobs(self, jobs: List[Dict[str, Any]], worker_id: str) -> List[_ClaimedJob]:
+        """
+        Embed the records of claimed jobs and record the outcome
+
+        Args:
+            jobs: Jobs claimed by worker_id
+            worker_id: Consumer holding the leases
+
+        Returns:
+            Per-job outcome
+        """
+        claimed = [
+            _ClaimedJob(job=job, worker_id=worker_id, model=self._job_model(job), started=time.time())
+            for job in jobs
+        ]
+        await self._load_sources(claimed)
+
+        # Batch across jobs: one provider call per model and provider_batch_size records
+        usage: Dict[str, Dict[str, float]] = {}
+        operations = []
+        by_model: Dict[EmbeddingModel, List[Tuple[_ClaimedJob, Dict[str, Any], str]]] = {}
+        for job in claimed:
+            for record, content in job.items:
+                by_model.setdefault(job.model, []).append((job, record, content))
+
+        for model, entries in by_model.items():
+            for start in range(0, len(entries), self.provider_batch_size):
+                batch = entries[start:start + self.provider_batch_size]
+                batch_start = time.time()
+                try:
+                    operations.extend(await self._embed_batch(model, batch))
+                    succeeded = True
+                except Exception as e:
+                    logger.error(f"Error embedding job batch with {model.value}: {e}")
+                    for job, record, _ in batch:
+                        job.failed += 1
+                        job.errors.append(self._job_error(record.get('_id'), e))
+                    succeeded = False
+
+                model_usage = usage.setdefault(model.value, {
+                    'documents': 0, 'processingTime': 0.0, 'apiCalls': 0, 'failedApiCalls': 0
+                })
+                model_usage['documents'] += len(batch)
+                model_usage['processingTime'] += time.time() - batch_start
+                model_usage['apiCalls'] += 1
+                model_usage['failedApiCalls'] += 0 if succeeded else 1
+                await self._renew_leases(claimed)
+
+        await self._write_vectors(claimed, operations)
+        await self._finish_jobs(claimed)
+        await self._record_stats(claimed, usage)
+        return claimed
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get worker statistics"""
+        return {
+            **self.stats,
+            'is_running': self.is_running,
+            'consumers': len(self._tasks),
+            'documents_per_second': {
+                model: usage['documents'] / usage['seconds'] if usage['seconds'] else 0.0
+                for model, usage in self.model_throughput.items()
+            }
+        }
+
+    # Private methods
+
+    async def _consume(self, worker_id: str):
+        while self.is_running:
+            try:
+                jobs = await self.claim_jobs(worker_id, self.claim_batch_size)
+                if not jobs:
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                await self.process_jobs(jobs, worker_id)
+            except Exception as e:
+                logger.error(f"Error in embedding job consumer {worker_id}: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def _load_sources(self, claimed: List[_ClaimedJob]):
+        """Fetch every job's source records with one query per source collection"""
+        wanted: Dict[str, set] = {}
+        for job in claimed:
+            if job.job.get('sourceType') not in JOB_SOURCES:
+                job.error = f"Unsupported sourceType: {job.job.get('sourceType')}"
+                continue
+            wanted.setdefault(job.job['sourceType'], set()).update(job.job.get('sourceIds', []))
+
+        records: Dict[str, Dict[Any, Dict[str, Any]]] = {}
+        for source_type, ids in wanted.items():
+            docs = await self.db.find_documents(JOB_SOURCES[source_type][0], {"_id": {"$in": list(ids)}})
+            records[source_type] = {doc['_id']: doc for doc in docs}
+
+        for job in claimed:
+            if job.error:
+                continue
+            collection, extractor, _ = JOB_SOURCES[job.job['sourceType']]
+            for source_id in job.job.get('sourceIds', []):
+                record = records[job.job['sourceType']].get(source_id)
+                content = await getattr(self.migrator, extractor)(record) if record else ''
+                if not content:
+                    job.skipped += 1
+                    continue
+                job.items.append((record, content))
+                job.tokens += self.migrator.chunker.count_tokens(content)
+
+    async def _embed_batch(
+        self,
+        model: EmbeddingModel,
+        batch: List[Tuple[_ClaimedJob, Dict[str, Any], str]]
+    ) -> List[Tuple[_ClaimedJob, str, UpdateOne]]:
+        """Embed one provider batch and build its vectordocuments upserts, with their documentIds"""
+        contexts = []
+        for job, record, _ in batch:
+            source_type = job.job['sourceType']
+            contexts.append({
+                'data_type': source_type,
+                'source_type': source_type,
+                'site_id': record.get('siteId'),
+                'importance': JOB_SOURCES[source_type][2]
+            })
+
+        result = await self.embedding_generator.generate_batch_embeddings(
+            [content for _, _, content in batch], model, batch_size=len(batch), context=contexts
+        )
+        embeddings = result.embeddings or [None] * len(batch)
+        quality_scores = result.quality_scores or [0.0] * len(batch)
+        model_used = (result.metadata or {}).get('model_used', model.value)
+
+        operations = []
+        for (job, record, content), embedding, quality in zip(batch, embeddings, quality_scores):
+            if embedding is None:
+                job.failed += 1
+                job.errors.append(self._job_error(record['_id'], "Embedding generation failed"))
+                continue
+            vector_doc = await self.migrator._create_vector_document(
+                record,
+                EmbeddingResult(success=True, embedding=embedding, model_used=model_used, quality_score=quality),
+                job.job['sourceType'],
+                content
+            )
+            created_at = vector_doc.pop('createdAt')
+            operations.append((job, vector_doc['documentId'], UpdateOne(
+                {"documentId": vector_doc['documentId']},
+                {"$set": vector_doc, "$setOnInsert": {"createdAt": created_at}},
+                upsert=True
+            )))
+        return operations
+
+    async def _write_vectors(self, claimed: List[_ClaimedJob], operations: List[Tuple[_ClaimedJob, str, UpdateOne]]):
+        """Upsert all embedded records with one bulk write, counting created and updated per job"""
+        if not operations:
+            return
+        document_ids = [document_id for _, document_id, _ in operations]
+        existing = await self.db.find_documents(
+            "vectordocuments", {"documentId": {"$in": document_ids}}, {"documentId": 1}
+        )
+        existing_ids = {doc['documentId'] for doc in existing}
+
+        try:
+            await self.db.bulk_write("vectordocuments", [operation for _, _, operation in operations])
+        except Exception as e:
+            logger.error(f"Error writing job vectors: {e}")
+            for job in claimed:
+                job.error = job.error or str(e)
+            return
+
+        for job, document_id, _ in operations:
+            if document_id in existing_ids:
+                job.updated += 1
+            else:
+                job.created += 1
+
+    async def _finish_jobs(self, claimed: List[_ClaimedJob]):
+        """Complete, retry or fail each job with one bulk write"""
+        now = datetime.now()
+        operations = []
+        for job in claimed:
+            total = len(job.job.get('sourceIds', []))
+            processed = job.created + job.updated
+            duration = time.time() - job.started
+            update = {
+                "progress.total": total,
+                "progress.processed": processed,
+                "progress.failed": job.failed,
+                "progress.percentage": round(100 * (processed + job.skipped) / total) if total else 100,
+                "results.documentsCreated": job.created,
+                "results.documentsUpdated": job.updated,
+                "results.documentsSkipped": job.skipped,
+                "results.totalTokensUsed": job.tokens,
+                "results.averageProcessingTime": duration / max(processed, 1)
+            }
+
+            # Retry when nothing got through; partial failures are listed in errors
+            if job.error or (job.items and processed == 0):
+                retry = job.job.get('retryConfig') or {}
+                retry_count = retry.get('retryCount', 0)
+                if job.error:
+                    job.errors.append(self._job_error(None, job.error))
+                if retry_count < retry.get('maxRetries', 3):
+                    delay = retry.get('backoffMultiplier', 2) ** (retry_count + 1) * 60
+                    update.update({
+                        "status": "retrying",
+                        "retryConfig.retryCount": retry_count + 1,
+                        "retryConfig.nextRetryAt": now + timedelta(seconds=delay)
+                    })
+                else:
+                    update.update({"status": "failed", "completedAt": now})
+            else:
+                update.update({"status": "completed", "completedAt": now})
+            job.status = update['status']
+            self.stats[job.status if job.status != 'retrying' else 'retried'] += 1
+
+            update_dict = {"$set": update, "$unset": {"leaseExpiresAt": ""}}
+            if job.errors:
+                update_dict["$push"] = {"errors": {"$each": job.errors}}
+            # A job whose lease was lost to another consumer is left to that consumer
+            operations.append(UpdateOne({"_id": job.job['_id'], "workerId": job.worker_id}, update_dict))
+            self.stats['documents'] += processed
+
+        await self.db.bulk_write(JOB_COLLECTION, operations)
+
+    async def _record_stats(self, claimed: List[_ClaimedJob], usage: Dict[str, Dict[str, float]]):
+        """Add this round to the hourly and daily embeddingstats, per team and global"""
+        for model, model_usage in usage.items():
+            totals = self.model_throughput.setdefault(model, {'documents': 0, 'seconds': 0.0})
+            totals['documents'] += model_usage['documents']
+            totals['seconds'] += model_usage['processingTime']
+            self.metrics.increment_counter('embedding_jobs.documents', model_usage['documents'], tags={'model': model})
+            self.metrics.record_timer('embedding_jobs.batch', model_usage['processingTime'] / model_usage['apiCalls'])
+        self.stats['api_calls'] += sum(model_usage['apiCalls'] for model_usage in usage.values())
+
+        increments: Dict[Any, Dict[str, float]] = {}
+        for job in claimed:
+            counts = {
+                f"processing.{JOB_STATUS_STATS[job.status]}": 1,
+                "processing.documentsProcessed": job.created + job.updated,
+                "processing.documentsCreated": job.created,
+                "processing.documentsUpdated": job.updated,
+                "processing.documentsSkipped": job.skipped,
+                "processing.totalErrors": len(job.errors),
+                "processing.totalProcessingTime": time.time() - job.started,
+                "apiUsage.totalTokensUsed": job.tokens,
+                f"sourceTypeBreakdown.{job.job.get('sourceType')}.documents": job.created + job.updated,
+                f"models.{job.model.value}.documents": job.created + job.updated
+            }
+            for team_id in {job.job.get('teamId'), None}:
+                team_increments = increments.setdefault(team_id, {})
+                for key, value in counts.items():
+                    team_increments[key] = team_increments.get(key, 0) + value
+
+        for model, model_usage in usage.items():
+            model_counts = {
+                "apiUsage.totalApiCalls": model_usage['apiCalls'],
+                "apiUsage.successfulApiCalls": model_usage['apiCalls'] - model_usage['failedApiCalls'],
+                "apiUsage.failedApiCalls": model_usage['failedApiCalls'],
+                f"models.{model}.processingTime": model_usage['processingTime'],
+                f"models.{model}.apiCalls": model_usage['apiCalls']
+            }
+            global_increments = increments.setdefault(None, {})
+            for key, value in model_counts.items():
+                global_increments[key] = global_increments.get(key, 0) + value
+
+        now = datetime.now()
+        operations = []
+        for period, length in STATS_PERIODS.items():
+            start = now.replace(minute=0, second=0, microsecond=0)
+            if period == 'daily':
+                start = start.replace(hour=0)
+            for team_id, counts in increments.items():
+                operations.append(UpdateOne(
+                    {"period": period, "startDate": start, "teamId": team_id},
+                    {
+                        "$inc": counts,
+                        "$set": {"updatedAt": now},
+                        "$setOnInsert": {"endDate": start + length, "createdAt": now}
+                    },
+                    upsert=True
+                ))
+        try:
+            await self.db.bulk_write(STATS_COLLECTION, operations)
+        except Exception as e:
+            # Statistics are best effort and never fail the jobs
+            logger.error(f"Error recording embedding stats: {e}")
+
+    async def _renew_leases(self, claimed: List[_ClaimedJob]):
+        """Extend the leases of jobs still being processed"""
+        for worker_id in {job.worker_id for job in claimed}:
+            await self.db.update_documents(
+                JOB_COLLECTION,
+                {"_id": {"$in": [job.job['_id'] for job in claimed]}, "workerId": worker_id, "status": "processing"},
+                {"$set": {"leaseExpiresAt": datetime.now() + timedelta(seconds=self.lease_seconds)}}
+            )
+
+    def _job_model(self, job: Dict[str, Any]) -> EmbeddingModel:
+        """Map a job's configured model name (e.g. 'gemini-embedding') to an EmbeddingModel"""
+        name = ((job.get('config') or {}).get('embeddingModel') or '').lower()
+        for model in EmbeddingModel:
+            if model is not EmbeddingModel.AUTO and name.startswith(model.value):
+                return model
+        return self.default_model
+
+    def _worker_id(self, slot: int) -> str:
+        return f"{self.host}:{os.getpid()}:{slot}"
+
+    @staticmethod
+    def _job_error(source_id: Any, error: Any) -> Dict[str, Any]:
+        return {"timestamp": datetime.now(), "sourceId": source_id, "error": str(error)}
+
+# Global job worker instance
+embedding_job_worker = EmbeddingJobWorker()
+
+# Convenience functions
+async def get_embedding_job_worker() -> EmbeddingJobWorker:
+    """Get embedding job worker instance"""
+    if embedding_job_worker.db is None:
+        await embedding_job_worker.initialize()
+    return embedding_job_worker
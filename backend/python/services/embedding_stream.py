@@ -0,0 +1,153 @@
+"""
+Streaming Batch Embeddings for Cryptique
+NDJSON in, NDJSON out: the request body is spooled (to disk past a threshold) and results stream back per batch
+"""
+
+import json
+import tempfile
+import time
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from config import config
+from utils.logger import get_logger
+from utils.metrics import get_metrics_collector
+from utils.wire_format import dumps_json
+from services.embedding_generator import EmbeddingGenerator, EmbeddingModel
+
+logger = get_logger(__name__)
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+async def spool_ndjson(chunks: AsyncIterator[bytes], max_memory_bytes: Optional[int] = None):
+    """
+    Spool a request body, in memory up to max_memory_bytes and on disk beyond
+
+    Args:
+        chunks: Body chunks, e.g. Request.stream()
+        max_memory_bytes: Size at which the spool moves to a temporary file
+
+    Returns:
+        Spool file positioned at the start; the caller closes it
+    """
+    max_memory_bytes = max_memory_bytes or config.get_embedding_config()['stream_spool_max_memory_bytes']
+    spool = tempfile.SpooledTemporaryFile(max_size=max_memory_bytes, mode='w+b')
+    try:
+        async for chunk in chunks:
+            spool.write(chunk)
+        spool.seek(0)
+        return spool
+    except Exception:
+        spool.close()
+        raise
+
+def iter_ndjson_texts(spool) -> Iterator[Tuple[int, Optional[str], Optional[str]]]:
+    """
+    Parse spooled NDJSON lines, each a JSON string or an object with a "text" field
+
+    Args:
+        spool: Binary file of NDJSON lines
+
+    Yields:
+        Tuples of (index, text, error); blank lines are skipped and not numbered
+    """
+    index = 0
+    for line in spool:
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+            text = item.get('text') if isinstance(item, dict) else item
+            if not isinstance(text, str) or not text:
+                raise ValueError("expected a string or an object with a non-empty \"text\"")
+            yield index, text, None
+        except ValueError as e:
+            yield index, None, f"Invalid line: {e}"
+        index += 1
+
+async def stream_batch_embeddings(
+    embedding_generator: EmbeddingGenerator,
+    spool,
+    model: EmbeddingModel = EmbeddingModel.GEMINI,
+    batch_size: Optional[int] = None,
+    use_cache: bool = True
+) -> AsyncGenerator[bytes, None]:
+    """
+    Embed spooled NDJSON texts batch by batch, yielding one NDJSON result line per input line
+
+    Only one batch of texts and vectors is held at a time. Result lines are
+    {"index", "status": "ok", "embedding"} or {"index", "status": "failed"|"invalid", "error"},
+    in input order, followed by a final {"status": "done", ...} summary line.
+
+    Args:
+        embedding_generator: Generator to embed with
+        spool: Spool from spool_ndjson; closed when the stream ends
+        model: Embedding model
+        batch_size: Texts per batch (default EMBEDDING_BATCH_SIZE)
+        use_cache: Whether to use cached embeddings
+
+    Yields:
+        Encoded NDJSON lines
+    """
+    batch_size = batch_size or config.get_embedding_config()['batch_size']
+    metrics = get_metrics_collector()
+    counts = {'ok': 0, 'failed': 0, 'invalid': 0}
+    start_time = time.time()
+
+    try:
+        batch: List[Tuple[int, Optional[str], Optional[str]]] = []
+        for entry in iter_ndjson_texts(spool):
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                for line in await _embed_batch(embedding_generator, batch, model, use_cache, counts):
+                    yield line
+                batch = []
+        if batch:
+            for line in await _embed_batch(embedding_generator, batch, model, use_cache, counts):
+                yield line
+
+        yield _encode({
+            'status': 'done',
+            'total': sum(counts.values()),
+            'successful_count': counts['ok'],
+            'failed_count': counts['failed'] + counts['invalid'],
+            'processing_time': time.time() - start_time
+        })
+        metrics.record_timer('embedding_stream.duration', time.time() - start_time)
+        metrics.increment_counter('embedding_stream.texts', sum(counts.values()))
+
+    finally:
+        spool.close()
+
+async def _embed_batch(
+    embedding_generator: EmbeddingGenerator,
+    batch: List[Tuple[int, Optional[str], Optional[str]]],
+    model: EmbeddingModel,
+    use_cache: bool,
+    counts: Dict[str, int]
+) -> List[bytes]:
+    """Embed the valid texts of a batch and encode a result line for every entry"""
+    valid = [(index, text) for index, text, error in batch if error is None]
+    results: Dict[int, Dict[str, Any]] = {}
+
+    if valid:
+        result = await embedding_generator.generate_batch_embeddings(
+            [text for _, text in valid], model, batch_size=len(valid), use_cache=use_cache
+        )
+        errors = dict(zip(result.failed_indices or [], result.errors or []))
+        for position, (index, _) in enumerate(valid):
+            embedding = result.embeddings[position] if result.embeddings else None
+            if embedding is not None:
+                results[index] = {'index': index, 'status': 'ok', 'embedding': embedding}
+            else:
+                error = errors.get(position) or (result.errors[0] if result.errors else "Embedding generation failed")
+                results[index] = {'index': index, 'status': 'failed', 'error': error}
+
+    lines = []
+    for index, _, error in batch:
+        entry = results.get(index) or {'index': index, 'status': 'invalid', 'error': error}
+        counts[entry['status']] += 1
+        lines.append(_encode(entry))
+    return lines
+
+def _encode(entry: Dict[str, Any]) -> bytes:
+    return dumps_json(entry) + b"\n"
@@ -0,0 +1,456 @@
+"""
+Lexical and Hybrid Search for Cryptique
+In-process BM25 inverted index over vectordocuments.content, fused with vector
+results by reciprocal rank fusion
+"""
+
+import re
+import math
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+from config import config
+from utils.logger import get_logger
+from utils.database import get_db
+from utils.metrics import get_metrics_collector
+from services.vector_search import SearchHit, SearchResult, two_stage_search, _get_path
+
+logger = get_logger(__name__)
+
+# Identifiers such as 0x addresses, tx hashes and utm_source values stay whole
+TOKEN_PATTERN = re.compile(r"[0-9a-z_]+")
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased alphanumeric tokens"""
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+@dataclass
+class _Segment:
+    """Immutable postings in CSR form: postings of term i are [offsets[i], offsets[i + 1])"""
+    terms: Dict[str, int]
+    offsets: np.ndarray
+    positions: np.ndarray
+    frequencies: np.ndarray
+
+    def postings(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        i = self.terms.get(term)
+        if i is None:
+            return None
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.positions[start:end], self.frequencies[start:end]
+
+    def nbytes(self) -> int:
+        return self.offsets.nbytes + self.positions.nbytes + self.frequencies.nbytes
+
+class BM25Index:
+    """
+    Incrementally built BM25 index.
+
+    New documents go to a small in-memory buffer that is sealed into a compact
+    segment (int32 document positions, uint16 term frequencies, int64 offsets)
+    every seal_threshold documents. Removed or replaced documents are masked
+    out until compact() rewrites the segments without them.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, seal_threshold: int = 5000):
+        self.k1 = k1
+        self.b = b
+        self.seal_threshold = seal_threshold
+        self.doc_ids: List[Any] = []
+        self.partitions: List[Any] = []
+        self.doc_lengths = np.zeros(0, dtype=np.float32)
+        self.live = np.zeros(0, dtype=bool)
+        self.doc_freq: Counter = Counter()
+        self.total_length = 0
+        self.live_count = 0
+        self.segments: List[_Segment] = []
+        self._positions: Dict[Any, int] = {}
+        self._buffer: Dict[str, List[Tuple[int, int]]] = {}
+        self._buffered_docs = 0
+        self._doc_terms: Dict[int, List[str]] = {}
+
+    def __len__(self) -> int:
+        return self.live_count
+
+    def add(self, doc_id: Any, text: str, partition: Any = None):
+        """
+        Add or replace a document
+
+        Args:
+            doc_id: Document ID
+            text: Document text
+            partition: Partition (tenant) of the document
+        """
+        self.remove(doc_id)
+
+        counts = Counter(tokenize(text))
+        length = sum(counts.values())
+        position = len(self.doc_ids)
+        self.doc_ids.append(doc_id)
+        self.partitions.append(partition)
+        self._positions[doc_id] = position
+        self._grow(position + 1)
+        self.doc_lengths[position] = length
+        self.live[position] = True
+        self.live_count += 1
+        self.total_length += length
+
+        for term, frequency in counts.items():
+            self._buffer.setdefault(term, []).append((position, frequency))
+            self.doc_freq[term] += 1
+        self._doc_terms[position] = list(counts)
+
+        self._buffered_docs += 1
+        if self._buffered_docs >= self.seal_threshold:
+            self.seal()
+
+    def add_many(self, documents: Iterable[Tuple[Any, str, Any]]):
+        """Add (doc_id, text, partition) tuples"""
+        for doc_id, text, partition in documents:
+            self.add(doc_id, text, partition)
+
+    def remove(self, doc_id: Any) -> bool:
+        """Remove a document"""
+        position = self._positions.pop(doc_id, None)
+        if position is None:
+            return False
+
+        self.live[position] = False
+        self.live_count -= 1
+        self.total_length -= int(self.doc_lengths[position])
+        for term in self._doc_terms.pop(position, []):
+            self.doc_freq[term] -= 1
+            if self.doc_freq[term] <= 0:
+                del self.doc_freq[term]
+        return True
+
+    def seal(self):
+        """Turn the buffer into a compact segment"""
+        if self._buffer:
+            self.segments.append(self._build_segment(
+                {term: postings for term, postings in self._buffer.items()}
+            ))
+        self._buffer = {}
+        self._buffered_docs = 0
+
+    def compact(self):
+        """Merge all segments into one, dropping removed documents"""
+        self.seal()
+        merged: Dict[str, List[Tuple[int, int]]] = {}
+        for segment in self.segments:
+            for term in segment.terms:
+                positions, frequencies = segment.postings(term)
+                keep = self.live[positions]
+                if keep.any():
+                    merged.setdefault(term, []).extend(zip(positions[keep].tolist(), frequencies[keep].tolist()))
+        self.segments = [self._build_segment(merged)] if merged else []
+
+    def search(
+        self,
+        query: str,
+        limit: int = 10,
+        partitions: Optional[List[Any]] = None
+    ) -> List[Tuple[Any, float]]:
+        """
+        Top documents by BM25 score
+
+        Args:
+            query: Query text
+            limit: Number of results
+            partitions: Only return documents from these partitions
+
+        Returns:
+            (document_id, score) pairs, best first
+        """
+        terms = set(tokenize(query))
+        if not terms or not self.live_count:
+            return []
+
+        average_length = self.total_length / self.live_count or 1.0
+        all_positions, all_scores = [], []
+        for term in terms:
+            df = self.doc_freq.get(term, 0)
+            if df == 0:
+                continue
+            idf = math.log(1 + (self.live_count - df + 0.5) / (df + 0.5))
+            for positions, frequencies in self._postings(term):
+                tf = frequencies.astype(np.float32)
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[positions] / average_length)
+                all_positions.append(positions)
+                all_scores.append(idf * tf * (self.k1 + 1) / (tf + norm))
+
+        if not all_positions:
+            return []
+
+        positions, inverse = np.unique(np.concatenate(all_positions), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+
+        keep = self.live[positions]
+        if partitions is not None:
+            allowed = set(partitions)
+            keep &= np.fromiter((self.partitions[p] in allowed for p in positions), dtype=bool, count=len(positions))
+        positions, scores = positions[keep], scores[keep]
+
+        k = min(limit, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.doc_ids[positions[i]], float(scores[i])) for i in top]
+
+    def memory_bytes(self) -> int:
+        """Approximate memory used by the compact arrays"""
+        return (
+            sum(segment.nbytes() for segment in self.segments) +
+            self.doc_lengths.nbytes + self.live.nbytes
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'documents': self.live_count,
+            'removed': len(self.doc_ids) - self.live_count,
+            'terms': len(self.doc_freq),
+            'segments': len(self.segments),
+            'buffered_documents': self._buffered_docs,
+            'index_bytes': self.memory_bytes()
+        }
+
+    # Private methods
+
+    def _postings(self, term: str):
+        for segment in self.segments:
+            postings = segment.postings(term)
+            if postings is not None:
+                yield postings
+        buffered = self._buffer.get(term)
+        if buffered:
+            array = np.array(buffered, dtype=np.int64)
+            yield array[:, 0], array[:, 1]
+
+    def _build_segment(self, postings: Dict[str, List[Tuple[int, int]]]) -> _Segment:
+        terms = {term: i for i, term in enumerate(postings)}
+        lengths = np.array([len(postings[term]) for term in terms], dtype=np.int64)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        flat = np.array([posting for term in terms for posting in postings[term]], dtype=np.int64)
+        return _Segment(
+            terms=terms,
+            offsets=offsets,
+            positions=flat[:, 0].astype(np.int32),
+            frequencies=np.minimum(flat[:, 1], np.iinfo(np.uint16).max).astype(np.uint16)
+        )
+
+    def _grow(self, size: int):
+        if size <= len(self.doc_lengths):
+            return
+        capacity = max(size, 2 * len(self.doc_lengths), 1024)
+        self.doc_lengths = np.concatenate([self.doc_lengths, np.zeros(capacity - len(self.doc_lengths), dtype=np.float32)])
+        self.live = np.concatenate([self.live, np.zeros(capacity - len(self.live), dtype=bool)])
+
+def reciprocal_rank_fusion(rankings: List[List[Any]], k: int = 60) -> List[Tuple[Any, float]]:
+    """
+    Fuse ranked lists of document IDs
+
+    Args:
+        rankings: Ranked lists, best first
+        k: RRF constant; larger values flatten the weight of top ranks
+
+    Returns:
+        (document_id, fused score) pairs, best first
+    """
+    scores: Dict[Any, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+class HybridSearch:
+    """
+    Lexical + vector retrieval over vectordocuments in one call. Exact identifiers
+    are found by the BM25 index, semantic matches by vector search, and the two
+    rankings are merged with reciprocal rank fusion.
+    """
+
+    def __init__(self, collection_name: str = "vectordocuments"):
+        self.collection_name = collection_name
+        self.db = None
+        self.index = BM25Index()
+        self.metrics = get_metrics_collector()
+        embedding_config = config.get_embedding_config()
+        self.partition_field = embedding_config['compact_index_partition_field']
+        self.rrf_k = embedding_config['hybrid_rrf_k']
+
+    async def initialize(self):
+        """Initialize the search service"""
+        self.db = await get_db()
+
+    def add_documents(self, docs: List[Dict[str, Any]]):
+        """
+        Index stored vector documents as they are written
+
+        Args:
+            docs: Documents with _id and content
+        """
+        for doc in docs:
+            if doc.get('_id') is not None and doc.get('content'):
+                self.index.add(doc['_id'], doc['content'], _get_path(doc, self.partition_field))
+
+    async def build_index(
+        self,
+        filter_dict: Optional[Dict[str, Any]] = None,
+        batch_size: int = 1000
+    ) -> Dict[str, Any]:
+        """
+        Build the BM25 index by streaming stored content
+
+        Args:
+            filter_dict: Filter for documents to index
+            batch_size: Documents per batch
+
+        Returns:
+            Index statistics
+        """
+        start_time = time.time()
+        index = BM25Index()
+        async for doc in self.db.stream_documents(
+            self.collection_name,
+            {**(filter_dict or {}), "content": {"$type": "string"}, "status": "active"},
+            {"content": 1, self.partition_field: 1},
+            batch_size=batch_size
+        ):
+            index.add(doc['_id'], doc['content'], _get_path(doc, self.partition_field))
+        index.compact()
+
+        self.index = index
+        stats = {**index.get_stats(), 'build_time': time.time() - start_time}
+        self.metrics.set_gauge('lexical_search.documents', len(index))
+        logger.info(f"Built lexical index: {stats}")
+        return stats
+
+    async def search(
+        self,
+        query: str,
+        query_embedding: Optional[np.ndarray] = None,
+        limit: int = 10,
+        num_candidates: int = 50,
+        filters: Optional[Dict[str, Any]] = None,
+        projection: Optional[Dict[str, int]] = None
+    ) -> SearchResult:
+        """
+        Hybrid search
+
+        Args:
+            query: Query text for the lexical ranking
+            query_embedding: Query embedding for the vector ranking; lexical only if None
+            limit: Number of results
+            num_candidates: Results taken from each ranking before fusion
+            filters: MongoDB query filter for the hits
+            projection: Fields to return with each hit
+
+        Returns:
+            SearchResult with fused hits and per-stage timings
+        """
+        try:
+            num_candidates = max(num_candidates, limit)
+            timings = {}
+
+            stage_start = time.time()
+            partitions = self._partitions_for(filters)
+            lexical = self.index.search(query, num_candidates, partitions)
+            timings['lexical'] = time.time() - stage_start
+
+            vector = []
+            if query_embedding is not None:
+                stage_start = time.time()
+                vector = await self._vector_ranking(query_embedding, num_candidates, filters)
+                timings['vector'] = time.time() - stage_start
+
+            stage_start = time.time()
+            fused = reciprocal_rank_fusion(
+                [[doc_id for doc_id, _ in lexical], [doc_id for doc_id, _ in vector]], self.rrf_k
+            )
+            timings['fuse'] = time.time() - stage_start
+
+            # One fetch for the fused candidates applies the full filter and loads fields
+            stage_start = time.time()
+            fetch_projection = projection if projection is not None else {"embedding": 0}
+            docs = await self.db.find_documents(
+                self.collection_name,
+                {**(filters or {}), "_id": {"$in": [doc_id for doc_id, _ in fused[:num_candidates]]}},
+                fetch_projection
+            )
+            timings['fetch'] = time.time() - stage_start
+
+            by_id = {doc['_id']: doc for doc in docs}
+            hits = [
+                SearchHit(
+                    document_id=doc_id,
+                    score=score,
+                    document={key: value for key, value in by_id[doc_id].items() if key not in ('_id', 'embedding')}
+                )
+                for doc_id, score in fused if doc_id in by_id
+            ][:limit]
+
+            for stage, duration in timings.items():
+                self.metrics.record_timer(f'hybrid_search.{stage}', duration)
+
+            return SearchResult(success=True, hits=hits, candidates=len(fused), timings=timings)
+
+        except Exception as e:
+            logger.error(f"Error in hybrid search: {e}")
+            return SearchResult(success=False, error=str(e))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get lexical index statistics"""
+        return self.index.get_stats()
+
+    # Private methods
+
+    def _partitions_for(self, filters: Optional[Dict[str, Any]]) -> Optional[List[Any]]:
+        if not filters or self.partition_field not in filters:
+            return None
+        condition = filters[self.partition_field]
+        if not isinstance(condition, dict):
+            return [condition]
+        if set(condition) == {"$in"}:
+            return list(condition["$in"])
+        if set(condition) == {"$eq"}:
+            return [condition["$eq"]]
+        return None
+
+    async def _vector_ranking(
+        self,
+        query_embedding: np.ndarray,
+        num_candidates: int,
+        filters: Optional[Dict[str, Any]]
+    ) -> List[Tuple[Any, float]]:
+        """Vector ranking from the compact index when built, else Atlas vector search"""
+        if two_stage_search.index is not None:
+            result = await two_stage_search.search(
+                query_embedding, num_candidates, projection={"_id": 1}, filters=filters
+            )
+            if not result.success:
+                raise RuntimeError(result.error)
+            return [(hit.document_id, hit.score) for hit in result.hits]
+
+        docs = await self.db.vector_search(
+            self.collection_name,
+            np.asarray(query_embedding, dtype=float).tolist(),
+            config.database.vector_index_name,
+            limit=num_candidates,
+            filters=filters
+        )
+        return [(doc['_id'], doc.get('score', 0.0)) for doc in docs]
+
+# Global hybrid search instance
+hybrid_search = HybridSearch()
+
+# Convenience functions
+async def get_hybrid_search() -> HybridSearch:
+    """Get hybrid search instance"""
+    if hybrid_search.db is None:
+        await hybrid_search.initialize()
+    return hybrid_search
@@ -0,0 +1,422 @@
+"""
+Local Inference Worker for Cryptique
+Dynamic micro-batching for locally hosted embedding models
+"""
+
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Any, Tuple, TYPE_CHECKING
+from dataclasses import dataclass, field
+from concurrent.futures import Future
+import asyncio
+import numpy as np
+
+from utils.logger import get_logger
+from utils.metrics import get_metrics_collector
+
+if TYPE_CHECKING:
+    import torch
+
+logger = get_logger(__name__)
+
+# Representative texts used to check quantised outputs against fp32 outputs
+QUANTIZATION_SAMPLE_TEXTS = [
+    "Site ID: site_1 | Total Visitors: 1200 | Unique Visitors: 950 | Web3 Visitors: 210",
+    "Session lasted 300 seconds with 5 pages viewed on desktop Chrome; wallet connected via MetaMask on Ethereum",
+    "Transaction 0x9f2c transferred 1.5 ETH to the staking contract; gas used 21000; status success",
+    "Campaign brand_q3 from google / cpc drove 320 sessions and 41 wallet connections",
+    "Bounce rate increased sharply on the pricing page after the release",
+    "Top pages: / (2000 views), /dashboard (1500 views), /analytics (1000 views), /settings (500 views)",
+    "User returned three times this week and completed a token swap on Polygon",
+    "Daily active wallets dropped 12% while total page views stayed flat",
+]
+
+@dataclass
+class InferenceRequest:
+    """A single text queued for local inference"""
+    text: str
+    future: Future = field(default_factory=Future)
+    enqueued_at: float = field(default_factory=time.time)
+
+def mean_pool(last_hidden_state: "torch.Tensor", attention_mask: "torch.Tensor") -> "torch.Tensor":
+    """
+    Mean-pool token embeddings, ignoring padding positions
+
+    Args:
+        last_hidden_state: Token embeddings of shape (batch, seq_len, hidden)
+        attention_mask: Attention mask of shape (batch, seq_len)
+
+    Returns:
+        Sentence embeddings of shape (batch, hidden)
+    """
+    mask = attention_mask.unsqueeze(-1).to(last_hidden_state.dtype)
+    summed = (last_hidden_state * mask).sum(dim=1)
+    counts = mask.sum(dim=1).clamp(min=1e-9)
+    return summed / counts
+
+def bucket_length(length: int, buckets: Optional[List[int]]) -> int:
+    """Round a sequence length up to the nearest bucket boundary"""
+    if not buckets:
+        return length
+    for bucket in sorted(buckets):
+        if bucket >= length:
+            return bucket
+    return length
+
+def quantize_dynamic(model):
+    """
+    Quantise a model's linear layers to int8 for CPU inference
+
+    Args:
+        model: torch module (HuggingFace encoder or SentenceTransformer)
+
+    Returns:
+        Quantised copy of the model
+    """
+    import torch
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+def measure_agreement(reference, candidate, texts: Optional[List[str]] = None) -> Dict[str, float]:
+    """
+    Compare a candidate backend's embeddings against a reference backend
+
+    Args:
+        reference: Backend producing reference (fp32) embeddings
+        candidate: Backend under test (e.g. int8 quantised)
+        texts: Sample texts (defaults to QUANTIZATION_SAMPLE_TEXTS)
+
+    Returns:
+        Cosine agreement statistics and relative speed
+    """
+    texts = texts or QUANTIZATION_SAMPLE_TEXTS
+
+    start_time = time.time()
+    reference_embeddings = np.asarray(reference.encode(reference.tokenize(texts)))
+    reference_time = time.time() - start_time
+
+    start_time = time.time()
+    candidate_embeddings = np.asarray(candidate.encode(candidate.tokenize(texts)))
+    candidate_time = time.time() - start_time
+
+    norms = (
+        np.linalg.norm(reference_embeddings, axis=1) *
+        np.linalg.norm(candidate_embeddings, axis=1)
+    )
+    cosines = np.sum(reference_embeddings * candidate_embeddings, axis=1) / np.maximum(norms, 1e-12)
+
+    return {
+        'samples': len(texts),
+        'mean_cosine': float(np.mean(cosines)),
+        'min_cosine': float(np.min(cosines)),
+        'p5_cosine': float(np.percentile(cosines, 5)),
+        'reference_time': reference_time,
+        'candidate_time': candidate_time,
+        'speedup': reference_time / candidate_time if candidate_time > 0 else 0.0
+    }
+
+class HuggingFaceBackend:
+    """Inference backend for a raw HuggingFace encoder with padding-aware mean pooling"""
+
+    def __init__(self, tokenizer, model, max_length: int = 512):
+        self.tokenizer = tokenizer
+        self.model = model
+        self.max_length = max_length
+
+    def prepare(self, num_threads: int):
+        """Prepare the backend on the worker thread"""
+        import torch
+        if num_threads > 0:
+            torch.set_num_threads(num_threads)
+        self.model.eval()
+
+    def tokenize(self, texts: List[str]) -> List[List[int]]:
+        """Tokenize texts without padding"""
+        encoded = self.tokenizer(texts, truncation=True, max_length=self.max_length)
+        return encoded['input_ids']
+
+    def encode(self, token_ids: List[List[int]], pad_to: Optional[int] = None) -> np.ndarray:
+        """Run a padded forward pass and pool the token embeddings"""
+        import torch
+        features = _pad(self.tokenizer, token_ids, pad_to)
+        with torch.inference_mode():
+            outputs = self.model(
+                input_ids=features['input_ids'],
+                attention_mask=features['attention_mask']
+            )
+            pooled = mean_pool(outputs.last_hidden_state, features['attention_mask'])
+        return pooled.cpu().numpy()
+
+class SentenceTransformerBackend:
+    """Inference backend for a SentenceTransformer model"""
+
+    def __init__(self, model):
+        self.model = model
+        self.tokenizer = model.tokenizer
+        self.max_length = model.max_seq_length
+
+    def prepare(self, num_threads: int):
+        """Prepare the backend on the worker thread"""
+        import torch
+        if num_threads > 0:
+            torch.set_num_threads(num_threads)
+        self.model.eval()
+
+    def tokenize(self, texts: List[str]) -> List[List[int]]:
+        """Tokenize texts without padding"""
+        encoded = self.tokenizer(texts, truncation=True, max_length=self.max_length)
+        return encoded['input_ids']
+
+    def encode(self, token_ids: List[List[int]], pad_to: Optional[int] = None) -> np.ndarray:
+        """Run the model's own modules (including its pooling layer) on a padded batch"""
+        import torch
+        features = dict(_pad(self.tokenizer, token_ids, pad_to))
+        with torch.inference_mode():
+            outputs = self.model(features)
+        return outputs['sentence_embedding'].cpu().numpy()
+
+def _pad(tokenizer, token_ids: List[List[int]], pad_to: Optional[int]):
+    """Pad token ids to the longest sequence, or to a fixed bucket length"""
+    if pad_to:
+        return tokenizer.pad(
+            {'input_ids': token_ids},
+            padding='max_length',
+            max_length=pad_to,
+            return_tensors='pt'
+        )
+    return tokenizer.pad({'input_ids': token_ids}, return_tensors='pt')
+
+class LocalInferenceWorker:
+    """
+    Dedicated thread that owns a local model and batches queued texts by token length
+    """
+
+    def __init__(
+        self,
+        name: str,
+        backend,
+        max_batch_size: int = 32,
+        max_batch_tokens: int = 16384,
+        max_wait_ms: float = 5.0,
+        num_threads: int = 4,
+        sequence_buckets: Optional[List[int]] = None
+    ):
+        self.name = name
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_wait = max_wait_ms / 1000.0
+        self.num_threads = num_threads
+        self.sequence_buckets = sorted(sequence_buckets) if sequence_buckets else None
+        self.metrics = get_metrics_collector()
+
+        self.requests: "queue.Queue[Optional[InferenceRequest]]" = queue.Queue()
+        self.thread: Optional[threading.Thread] = None
+        self.is_running = False
+        self.stats = {
+            'batches': 0,
+            'texts': 0,
+            'tokens': 0,
+            'padded_tokens': 0,
+            'busy_time': 0.0,
+            'last_batch_latency': 0.0,
+            'last_tokens_per_second': 0.0
+        }
+
+    def start(self):
+        """Start the worker thread"""
+        if self.is_running:
+            return
+
+        self.is_running = True
+        self.thread = threading.Thread(
+            target=self._run,
+            name=f"local-inference-{self.name}",
+            daemon=True
+        )
+        self.thread.start()
+        logger.info(f"Local inference worker started: {self.name}")
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the worker thread, failing any requests still queued"""
+        if not self.is_running:
+            return
+
+        self.is_running = False
+        self.requests.put(None)
+        if self.thread:
+            self.thread.join(timeout=timeout)
+
+        while True:
+            try:
+                request = self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None and request.future.set_running_or_notify_cancel():
+                request.future.set_exception(RuntimeError(f"Inference worker {self.name} stopped"))
+
+        logger.info(f"Local inference worker stopped: {self.name}")
+
+    def submit(self, text: str) -> Future:
+        """Queue a text for inference and return a future for its embedding"""
+        if not self.is_running:
+            self.start()
+
+        request = InferenceRequest(text=text)
+        self.requests.put(request)
+        return request.future
+
+    async def embed(self, text: str) -> np.ndarray:
+        """Embed a single text through the batching queue"""
+        return await asyncio.wrap_future(self.submit(text))
+
+    async def embed_many(self, texts: List[str]) -> List[np.ndarray]:
+        """Embed several texts; they are batched together with any other queued work"""
+        futures = [asyncio.wrap_future(self.submit(text)) for text in texts]
+        return list(await asyncio.gather(*futures))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get worker throughput statistics"""
+        stats = dict(self.stats)
+        stats['queue_depth'] = self.requests.qsize()
+        stats['avg_batch_size'] = stats['texts'] / stats['batches'] if stats['batches'] else 0.0
+        stats['tokens_per_second'] = stats['tokens'] / stats['busy_time'] if stats['busy_time'] else 0.0
+        stats['padding_ratio'] = (
+            1 - stats['tokens'] / stats['padded_tokens'] if stats['padded_tokens'] else 0.0
+        )
+        return stats
+
+    # Private methods
+
+    def _run(self):
+        """Worker loop: collect a batch, run it, resolve futures"""
+        try:
+            self.backend.prepare(self.num_threads)
+        except Exception as e:
+            logger.error(f"Error preparing inference backend {self.name}: {e}")
+
+        while self.is_running:
+            batch = []
+            try:
+                batch = self._collect_batch()
+                if batch:
+                    self._process_requests(batch)
+            except Exception as e:
+                # Keep serving: a dead worker thread would leave every later submit waiting
+                logger.error(f"Error in local inference worker {self.name}: {e}")
+                for request in batch:
+                    self._fail(request, e)
+
+    def _collect_batch(self) -> List[InferenceRequest]:
+        """Block for the first request, then gather more until the batch is full or the wait expires"""
+        first = self.requests.get()
+        if first is None:
+            return []
+
+        batch = [first]
+        deadline = time.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            try:
+                request = self.requests.get(timeout=max(remaining, 0)) if remaining > 0 else self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                self.is_running = False
+                break
+            batch.append(request)
+
+        return batch
+
+    def _process_requests(self, requests: List[InferenceRequest]):
+        """Tokenize, group by length and encode a collected set of requests"""
+        # Drop requests cancelled while queued; the rest can no longer be cancelled,
+        # so only this worker completes their futures
+        requests = [r for r in requests if r.future.set_running_or_notify_cancel()]
+        if not requests:
+            return
+        try:
+            token_ids = self.backend.tokenize([r.text for r in requests])
+        except Exception as e:
+            for request in requests:
+                self._fail(request, e)
+            return
+
+        for group in self._group_by_length(list(zip(requests, token_ids))):
+            self._encode_group(group)
+
+    def _group_by_length(
+        self,
+        items: List[Tuple[InferenceRequest, List[int]]]
+    ) -> List[List[Tuple[InferenceRequest, List[int]]]]:
+        """Sort by token length and split so padded batch size stays within the token budget"""
+        items.sort(key=lambda item: len(item[1]))
+
+        groups = []
+        current = []
+        for item in items:
+            longest = self._padded_length(len(item[1]))
+            if current and longest * (len(current) + 1) > self.max_batch_tokens:
+                groups.append(current)
+                current = []
+            current.append(item)
+        if current:
+            groups.append(current)
+
+        return groups
+
+    def _padded_length(self, length: int) -> int:
+        """Length a sequence is padded to, after sequence-length bucketing"""
+        padded = bucket_length(length, self.sequence_buckets)
+        max_length = getattr(self.backend, 'max_length', None)
+        if max_length:
+            padded = min(padded, max(max_length, length))
+        return padded
+
+    def _encode_group(self, group: List[Tuple[InferenceRequest, List[int]]]):
+        """Encode one length-homogeneous group and record its throughput"""
+        token_ids = [ids for _, ids in group]
+        real_tokens = sum(len(ids) for ids in token_ids)
+        pad_to = self._padded_length(max(len(ids) for ids in token_ids))
+        padded_tokens = pad_to * len(token_ids)
+
+        start_time = time.time()
+        try:
+            if self.sequence_buckets:
+                embeddings = self.backend.encode(token_ids, pad_to=pad_to)
+            else:
+                embeddings = self.backend.encode(token_ids)
+        except Exception as e:
+            logger.error(f"Error in local inference batch ({self.name}): {e}")
+            for request, _ in group:
+                self._fail(request, e)
+            return
+        latency = time.time() - start_time
+
+        for (request, _), embedding in zip(group, embeddings):
+            request.future.set_result(np.asarray(embedding))
+
+        tokens_per_second = real_tokens / latency if latency > 0 else 0.0
+        self.stats['batches'] += 1
+        self.stats['texts'] += len(group)
+        self.stats['tokens'] += real_tokens
+        self.stats['padded_tokens'] += padded_tokens
+        self.stats['busy_time'] += latency
+        self.stats['last_batch_latency'] = latency
+        self.stats['last_tokens_per_second'] = tokens_per_second
+
+        self.metrics.record_timer(f"local_inference.{self.name}.batch_latency", latency)
+        self.metrics.set_gauge(f"local_inference.{self.name}.tokens_per_second", tokens_per_second)
+        self.metrics.increment_counter(f"local_inference.{self.name}.texts", len(group))
+
+        logger.debug(
+            f"Local batch ({self.name}): {len(group)} texts, {real_tokens} tokens "
+            f"in {latency:.4f}s ({tokens_per_second:.0f} tokens/sec)"
+        )
+
+    @staticmethod
+    def _fail(request: InferenceRequest, error: Exception):
+        # Skips requests cancelled while queued and ones already resolved by an earlier group
+        if not request.future.done():
+            request.future.set_exception(error)
@@ -0,0 +1,256 @@
+"""
+Dimensionality-Reduction Projectors for Cryptique
+Fit once, persist, and reuse the same projection for every embedding
+"""
+
+import asyncio
+import re
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Any
+from dataclasses import dataclass
+import numpy as np
+from sklearn.decomposition import PCA, IncrementalPCA
+
+from config import config
+from utils.logger import get_logger
+from utils.database import get_db
+
+logger = get_logger(__name__)
+
+# Projector names become file names, so they are limited to a safe character set
+PROJECTOR_NAME_PATTERN = r"^[A-Za-z0-9_-]{1,64}$"
+
+@dataclass
+class Projector:
+    """
+    Linear projection fitted by PCA, applied as X @ weights - bias
+    (equivalent to (X - mean) @ components.T)
+    """
+    name: str
+    method: str
+    weights: np.ndarray
+    bias: np.ndarray
+    explained_variance_ratio: float
+    samples: int
+    fitted_at: float
+
+    @property
+    def source_dimensions(self) -> int:
+        return self.weights.shape[0]
+
+    @property
+    def target_dimensions(self) -> int:
+        return self.weights.shape[1]
+
+    @classmethod
+    def from_pca(cls, name: str, method: str, pca, samples: int) -> 'Projector':
+        weights = np.ascontiguousarray(pca.components_.T, dtype=np.float32)
+        return cls(
+            name=name,
+            method=method,
+            weights=weights,
+            bias=(pca.mean_.astype(np.float32) @ weights),
+            explained_variance_ratio=float(np.sum(pca.explained_variance_ratio_)),
+            samples=samples,
+            fitted_at=time.time()
+        )
+
+    def transform(self, embeddings: np.ndarray) -> np.ndarray:
+        """
+        Project embeddings
+
+        Args:
+            embeddings: Array of shape (n, source_dimensions) or (source_dimensions,)
+
+        Returns:
+            Projected embeddings of shape (n, target_dimensions) or (target_dimensions,)
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if embeddings.shape[-1] != self.source_dimensions:
+            raise ValueError(
+                f"Projector {self.name} expects {self.source_dimensions} dimensions, "
+                f"got {embeddings.shape[-1]}"
+            )
+        return embeddings @ self.weights - self.bias
+
+    def save(self, path: Path):
+        """Persist the projector to an .npz file"""
+        with open(path, 'wb') as f:
+            np.savez(
+                f,
+                weights=self.weights,
+                bias=self.bias,
+                method=np.array(self.method),
+                stats=np.array([self.explained_variance_ratio, self.samples, self.fitted_at])
+            )
+
+    @classmethod
+    def load(cls, name: str, path: Path) -> 'Projector':
+        """Load a projector saved with save()"""
+        with np.load(path) as data:
+            explained_variance_ratio, samples, fitted_at = data['stats']
+            return cls(
+                name=name,
+                method=str(data['method']),
+                weights=data['weights'],
+                bias=data['bias'],
+                explained_variance_ratio=float(explained_variance_ratio),
+                samples=int(samples),
+                fitted_at=float(fitted_at)
+            )
+
+    def get_info(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'method': self.method,
+            'source_dimensions': self.source_dimensions,
+            'target_dimensions': self.target_dimensions,
+            'explained_variance_ratio': self.explained_variance_ratio,
+            'samples': self.samples,
+            'fitted_at': self.fitted_at
+        }
+
+class ProjectorRegistry:
+    """
+    Named, persisted projectors. Fitting is explicit; once fitted a projector is
+    loaded from disk and reused so reduced vectors stay comparable across calls.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = Path(directory or config.get_embedding_config()['projector_dir'])
+        self.projectors: Dict[str, Projector] = {}
+        self.db = None
+
+    async def initialize(self):
+        """Initialize the registry"""
+        self.db = await get_db()
+
+    def get(self, name: str) -> Optional[Projector]:
+        """
+        Get a fitted projector from memory or disk
+
+        Args:
+            name: Projector name
+
+        Returns:
+            Projector or None if it has not been fitted
+        """
+        if name in self.projectors:
+            return self.projectors[name]
+
+        path = self._path(name)
+        if not path.exists():
+            return None
+
+        try:
+            projector = Projector.load(name, path)
+            self.projectors[name] = projector
+            return projector
+        except Exception as e:
+            logger.error(f"Error loading projector {name}: {e}")
+            return None
+
+    def list_projectors(self) -> List[Dict[str, Any]]:
+        """Get info for every persisted projector"""
+        names = {path.name[:-len(".projector.npz")] for path in self.directory.glob("*.projector.npz")}
+        names = {name for name in names if re.match(PROJECTOR_NAME_PATTERN, name)}
+        names.update(self.projectors)
+        return [self.get(name).get_info() for name in sorted(names) if self.get(name)]
+
+    def fit(self, name: str, embeddings: np.ndarray, target_dimensions: int) -> Projector:
+        """
+        Fit a PCA projector on in-memory embeddings and persist it
+
+        Args:
+            name: Projector name
+            embeddings: Training embeddings, shape (n, d)
+            target_dimensions: Number of output dimensions
+
+        Returns:
+            Fitted projector
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        pca = PCA(n_components=target_dimensions, svd_solver='randomized', random_state=0)
+        pca.fit(embeddings)
+        return self._register(Projector.from_pca(name, "pca", pca, len(embeddings)))
+
+    async def fit_from_collection(
+        self,
+        name: str,
+        target_dimensions: int,
+        collection_name: str = "vectordocuments",
+        filter_dict: Optional[Dict[str, Any]] = None,
+        sample_size: int = 20000,
+        batch_size: int = 1000
+    ) -> Projector:
+        """
+        Fit an IncrementalPCA projector over a random sample of stored embeddings,
+        streaming in batches so memory stays bounded by batch_size
+
+        Args:
+            name: Projector name
+            target_dimensions: Number of output dimensions
+            collection_name: Collection holding an `embedding` field
+            filter_dict: Filter for the documents to sample
+            sample_size: Number of documents to sample
+            batch_size: Documents per partial fit (at least target_dimensions)
+
+        Returns:
+            Fitted projector
+        """
+        batch_size = max(batch_size, target_dimensions)
+        pca = IncrementalPCA(n_components=target_dimensions)
+        pipeline = [
+            {"$match": {**(filter_dict or {}), "embedding": {"$exists": True}}},
+            {"$sample": {"size": sample_size}},
+            {"$project": {"_id": 0, "embedding": 1}}
+        ]
+
+        samples = 0
+        batch = []
+        async for doc in self.db.stream_aggregate(collection_name, pipeline, batch_size=batch_size):
+            batch.append(doc['embedding'])
+            if len(batch) == batch_size:
+                await asyncio.to_thread(pca.partial_fit, np.array(batch, dtype=np.float32))
+                samples += len(batch)
+                batch = []
+
+        # A final short batch can only be used if it still has enough rows
+        if len(batch) >= target_dimensions:
+            await asyncio.to_thread(pca.partial_fit, np.array(batch, dtype=np.float32))
+            samples += len(batch)
+
+        if samples == 0:
+            raise ValueError(
+                f"Need at least {target_dimensions} embeddings in {collection_name} to fit projector {name}"
+            )
+
+        projector = self._register(Projector.from_pca(name, "incremental_pca", pca, samples))
+        logger.info(
+            f"Fitted projector {name} on {samples} embeddings "
+            f"({projector.source_dimensions} -> {target_dimensions}, "
+            f"{projector.explained_variance_ratio:.1%} variance explained)"
+        )
+        return projector
+
+    def _register(self, projector: Projector) -> Projector:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        projector.save(self._path(projector.name))
+        self.projectors[projector.name] = projector
+        return projector
+
+    def _path(self, name: str) -> Path:
+        if not re.match(PROJECTOR_NAME_PATTERN, name):
+            raise ValueError(f"Invalid projector name {name!r}: use 1-64 letters, digits, '_' or '-'")
+        return self.directory / f"{name}.projector.npz"
+
+# Global projector registry instance
+projector_registry = ProjectorRegistry()
+
+# Convenience functions
+async def get_projector_registry() -> ProjectorRegistry:
+    """Get projector registry instance"""
+    if projector_registry.db is None:
+        await projector_registry.initialize()
+    return projector_registry
@@ -0,0 +1,269 @@
+"""
+Semantic Search for Cryptique
+End-to-end retrieval: query embedding (cached), filtered top-k and MMR diversity reranking
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+
+from config import config
+from utils.logger import get_logger
+from utils.database import get_db
+from utils.metrics import get_metrics_collector
+from services.embedding_generator import EmbeddingGenerator, EmbeddingModel, get_embedding_generator
+from services.vector_search import SearchHit, SearchResult, two_stage_search, _normalize_rows
+from services.vector_tiering import check_archive_filters, vector_tiering
+
+logger = get_logger(__name__)
+
+# Fields returned with each hit unless the caller asks for others
+DEFAULT_RESULT_FIELDS = ("documentId", "sourceType", "siteId", "content")
+
+def maximal_marginal_relevance(
+    query: np.ndarray,
+    candidates: np.ndarray,
+    limit: int,
+    diversity: float = 0.5
+) -> List[int]:
+    """
+    Select candidates by maximal marginal relevance
+
+    Args:
+        query: Normalised query vector
+        candidates: Normalised candidate vectors, one per row
+        limit: Number of candidates to select
+        diversity: Weight of dissimilarity to already selected candidates (0 = pure relevance)
+
+    Returns:
+        Indices of the selected candidates in selection order
+    """
+    count = len(candidates)
+    limit = min(limit, count)
+    if limit == 0:
+        return []
+
+    relevance = candidates @ query
+    # Highest similarity of each candidate to anything selected so far
+    redundancy = np.zeros(count, dtype=np.float32)
+    available = np.ones(count, dtype=bool)
+    selected = []
+
+    for _ in range(limit):
+        scores = (1 - diversity) * relevance - diversity * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, candidates @ candidates[best], out=redundancy)
+
+    return selected
+
+class SemanticSearch:
+    """
+    Semantic search over vectordocuments in one call. Query vectors are kept in
+    a small LRU cache, candidates come from the compact index when it is built
+    (otherwise Atlas vector search), and the final results are diversified with MMR.
+    """
+
+    def __init__(self, collection_name: str = "vectordocuments"):
+        self.collection_name = collection_name
+        self.db = None
+        self.embedding_generator: Optional[EmbeddingGenerator] = None
+        self.metrics = get_metrics_collector()
+        embedding_config = config.get_embedding_config()
+        self.query_cache_size = embedding_config['search_query_cache_size']
+        self.default_diversity = embedding_config['search_mmr_diversity']
+        self.query_cache: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+        self.query_cache_stats = {'hits': 0, 'misses': 0}
+
+    async def initialize(self, embedding_generator: Optional[EmbeddingGenerator] = None):
+        """
+        Initialize the search service
+
+        Args:
+            embedding_generator: Generator used for query embeddings; the shared one if None
+        """
+        self.db = await get_db()
+        self.embedding_generator = embedding_generator or await get_embedding_generator()
+
+    async def search(
+        self,
+        query: str,
+        limit: int = 10,
+        num_candidates: Optional[int] = None,
+        model: EmbeddingModel = EmbeddingModel.GEMINI,
+        filters: Optional[Dict[str, Any]] = None,
+        fields: Optional[List[str]] = None,
+        diversity: Optional[float] = None,
+        include_archive: bool = False
+    ) -> SearchResult:
+        """
+        Semantic search
+
+        Args:
+            query: Query text
+            limit: Number of results
+            num_candidates: Candidates retrieved before MMR reranking (default 4 * limit)
+            model: Embedding model of the indexed vectors
+            filters: MongoDB query filter for the hits
+            fields: Fields to return with each hit
+            diversity: MMR diversity weight, 0 disables diversity reranking
+            include_archive: Also search archived (cold) vectors; archived hits are
+                promoted back to the hot collection
+
+        Returns:
+            SearchResult with hits and per-stage timings
+
+        Raises:
+            ValueError: include_archive is set and the filters cannot be applied to archived vectors
+        """
+        if include_archive:
+            # Fail closed rather than return archived vectors the filters would have excluded
+            check_archive_filters(filters)
+
+        try:
+            num_candidates = max(num_candidates or 4 * limit, limit)
+            diversity = self.default_diversity if diversity is None else diversity
+            fields = list(fields or DEFAULT_RESULT_FIELDS)
+            timings = {}
+
+            stage_start = time.time()
+            query_embedding = await self.embed_query(query, model)
+            timings['embed'] = time.time() - stage_start
+
+            stage_start = time.time()
+            ids, scores, docs = await self._retrieve(query_embedding, num_candidates, filters, fields)
+            timings['retrieve'] = time.time() - stage_start
+
+            if include_archive:
+                stage_start = time.time()
+                archived = await asyncio.to_thread(
+                    vector_tiering.search_archive, query_embedding, num_candidates, filters
+                )
+                candidates = sorted(
+                    zip(ids + [hit.document_id for hit in archived],
+                        scores + [hit.score for hit in archived],
+                        docs + [hit.document for hit in archived]),
+                    key=lambda candidate: candidate[1],
+                    reverse=True
+                )[:num_candidates]
+                ids, scores, docs = (list(column) for column in zip(*candidates)) if candidates else ([], [], [])
+                timings['archive'] = time.time() - stage_start
+
+            stage_start = time.time()
+            order = list(range(min(limit, len(ids))))
+            if diversity > 0 and len(ids) > 1:
+                embeddings = [doc.get('embedding') for doc in docs]
+                if all(embedding is not None and len(embedding) == len(query_embedding) for embedding in embeddings):
+                    matrix = _normalize_rows(np.array(embeddings, dtype=np.float32))
+                    order = maximal_marginal_relevance(query_embedding, matrix, limit, diversity)
+            timings['rerank'] = time.time() - stage_start
+
+            hits = [
+                SearchHit(
+                    document_id=ids[i],
+                    score=scores[i],
+                    document={field: docs[i][field] for field in fields if field in docs[i]}
+                )
+                for i in order
+            ]
+
+            archived_hits = [ids[i] for i in order if 'archiveSegment' in docs[i]]
+            if archived_hits:
+                vector_tiering.promote_in_background(archived_hits)
+            vector_tiering.record_access(ids[i] for i in order if 'archiveSegment' not in docs[i])
+
+            for stage, duration in timings.items():
+                self.metrics.record_timer(f'semantic_search.{stage}', duration)
+
+            return SearchResult(success=True, hits=hits, candidates=len(ids), timings=timings)
+
+        except Exception as e:
+            logger.error(f"Error in semantic search: {e}")
+            return SearchResult(success=False, error=str(e))
+
+    async def embed_query(self, query: str, model: EmbeddingModel) -> np.ndarray:
+        """
+        Normalised query embedding, from the query cache when possible
+
+        Args:
+            query: Query text
+            model: Embedding model
+
+        Returns:
+            Unit-length float32 query vector
+        """
+        key = (model.value, " ".join(query.split()))
+        cached = self.query_cache.get(key)
+        if cached is not None:
+            self.query_cache.move_to_end(key)
+            self.query_cache_stats['hits'] += 1
+            return cached
+
+        self.query_cache_stats['misses'] += 1
+        result = await self.embedding_generator.generate_embedding(key[1], model)
+        if not result.success:
+            raise RuntimeError(f"Query embedding failed: {result.error}")
+
+        embedding = _normalize_rows(np.asarray(result.embedding, dtype=np.float32))
+        self.query_cache[key] = embedding
+        if len(self.query_cache) > self.query_cache_size:
+            self.query_cache.popitem(last=False)
+        return embedding
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get query cache statistics"""
+        lookups = self.query_cache_stats['hits'] + self.query_cache_stats['misses']
+        return {
+            'query_cache_entries': len(self.query_cache),
+            'query_cache_hit_rate': self.query_cache_stats['hits'] / lookups if lookups else 0.0,
+            **self.query_cache_stats
+        }
+
+    # Private methods
+
+    async def _retrieve(
+        self,
+        query_embedding: np.ndarray,
+        num_candidates: int,
+        filters: Optional[Dict[str, Any]],
+        fields: List[str]
+    ) -> Tuple[List[Any], List[float], List[Dict[str, Any]]]:
+        """Filtered top-k candidates with their embeddings, best first"""
+        if two_stage_search.index is not None:
+            result = await two_stage_search.search(
+                query_embedding,
+                num_candidates,
+                projection={field: 1 for field in fields},
+                filters=filters,
+                include_embeddings=True
+            )
+            if not result.success:
+                raise RuntimeError(result.error)
+            return (
+                [hit.document_id for hit in result.hits],
+                [hit.score for hit in result.hits],
+                [hit.document for hit in result.hits]
+            )
+
+        docs = await self.db.vector_search(
+            self.collection_name,
+            query_embedding.tolist(),
+            config.database.vector_index_name,
+            limit=num_candidates,
+            filters=filters
+        )
+        return [doc['_id'] for doc in docs], [float(doc.get('score', 0.0)) for doc in docs], docs
+
+# Global semantic search instance
+semantic_search = SemanticSearch()
+
+# Convenience functions
+async def get_semantic_search() -> SemanticSearch:
+    """Get semantic search instance"""
+    if semantic_search.db is None:
+        await semantic_search.initialize()
+    return semantic_search
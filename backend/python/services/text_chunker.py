@@ -0,0 +1,195 @@
+"""
+Token-aware Text Chunker for Cryptique
+Splits long content into overlapping chunks sized by token count
+"""
+
+import re
+import hashlib
+from typing import Callable, List, Optional, Tuple
+from dataclasses import dataclass
+
+from config import config
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Approximates sub-word tokenizers: words, numbers and individual punctuation marks
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# Sentence ends and blank lines
+SEGMENT_PATTERN = re.compile(r"(?<=[.!?|;])\s+|\n\s*\n")
+
+TokenSpans = List[Tuple[int, int]]
+
+@dataclass
+class TextChunk:
+    """A chunk of a longer text"""
+    index: int
+    text: str
+    start_char: int
+    end_char: int
+    token_count: int
+    content_hash: str
+
+def regex_token_spans(text: str) -> TokenSpans:
+    """Character spans of approximate tokens"""
+    return [match.span() for match in TOKEN_PATTERN.finditer(text)]
+
+def hf_token_spans(tokenizer) -> Callable[[str], TokenSpans]:
+    """
+    Build a span function from a HuggingFace fast tokenizer
+
+    Args:
+        tokenizer: Tokenizer supporting return_offsets_mapping
+
+    Returns:
+        Function mapping text to token character spans
+    """
+    def spans(text: str) -> TokenSpans:
+        encoded = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+        return [tuple(span) for span in encoded['offset_mapping']]
+    return spans
+
+class TextChunker:
+    """
+    Splits text into chunks of at most chunk_size tokens with chunk_overlap
+    tokens carried over from the previous chunk.
+
+    Chunks are packed from sentence-like segments and, once a chunk is at least
+    half full, are cut at segments whose content hash marks a boundary. Cut points
+    therefore depend on nearby content rather than absolute position, so an edit
+    usually changes only the chunks around it and the rest keep their cache keys.
+    """
+
+    def __init__(
+        self,
+        chunk_size: Optional[int] = None,
+        chunk_overlap: Optional[int] = None,
+        token_spans: Optional[Callable[[str], TokenSpans]] = None,
+        boundary_modulus: int = 4
+    ):
+        processing_config = config.get_processing_config()
+        self.chunk_size = chunk_size or processing_config['chunk_size']
+        self.chunk_overlap = min(
+            chunk_overlap if chunk_overlap is not None else processing_config['chunk_overlap'],
+            self.chunk_size // 2
+        )
+        self.token_spans = token_spans or regex_token_spans
+        self.boundary_modulus = boundary_modulus
+
+    def count_tokens(self, text: str) -> int:
+        """Count tokens in text"""
+        return len(self.token_spans(text))
+
+    def needs_chunking(self, text: str) -> bool:
+        """Whether text is longer than one chunk"""
+        return self.count_tokens(text) > self.chunk_size
+
+    def chunk(self, text: str) -> List[TextChunk]:
+        """
+        Split text into overlapping chunks
+
+        Args:
+            text: Text to split
+
+        Returns:
+            Chunks in document order
+        """
+        spans = self.token_spans(text)
+        if not spans:
+            return []
+        if len(spans) <= self.chunk_size:
+            return [self._make_chunk(0, text, spans, 0, len(spans))]
+
+        # Each segment is a [start, end) range of token indices
+        segments = self._split_segments(text, spans)
+
+        chunks = []
+        current: List[Tuple[int, int]] = []
+        current_tokens = 0
+        carried = 0  # Number of leading segments in current that repeat the previous chunk
+
+        for segment in segments:
+            segment_tokens = segment[1] - segment[0]
+            if current_tokens + segment_tokens > self.chunk_size and len(current) == carried:
+                # Drop the overlap if it would leave no room for the next segment
+                current, current_tokens, carried = [], 0, 0
+            elif len(current) > carried and (
+                current_tokens + segment_tokens > self.chunk_size or
+                (current_tokens >= self.chunk_size // 2 and self._is_boundary(text, spans, segment))
+            ):
+                chunks.append(self._make_chunk(len(chunks), text, spans, current[0][0], current[-1][1]))
+                current = self._overlap_segments(current)
+                current_tokens = sum(end - start for start, end in current)
+                carried = len(current)
+
+                if current_tokens + segment_tokens > self.chunk_size:
+                    current, current_tokens, carried = [], 0, 0
+
+            current.append(segment)
+            current_tokens += segment_tokens
+
+        if len(current) > carried:
+            chunks.append(self._make_chunk(len(chunks), text, spans, current[0][0], current[-1][1]))
+
+        return chunks
+
+    # Private methods
+
+    def _split_segments(self, text: str, spans: TokenSpans) -> List[Tuple[int, int]]:
+        """Group tokens into sentence-like segments no longer than chunk_size"""
+        boundaries = [match.start() for match in SEGMENT_PATTERN.finditer(text)]
+
+        segments = []
+        start = 0
+        boundary_index = 0
+        for i, (token_start, _) in enumerate(spans):
+            while boundary_index < len(boundaries) and boundaries[boundary_index] < token_start:
+                if i > start:
+                    segments.append((start, i))
+                    start = i
+                boundary_index += 1
+        segments.append((start, len(spans)))
+
+        # Split oversized segments (e.g. long runs without punctuation) into
+        # overlap-sized pieces so that packing still carries the overlap over
+        piece_size = self.chunk_overlap or self.chunk_size
+        sized = []
+        for seg_start, seg_end in segments:
+            if seg_end - seg_start <= self.chunk_size:
+                sized.append((seg_start, seg_end))
+                continue
+            for piece_start in range(seg_start, seg_end, piece_size):
+                sized.append((piece_start, min(piece_start + piece_size, seg_end)))
+        return sized
+
+    def _overlap_segments(self, segments: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """Trailing segments of a chunk that fit in the overlap budget"""
+        overlap = []
+        tokens = 0
+        for segment in reversed(segments):
+            segment_tokens = segment[1] - segment[0]
+            if tokens + segment_tokens > self.chunk_overlap:
+                break
+            overlap.insert(0, segment)
+            tokens += segment_tokens
+        return overlap
+
+    def _is_boundary(self, text: str, spans: TokenSpans, segment: Tuple[int, int]) -> bool:
+        """Content-defined cut point before this segment"""
+        segment_text = text[spans[segment[0]][0]:spans[segment[1] - 1][1]]
+        digest = hashlib.md5(segment_text.encode()).digest()
+        return digest[0] % self.boundary_modulus == 0
+
+    def _make_chunk(self, index: int, text: str, spans: TokenSpans, start: int, end: int) -> TextChunk:
+        start_char = spans[start][0]
+        end_char = spans[end - 1][1]
+        chunk_text = text[start_char:end_char]
+        return TextChunk(
+            index=index,
+            text=chunk_text,
+            start_char=start_char,
+            end_char=end_char,
+            token_count=end - start,
+            content_hash=hashlib.md5(chunk_text.encode()).hexdigest()
+        )
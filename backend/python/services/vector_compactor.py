@@ -0,0 +1,327 @@
+"""
+Vector Index Compaction for Cryptique
+Removes duplicate and orphaned vector documents and merges near-duplicate vectors
+"""
+
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from pymongo import UpdateOne
+
+from config import config
+from utils.logger import get_logger
+from utils.database import get_db
+from utils.metrics import get_metrics_collector
+from services.vector_search import two_stage_search
+from services.lexical_search import hybrid_search
+
+logger = get_logger(__name__)
+
+# Collection holding the source records of each vector document sourceType
+SOURCE_COLLECTIONS = {
+    'analytics': 'analytics',
+    'session': 'sessions',
+    'transaction': 'transactions'
+}
+
+# Random hyperplanes used to bucket vectors before exact near-duplicate checks
+SIMHASH_BITS = 16
+
+@dataclass
+class CompactionResult:
+    """Result of a compaction run"""
+    success: bool
+    scanned: int = 0
+    duplicates_removed: int = 0
+    orphans_removed: int = 0
+    near_duplicates_merged: int = 0
+    bytes_reclaimed: int = 0
+    latency_before: Optional[float] = None
+    latency_after: Optional[float] = None
+    processing_time: float = 0.0
+    dry_run: bool = False
+    error: Optional[str] = None
+
+class VectorCompactor:
+    """
+    Streams vectordocuments in _id order and:
+    - removes exact duplicates (same documentId), keeping the newest
+    - removes orphans, whose source record no longer exists, checked with one
+      batched $in lookup per source collection
+    - optionally merges near-duplicate vectors: a document whose embedding is
+      within merge_threshold cosine of an earlier one in the same sourceType and
+      site keeps its metadata but drops its embedding, leaving the vector index,
+      and references the kept document in metadata.nearDuplicateOf
+    """
+
+    def __init__(self, collection_name: str = "vectordocuments", batch_size: int = 1000):
+        self.collection_name = collection_name
+        self.batch_size = batch_size
+        self.db = None
+        self.metrics = get_metrics_collector()
+        self.last_result: Optional[CompactionResult] = None
+
+    async def initialize(self):
+        """Initialize the compactor"""
+        self.db = await get_db()
+
+    async def compact(
+        self,
+        remove_orphans: bool = True,
+        merge_near_duplicates: bool = False,
+        merge_threshold: float = 0.995,
+        max_representatives: int = 100000,
+        benchmark_queries: int = 20,
+        dry_run: bool = False
+    ) -> CompactionResult:
+        """
+        Run a compaction pass
+
+        Args:
+            remove_orphans: Remove documents whose source record is gone
+            merge_near_duplicates: Merge near-duplicate vectors
+            merge_threshold: Cosine similarity at which vectors are merged
+            max_representatives: Kept vectors remembered for merging
+            benchmark_queries: Vector searches timed before and after (0 skips)
+            dry_run: Count what would change without writing
+
+        Returns:
+            CompactionResult with counts, bytes reclaimed and search latency
+        """
+        start_time = time.time()
+        result = CompactionResult(success=False, dry_run=dry_run)
+
+        try:
+            queries = await self._sample_queries(benchmark_queries)
+            result.latency_before = await self._benchmark(queries)
+            size_before = await self._collection_bytes()
+
+            state = _CompactionState(merge_threshold, max_representatives)
+            async for doc in self._stream({"documentId": 1, "sourceType": 1, "sourceId": 1}):
+                result.scanned += 1
+
+                # Later documents are newer; the earlier copy of a documentId is dropped
+                previous = state.latest.get(doc.get('documentId'))
+                if previous is not None:
+                    state.duplicates.append(previous)
+                if doc.get('documentId') is not None:
+                    state.latest[doc['documentId']] = doc['_id']
+
+                if remove_orphans and doc.get('sourceType') in SOURCE_COLLECTIONS and doc.get('sourceId') is not None:
+                    state.sources.setdefault(doc['sourceType'], []).append((doc['_id'], doc['sourceId']))
+                    if len(state.sources[doc['sourceType']]) >= self.batch_size:
+                        await self._check_sources(state, doc['sourceType'])
+
+                if len(state.duplicates) + len(state.orphans) >= self.batch_size:
+                    await self._flush_deletes(state, result, dry_run)
+
+            for source_type in list(state.sources):
+                await self._check_sources(state, source_type)
+            await self._flush_deletes(state, result, dry_run)
+
+            # Merging runs as a second pass so no document is merged into one removed above
+            if merge_near_duplicates:
+                async for doc in self._stream(
+                    {"documentId": 1, "sourceType": 1, "siteId": 1, "embedding": 1},
+                    {"embedding": {"$exists": True}}
+                ):
+                    if doc['_id'] in state.removed:
+                        continue
+                    state.consider_merge(doc)
+                    if len(state.merges) >= self.batch_size:
+                        await self._flush_merges(state, result, dry_run)
+                await self._flush_merges(state, result, dry_run)
+
+            if not dry_run:
+                size_after = await self._collection_bytes()
+                if size_before is not None and size_after is not None:
+                    result.bytes_reclaimed = max(size_before - size_after, 0)
+                result.latency_after = await self._benchmark(queries)
+
+            result.success = True
+            result.processing_time = time.time() - start_time
+            self.last_result = result
+
+            self.metrics.increment_counter('vector_compaction.duplicates_removed', result.duplicates_removed)
+            self.metrics.increment_counter('vector_compaction.orphans_removed', result.orphans_removed)
+            self.metrics.increment_counter('vector_compaction.near_duplicates_merged', result.near_duplicates_merged)
+            logger.info(f"Vector compaction finished: {result}")
+            return result
+
+        except Exception as e:
+            logger.error(f"Error compacting vector documents: {e}")
+            result.error = str(e)
+            result.processing_time = time.time() - start_time
+            return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get the result of the last compaction run"""
+        return self.last_result.__dict__ if self.last_result else {}
+
+    # Private methods
+
+    async def _stream(self, projection: Dict[str, int], filter_dict: Optional[Dict[str, Any]] = None):
+        """Stream vector documents in _id order"""
+        pipeline = [{"$sort": {"_id": 1}}, {"$project": projection}]
+        if filter_dict:
+            pipeline.insert(0, {"$match": filter_dict})
+        async for doc in self.db.stream_aggregate(self.collection_name, pipeline, batch_size=self.batch_size):
+            yield doc
+
+    async def _check_sources(self, state: "_CompactionState", source_type: str):
+        """Mark documents whose source records no longer exist as orphans"""
+        pending = state.sources.pop(source_type, [])
+        if not pending:
+            return
+        existing = await self.db.find_documents(
+            SOURCE_COLLECTIONS[source_type],
+            {"_id": {"$in": list({source_id for _, source_id in pending})}},
+            {"_id": 1}
+        )
+        existing_ids = {doc['_id'] for doc in existing}
+        state.orphans.extend(doc_id for doc_id, source_id in pending if source_id not in existing_ids)
+
+    async def _flush_deletes(self, state: "_CompactionState", result: CompactionResult, dry_run: bool):
+        # A document may be both an orphan and a superseded duplicate
+        duplicates = set(state.duplicates)
+        orphans = set(state.orphans) - duplicates
+        state.duplicates, state.orphans = [], []
+        ids = list(duplicates | orphans)
+        if not ids:
+            return
+        state.removed.update(ids)
+
+        result.duplicates_removed += len(duplicates)
+        result.orphans_removed += len(orphans)
+        if dry_run:
+            return
+
+        await self.db.delete_documents(self.collection_name, {"_id": {"$in": ids}})
+        # Keep the in-process indexes in step with the collection
+        for doc_id in ids:
+            hybrid_search.index.remove(doc_id)
+            if two_stage_search.index is not None:
+                two_stage_search.index.remove(doc_id)
+
+    async def _flush_merges(self, state: "_CompactionState", result: CompactionResult, dry_run: bool):
+        merges, state.merges = state.merges, []
+        result.near_duplicates_merged += len(merges)
+        if dry_run:
+            return
+
+        await self.db.bulk_write(self.collection_name, [
+            UpdateOne(
+                {"_id": doc_id},
+                {
+                    "$unset": {"embedding": ""},
+                    "$set": {
+                        "metadata.nearDuplicateOf": representative_id,
+                        "metadata.nearDuplicateSimilarity": similarity
+                    }
+                }
+            )
+            for doc_id, representative_id, similarity in merges
+        ])
+        if two_stage_search.index is not None:
+            for doc_id, _, _ in merges:
+                two_stage_search.index.remove(doc_id)
+
+    async def _collection_bytes(self) -> Optional[int]:
+        """Data plus index size of the collection"""
+        try:
+            stats = await self.db.get_collection_stats(self.collection_name)
+            return int(stats.get('size', 0)) + int(stats.get('totalIndexSize', 0))
+        except Exception as e:
+            logger.warning(f"Collection size unavailable: {e}")
+            return None
+
+    async def _sample_queries(self, count: int) -> List[List[float]]:
+        if count <= 0:
+            return []
+        try:
+            docs = await self.db.aggregate(self.collection_name, [
+                {"$match": {"embedding": {"$exists": True}, "status": "active"}},
+                {"$sample": {"size": count}},
+                {"$project": {"embedding": 1}}
+            ])
+        except Exception as e:
+            logger.warning(f"Benchmark queries unavailable: {e}")
+            return []
+        return [doc['embedding'] for doc in docs]
+
+    async def _benchmark(self, queries: List[List[float]]) -> Optional[float]:
+        """Median vector search latency over the benchmark queries, or None if search is unavailable"""
+        if not queries:
+            return None
+        durations = []
+        try:
+            for query in queries:
+                start = time.time()
+                await self.db.vector_search(
+                    self.collection_name,
+                    query,
+                    config.database.vector_index_name,
+                    limit=10,
+                    num_candidates=100
+                )
+                durations.append(time.time() - start)
+        except Exception as e:
+            # The benchmark is informational and must not block compaction
+            logger.warning(f"Vector search benchmark failed: {e}")
+            return None
+        return float(np.median(durations))
+
+class _CompactionState:
+    """Bookkeeping for one compaction pass"""
+
+    def __init__(self, merge_threshold: float, max_representatives: int):
+        self.latest: Dict[Any, Any] = {}
+        self.duplicates: List[Any] = []
+        self.orphans: List[Any] = []
+        self.removed: set = set()
+        self.sources: Dict[str, List[Tuple[Any, Any]]] = {}
+        self.merges: List[Tuple[Any, Any, float]] = []
+        self.merge_threshold = merge_threshold
+        self.max_representatives = max_representatives
+        self.representative_count = 0
+        # (sourceType, siteId, dimensions, simhash) -> (documentIds, normalised vectors)
+        self.buckets: Dict[Tuple, Tuple[List[Any], List[np.ndarray]]] = {}
+        self.hyperplanes: Dict[int, np.ndarray] = {}
+
+    def consider_merge(self, doc: Dict[str, Any]):
+        vector = np.asarray(doc['embedding'], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return
+        vector /= norm
+
+        dimensions = len(vector)
+        if dimensions not in self.hyperplanes:
+            rng = np.random.default_rng(dimensions)
+            self.hyperplanes[dimensions] = rng.normal(size=(SIMHASH_BITS, dimensions)).astype(np.float32)
+        bits = (self.hyperplanes[dimensions] @ vector) > 0
+        key = (doc.get('sourceType'), doc.get('siteId'), dimensions, np.packbits(bits).tobytes())
+
+        ids, vectors = self.buckets.setdefault(key, ([], []))
+        if vectors:
+            similarities = np.stack(vectors) @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.merge_threshold:
+                self.merges.append((doc['_id'], ids[best], float(similarities[best])))
+                return
+
+        if self.representative_count < self.max_representatives:
+            ids.append(doc.get('documentId'))
+            vectors.append(vector)
+            self.representative_count += 1
+
+# Global compactor instance
+vector_compactor = VectorCompactor()
+
+# Convenience functions
+async def get_vector_compactor() -> VectorCompactor:
+    """Get vector compactor instance"""
+    if vector_compactor.db is None:
+        await vector_compactor.initialize()
+    return vector_compactor
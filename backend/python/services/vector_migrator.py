@@ -20,8 +20,11 @@ from config import config
 from utils.logger import get_logger, log_async_performance, LogContext
 from utils.database import get_db
 from utils.validators import DataValidator
+from utils.minhash import MinHashLSH
 from services.data_processor import DataProcessor
-from services.embedding_generator import EmbeddingGenerator, EmbeddingModel
+from services.embedding_generator import EmbeddingGenerator, EmbeddingModel, EmbeddingResult
+from services.text_chunker import TextChunker
+from services.lexical_search import hybrid_search
 
 logger = get_logger(__name__)
 
@@ -53,6 +56,11 @@ class MigrationConfig:
     optimize_embeddings: bool = True
     backup_original: bool = True
     resume_from_checkpoint: bool = True
+    chunk_long_content: bool = True
+    # Records whose content is at least this similar to an already embedded
+    # record reuse its embedding instead of calling the provider (None disables)
+    near_duplicate_threshold: Optional[float] = 0.9
+    near_duplicate_max_representatives: int = 10000
     
 @dataclass
 class MigrationProgress:
@@ -99,6 +107,7 @@ class VectorMigrator:
         self.data_processor = DataProcessor()
         self.embedding_generator = EmbeddingGenerator()
         self.validator = DataValidator()
+        self.chunker = TextChunker()
         self.progress = MigrationProgress()
         self.checkpoint_file = "migration_checkpoint.json"
         
@@ -107,6 +116,9 @@ class VectorMigrator:
         self.should_pause = False
         self.current_checkpoint = {}
         
+        # Near-duplicate detection state for the current run
+        self._reset_deduplication()
+        
     async def initialize(self):
         """Initialize the migrator"""
         self.db = await get_db()
@@ -137,6 +149,7 @@ class VectorMigrator:
         start_time = time.time()
         self.is_running = True
         self.progress.start_time = datetime.now()
+        self._reset_deduplication()
         
         try:
             with LogContext("Starting full data migration"):
@@ -167,7 +180,8 @@ class VectorMigrator:
                     processing_time=time.time() - start_time,
                     metadata={
                         'migration_config': self.config.__dict__,
-                        'completion_time': datetime.now().isoformat()
+                        'completion_time': datetime.now().isoformat(),
+                        'deduplication': dict(self.dedupe_stats)
                     }
                 )
                 
@@ -482,6 +496,7 @@ class VectorMigrator:
                 'start_time': self.progress.start_time.isoformat() if self.progress.start_time else None,
                 'estimated_completion': self.progress.estimated_completion.isoformat() if self.progress.estimated_completion else None
             },
+            'deduplication': dict(self.dedupe_stats),
             'errors': self.progress.errors[-10:]  # Last 10 errors
         }
     
@@ -586,16 +601,16 @@ class VectorMigrator:
     async def _process_analytics_batch(self, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Process a batch of analytics data"""
         results = []
+        pending = []  # (result index, vector document) awaiting validation and insert
         
         for record in batch:
             try:
                 # Extract relevant data for embedding
                 content = await self._extract_analytics_content(record)
                 
-                # Generate embedding
-                embedding_result = await self.embedding_generator.generate_embedding(
-                    content,
-                    self.config.embedding_model,
+                # Generate embedding(s); single vector documents are stored with the batch
+                result, vector_doc = await self._embed_or_reuse(
+                    record, content, 'analytics',
                     context={
                         'data_type': 'analytics',
                         'source_type': 'analytics',
@@ -603,38 +618,30 @@ class VectorMigrator:
                         'importance': 7
                     }
                 )
-                
-                if embedding_result.success:
-                    # Create vector document
-                    vector_doc = await self._create_vector_document(
-                        record, embedding_result, 'analytics'
-                    )
-                    
-                    # Insert into database
-                    await self.db.insert_document("vectordocuments", vector_doc)
-                    results.append({'success': True, 'record_id': record.get('_id')})
-                else:
-                    results.append({'success': False, 'error': embedding_result.error})
+                if vector_doc is not None:
+                    pending.append((len(results), vector_doc))
+                results.append(result)
                     
             except Exception as e:
                 logger.error(f"Error processing analytics record: {e}")
                 results.append({'success': False, 'error': str(e)})
         
+        await self._store_vector_documents(results, pending)
         return results
     
     async def _process_session_batch(self, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Process a batch of session data"""
         results = []
+        pending = []  # (result index, vector document) awaiting validation and insert
         
         for record in batch:
             try:
                 # Extract relevant data for embedding
                 content = await self._extract_session_content(record)
                 
-                # Generate embedding
-                embedding_result = await self.embedding_generator.generate_embedding(
-                    content,
-                    self.config.embedding_model,
+                # Generate embedding(s); single vector documents are stored with the batch
+                result, vector_doc = await self._embed_or_reuse(
+                    record, content, 'session',
                     context={
                         'data_type': 'session',
                         'source_type': 'session',
@@ -642,38 +649,30 @@ class VectorMigrator:
                         'importance': 6
                     }
                 )
-                
-                if embedding_result.success:
-                    # Create vector document
-                    vector_doc = await self._create_vector_document(
-                        record, embedding_result, 'session'
-                    )
-                    
-                    # Insert into database
-                    await self.db.insert_document("vectordocuments", vector_doc)
-                    results.append({'success': True, 'record_id': record.get('_id')})
-                else:
-                    results.append({'success': False, 'error': embedding_result.error})
+                if vector_doc is not None:
+                    pending.append((len(results), vector_doc))
+                results.append(result)
                     
             except Exception as e:
                 logger.error(f"Error processing session record: {e}")
                 results.append({'success': False, 'error': str(e)})
         
+        await self._store_vector_documents(results, pending)
         return results
     
     async def _process_transaction_batch(self, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Process a batch of transaction data"""
         results = []
+        pending = []  # (result index, vector document) awaiting validation and insert
         
         for record in batch:
             try:
                 # Extract relevant data for embedding
                 content = await self._extract_transaction_content(record)
                 
-                # Generate embedding
-                embedding_result = await self.embedding_generator.generate_embedding(
-                    content,
-                    self.config.embedding_model,
+                # Generate embedding(s); single vector documents are stored with the batch
+                result, vector_doc = await self._embed_or_reuse(
+                    record, content, 'transaction',
                     context={
                         'data_type': 'transaction',
                         'source_type': 'transaction',
@@ -681,25 +680,224 @@ class VectorMigrator:
                         'importance': 8
                     }
                 )
-                
-                if embedding_result.success:
-                    # Create vector document
-                    vector_doc = await self._create_vector_document(
-                        record, embedding_result, 'transaction'
-                    )
-                    
-                    # Insert into database
-                    await self.db.insert_document("vectordocuments", vector_doc)
-                    results.append({'success': True, 'record_id': record.get('_id')})
-                else:
-                    results.append({'success': False, 'error': embedding_result.error})
+                if vector_doc is not None:
+                    pending.append((len(results), vector_doc))
+                results.append(result)
                     
             except Exception as e:
                 logger.error(f"Error processing transaction record: {e}")
                 results.append({'success': False, 'error': str(e)})
         
+        await self._store_vector_documents(results, pending)
         return results
     
+    async def _embed_or_reuse(
+        self,
+        record: Dict[str, Any],
+        content: str,
+        source_type: str,
+        context: Dict[str, Any]
+    ) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+        """
+        Embed a record unless its content is a near duplicate of a record already
+        embedded and stored in this run, in which case the representative's
+        embedding is copied and the vector document references the representative.
+        A freshly embedded record becomes a representative only once
+        _store_vector_documents has validated and inserted it.
+        
+        Returns:
+            Tuple of (result, vector document to store or None)
+        """
+        if self.deduplicator is None or (
+            self.config.chunk_long_content and self.chunker.needs_chunking(content)
+        ):
+            return await self._embed_record(record, content, source_type, context)
+        
+        signature = self.deduplicator.signature(content)
+        self.dedupe_stats['checked'] += 1
+        match = self.deduplicator.query(signature)
+        if match is not None:
+            representative_id, similarity = match
+            representative = self.representatives[representative_id]
+            embedding_result = EmbeddingResult(
+                success=True,
+                embedding=representative['embedding'],
+                model_used=representative['model_used'],
+                dimensions=len(representative['embedding']),
+                quality_score=representative['quality_score'],
+                processing_time=0.0
+            )
+            vector_doc = await self._create_vector_document(record, embedding_result, source_type, content)
+            vector_doc['metadata']['nearDuplicateOf'] = representative_id
+            vector_doc['metadata']['nearDuplicateSimilarity'] = similarity
+            self.dedupe_stats['near_duplicates'] += 1
+            self.dedupe_stats['provider_calls_saved'] += 1
+            return {'success': True, 'record_id': record.get('_id'), 'near_duplicate_of': representative_id}, vector_doc
+        
+        result, vector_doc = await self._embed_record(record, content, source_type, context)
+        if vector_doc is not None:
+            self.pending_signatures[vector_doc['documentId']] = signature
+        return result, vector_doc
+    
+    async def _embed_record(
+        self,
+        record: Dict[str, Any],
+        content: str,
+        source_type: str,
+        context: Dict[str, Any]
+    ) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+        """
+        Embed a record. Content longer than one chunk is embedded per chunk and
+        stored immediately; the parent document holds the combined embedding and
+        each chunk is stored with a reference to it. Otherwise the vector document
+        is returned unsaved so a whole batch can be validated and inserted at once.
+        
+        Returns:
+            Tuple of (result, vector document to store or None)
+        """
+        if self.config.chunk_long_content and self.chunker.needs_chunking(content):
+            chunked_result = await self.embedding_generator.generate_chunked_embeddings(
+                content,
+                self.config.embedding_model,
+                context=context
+            )
+            if not chunked_result.success:
+                return {'success': False, 'error': chunked_result.error}, None
+            
+            embedding_result = EmbeddingResult(
+                success=True,
+                embedding=chunked_result.document_embedding,
+                model_used=chunked_result.model_used,
+                dimensions=len(chunked_result.document_embedding),
+                quality_score=chunked_result.quality_score,
+                processing_time=chunked_result.processing_time,
+                metadata=chunked_result.metadata
+            )
+            vector_doc = await self._create_vector_document(record, embedding_result, source_type, content)
+            vector_doc['metadata']['chunkCount'] = len(chunked_result.chunks)
+            chunk_docs = self._create_chunk_documents(vector_doc, chunked_result)
+            
+            await self.db.insert_document("vectordocuments", vector_doc)
+            if chunk_docs:
+                await self.db.insert_documents("vectordocuments", chunk_docs)
+            hybrid_search.add_documents([vector_doc] + chunk_docs)
+            return {'success': True, 'record_id': record.get('_id'), 'chunks': len(chunk_docs)}, None
+        
+        embedding_result = await self.embedding_generator.generate_embedding(
+            content,
+            self.config.embedding_model,
+            context=context
+        )
+        
+        if not embedding_result.success:
+            return {'success': False, 'error': embedding_result.error}, None
+        
+        vector_doc = await self._create_vector_document(record, embedding_result, source_type, content)
+        return {'success': True, 'record_id': record.get('_id')}, vector_doc
+    
+    async def _store_vector_documents(
+        self,
+        results: List[Dict[str, Any]],
+        pending: List[Tuple[int, Dict[str, Any]]]
+    ):
+        """
+        Validate the embeddings of a batch of vector documents in one vectorised
+        pass and bulk insert the valid ones. Rejected or failed documents are
+        marked as failed in results.
+        
+        Args:
+            results: Per-record results, updated in place
+            pending: (index into results, vector document) pairs
+        """
+        if not pending:
+            return
+        signatures = {
+            doc['documentId']: self.pending_signatures.pop(doc['documentId'])
+            for _, doc in pending if doc['documentId'] in self.pending_signatures
+        }
+        
+        if self.config.validate_data:
+            embeddings = [doc['embedding'] for _, doc in pending]
+            # Vectors that differ from the batch's dominant size cannot share an index
+            dimensions, counts = np.unique([len(embedding) for embedding in embeddings], return_counts=True)
+            validation = self.validator.validate_embedding_batch(
+                embeddings, expected_dim=int(dimensions[np.argmax(counts)])
+            )
+            
+            accepted = []
+            for (index, doc), valid, errors in zip(pending, validation['valid'], validation['errors']):
+                if valid:
+                    accepted.append((index, doc))
+                else:
+                    results[index] = {'success': False, 'error': '; '.join(errors)}
+            
+            rejected = len(pending) - len(accepted)
+            if rejected:
+                logger.warning(f"Rejected {rejected} of {len(pending)} embeddings in batch validation")
+            pending = accepted
+        
+        if not pending:
+            return
+        
+        try:
+            await self.db.insert_documents("vectordocuments", [doc for _, doc in pending])
+            # The driver sets _id on inserted documents, which keys the lexical index
+            hybrid_search.add_documents([doc for _, doc in pending])
+        except Exception as e:
+            logger.error(f"Error inserting vector documents: {e}")
+            for index, _ in pending:
+                results[index] = {'success': False, 'error': str(e)}
+            return
+        
+        for _, doc in pending:
+            if doc['documentId'] in signatures:
+                self._add_representative(doc, signatures[doc['documentId']])
+    
+    def _add_representative(self, vector_doc: Dict[str, Any], signature: np.ndarray):
+        """Let later near duplicates reuse a stored vector document's embedding"""
+        if self.deduplicator.add(vector_doc['documentId'], signature):
+            self.representatives[vector_doc['documentId']] = {
+                'embedding': np.asarray(vector_doc['embedding'], dtype=np.float32),
+                'model_used': vector_doc['metadata']['embeddingModel'],
+                'quality_score': vector_doc['metadata']['qualityScore']
+            }
+    
+    def _create_chunk_documents(
+        self,
+        parent_doc: Dict[str, Any],
+        chunked_result
+    ) -> List[Dict[str, Any]]:
+        """Create one vector document per successfully embedded chunk"""
+        chunk_docs = []
+        for chunk, embedding in zip(chunked_result.chunks, chunked_result.embeddings):
+            if embedding is None:
+                continue
+            chunk_docs.append({
+                'documentId': f"{parent_doc['documentId']}_chunk_{chunk.index}",
+                'sourceType': parent_doc['sourceType'],
+                'sourceId': parent_doc['sourceId'],
+                'siteId': parent_doc.get('siteId'),
+                'teamId': parent_doc.get('teamId'),
+                'embedding': embedding.tolist(),
+                'content': chunk.text,
+                'metadata': {
+                    'dataType': parent_doc['metadata']['dataType'],
+                    'parentDocumentId': parent_doc['documentId'],
+                    'chunkIndex': chunk.index,
+                    'chunkCount': len(chunked_result.chunks),
+                    'startChar': chunk.start_char,
+                    'endChar': chunk.end_char,
+                    'tokenCount': chunk.token_count,
+                    'contentHash': chunk.content_hash,
+                    'embeddingModel': chunked_result.model_used,
+                    'migrationTimestamp': datetime.now().isoformat()
+                },
+                'status': 'active',
+                'createdAt': datetime.now(),
+                'updatedAt': datetime.now()
+            })
+        return chunk_docs
+    
     async def _extract_analytics_content(self, record: Dict[str, Any]) -> str:
         """Extract content from analytics record for embedding"""
         content_parts = []
@@ -795,17 +993,18 @@ class VectorMigrator:
         self,
         original_record: Dict[str, Any],
         embedding_result,
-        source_type: str
+        source_type: str,
+        content: str = ''
     ) -> Dict[str, Any]:
-        """Create vector document from original record and embedding"""
+        """Create vector document from original record, its embedded content and embedding"""
         return {
             'documentId': f"{source_type}_{original_record['_id']}",
             'sourceType': source_type,
             'sourceId': original_record['_id'],
             'siteId': original_record.get('siteId'),
             'teamId': original_record.get('teamId'),
-            'embedding': embedding_result.embedding.tolist(),
-            'content': embedding_result.metadata.get('processed_text_length', ''),
+            'embedding': np.asarray(embedding_result.embedding).tolist(),
+            'content': content,
             'metadata': {
                 'dataType': source_type,
                 'originalRecord': original_record,
@@ -942,11 +1141,28 @@ class VectorMigrator:
         except Exception as e:
             logger.error(f"Error loading checkpoint: {e}")
     
+    def _reset_deduplication(self):
+        """Start near-duplicate detection afresh for a new run"""
+        threshold = self.config.near_duplicate_threshold
+        self.deduplicator = MinHashLSH(
+            threshold, max_entries=self.config.near_duplicate_max_representatives
+        ) if threshold else None
+        self.representatives = {}
+        # Signatures of embedded records waiting to be stored before they can represent others
+        self.pending_signatures = {}
+        self.dedupe_stats = {'checked': 0, 'near_duplicates': 0, 'provider_calls_saved': 0}
+    
     async def _finalize_migration(self):
         """Finalize migration process"""
         # Update progress
         self.progress.estimated_completion = datetime.now()
         
+        if self.dedupe_stats['checked']:
+            logger.info(
+                f"Near-duplicate detection saved {self.dedupe_stats['provider_calls_saved']} "
+                f"of {self.dedupe_stats['checked']} embedding calls"
+            )
+        
         # Clean up checkpoint file
         try:
             import os
@@ -0,0 +1,579 @@
+"""
+Two-Stage Vector Search for Cryptique
+Compact quantised index for candidate recall, full-precision vectors for rerank
+"""
+
+import time
+from typing import Dict, List, Optional, Any, Tuple
+from dataclasses import dataclass, field
+import numpy as np
+
+from config import config
+from utils.logger import get_logger
+from utils.database import get_db
+from utils.metrics import get_metrics_collector
+from services.projectors import Projector, projector_registry
+
+logger = get_logger(__name__)
+
+@dataclass
+class SearchHit:
+    """A single search result"""
+    document_id: Any
+    score: float
+    document: Optional[Dict[str, Any]] = None
+
+@dataclass
+class SearchResult:
+    """Result of a vector search"""
+    success: bool
+    hits: List[SearchHit] = field(default_factory=list)
+    candidates: int = 0
+    timings: Dict[str, float] = field(default_factory=dict)
+    error: Optional[str] = None
+
+def top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Indices and values of the k largest scores
+
+    Args:
+        scores: Score per row
+        k: Number of results
+
+    Returns:
+        (indices, scores) sorted by descending score
+    """
+    k = min(k, len(scores))
+    if k == 0:
+        return np.array([], dtype=int), np.array([], dtype=scores.dtype)
+    top = np.argpartition(-scores, k - 1)[:k]
+    order = top[np.argsort(-scores[top])]
+    return order, scores[order]
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+class CompactVectorIndex:
+    """
+    In-memory index of reduced, int8-quantised vectors.
+
+    Vectors are reduced either by Matryoshka-style truncation to the leading
+    dimensions or by a fitted PCA projector, L2-normalised, and quantised with a
+    per-vector scale. Scores approximate cosine similarity in the reduced space.
+    """
+
+    SCORE_BLOCK_ROWS = 16384
+
+    def __init__(
+        self,
+        dimensions: int = 256,
+        projector: Optional[Projector] = None
+    ):
+        self.dimensions = projector.target_dimensions if projector else dimensions
+        self.projector = projector
+        self.source_dimensions: Optional[int] = projector.source_dimensions if projector else None
+        self.ids: List[Any] = []
+        self.codes = np.zeros((0, self.dimensions), dtype=np.int8)
+        self.scales = np.zeros(0, dtype=np.float32)
+        self._positions: Dict[Any, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def reduce(self, embeddings: np.ndarray) -> np.ndarray:
+        """Reduce and L2-normalise embeddings, shape (n, source_dimensions)"""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if self.projector is not None:
+            reduced = self.projector.transform(embeddings)
+        else:
+            reduced = embeddings[..., :self.dimensions]
+        return _normalize_rows(reduced)
+
+    def add(self, ids: List[Any], embeddings: np.ndarray):
+        """
+        Add or replace vectors
+
+        Args:
+            ids: Document IDs
+            embeddings: Full-precision embeddings, shape (n, source_dimensions)
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if self.source_dimensions is None:
+            self.source_dimensions = embeddings.shape[1]
+
+        reduced = self.reduce(embeddings)
+        scales = np.abs(reduced).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.round(reduced / scales[:, None]).astype(np.int8)
+
+        new_ids, new_rows = [], []
+        for i, doc_id in enumerate(ids):
+            position = self._positions.get(doc_id)
+            if position is not None:
+                self.codes[position] = codes[i]
+                self.scales[position] = scales[i]
+            else:
+                self._positions[doc_id] = len(self.ids) + len(new_ids)
+                new_ids.append(doc_id)
+                new_rows.append(i)
+
+        if new_rows:
+            self.ids.extend(new_ids)
+            self.codes = np.vstack([self.codes, codes[new_rows]])
+            self.scales = np.concatenate([self.scales, scales[new_rows]])
+
+    def remove(self, doc_id: Any) -> bool:
+        """Remove a vector by swapping the last row into its slot"""
+        position = self._positions.pop(doc_id, None)
+        if position is None:
+            return False
+
+        last = len(self.ids) - 1
+        if position != last:
+            self.ids[position] = self.ids[last]
+            self.codes[position] = self.codes[last]
+            self.scales[position] = self.scales[last]
+            self._positions[self.ids[position]] = position
+
+        self.ids.pop()
+        self.codes = self.codes[:last]
+        self.scales = self.scales[:last]
+        return True
+
+    def search(self, query: np.ndarray, num_candidates: int) -> List[Tuple[Any, float]]:
+        """
+        Approximate top candidates for a full-precision query
+
+        Args:
+            query: Query embedding, shape (source_dimensions,)
+            num_candidates: Number of candidates to return
+
+        Returns:
+            (document_id, approximate score) pairs, best first
+        """
+        if not self.ids:
+            return []
+        return self.search_reduced(self.reduce(np.asarray(query, dtype=np.float32)[None, :])[0], num_candidates)
+
+    def search_reduced(self, reduced_query: np.ndarray, num_candidates: int) -> List[Tuple[Any, float]]:
+        """search() for a query that has already been reduced and normalised"""
+        if not self.ids:
+            return []
+        # Score in blocks so the float32 copy of the int8 codes stays small
+        scores = np.empty(len(self.ids), dtype=np.float32)
+        for start in range(0, len(self.ids), self.SCORE_BLOCK_ROWS):
+            end = start + self.SCORE_BLOCK_ROWS
+            scores[start:end] = self.codes[start:end].astype(np.float32) @ reduced_query
+        scores *= self.scales
+        order, top_scores = top_k(scores, num_candidates)
+        return [(self.ids[i], float(score)) for i, score in zip(order, top_scores)]
+
+    def memory_bytes(self) -> int:
+        """Approximate memory used by codes and scales"""
+        return self.codes.nbytes + self.scales.nbytes
+
+def _get_path(doc: Dict[str, Any], path: str) -> Any:
+    """Value at a dotted path, or None"""
+    value = doc
+    for part in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+class PartitionedVectorIndex:
+    """
+    Compact index split into one CompactVectorIndex per tenant (the value of
+    partition_field), so a search scoped to a tenant only scans that tenant's
+    vectors instead of discarding everyone else's candidates afterwards
+    """
+
+    def __init__(
+        self,
+        dimensions: int = 256,
+        projector: Optional[Projector] = None,
+        partition_field: str = "siteId"
+    ):
+        self.dimensions = projector.target_dimensions if projector else dimensions
+        self.projector = projector
+        self.partition_field = partition_field
+        self.source_dimensions: Optional[int] = projector.source_dimensions if projector else None
+        self.partitions: Dict[Any, CompactVectorIndex] = {}
+        self._partition_of: Dict[Any, Any] = {}
+
+    def __len__(self) -> int:
+        return len(self._partition_of)
+
+    def add(self, ids: List[Any], embeddings: np.ndarray, partitions: List[Any]):
+        """
+        Add or replace vectors
+
+        Args:
+            ids: Document IDs
+            embeddings: Full-precision embeddings, shape (n, source_dimensions)
+            partitions: Partition (tenant) of each document
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if self.source_dimensions is None:
+            self.source_dimensions = embeddings.shape[1]
+
+        rows_by_partition: Dict[Any, List[int]] = {}
+        for i, (doc_id, partition) in enumerate(zip(ids, partitions)):
+            previous = self._partition_of.get(doc_id, partition)
+            if previous != partition:
+                self.partitions[previous].remove(doc_id)
+            self._partition_of[doc_id] = partition
+            rows_by_partition.setdefault(partition, []).append(i)
+
+        for partition, rows in rows_by_partition.items():
+            index = self.partitions.get(partition)
+            if index is None:
+                index = self.partitions[partition] = CompactVectorIndex(self.dimensions, self.projector)
+                index.source_dimensions = self.source_dimensions
+            index.add([ids[i] for i in rows], embeddings[rows])
+
+    def remove(self, doc_id: Any) -> bool:
+        """Remove a vector"""
+        if doc_id not in self._partition_of:
+            return False
+        return self.partitions[self._partition_of.pop(doc_id)].remove(doc_id)
+
+    def search(
+        self,
+        query: np.ndarray,
+        num_candidates: int,
+        partitions: Optional[List[Any]] = None
+    ) -> List[Tuple[Any, float]]:
+        """
+        Approximate top candidates, optionally only within some partitions
+
+        Args:
+            query: Query embedding, shape (source_dimensions,)
+            num_candidates: Number of candidates to return
+            partitions: Partitions to scan, or None for all
+
+        Returns:
+            (document_id, approximate score) pairs, best first
+        """
+        keys = list(self.partitions) if partitions is None else [p for p in partitions if p in self.partitions]
+        if not keys:
+            return []
+
+        reduced_query = self.partitions[keys[0]].reduce(np.asarray(query, dtype=np.float32)[None, :])[0]
+        candidates = [
+            candidate
+            for key in keys
+            for candidate in self.partitions[key].search_reduced(reduced_query, num_candidates)
+        ]
+        if len(keys) == 1:
+            return candidates
+
+        order, _ = top_k(np.array([score for _, score in candidates], dtype=np.float32), num_candidates)
+        return [candidates[i] for i in order]
+
+    def partitions_for(self, filters: Optional[Dict[str, Any]]) -> Optional[List[Any]]:
+        """
+        Partitions a filter restricts the search to
+
+        Args:
+            filters: MongoDB query filter
+
+        Returns:
+            Partition values, or None if the filter does not constrain the partition field
+        """
+        if not filters or self.partition_field not in filters:
+            return None
+        condition = filters[self.partition_field]
+        if not isinstance(condition, dict):
+            return [condition]
+        if set(condition) == {"$eq"}:
+            return [condition["$eq"]]
+        if set(condition) == {"$in"}:
+            return list(condition["$in"])
+        return None
+
+    def memory_bytes(self) -> int:
+        """Approximate memory used by codes and scales"""
+        return sum(index.memory_bytes() for index in self.partitions.values())
+
+class TwoStageVectorSearch:
+    """
+    Two-stage retrieval over vectordocuments: the compact index supplies
+    candidates, which are reranked with full vectors fetched in one batch query
+    """
+
+    def __init__(self, collection_name: str = "vectordocuments"):
+        self.collection_name = collection_name
+        self.db = None
+        self.index: Optional[PartitionedVectorIndex] = None
+        self.metrics = get_metrics_collector()
+        embedding_config = config.get_embedding_config()
+        self.dimensions = embedding_config['compact_index_dimensions']
+        self.projector_name = embedding_config['compact_index_projector']
+        self.default_candidates = embedding_config['two_stage_candidates']
+        self.partition_field = embedding_config['compact_index_partition_field']
+
+    async def initialize(self):
+        """Initialize the search service"""
+        self.db = await get_db()
+
+    async def build_index(
+        self,
+        filter_dict: Optional[Dict[str, Any]] = None,
+        batch_size: int = 1000
+    ) -> Dict[str, Any]:
+        """
+        Build the compact index by streaming stored embeddings
+
+        Args:
+            filter_dict: Filter for documents to index
+            batch_size: Documents per batch
+
+        Returns:
+            Build statistics
+        """
+        start_time = time.time()
+        projector = projector_registry.get(self.projector_name) if self.projector_name else None
+        if self.projector_name and projector is None:
+            raise ValueError(f"Projector {self.projector_name} has not been fitted")
+
+        index = PartitionedVectorIndex(self.dimensions, projector, self.partition_field)
+        skipped = 0
+        ids, batch, partitions = [], [], []
+
+        async for doc in self.db.stream_documents(
+            self.collection_name,
+            {**(filter_dict or {}), "embedding": {"$exists": True}, "status": "active"},
+            {"embedding": 1, self.partition_field: 1},
+            batch_size=batch_size
+        ):
+            embedding = doc['embedding']
+            if index.source_dimensions is None:
+                index.source_dimensions = len(embedding)
+            if len(embedding) != index.source_dimensions:
+                skipped += 1
+                continue
+            ids.append(doc['_id'])
+            batch.append(embedding)
+            partitions.append(_get_path(doc, self.partition_field))
+            if len(batch) == batch_size:
+                index.add(ids, np.array(batch, dtype=np.float32), partitions)
+                ids, batch, partitions = [], [], []
+
+        if batch:
+            index.add(ids, np.array(batch, dtype=np.float32), partitions)
+
+        self.index = index
+        full_bytes = len(index) * (index.source_dimensions or 0) * 4
+        stats = {
+            'documents': len(index),
+            'partitions': len(index.partitions),
+            'partition_field': self.partition_field,
+            'skipped_dimension_mismatch': skipped,
+            'dimensions': index.dimensions,
+            'source_dimensions': index.source_dimensions,
+            'reduction': f"projector:{self.projector_name}" if projector else "truncation",
+            'index_bytes': index.memory_bytes(),
+            'full_precision_bytes': full_bytes,
+            'build_time': time.time() - start_time
+        }
+        self.metrics.set_gauge('vector_search.compact_index.documents', len(index))
+        logger.info(f"Built compact vector index: {stats}")
+        return stats
+
+    async def search(
+        self,
+        query_embedding: np.ndarray,
+        limit: int = 10,
+        num_candidates: Optional[int] = None,
+        projection: Optional[Dict[str, int]] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        include_embeddings: bool = False
+    ) -> SearchResult:
+        """
+        Two-stage search. A filter on the partition field limits recall to those
+        tenants' partitions; the whole filter is applied when candidates are fetched.
+
+        Args:
+            query_embedding: Full-precision query embedding
+            limit: Number of results
+            num_candidates: Candidates taken from the compact index
+            projection: Extra fields to return with each hit
+            filters: MongoDB query filter for the hits
+            include_embeddings: Keep the full embedding in each hit's document
+
+        Returns:
+            SearchResult with reranked hits and per-stage timings
+        """
+        try:
+            if self.index is None:
+                raise RuntimeError("Compact index has not been built")
+
+            num_candidates = max(num_candidates or self.default_candidates, limit)
+            query = _normalize_rows(np.asarray(query_embedding, dtype=np.float32))
+
+            stage_start = time.time()
+            candidates = self.index.search(query, num_candidates, self.index.partitions_for(filters))
+            recall_time = time.time() - stage_start
+
+            stage_start = time.time()
+            docs = await self.db.find_documents(
+                self.collection_name,
+                {**(filters or {}), "_id": {"$in": [doc_id for doc_id, _ in candidates]}},
+                {**(projection or {}), "embedding": 1}
+            )
+            fetch_time = time.time() - stage_start
+
+            stage_start = time.time()
+            hits = self._rerank(query, docs, limit, include_embeddings)
+            rerank_time = time.time() - stage_start
+
+            timings = {'recall': recall_time, 'fetch': fetch_time, 'rerank': rerank_time}
+            for stage, duration in timings.items():
+                self.metrics.record_timer(f'vector_search.two_stage.{stage}', duration)
+
+            return SearchResult(success=True, hits=hits, candidates=len(candidates), timings=timings)
+
+        except Exception as e:
+            logger.error(f"Error in two-stage vector search: {e}")
+            return SearchResult(success=False, error=str(e))
+
+    async def evaluate(
+        self,
+        query_count: int = 100,
+        limit: int = 10,
+        candidate_counts: Optional[List[int]] = None
+    ) -> Dict[str, Any]:
+        """
+        Measure recall@limit and latency against exact full-precision search.
+        Queries are sampled from the collection and excluded from their own results.
+
+        Args:
+            query_count: Number of held-out queries
+            limit: Results per query
+            candidate_counts: Candidate set sizes to evaluate
+
+        Returns:
+            Recall and latency for each candidate count
+        """
+        if self.index is None:
+            raise RuntimeError("Compact index has not been built")
+
+        candidate_counts = candidate_counts or [limit * 2, limit * 5, limit * 10, limit * 20]
+        queries = await self.db.aggregate(self.collection_name, [
+            {"$match": {"embedding": {"$exists": True}, "status": "active"}},
+            {"$sample": {"size": query_count}},
+            {"$project": {"embedding": 1}}
+        ])
+        queries = [q for q in queries if len(q['embedding']) == self.index.source_dimensions]
+        if not queries:
+            raise ValueError("No queries with matching dimensions")
+
+        ground_truth = await self._exact_neighbours(queries, limit)
+
+        report = {'queries': len(queries), 'limit': limit, 'results': []}
+        for num_candidates in candidate_counts:
+            recalls, latencies = [], []
+            for query, truth in zip(queries, ground_truth):
+                start_time = time.time()
+                result = await self.search(np.array(query['embedding']), limit + 1, num_candidates)
+                latencies.append(time.time() - start_time)
+                found = [hit.document_id for hit in result.hits if hit.document_id != query['_id']][:limit]
+                recalls.append(len(set(found) & truth) / max(len(truth), 1))
+
+            report['results'].append({
+                'num_candidates': num_candidates,
+                'recall': float(np.mean(recalls)),
+                'latency_p50': float(np.percentile(latencies, 50)),
+                'latency_p95': float(np.percentile(latencies, 95))
+            })
+
+        logger.info(f"Two-stage search evaluation: {report['results']}")
+        return report
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get compact index statistics"""
+        if self.index is None:
+            return {'built': False}
+        return {
+            'built': True,
+            'documents': len(self.index),
+            'partitions': len(self.index.partitions),
+            'dimensions': self.index.dimensions,
+            'source_dimensions': self.index.source_dimensions,
+            'index_bytes': self.index.memory_bytes()
+        }
+
+    # Private methods
+
+    def _rerank(
+        self,
+        query: np.ndarray,
+        docs: List[Dict[str, Any]],
+        limit: int,
+        include_embeddings: bool = False
+    ) -> List[SearchHit]:
+        """Exact cosine rerank of fetched candidates"""
+        excluded = ('_id',) if include_embeddings else ('_id', 'embedding')
+        docs = [doc for doc in docs if len(doc.get('embedding') or []) == len(query)]
+        if not docs:
+            return []
+        matrix = _normalize_rows(np.array([doc['embedding'] for doc in docs], dtype=np.float32))
+        order, scores = top_k(matrix @ query, limit)
+        hits = []
+        for i, score in zip(order, scores):
+            doc = {key: value for key, value in docs[i].items() if key not in excluded}
+            hits.append(SearchHit(document_id=docs[i]['_id'], score=float(score), document=doc))
+        return hits
+
+    async def _exact_neighbours(self, queries: List[Dict[str, Any]], limit: int) -> List[set]:
+        """Exact top-limit neighbours for each query, streaming the collection in batches"""
+        query_matrix = _normalize_rows(np.array([q['embedding'] for q in queries], dtype=np.float32))
+        query_ids = [q['_id'] for q in queries]
+        best_scores = np.full((len(queries), limit), -np.inf, dtype=np.float32)
+        best_ids = np.full((len(queries), limit), None, dtype=object)
+
+        ids, batch = [], []
+
+        def merge():
+            matrix = _normalize_rows(np.array(batch, dtype=np.float32))
+            scores = query_matrix @ matrix.T
+            batch_ids = np.array(ids, dtype=object)
+            for q in range(len(queries)):
+                # Exclude the query document itself
+                row = np.where(batch_ids == query_ids[q], -np.inf, scores[q])
+                combined_scores = np.concatenate([best_scores[q], row])
+                combined_ids = np.concatenate([best_ids[q], batch_ids])
+                top = np.argsort(-combined_scores)[:limit]
+                best_scores[q], best_ids[q] = combined_scores[top], combined_ids[top]
+
+        async for doc in self.db.stream_documents(
+            self.collection_name,
+            {"embedding": {"$exists": True}, "status": "active"},
+            {"embedding": 1}
+        ):
+            if len(doc['embedding']) != self.index.source_dimensions:
+                continue
+            ids.append(doc['_id'])
+            batch.append(doc['embedding'])
+            if len(batch) == 1000:
+                merge()
+                ids, batch = [], []
+        if batch:
+            merge()
+
+        return [
+            {doc_id for doc_id, score in zip(best_ids[q], best_scores[q]) if np.isfinite(score)}
+            for q in range(len(queries))
+        ]
+
+# Global two-stage search instance
+two_stage_search = TwoStageVectorSearch()
+
+# Convenience functions
+async def get_two_stage_search() -> TwoStageVectorSearch:
+    """Get two-stage search instance"""
+    if two_stage_search.db is None:
+        await two_stage_search.initialize()
+    return two_stage_search
@@ -0,0 +1,413 @@
+"""
+Hot/Cold Vector Tiering for Cryptique
+Archives rarely used vector documents to local float16 segment files and
+promotes them back to the hot collection when they are retrieved
+"""
+
+import asyncio
+import gzip
+import json
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+import numpy as np
+from bson import json_util
+
+from config import config
+from utils.logger import get_logger
+from utils.database import get_db
+from utils.metrics import get_metrics_collector
+from services.vector_search import SearchHit, top_k, _normalize_rows, two_stage_search
+from services.lexical_search import hybrid_search
+
+logger = get_logger(__name__)
+
+# Rows scanned per block of a memory-mapped segment
+SCAN_BLOCK_ROWS = 65536
+
+# Recorded retrievals written to lastAccessedAt at once
+ACCESS_FLUSH_SIZE = 10000
+
+# Fields kept per archived row, and so the only fields archive search can filter on
+ARCHIVE_COLUMNS = ('_id', 'documentId', 'siteId', 'teamId', 'sourceType', 'status')
+
+# Filter operators archive search can evaluate on those fields
+ARCHIVE_FILTER_OPERATORS = ('$eq', '$ne', '$in', '$nin')
+
+def check_archive_filters(filters: Optional[Dict[str, Any]]):
+    """
+    Make sure archive search can apply every condition of a filter
+
+    Args:
+        filters: MongoDB query filter
+
+    Raises:
+        ValueError: A condition is on a field that is not archived or uses an unsupported operator
+    """
+    for name, condition in (filters or {}).items():
+        if name not in ARCHIVE_COLUMNS:
+            raise ValueError(f"Archive search cannot filter on {name}; supported fields: {', '.join(ARCHIVE_COLUMNS)}")
+        if isinstance(condition, dict):
+            unsupported = [op for op in condition if op not in ARCHIVE_FILTER_OPERATORS]
+            if unsupported:
+                raise ValueError(
+                    f"Archive search cannot apply {', '.join(unsupported)} on {name}; "
+                    f"supported operators: {', '.join(ARCHIVE_FILTER_OPERATORS)}"
+                )
+
+@dataclass
+class TieringResult:
+    """Result of an archival run"""
+    success: bool
+    archived: int = 0
+    segments: int = 0
+    bytes_written: int = 0
+    processing_time: float = 0.0
+    error: Optional[str] = None
+
+class ArchiveSegment:
+    """
+    One archived batch of vector documents in its own directory:
+    - embeddings.npy: normalised float16 matrix, scanned through a memory map
+    - columns.json.gz: the ARCHIVE_COLUMNS of each row, for filtering
+    - documents.json.gz: the documents without embeddings, read only on promotion
+    - promoted.json: rows that have been moved back to the hot tier
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.embeddings = np.load(path / "embeddings.npy", mmap_mode='r')
+        with gzip.open(path / "columns.json.gz", 'rt') as f:
+            columns = json_util.loads(f.read())
+        self.ids: List[Any] = columns['_id']
+        self.row_of = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        self.columns = {name: np.array(values, dtype=object) for name, values in columns.items()}
+        self.promoted: Set[int] = set()
+        promoted_path = path / "promoted.json"
+        if promoted_path.exists():
+            self.promoted = set(json.loads(promoted_path.read_text()))
+        self._live = np.ones(len(self.ids), dtype=bool)
+        self._live[list(self.promoted)] = False
+
+    @classmethod
+    def write(cls, directory: Path, docs: List[Dict[str, Any]]) -> "ArchiveSegment":
+        """
+        Write documents with equal-length embeddings as a new segment
+
+        Args:
+            directory: Archive directory
+            docs: Vector documents including embeddings
+
+        Returns:
+            The written segment
+        """
+        path = directory / f"{datetime.now():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}"
+        staging = path.with_suffix(".tmp")
+        staging.mkdir(parents=True)
+
+        matrix = _normalize_rows(np.array([doc['embedding'] for doc in docs], dtype=np.float32))
+        np.save(staging / "embeddings.npy", matrix.astype(np.float16))
+        columns = {name: [doc.get(name) for doc in docs] for name in ARCHIVE_COLUMNS}
+        with gzip.open(staging / "columns.json.gz", 'wt') as f:
+            f.write(json_util.dumps(columns))
+        with gzip.open(staging / "documents.json.gz", 'wt') as f:
+            f.write(json_util.dumps([{k: v for k, v in doc.items() if k != 'embedding'} for doc in docs]))
+
+        # Rename last so a crash never leaves a half-written segment behind
+        staging.rename(path)
+        return cls(path)
+
+    def __len__(self) -> int:
+        return len(self.ids) - len(self.promoted)
+
+    def nbytes(self) -> int:
+        return sum(file.stat().st_size for file in self.path.iterdir())
+
+    def search(
+        self,
+        query: np.ndarray,
+        limit: int,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[Any, float]]:
+        """
+        Top rows by cosine similarity, scanning the memory map block by block.
+        Filters must pass check_archive_filters; a segment written before a
+        filtered column was archived matches nothing.
+        """
+        mask = self._live.copy()
+        for name, condition in (filters or {}).items():
+            if name not in self.columns:
+                return []
+            mask &= self._condition_mask(self.columns[name], condition)
+        if not mask.any():
+            return []
+
+        best_ids: List[Any] = []
+        best_scores = np.zeros(0, dtype=np.float32)
+        for start in range(0, len(self.ids), SCAN_BLOCK_ROWS):
+            block_mask = mask[start:start + SCAN_BLOCK_ROWS]
+            if not block_mask.any():
+                continue
+            rows = np.flatnonzero(block_mask) + start
+            scores = np.asarray(self.embeddings[rows], dtype=np.float32) @ query
+            order, top_scores = top_k(scores, limit)
+            combined_scores = np.concatenate([best_scores, top_scores])
+            combined_ids = best_ids + [self.ids[rows[i]] for i in order]
+            keep, best_scores = top_k(combined_scores, limit)
+            best_ids = [combined_ids[i] for i in keep]
+        return list(zip(best_ids, best_scores.tolist()))
+
+    @staticmethod
+    def _condition_mask(values: np.ndarray, condition: Any) -> np.ndarray:
+        """Rows whose column value satisfies an equality or $eq/$ne/$in/$nin condition"""
+        operators = condition if isinstance(condition, dict) else {'$eq': condition}
+        mask = np.ones(len(values), dtype=bool)
+        for op, argument in operators.items():
+            allowed = argument if op in ('$in', '$nin') else [argument]
+            matched = np.fromiter((value in allowed for value in values), dtype=bool, count=len(values))
+            mask &= ~matched if op in ('$ne', '$nin') else matched
+        return mask
+
+    def documents(self, ids: Iterable[Any]) -> List[Dict[str, Any]]:
+        """Load archived documents with their float16 embeddings restored to lists"""
+        rows = [self.row_of[doc_id] for doc_id in ids if doc_id in self.row_of]
+        if not rows:
+            return []
+        with gzip.open(self.path / "documents.json.gz", 'rt') as f:
+            docs = json_util.loads(f.read())
+        return [{**docs[row], 'embedding': np.asarray(self.embeddings[row], dtype=np.float32).tolist()} for row in rows]
+
+    def mark_promoted(self, ids: Iterable[Any]):
+        rows = [self.row_of[doc_id] for doc_id in ids if doc_id in self.row_of]
+        self.promoted.update(rows)
+        self._live[rows] = False
+        (self.path / "promoted.json").write_text(json.dumps(sorted(self.promoted)))
+
+class VectorTiering:
+    """
+    Moves cold vector documents out of the hot collection and its vector index.
+    A document is cold when it is one of the configured source types, older than
+    cold_after_days and not retrieved for idle_days. Retrievals are recorded in
+    memory and written to lastAccessedAt in batches. Archived vectors are only
+    searched when a caller asks for historical scope, and archived hits are
+    promoted back to the hot collection.
+    """
+
+    def __init__(self, collection_name: str = "vectordocuments", archive_dir: Optional[str] = None):
+        self.collection_name = collection_name
+        embedding_config = config.get_embedding_config()
+        self.archive_dir = Path(archive_dir or embedding_config['tiering_archive_dir'])
+        self.cold_after_days = embedding_config['tiering_cold_after_days']
+        self.idle_days = embedding_config['tiering_idle_days']
+        self.source_types = embedding_config['tiering_source_types']
+        self.db = None
+        self.metrics = get_metrics_collector()
+        self.segments: Dict[str, ArchiveSegment] = {}
+        self.pending_access: Set[Any] = set()
+        self.stats = {'archived': 0, 'promoted': 0, 'archive_searches': 0}
+        self._background_tasks: Set[asyncio.Task] = set()
+
+    async def initialize(self):
+        """Initialize tiering and open existing archive segments"""
+        self.db = await get_db()
+        self.load_segments()
+
+    def load_segments(self):
+        """Open every segment in the archive directory"""
+        if not self.archive_dir.exists():
+            return
+        for path in sorted(self.archive_dir.iterdir()):
+            if path.is_dir() and path.suffix != ".tmp" and path.name not in self.segments:
+                try:
+                    self.segments[path.name] = ArchiveSegment(path)
+                except Exception as e:
+                    logger.error(f"Error opening archive segment {path.name}: {e}")
+
+    def record_access(self, ids: Iterable[Any]):
+        """Note that hot documents were retrieved"""
+        self.pending_access.update(ids)
+        if len(self.pending_access) >= ACCESS_FLUSH_SIZE and self.db is not None:
+            task = asyncio.create_task(self.flush_access())
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+
+    async def flush_access(self):
+        """Write recorded retrievals to lastAccessedAt"""
+        if not self.pending_access:
+            return
+        ids, self.pending_access = list(self.pending_access), set()
+        await self.db.update_documents(
+            self.collection_name, {"_id": {"$in": ids}}, {"$set": {"lastAccessedAt": datetime.now()}}
+        )
+
+    async def archive_cold(self, batch_size: int = 10000, dry_run: bool = False) -> TieringResult:
+        """
+        Move cold vector documents to archive segments
+
+        Args:
+            batch_size: Documents per segment
+            dry_run: Count cold documents without moving them
+
+        Returns:
+            TieringResult with documents archived and bytes written
+        """
+        start_time = time.time()
+        result = TieringResult(success=False)
+
+        try:
+            await self.flush_access()
+            now = datetime.now()
+            cold_filter = {
+                "sourceType": {"$in": self.source_types},
+                "createdAt": {"$lt": now - timedelta(days=self.cold_after_days)},
+                "embedding": {"$exists": True},
+                "$or": [
+                    {"lastAccessedAt": {"$exists": False}},
+                    {"lastAccessedAt": {"$lt": now - timedelta(days=self.idle_days)}}
+                ]
+            }
+
+            if dry_run:
+                result.archived = await self.db.count_documents(self.collection_name, cold_filter)
+                result.success = True
+                return result
+
+            self.archive_dir.mkdir(parents=True, exist_ok=True)
+            batch: List[Dict[str, Any]] = []
+            async for doc in self.db.stream_documents(self.collection_name, cold_filter, batch_size=1000):
+                batch.append(doc)
+                if len(batch) >= batch_size:
+                    await self._archive_batch(batch, result)
+                    batch = []
+            if batch:
+                await self._archive_batch(batch, result)
+
+            result.success = True
+            result.processing_time = time.time() - start_time
+            self.stats['archived'] += result.archived
+            self.metrics.increment_counter('vector_tiering.archived', result.archived)
+            logger.info(f"Archived {result.archived} cold vector documents in {result.segments} segments")
+            return result
+
+        except Exception as e:
+            logger.error(f"Error archiving cold vector documents: {e}")
+            result.error = str(e)
+            result.processing_time = time.time() - start_time
+            return result
+
+    def search_archive(
+        self,
+        query_embedding: np.ndarray,
+        limit: int = 10,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[SearchHit]:
+        """
+        Search archived vectors. Scans memory-mapped segments, so callers on
+        the event loop run it in a thread.
+
+        Args:
+            query_embedding: Query embedding
+            limit: Number of results
+            filters: Equality, $eq, $ne, $in or $nin conditions on ARCHIVE_COLUMNS
+
+        Returns:
+            Hits whose document holds the filter columns, the embedding and the archive segment name
+
+        Raises:
+            ValueError: The filters include a condition archive search cannot apply
+        """
+        check_archive_filters(filters)
+        query = _normalize_rows(np.asarray(query_embedding, dtype=np.float32))
+        hits = []
+        # Copy: archival may add segments while a search runs in a thread
+        for name, segment in list(self.segments.items()):
+            if segment.embeddings.shape[1] != len(query):
+                continue
+            for doc_id, score in segment.search(query, limit, filters):
+                row = segment.row_of[doc_id]
+                document = {column: values[row] for column, values in segment.columns.items() if column != '_id'}
+                document['embedding'] = np.asarray(segment.embeddings[row], dtype=np.float32).tolist()
+                document['archiveSegment'] = name
+                hits.append(SearchHit(document_id=doc_id, score=score, document=document))
+        self.stats['archive_searches'] += 1
+        return sorted(hits, key=lambda hit: hit.score, reverse=True)[:limit]
+
+    async def promote(self, ids: Iterable[Any]) -> int:
+        """
+        Move archived documents back to the hot collection
+
+        Args:
+            ids: Document _ids
+
+        Returns:
+            Number of documents promoted
+        """
+        ids = set(ids)
+        promoted = 0
+        for segment in self.segments.values():
+            live = [doc_id for doc_id in ids if doc_id in segment.row_of and segment.row_of[doc_id] not in segment.promoted]
+            docs = segment.documents(live)
+            if not docs:
+                continue
+            for doc in docs:
+                doc['lastAccessedAt'] = datetime.now()
+            await self.db.insert_documents(self.collection_name, docs)
+            segment.mark_promoted(doc['_id'] for doc in docs)
+            hybrid_search.add_documents(docs)
+            promoted += len(docs)
+
+        self.stats['promoted'] += promoted
+        self.metrics.increment_counter('vector_tiering.promoted', promoted)
+        return promoted
+
+    def promote_in_background(self, ids: Iterable[Any]):
+        """Promote archived hits without delaying the search that returned them"""
+        task = asyncio.create_task(self.promote(list(ids)))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get tiering statistics"""
+        return {
+            **self.stats,
+            'segments': len(self.segments),
+            'archived_documents': sum(len(segment) for segment in self.segments.values()),
+            'archive_bytes': sum(segment.nbytes() for segment in self.segments.values()),
+            'pending_access': len(self.pending_access)
+        }
+
+    # Private methods
+
+    async def _archive_batch(self, batch: List[Dict[str, Any]], result: TieringResult):
+        """Write one segment per embedding size, then remove the documents from the hot tier"""
+        by_dimensions: Dict[int, List[Dict[str, Any]]] = {}
+        for doc in batch:
+            by_dimensions.setdefault(len(doc['embedding']), []).append(doc)
+
+        for docs in by_dimensions.values():
+            segment = await asyncio.to_thread(ArchiveSegment.write, self.archive_dir, docs)
+            self.segments[segment.path.name] = segment
+
+            ids = [doc['_id'] for doc in docs]
+            await self.db.delete_documents(self.collection_name, {"_id": {"$in": ids}})
+            for doc_id in ids:
+                hybrid_search.index.remove(doc_id)
+                if two_stage_search.index is not None:
+                    two_stage_search.index.remove(doc_id)
+
+            result.archived += len(docs)
+            result.segments += 1
+            result.bytes_written += segment.nbytes()
+
+# Global tiering instance
+vector_tiering = VectorTiering()
+
+# Convenience functions
+async def get_vector_tiering() -> VectorTiering:
+    """Get vector tiering instance"""
+    if vector_tiering.db is None:
+        await vector_tiering.initialize()
+    return vector_tiering
@@ -0,0 +1,405 @@
+"""
+Real-time Vectorization Worker for Cryptique
+Tails MongoDB change streams on source collections and keeps vectordocuments current
+"""
+
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from pymongo import DeleteMany, UpdateOne
+
+from config import config
+from utils.logger import get_logger
+from utils.database import get_db
+from utils.metrics import get_metrics_collector
+from services.embedding_generator import EmbeddingGenerator, EmbeddingModel, EmbeddingResult, get_embedding_generator
+from services.vector_migrator import MigrationConfig, VectorMigrator
+from services.vector_search import two_stage_search
+from services.lexical_search import hybrid_search
+
+logger = get_logger(__name__)
+
+# Watched collection -> (vector document sourceType, content extractor, importance)
+WATCHED_SOURCES = {
+    'analytics': ('analytics', '_extract_analytics_content', 7),
+    'sessions': ('session', '_extract_session_content', 6),
+    'transactions': ('transaction', '_extract_transaction_content', 8)
+}
+
+CHECKPOINT_COLLECTION = "changestreamcheckpoints"
+
+# Changes that kept failing to embed, kept for inspection and replay
+DEAD_LETTER_COLLECTION = "vectorizationdeadletters"
+
+# Longest wait before retrying a change that failed to embed
+MAX_RETRY_DELAY_SECONDS = 300.0
+
+@dataclass
+class PendingChange:
+    """Latest state of a changed source document awaiting vectorization"""
+    collection: str
+    document_id: Any
+    document: Optional[Dict[str, Any]]  # None when the source was deleted
+    first_seq: int
+    last_seq: int
+    first_seen: float
+    last_seen: float
+    attempts: int = 0
+    retry_at: float = 0.0
+
+class VectorizationWorker:
+    """
+    Long-running worker that vectorizes source documents as they change.
+
+    Change events are coalesced per document and held until the document has
+    been quiet for debounce_seconds (or has waited max_delay_seconds), then
+    embedded in batches and upserted into vectordocuments with one bulk write,
+    and the lexical index is updated to match. A change whose embedding fails
+    stays pending and is retried with exponential backoff; after max_attempts
+    it is moved to the dead-letter collection. Resume tokens are checkpointed
+    per collection only up to the oldest change still pending, so a restart
+    never skips an update.
+    """
+
+    def __init__(
+        self,
+        collections: Optional[List[str]] = None,
+        model: Optional[EmbeddingModel] = None
+    ):
+        embedding_config = config.get_embedding_config()
+        self.collections = collections or list(WATCHED_SOURCES)
+        self.model = model or EmbeddingModel(embedding_config['vectorization_model'])
+        self.debounce_seconds = embedding_config['vectorization_debounce_seconds']
+        self.max_delay_seconds = embedding_config['vectorization_max_delay_seconds']
+        self.batch_size = embedding_config['vectorization_batch_size']
+        self.max_attempts = embedding_config['vectorization_max_attempts']
+        self.db = None
+        self.embedding_generator: Optional[EmbeddingGenerator] = None
+        self.migrator: Optional[VectorMigrator] = None
+        self.metrics = get_metrics_collector()
+
+        self.pending: Dict[Tuple[str, Any], PendingChange] = {}
+        self.tokens: Dict[str, Deque[Tuple[int, Any]]] = {name: deque() for name in self.collections}
+        self.checkpoints: Dict[str, Any] = {}
+        self.lag: Dict[str, float] = {}
+        self.stats = {'events': 0, 'coalesced': 0, 'upserted': 0, 'deleted': 0, 'failed': 0, 'dead_lettered': 0}
+        self.is_running = False
+        self._seq = 0
+        self._tasks: List[asyncio.Task] = []
+        self._flush_lock = asyncio.Lock()
+
+    async def initialize(self, embedding_generator: Optional[EmbeddingGenerator] = None):
+        """
+        Initialize the worker
+
+        Args:
+            embedding_generator: Generator to embed with; the shared one if None
+        """
+        self.db = await get_db()
+        self.embedding_generator = embedding_generator or await get_embedding_generator()
+        # The migrator supplies content extraction and the vector document layout
+        self.migrator = VectorMigrator(MigrationConfig(embedding_model=self.model, near_duplicate_threshold=None))
+        self.migrator.db = self.db
+        self.migrator.embedding_generator = self.embedding_generator
+
+    async def start(self):
+        """Start tailing every watched collection"""
+        if self.is_running:
+            return
+        self.is_running = True
+        for collection in self.collections:
+            doc = await self.db.find_one_document(CHECKPOINT_COLLECTION, {"_id": self._checkpoint_id(collection)})
+            self.checkpoints[collection] = doc.get('resumeToken') if doc else None
+            self._tasks.append(asyncio.create_task(self._tail(collection)))
+        self._tasks.append(asyncio.create_task(self._flush_loop()))
+        logger.info(f"Vectorization worker watching {self.collections}")
+
+    async def stop(self):
+        """Stop tailing and write out everything still pending"""
+        self.is_running = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.flush(force=True)
+        logger.info("Vectorization worker stopped")
+
+    def handle_event(self, collection: str, event: Dict[str, Any]):
+        """
+        Record a change event
+
+        Args:
+            collection: Watched collection the event came from
+            event: Change stream event
+        """
+        operation = event.get('operationType')
+        if operation not in ('insert', 'update', 'replace', 'delete'):
+            logger.warning(f"Ignoring {operation} event on {collection}")
+            return
+
+        now = time.time()
+        self._seq += 1
+        self.tokens[collection].append((self._seq, event['_id']))
+        self.stats['events'] += 1
+
+        cluster_time = event.get('clusterTime')
+        if cluster_time is not None:
+            self.lag[collection] = max(now - cluster_time.time, 0.0)
+            self.metrics.set_gauge('vectorization.lag_seconds', self.lag[collection], tags={'collection': collection})
+
+        # An update whose document was deleted before the lookup has no fullDocument
+        document = None if operation == 'delete' else event.get('fullDocument')
+        key = (collection, event['documentKey']['_id'])
+        change = self.pending.get(key)
+        if change is None:
+            self.pending[key] = PendingChange(collection, key[1], document, self._seq, self._seq, now, now)
+        else:
+            change.document = document
+            change.last_seq = self._seq
+            change.last_seen = now
+            # New content gets a fresh set of attempts
+            change.attempts = 0
+            change.retry_at = 0.0
+            self.stats['coalesced'] += 1
+
+    async def flush(self, force: bool = False) -> int:
+        """
+        Vectorize changes that are due
+
+        Args:
+            force: Flush every pending change regardless of debounce
+
+        Returns:
+            Number of changes written
+        """
+        async with self._flush_lock:
+            return await self._flush(force)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get worker statistics"""
+        return {
+            **self.stats,
+            'is_running': self.is_running,
+            'pending': len(self.pending),
+            'lag_seconds': dict(self.lag)
+        }
+
+    # Private methods
+
+    async def _flush(self, force: bool) -> int:
+        written = 0
+        # Each change is tried at most once per flush, so failures cannot spin the loop
+        attempted = set()
+        while True:
+            now = time.time()
+            due = [
+                change for key, change in self.pending.items()
+                if key not in attempted and now >= change.retry_at and (
+                    force
+                    or now - change.last_seen >= self.debounce_seconds
+                    or now - change.first_seen >= self.max_delay_seconds
+                )
+            ][:self.batch_size]
+            if not due:
+                break
+            attempted.update((change.collection, change.document_id) for change in due)
+
+            # Events arriving during the write leave their change pending
+            written_seqs = [change.last_seq for change in due]
+            try:
+                failed = await self._write_batch([PendingChange(**change.__dict__) for change in due])
+            except Exception as e:
+                # Left pending and retried on the next tick
+                logger.error(f"Error writing vectorization batch: {e}")
+                break
+
+            for change, seq in zip(due, written_seqs):
+                if change.last_seq != seq:
+                    continue
+                key = (change.collection, change.document_id)
+                if key in failed:
+                    await self._retry_later(change, failed[key])
+                    continue
+                self.pending.pop(key, None)
+                self.metrics.record_timer('vectorization.end_to_end', time.time() - change.first_seen)
+            written += len(due) - len(failed)
+
+        await self._advance_checkpoints()
+        return written
+
+    async def _tail(self, collection: str):
+        """Consume a collection's change stream, resuming after errors"""
+        backoff = 1.0
+        while self.is_running:
+            try:
+                async for event in self.db.watch(
+                    collection,
+                    [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}],
+                    resume_after=self.checkpoints.get(collection)
+                ):
+                    self.handle_event(collection, event)
+                    backoff = 1.0
+                    if len(self.pending) >= self.batch_size * 10:
+                        await self.flush()
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Change stream on {collection} failed, retrying in {backoff:.0f}s: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60.0)
+
+    async def _flush_loop(self):
+        interval = max(min(self.debounce_seconds, 1.0), 0.05)
+        while self.is_running:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error in vectorization flush: {e}")
+
+    async def _write_batch(self, changes: List[PendingChange]) -> Dict[Tuple[str, Any], str]:
+        """
+        Embed upserted documents and apply all changes with one bulk write
+
+        Returns:
+            Error per (collection, document ID) of changes that could not be embedded
+        """
+        operations = []
+        failed: Dict[Tuple[str, Any], str] = {}
+        deleted = [change for change in changes if change.document is None]
+        delete_filters = [
+            {
+                "sourceType": WATCHED_SOURCES[collection][0],
+                "sourceId": {"$in": [change.document_id for change in deleted if change.collection == collection]}
+            }
+            for collection in {change.collection for change in deleted}
+        ]
+        operations.extend(DeleteMany(filter_dict) for filter_dict in delete_filters)
+        # Vector documents about to be deleted, to drop from the in-process indexes afterwards
+        removed_ids = []
+        if delete_filters:
+            stale = await self.db.find_documents("vectordocuments", {"$or": delete_filters}, {"_id": 1})
+            removed_ids = [doc['_id'] for doc in stale]
+
+        upserts = [change for change in changes if change.document is not None]
+        written_ids = []  # documentIds of the vector documents upserted below
+        contents, contexts = [], []
+        for change in upserts:
+            source_type, extractor, importance = WATCHED_SOURCES[change.collection]
+            contents.append(await getattr(self.migrator, extractor)(change.document))
+            contexts.append({
+                'data_type': source_type,
+                'source_type': source_type,
+                'site_id': change.document.get('siteId'),
+                'importance': importance
+            })
+
+        if upserts:
+            result = await self.embedding_generator.generate_batch_embeddings(
+                contents, self.model, context=contexts
+            )
+            embeddings = result.embeddings or [None] * len(upserts)
+            quality_scores = result.quality_scores or [0.0] * len(upserts)
+            model_used = (result.metadata or {}).get('model_used', self.model.value)
+            errors = dict(zip(result.failed_indices or [], result.errors or []))
+            batch_error = "; ".join(str(e) for e in result.errors or []) or "Embedding failed"
+
+            for i, (change, content, embedding, quality) in enumerate(zip(upserts, contents, embeddings, quality_scores)):
+                if embedding is None:
+                    self.stats['failed'] += 1
+                    failed[(change.collection, change.document_id)] = errors.get(i, batch_error)
+                    continue
+                vector_doc = await self.migrator._create_vector_document(
+                    change.document,
+                    EmbeddingResult(success=True, embedding=embedding, model_used=model_used, quality_score=quality),
+                    WATCHED_SOURCES[change.collection][0],
+                    content
+                )
+                created_at = vector_doc.pop('createdAt')
+                written_ids.append(vector_doc['documentId'])
+                operations.append(UpdateOne(
+                    {"documentId": vector_doc['documentId']},
+                    {"$set": vector_doc, "$setOnInsert": {"createdAt": created_at}},
+                    upsert=True
+                ))
+
+        counts = await self.db.bulk_write("vectordocuments", operations)
+        self.stats['upserted'] += counts['upserted'] + counts['modified']
+        self.stats['deleted'] += counts['deleted']
+        self.metrics.increment_counter('vectorization.documents', len(changes) - len(failed))
+
+        # Keep the lexical index (and the compact vector index, for deletes) in step with the collection
+        for doc_id in removed_ids:
+            hybrid_search.index.remove(doc_id)
+            if two_stage_search.index is not None:
+                two_stage_search.index.remove(doc_id)
+        if written_ids:
+            hybrid_search.add_documents(await self.db.find_documents(
+                "vectordocuments",
+                {"documentId": {"$in": written_ids}},
+                {"_id": 1, "content": 1, hybrid_search.partition_field: 1}
+            ))
+        return failed
+
+    async def _retry_later(self, change: PendingChange, error: str):
+        """Back off a change that failed to embed, or dead-letter it after max_attempts"""
+        change.attempts += 1
+        if change.attempts >= self.max_attempts:
+            try:
+                await self.db.insert_document(DEAD_LETTER_COLLECTION, {
+                    'collection': change.collection,
+                    'documentId': change.document_id,
+                    'document': change.document,
+                    'attempts': change.attempts,
+                    'error': error,
+                    'failedAt': datetime.now()
+                })
+                self.pending.pop((change.collection, change.document_id), None)
+                self.stats['dead_lettered'] += 1
+                logger.error(f"Dead-lettered {change.collection}/{change.document_id} after {change.attempts} attempts: {error}")
+                return
+            except Exception as e:
+                logger.error(f"Error dead-lettering {change.collection}/{change.document_id}: {e}")
+
+        delay = min(max(self.debounce_seconds, 1.0) * 2 ** (change.attempts - 1), MAX_RETRY_DELAY_SECONDS)
+        change.retry_at = time.time() + delay
+        logger.warning(f"Vectorizing {change.collection}/{change.document_id} failed, retrying in {delay:.0f}s: {error}")
+
+    async def _advance_checkpoints(self):
+        """Checkpoint each collection's token just before its oldest unwritten change"""
+        oldest: Dict[str, int] = {}
+        for change in self.pending.values():
+            oldest[change.collection] = min(oldest.get(change.collection, change.first_seq), change.first_seq)
+
+        for collection, tokens in self.tokens.items():
+            limit = oldest.get(collection, self._seq + 1)
+            token = None
+            while tokens and tokens[0][0] < limit:
+                token = tokens.popleft()[1]
+            if token is None:
+                continue
+            self.checkpoints[collection] = token
+            await self.db.update_document(
+                CHECKPOINT_COLLECTION,
+                {"_id": self._checkpoint_id(collection)},
+                {"$set": {"resumeToken": token, "updatedAt": datetime.now()}},
+                upsert=True
+            )
+
+    @staticmethod
+    def _checkpoint_id(collection: str) -> str:
+        return f"vectorization:{collection}"
+
+# Global worker instance
+vectorization_worker = VectorizationWorker()
+
+# Convenience functions
+async def get_vectorization_worker() -> VectorizationWorker:
+    """Get vectorization worker instance"""
+    if vectorization_worker.db is None:
+        await vectorization_worker.initialize()
+    return vectorization_worker
@@ -8,7 +8,7 @@ import pandas as pd
 import numpy as np
 from unittest.mock import Mock, AsyncMock, patch
 from datetime import datetime, timedelta
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 
 from . import (
     TEST_CONFIG, 
@@ -75,6 +75,323 @@ def mock_database():
     db_mock.vector_search = AsyncMock(return_value=[])
     return db_mock
 
+class InMemoryDatabase:
+    """
+    Stand-in for DatabaseManager backed by in-memory collections. Filters,
+    updates, projections and sorts cover the subset of Mongo the services use;
+    every method is a mock, so tests can assert on calls or override results
+    and failures with side_effect / return_value.
+    """
+
+    def __init__(self):
+        self.is_connected = True
+        self.collections: Dict[str, Dict[Any, Dict[str, Any]]] = {}
+        self.change_streams: Dict[str, asyncio.Queue] = {}
+        # Bytes per document reported by get_collection_stats
+        self.document_size = 100
+        self._next_id = 0
+
+        for name in (
+            'find_documents', 'find_one_document', 'insert_document', 'insert_documents',
+            'update_document', 'update_documents', 'find_one_and_update', 'delete_document',
+            'delete_documents', 'count_documents', 'aggregate', 'bulk_write', 'create_index',
+            'get_collection_stats'
+        ):
+            setattr(self, name, AsyncMock(side_effect=getattr(self, f"_{name}")))
+        self.vector_search = AsyncMock(return_value=[])
+        for name in ('stream_documents', 'stream_aggregate', 'watch'):
+            setattr(self, name, Mock(side_effect=getattr(self, f"_{name}")))
+
+    def seed(self, collection_name: str, documents: List[Dict[str, Any]]):
+        """Insert documents directly, without recording a call"""
+        for document in documents:
+            self._store(collection_name, dict(document))
+
+    def documents(self, collection_name: str) -> List[Dict[str, Any]]:
+        """Current documents of a collection in insertion order"""
+        return list(self.collections.get(collection_name, {}).values())
+
+    async def emit(self, collection_name: str, operation: str, doc_id: Any, document: Optional[Dict[str, Any]] = None):
+        """Publish a change event to watchers of a collection and return its resume token"""
+        from bson import Timestamp
+        stream = self.change_streams.setdefault(collection_name, asyncio.Queue())
+        token = {'_data': f"{collection_name}-{stream.qsize()}-{doc_id}-{operation}"}
+        event = {
+            '_id': token,
+            'operationType': operation,
+            'documentKey': {'_id': doc_id},
+            'clusterTime': Timestamp(1700000000, 1)
+        }
+        if document is not None:
+            event['fullDocument'] = document
+        await stream.put(event)
+        return token
+
+    # Mongo semantics
+
+    @staticmethod
+    def _lookup(document: Dict[str, Any], path: str):
+        value = document
+        for part in path.split('.'):
+            if not isinstance(value, dict) or part not in value:
+                return _MISSING
+            value = value[part]
+        return value
+
+    @classmethod
+    def matches(cls, document: Dict[str, Any], filter_dict: Optional[Dict[str, Any]]) -> bool:
+        """Whether a document satisfies a filter"""
+        for key, condition in (filter_dict or {}).items():
+            if key == '$and':
+                if not all(cls.matches(document, part) for part in condition):
+                    return False
+                continue
+            if key == '$or':
+                if not any(cls.matches(document, part) for part in condition):
+                    return False
+                continue
+            value = cls._lookup(document, key)
+            operators = isinstance(condition, dict) and condition and all(op.startswith('$') for op in condition)
+            for op, argument in (condition.items() if operators else [('$eq', condition)]):
+                if not cls._compare(value, op, argument):
+                    return False
+        return True
+
+    @staticmethod
+    def _compare(value, op: str, argument) -> bool:
+        values = value if isinstance(value, list) else [value]
+        if op == '$exists':
+            return (value is not _MISSING) == bool(argument)
+        if op == '$eq':
+            return value == argument or argument in values
+        if op == '$ne':
+            return not (value == argument or argument in values)
+        if op == '$in':
+            return any(v in argument for v in values)
+        if op == '$nin':
+            return not any(v in argument for v in values)
+        if value is _MISSING or value is None:
+            return False
+        comparisons = {'$gt': lambda a, b: a > b, '$gte': lambda a, b: a >= b,
+                       '$lt': lambda a, b: a < b, '$lte': lambda a, b: a <= b}
+        if op in comparisons:
+            return comparisons[op](value, argument)
+        raise NotImplementedError(f"InMemoryDatabase does not support {op}")
+
+    @staticmethod
+    def _set_path(document: Dict[str, Any], path: str, value):
+        *parents, last = path.split('.')
+        for part in parents:
+            document = document.setdefault(part, {})
+        document[last] = value
+
+    @classmethod
+    def _apply_update(cls, document: Dict[str, Any], update_dict: Dict[str, Any], inserting: bool = False):
+        if not any(key.startswith('$') for key in update_dict):
+            kept_id = document.get('_id')
+            document.clear()
+            document.update(update_dict)
+            if kept_id is not None:
+                document.setdefault('_id', kept_id)
+            return
+        for op, fields in update_dict.items():
+            for path, value in fields.items():
+                if op == '$set' or (op == '$setOnInsert' and inserting):
+                    cls._set_path(document, path, value)
+                elif op == '$unset':
+                    *parents, last = path.split('.')
+                    parent = cls._lookup(document, '.'.join(parents)) if parents else document
+                    if isinstance(parent, dict):
+                        parent.pop(last, None)
+                elif op == '$inc':
+                    current = cls._lookup(document, path)
+                    cls._set_path(document, path, (0 if current is _MISSING else current) + value)
+                elif op == '$push':
+                    current = cls._lookup(document, path)
+                    items = value['$each'] if isinstance(value, dict) and '$each' in value else [value]
+                    cls._set_path(document, path, ([] if current is _MISSING else current) + list(items))
+                elif op != '$setOnInsert':
+                    raise NotImplementedError(f"InMemoryDatabase does not support {op}")
+
+    @classmethod
+    def _project(cls, document: Dict[str, Any], projection: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        if not projection:
+            return dict(document)
+        if all(not value for key, value in projection.items() if key != '_id'):
+            projected = dict(document)
+            for key, value in projection.items():
+                if not value:
+                    projected.pop(key, None)
+            return projected
+        projected = {'_id': document['_id']} if projection.get('_id', 1) and '_id' in document else {}
+        for key, value in projection.items():
+            if key != '_id' and value:
+                found = cls._lookup(document, key)
+                if found is not _MISSING:
+                    cls._set_path(projected, key, found)
+        return projected
+
+    @classmethod
+    def _sorted(cls, documents: List[Dict[str, Any]], sort) -> List[Dict[str, Any]]:
+        keys = list(sort.items()) if isinstance(sort, dict) else list(sort or [])
+        for field, direction in reversed(keys):
+            def sort_key(doc, field=field):
+                value = cls._lookup(doc, field)
+                return (0, 0) if value is _MISSING or value is None else (1, value)
+            documents = sorted(documents, key=sort_key, reverse=direction < 0)
+        return documents
+
+    def _store(self, collection_name: str, document: Dict[str, Any]) -> Any:
+        if '_id' not in document:
+            self._next_id += 1
+            document['_id'] = f"generated_{self._next_id}"
+        self.collections.setdefault(collection_name, {})[document['_id']] = document
+        return document['_id']
+
+    def _find(self, collection_name: str, filter_dict: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [doc for doc in self.documents(collection_name) if self.matches(doc, filter_dict)]
+
+    def _upsert(self, collection_name: str, filter_dict: Dict[str, Any], update_dict: Dict[str, Any]) -> Dict[str, Any]:
+        document = {key: value for key, value in filter_dict.items()
+                    if not key.startswith('$') and not isinstance(value, dict)}
+        self._apply_update(document, update_dict, inserting=True)
+        self._store(collection_name, document)
+        return document
+
+    # DatabaseManager methods
+
+    async def _find_documents(self, collection_name, filter_dict, projection=None, limit=None, skip=None, sort=None):
+        documents = self._sorted(self._find(collection_name, filter_dict), sort)[skip or 0:]
+        if limit:
+            documents = documents[:limit]
+        return [self._project(doc, projection) for doc in documents]
+
+    async def _stream_documents(self, collection_name, filter_dict, projection=None, batch_size=1000):
+        for document in self._find(collection_name, filter_dict):
+            yield self._project(document, projection)
+
+    async def _find_one_document(self, collection_name, filter_dict, projection=None):
+        found = self._find(collection_name, filter_dict)
+        return self._project(found[0], projection) if found else None
+
+    async def _insert_document(self, collection_name, document):
+        return self._store(collection_name, document)
+
+    async def _insert_documents(self, collection_name, documents):
+        return [self._store(collection_name, document) for document in documents]
+
+    async def _update_document(self, collection_name, filter_dict, update_dict, upsert=False):
+        found = self._find(collection_name, filter_dict)
+        if found:
+            self._apply_update(found[0], update_dict)
+            return 1
+        if upsert:
+            self._upsert(collection_name, filter_dict, update_dict)
+        return 0
+
+    async def _update_documents(self, collection_name, filter_dict, update_dict):
+        found = self._find(collection_name, filter_dict)
+        for document in found:
+            self._apply_update(document, update_dict)
+        return len(found)
+
+    async def _find_one_and_update(self, collection_name, filter_dict, update_dict, sort=None, projection=None):
+        found = self._sorted(self._find(collection_name, filter_dict), sort)
+        if not found:
+            return None
+        self._apply_update(found[0], update_dict)
+        return self._project(found[0], projection)
+
+    async def _delete_document(self, collection_name, filter_dict):
+        found = self._find(collection_name, filter_dict)[:1]
+        for document in found:
+            del self.collections[collection_name][document['_id']]
+        return len(found)
+
+    async def _delete_documents(self, collection_name, filter_dict):
+        found = self._find(collection_name, filter_dict)
+        for document in found:
+            del self.collections[collection_name][document['_id']]
+        return len(found)
+
+    async def _count_documents(self, collection_name, filter_dict):
+        return len(self._find(collection_name, filter_dict))
+
+    def _run_pipeline(self, collection_name, pipeline):
+        documents = self.documents(collection_name)
+        for stage in pipeline:
+            (name, argument), = stage.items()
+            if name == '$match':
+                documents = [doc for doc in documents if self.matches(doc, argument)]
+            elif name == '$sort':
+                documents = self._sorted(documents, argument)
+            elif name == '$project':
+                documents = [self._project(doc, argument) for doc in documents]
+            elif name == '$limit':
+                documents = documents[:argument]
+            elif name == '$skip':
+                documents = documents[argument:]
+            elif name == '$sample':
+                documents = documents[:argument['size']]
+            else:
+                raise NotImplementedError(f"InMemoryDatabase does not support {name}")
+        return [dict(doc) for doc in documents]
+
+    async def _aggregate(self, collection_name, pipeline):
+        return self._run_pipeline(collection_name, pipeline)
+
+    async def _stream_aggregate(self, collection_name, pipeline, batch_size=1000):
+        for document in self._run_pipeline(collection_name, pipeline):
+            yield document
+
+    async def _watch(self, collection_name, pipeline=None, resume_after=None, **kwargs):
+        stream = self.change_streams.setdefault(collection_name, asyncio.Queue())
+        while True:
+            yield await stream.get()
+
+    async def _bulk_write(self, collection_name, operations, ordered=False):
+        counts = {'inserted': 0, 'matched': 0, 'modified': 0, 'upserted': 0, 'deleted': 0}
+        for operation in operations:
+            kind = type(operation).__name__
+            if kind == 'InsertOne':
+                self._store(collection_name, operation._doc)
+                counts['inserted'] += 1
+            elif kind in ('UpdateOne', 'UpdateMany', 'ReplaceOne'):
+                found = self._find(collection_name, operation._filter)
+                if kind != 'UpdateMany':
+                    found = found[:1]
+                for document in found:
+                    self._apply_update(document, operation._doc)
+                counts['matched'] += len(found)
+                counts['modified'] += len(found)
+                if not found and operation._upsert:
+                    self._upsert(collection_name, operation._filter, operation._doc)
+                    counts['upserted'] += 1
+            elif kind in ('DeleteOne', 'DeleteMany'):
+                found = self._find(collection_name, operation._filter)
+                if kind == 'DeleteOne':
+                    found = found[:1]
+                for document in found:
+                    del self.collections[collection_name][document['_id']]
+                counts['deleted'] += len(found)
+            else:
+                raise NotImplementedError(f"InMemoryDatabase does not support {kind}")
+        return counts
+
+    async def _create_index(self, collection_name, keys, **kwargs):
+        return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+    async def _get_collection_stats(self, collection_name):
+        count = len(self.collections.get(collection_name, {}))
+        return {'count': count, 'size': count * self.document_size, 'totalIndexSize': 0}
+
+_MISSING = object()
+
+@pytest.fixture
+def memory_database():
+    """In-memory database fixture with Mongo-like collections"""
+    return InMemoryDatabase()
+
 @pytest.fixture
 def mock_gemini_embedding():
     """Mock Gemini embedding response"""
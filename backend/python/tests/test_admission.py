@@ -0,0 +1,161 @@
+"""
+Tests for admission control and request deadlines
+"""
+
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from utils.admission import (
+    AdmissionController, AdmissionMiddleware, AdmissionRejected, deadline_scope, max_time_ms, remaining_time
+)
+from utils.database import DatabaseManager
+
+
+def http_scope(path="/api/search", headers=None):
+    return {"type": "http", "method": "POST", "path": path, "headers": headers or []}
+
+
+class Client:
+    """ASGI client side: sends one request, optionally disconnects, records the response"""
+
+    def __init__(self, disconnect_after=None):
+        self.disconnect_after = disconnect_after
+        self.sent = []
+        self._requested = False
+
+    async def receive(self):
+        if not self._requested:
+            self._requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        if self.disconnect_after is None:
+            await asyncio.Event().wait()
+        await asyncio.sleep(self.disconnect_after)
+        return {"type": "http.disconnect"}
+
+    async def send(self, message):
+        self.sent.append(message)
+
+    @property
+    def status(self):
+        return next((m["status"] for m in self.sent if m["type"] == "http.response.start"), None)
+
+
+def slow_app(events):
+    async def app(scope, receive, send):
+        await receive()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            events.append("cancelled")
+            raise
+    return app
+
+
+class TestAdmissionControl:
+    """Test suite for admission control"""
+
+    def test_classify(self):
+        """Health checks and event streams are exempt; ML and bulk endpoints are heavy"""
+        controller = AdmissionController(max_concurrent_requests=4, heavy_concurrent_requests=1)
+
+        assert controller.classify("/health") is None
+        assert controller.classify("/api/analysis-jobs/abc/events") is None
+        assert controller.classify("/api/ml/predict") == "heavy"
+        assert controller.classify("/api/embeddings/batch/stream") == "heavy"
+        assert controller.classify("/api/search") == "default"
+
+    @pytest.mark.asyncio
+    async def test_bounded_queue_sheds(self):
+        """A full class queues up to queue_size, times out waiters with 503 and refuses the rest with 429"""
+        controller = AdmissionController(heavy_concurrent_requests=1, queue_size=1, max_wait=0.05)
+        release = asyncio.Event()
+
+        async def hold():
+            async with controller.admit("heavy"):
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(controller.admit("heavy").__aenter__())
+        await asyncio.sleep(0)
+
+        with pytest.raises(AdmissionRejected) as queue_full:
+            async with controller.admit("heavy"):
+                pass
+        with pytest.raises(AdmissionRejected) as timed_out:
+            await waiter
+
+        assert queue_full.value.status_code == 429
+        assert timed_out.value.status_code == 503
+        release.set()
+        await holder
+        stats = controller.get_stats()["heavy"]
+        assert stats["shed_queue_full"] == 1 and stats["shed_wait_timeout"] == 1
+        assert stats["active"] == 0 and stats["waiting"] == 0
+
+    @pytest.mark.asyncio
+    async def test_deadline_cancels_handler(self):
+        """A handler still running at the deadline is cancelled and the client gets 504"""
+        events = []
+        controller = AdmissionController(max_concurrent_requests=2)
+        middleware = AdmissionMiddleware(slow_app(events), controller=controller, request_timeout=0.05)
+        client = Client()
+
+        await asyncio.wait_for(middleware(http_scope(), client.receive, client.send), timeout=2)
+
+        assert events == ["cancelled"]
+        assert client.status == 504
+        assert controller.get_stats()["default"]["deadline_exceeded"] == 1
+        assert controller.get_stats()["default"]["active"] == 0
+
+    @pytest.mark.asyncio
+    async def test_disconnect_cancels_handler(self):
+        """A client that goes away cancels the work done on its behalf"""
+        events = []
+        controller = AdmissionController(max_concurrent_requests=2)
+        middleware = AdmissionMiddleware(slow_app(events), controller=controller, request_timeout=5)
+        client = Client(disconnect_after=0.02)
+
+        await asyncio.wait_for(middleware(http_scope(), client.receive, client.send), timeout=2)
+
+        assert events == ["cancelled"]
+        assert client.sent == []
+        assert controller.get_stats()["default"]["client_disconnected"] == 1
+
+    @pytest.mark.asyncio
+    async def test_deadline_propagation(self):
+        """Callers can shorten the deadline; it is visible to handlers and lifted once the response starts"""
+        seen = {}
+
+        async def app(scope, receive, send):
+            seen["max_time_ms"] = max_time_ms()
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            seen["after_start"] = remaining_time()
+            await send({"type": "http.response.body", "body": b"ok"})
+
+        middleware = AdmissionMiddleware(app, controller=AdmissionController(), request_timeout=300)
+        client = Client()
+        await middleware(http_scope(headers=[(b"x-request-timeout", b"2")]), client.receive, client.send)
+
+        assert client.status == 200
+        assert 0 < seen["max_time_ms"] <= 2000
+        assert seen["after_start"] is None
+        assert max_time_ms() is None
+
+    @pytest.mark.asyncio
+    async def test_database_reads_carry_max_time(self):
+        """Database reads under a deadline pass the remaining time as maxTimeMS"""
+        manager = DatabaseManager()
+        manager.is_connected = True
+        collection = MagicMock()
+        collection.count_documents = AsyncMock(return_value=3)
+        manager.db = {"sessions": collection}
+
+        with deadline_scope(1.5):
+            await manager.count_documents("sessions", {})
+        await manager.count_documents("sessions", {})
+
+        first, second = collection.count_documents.await_args_list
+        assert 0 < first.kwargs["maxTimeMS"] <= 1500
+        assert "maxTimeMS" not in second.kwargs
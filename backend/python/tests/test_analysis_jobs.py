@@ -0,0 +1,161 @@
+"""
+Tests for asynchronous analysis jobs
+"""
+
+import asyncio
+import pytest
+import numpy as np
+from unittest.mock import AsyncMock, MagicMock
+
+from services.analytics_ml import MLModelResult
+from services.analysis_jobs import JOB_COLLECTION, AnalysisJobManager
+
+
+def segmentation_result():
+    return MLModelResult(
+        success=True,
+        model_type="clustering",
+        prediction_type="user_segmentation",
+        predictions=np.array([0, 1, 1]),
+        metadata={'n_segments': np.int64(2)}
+    )
+
+
+@pytest.fixture
+def release():
+    return asyncio.Event()
+
+
+@pytest.fixture
+async def manager(release, memory_database):
+    async def segment_users(site_id, time_window, n_segments):
+        await release.wait()
+        return segmentation_result()
+
+    manager = AnalysisJobManager(workers=1, queue_size=2, result_ttl=60)
+    manager.db = memory_database
+    manager.data_processor = MagicMock()
+    manager.analytics_ml_service = MagicMock()
+    manager.analytics_ml_service.segment_users = AsyncMock(side_effect=segment_users)
+    await manager.start()
+    yield manager
+    release.set()
+    await manager.stop()
+
+
+async def wait_for_status(manager, job_id, status):
+    for _ in range(100):
+        job = await manager.get_job(job_id)
+        if job['status'] == status:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"job {job_id} never reached {status}")
+
+
+class TestAnalysisJobManager:
+    """Test suite for the analysis job manager"""
+
+    @pytest.mark.asyncio
+    async def test_result_is_stored_with_expiry(self, manager, release, memory_database):
+        """Submission returns at once; the JSON result is persisted with an expiry"""
+        job, deduplicated = await manager.submit("user_segmentation", "site_1", n_segments=2)
+        assert not deduplicated
+        assert (await manager.get_job(job.job_id))['status'] in ("queued", "running")
+
+        release.set()
+        state = await wait_for_status(manager, job.job_id, "completed")
+
+        assert state['result'] == {"success": True, "segments": [0, 1, 1], "metadata": {'n_segments': 2}}
+        stored = memory_database.collections[JOB_COLLECTION][job.job_id]
+        assert stored['expiresAt'] > stored['completedAt']
+        assert stored['params'] == {'time_window': 30, 'n_segments': 2}
+        assert manager.analytics_ml_service.segment_users.await_count == 1
+
+    @pytest.mark.asyncio
+    async def test_identical_submissions_share_the_running_job(self, manager, release):
+        """Same site, analysis and parameters attach to the active job; other parameters do not"""
+        first, _ = await manager.submit("user_segmentation", "site_1", time_window=7)
+        second, deduplicated = await manager.submit("user_segmentation", "site_1", time_window=7)
+        other, other_deduplicated = await manager.submit("user_segmentation", "site_1", time_window=14)
+
+        assert deduplicated and second is first
+        assert not other_deduplicated and other.job_id != first.job_id
+
+        release.set()
+        await wait_for_status(manager, other.job_id, "completed")
+        again, deduplicated = await manager.submit("user_segmentation", "site_1", time_window=7)
+        assert not deduplicated and again.job_id != first.job_id
+        assert manager.get_stats()['deduplicated'] == 1
+
+    @pytest.mark.asyncio
+    async def test_pool_and_queue_are_bounded(self, manager):
+        """One worker runs one job; once the queue is full submissions are rejected"""
+        running, _ = await manager.submit("user_segmentation", "site_1")
+        await wait_for_status(manager, running.job_id, "running")
+        queued = [(await manager.submit("user_segmentation", f"site_{i}"))[0] for i in (2, 3)]
+
+        assert all(job.status == "queued" for job in queued)
+        with pytest.raises(asyncio.QueueFull):
+            await manager.submit("user_segmentation", "site_4")
+        assert manager.get_stats()['running'] == 1
+
+    @pytest.mark.asyncio
+    async def test_concurrent_submissions_respect_dedup_and_capacity(self, manager, memory_database):
+        """Submissions racing through a slow insert neither duplicate jobs nor overfill the queue"""
+        running, _ = await manager.submit("user_segmentation", "site_1")
+        await wait_for_status(manager, running.job_id, "running")
+        insert = memory_database.insert_document.side_effect
+
+        async def slow_insert(collection_name, document):
+            await asyncio.sleep(0.01)
+            return await insert(collection_name, document)
+
+        memory_database.insert_document.side_effect = slow_insert
+        outcomes = await asyncio.gather(
+            manager.submit("user_segmentation", "site_2"),
+            manager.submit("user_segmentation", "site_2"),
+            manager.submit("user_segmentation", "site_3"),
+            manager.submit("user_segmentation", "site_4"),
+            return_exceptions=True
+        )
+
+        (first, _), (second, deduplicated) = outcomes[:2]
+        assert deduplicated and second is first
+        assert isinstance(outcomes[3], asyncio.QueueFull)
+        assert set(manager._jobs) == {running.job_id, first.job_id, outcomes[2][0].job_id}
+        assert len(memory_database.documents(JOB_COLLECTION)) == 3
+
+    @pytest.mark.asyncio
+    async def test_subscribe_follows_status_changes(self, manager, release):
+        """Subscribers receive each transition and finish with the final state"""
+        job, _ = await manager.submit("user_segmentation", "site_1")
+        statuses = []
+
+        async def follow():
+            async for state in manager.subscribe(job.job_id, heartbeat=5):
+                statuses.append(state['status'])
+
+        follower = asyncio.create_task(follow())
+        await wait_for_status(manager, job.job_id, "running")
+        release.set()
+        await asyncio.wait_for(follower, timeout=2)
+
+        assert statuses[-1] == "completed"
+        assert "running" in statuses
+
+    @pytest.mark.asyncio
+    async def test_failed_analysis_and_validation(self, manager):
+        """Unsuccessful results fail the job; unknown analyses and parameters are rejected"""
+        manager.analytics_ml_service.predict_user_churn = AsyncMock(return_value=MLModelResult(
+            success=False, model_type="classification", prediction_type="churn_prediction", error="No data"
+        ))
+
+        job, _ = await manager.submit("churn_prediction", "site_1", retrain_model=True)
+        state = await wait_for_status(manager, job.job_id, "failed")
+
+        assert state['error'] == "No data"
+        assert state['result'] is None
+        with pytest.raises(ValueError):
+            await manager.submit("forecast", "site_1")
+        with pytest.raises(ValueError):
+            await manager.submit("churn_prediction", "site_1", n_segments=3)
@@ -0,0 +1,120 @@
+"""
+Tests for adaptive numCandidates control
+"""
+
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from utils.candidate_budget import CandidateBudgetController
+from utils.database import DatabaseManager
+
+
+class TestCandidateBudgetController:
+    """Test suite for CandidateBudgetController"""
+
+    def test_query_classes(self):
+        """Selectivity and limit are bucketed so similar searches share a budget"""
+        controller = CandidateBudgetController()
+
+        assert controller.key("vector_index", 10, None, False) == ("vector_index", "broad", 16, False)
+        assert controller.key("vector_index", 16, 0.005, True) == ("vector_index", "0.1-1%", 16, True)
+        assert controller.key("vector_index", 3, 0.00001, False)[1] == "<0.1%"
+
+    def test_budget_grows_below_target_and_shrinks_above(self):
+        """Low recall raises the multiplier; sustained high recall lowers it again"""
+        controller = CandidateBudgetController(target_recall=0.9, initial_multiplier=10)
+        key = controller.key("vector_index", 10, 0.0001, False)
+        assert controller.num_candidates(key, 10) == 100
+
+        controller.record_recall(key, 0.5)
+        assert controller.num_candidates(key, 10) == 150
+
+        for _ in range(20):
+            controller.record_recall(key, 1.0)
+        assert controller.num_candidates(key, 10) < 100
+
+        stats = controller.get_stats()['classes'][0]
+        assert stats['calibrations'] == 21
+        assert stats['recall'] > 0.9
+
+    def test_budget_is_bounded(self):
+        """The budget never drops below limit * min_multiplier or exceeds max_candidates"""
+        controller = CandidateBudgetController(min_multiplier=2, max_candidates=300)
+        key = controller.key("vector_index", 10, None, False)
+
+        for _ in range(50):
+            controller.record_recall(key, 0.0)
+        assert controller.num_candidates(key, 10) == 300
+
+        for _ in range(200):
+            controller.record_recall(key, 1.0)
+        assert controller.num_candidates(key, 10) == 20
+
+
+class TestAdaptiveVectorSearch:
+    """Adaptive budgets in DatabaseManager.vector_search"""
+
+    @pytest.mark.asyncio
+    async def test_budget_and_calibration(self):
+        """The controller sets numCandidates and sampled searches feed back exact recall"""
+        manager = DatabaseManager()
+        manager.candidate_budget.calibration_rate = 1.0
+        approximate = [{'_id': i} for i in range(4)]
+        exact = [{'_id': i} for i in (0, 1, 2, 9)]
+
+        async def aggregate(collection_name, pipeline):
+            stage = pipeline[0]['$vectorSearch']
+            if stage.get('exact'):
+                return exact
+            return approximate
+
+        with patch.object(manager, 'aggregate', side_effect=aggregate) as aggregate_mock, \
+             patch.object(manager, '_filter_selectivity', AsyncMock(return_value=0.005)):
+            await manager.vector_search("vectordocuments", [0.1], "vector_index", limit=4, filters={'siteId': 's1'})
+            await asyncio.gather(*manager._calibration_tasks)
+
+        assert aggregate_mock.call_args_list[0][0][1][0]['$vectorSearch']['numCandidates'] == 40
+        classes = manager.candidate_budget.get_stats()['classes']
+        assert classes[0]['selectivity'] == "0.1-1%"
+        assert classes[0]['recall'] == pytest.approx(0.75)
+        assert classes[0]['num_candidates'] == 60
+
+    @pytest.mark.asyncio
+    async def test_calibration_applies_residual_filter(self):
+        """Recall is measured on what the search returns, i.e. after the residual $match"""
+        manager = DatabaseManager()
+        manager.candidate_budget.calibration_rate = 1.0
+
+        with patch.object(manager, 'aggregate', AsyncMock(return_value=[{'_id': 1}])) as aggregate_mock:
+            await manager.vector_search(
+                "vectordocuments", [0.1], "vector_index", limit=4, filters={'customTag': 'x'}
+            )
+            await asyncio.gather(*manager._calibration_tasks)
+
+        search, approximate, exact = (call[0][1] for call in aggregate_mock.call_args_list)
+        for pipeline in (approximate, exact):
+            assert pipeline[1] == {'$match': {'customTag': 'x'}}
+            assert pipeline[2] == {'$limit': 4}
+        assert approximate[0]['$vectorSearch']['limit'] == search[0]['$vectorSearch']['numCandidates']
+        assert exact[0]['$vectorSearch']['exact'] is True
+
+    @pytest.mark.asyncio
+    async def test_selectivity_count_is_bounded(self):
+        """The count stops at the broad boundary, carries a time limit and is cached; failures count as broad"""
+        manager = DatabaseManager()
+        manager.is_connected = True
+        collection = MagicMock()
+        collection.estimated_document_count = AsyncMock(return_value=1000)
+        collection.count_documents = AsyncMock(return_value=5)
+        manager.db = {"vectordocuments": collection}
+
+        assert await manager._filter_selectivity("vectordocuments", {'siteId': 's1'}) == 0.005
+        assert await manager._filter_selectivity("vectordocuments", {'siteId': 's1'}) == 0.005
+        collection.count_documents.assert_awaited_once()
+        kwargs = collection.count_documents.await_args.kwargs
+        assert kwargs['limit'] == 100
+        assert 0 < kwargs['maxTimeMS'] <= 100
+
+        collection.count_documents.side_effect = Exception("operation exceeded time limit")
+        assert await manager._filter_selectivity("vectordocuments", {'siteId': 's2'}) is None
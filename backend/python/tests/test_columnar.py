@@ -0,0 +1,88 @@
+"""
+Tests for Arrow IPC / Parquet responses
+"""
+
+import io
+import json
+import pytest
+import numpy as np
+import pandas as pd
+from bson import ObjectId
+from unittest.mock import patch
+
+pa = pytest.importorskip("pyarrow")
+import pyarrow.ipc
+import pyarrow.parquet as pq
+
+from utils.columnar import METADATA_KEY, ColumnarRequest, negotiate_columnar_format, render_table, to_arrow_table
+
+
+class TestColumnar:
+    """Test suite for columnar responses"""
+
+    def test_negotiation(self):
+        """The format parameter wins over Accept; JSON needs no columnar request"""
+        assert negotiate_columnar_format(None) is None
+        assert negotiate_columnar_format("application/vnd.apache.arrow.stream").format == "arrow"
+        assert negotiate_columnar_format("application/vnd.apache.arrow.stream", "json") is None
+        request = negotiate_columnar_format(None, "Parquet", "id, probability")
+        assert request == ColumnarRequest(format="parquet", columns=["id", "probability"])
+        with pytest.raises(ValueError):
+            negotiate_columnar_format(None, "csv")
+
+    def test_arrow_stream_round_trip(self):
+        """Prediction arrays become typed columns with metadata in the schema"""
+        predictions = np.array([0, 1, 1], dtype=np.int64)
+        probabilities = np.array([0.1, 0.7, 0.9])
+        response = render_table(
+            {"id": np.array(["u1", "u2", "u3"], dtype=object), "prediction": predictions, "probability": probabilities},
+            ColumnarRequest(format="arrow"),
+            {"churn_rate": np.float64(2 / 3), "total_users": np.int64(3)}
+        )
+
+        table = pa.ipc.open_stream(response.body).read_all()
+        assert response.media_type == "application/vnd.apache.arrow.stream"
+        assert response.headers['X-Row-Count'] == "3"
+        assert table.column_names == ["id", "prediction", "probability"]
+        assert table.schema.field("prediction").type == pa.int64()
+        assert table.column("probability").to_pylist() == [0.1, 0.7, 0.9]
+        assert json.loads(table.schema.metadata[METADATA_KEY])['total_users'] == 3
+
+    def test_parquet_with_column_selection(self):
+        """Only the selected columns are written, in the requested order"""
+        response = render_table(
+            {"id": ["u1", "u2"], "prediction": np.array([1, 0]), "probability": np.array([0.8, 0.2])},
+            ColumnarRequest(format="parquet", columns=["probability", "id"])
+        )
+
+        table = pq.read_table(io.BytesIO(response.body))
+        assert table.column_names == ["probability", "id"]
+        with pytest.raises(ValueError):
+            to_arrow_table({"id": ["u1"]}, ["missing"])
+
+    def test_dataframe_index_and_untypable_columns(self):
+        """A datetime index becomes a column and ObjectIds are sent as strings"""
+        ids = [ObjectId(), ObjectId()]
+        df = pd.DataFrame(
+            {"_id": ids, "pageViews": [3, 5]},
+            index=pd.DatetimeIndex(["2024-01-01", "2024-01-02"], name="timestamp")
+        )
+
+        table = to_arrow_table(df)
+
+        assert table.column_names == ["timestamp", "_id", "pageViews"]
+        assert table.column("_id").to_pylist() == [str(doc_id) for doc_id in ids]
+        assert pa.types.is_timestamp(table.schema.field("timestamp").type)
+
+    def test_missing_columns_are_dropped(self):
+        """Columns without values (e.g. no probabilities) are omitted"""
+        table = to_arrow_table({"id": None, "segment": np.array([0, 2, 1])})
+
+        assert table.column_names == ["segment"]
+
+    def test_pyarrow_is_only_needed_for_columnar_responses(self):
+        """JSON negotiation never imports pyarrow; columnar formats fail cleanly without it"""
+        with patch.dict("sys.modules", {"pyarrow": None}):
+            assert negotiate_columnar_format("application/json") is None
+            with pytest.raises(ValueError, match="pyarrow"):
+                negotiate_columnar_format(None, "arrow")
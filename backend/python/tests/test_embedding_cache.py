@@ -0,0 +1,251 @@
+"""
+Tests for the on-disk embedding cache and the tiered cache lookup
+"""
+
+import pytest
+import numpy as np
+from unittest.mock import AsyncMock
+
+from services.embedding_cache import DiskEmbeddingStore
+from utils.bloom_filter import BloomFilter
+from services.embedding_generator import EmbeddingGenerator, EmbeddingModel, EmbeddingResult
+
+
+class TestDiskEmbeddingStore:
+    """Test suite for DiskEmbeddingStore"""
+
+    @pytest.fixture
+    def store(self, tmp_path):
+        store = DiskEmbeddingStore(str(tmp_path / "cache"), max_entries=100, initial_capacity=4)
+        store.open()
+        yield store
+        store.close()
+
+    def test_put_and_get(self, store):
+        """Stored vectors round-trip through the memory-mapped slab"""
+        embedding = np.random.rand(8)
+        store.put("key", embedding, "gemini", 0.9, {"text_length": 12})
+
+        cached = store.get("key")
+
+        assert np.allclose(cached.embedding, embedding, atol=1e-6)
+        assert cached.model == "gemini"
+        assert cached.quality_score == pytest.approx(0.9)
+        assert cached.metadata == {"text_length": 12}
+        assert cached.hits == 1
+        assert store.get("missing") is None
+
+    def test_slab_grows_and_supports_multiple_dimensions(self, store):
+        """Slabs grow past their initial capacity and are kept per dimension"""
+        vectors = {f"k{i}": np.full(8, i, dtype=np.float32) for i in range(10)}
+        for key, vector in vectors.items():
+            store.put(key, vector)
+        store.put("wide", np.ones(16))
+
+        for key, vector in vectors.items():
+            assert np.array_equal(store.get(key).embedding, vector)
+        assert store.get("wide").embedding.shape == (16,)
+        assert store.count() == 11
+
+    def test_survives_restart(self, tmp_path):
+        """Entries and hit counts persist across close and reopen"""
+        path = str(tmp_path / "cache")
+        store = DiskEmbeddingStore(path)
+        store.open()
+        store.put("key", np.arange(4, dtype=np.float32))
+        store.get("key")
+        store.close()
+
+        reopened = DiskEmbeddingStore(path)
+        reopened.open()
+        entries = reopened.popular_entries(10)
+        count = reopened.count()
+        reopened.close()
+
+        assert count == 1
+
+        assert [entry.cache_key for entry in entries] == ["key"]
+        assert entries[0].hits == 1
+        assert np.array_equal(entries[0].embedding, np.arange(4, dtype=np.float32))
+
+    def test_eviction_demotes_least_hit_entries(self, tmp_path):
+        """When full, the least-hit entries are evicted and their slots reused"""
+        store = DiskEmbeddingStore(str(tmp_path / "cache"), max_entries=2, initial_capacity=2)
+        store.open()
+        store.put("hot", np.ones(4))
+        store.put("cold", np.zeros(4))
+        store.get("hot")
+
+        store.put("new", np.full(4, 2.0))
+
+        assert store.get("cold") is None
+        assert store.get("hot") is not None
+        assert store.get("new") is not None
+        assert store.slabs[4].shape[0] == 2
+        assert store.count() == 2
+        store.put("hot", np.ones(4))
+        assert store.count() == 2
+        store.close()
+
+
+class TestBloomFilter:
+    """Test suite for the Bloom filter negative cache"""
+
+    def test_no_false_negatives_and_bounded_false_positives(self):
+        """Every added key is found and the false positive rate stays near the target"""
+        bloom = BloomFilter(capacity=2000, error_rate=0.01)
+        bloom.add_many(f"key-{i}" for i in range(2000))
+
+        assert all(f"key-{i}" in bloom for i in range(2000))
+        false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+        assert false_positives / 10000 < 0.03
+        assert bloom.estimated_error_rate() < 0.02
+
+    def test_save_and_load(self, tmp_path):
+        """A persisted filter answers the same as the original"""
+        bloom = BloomFilter(capacity=100)
+        bloom.add_many(["a", "b", "c"])
+        bloom.source_version = "3:xyz"
+        path = str(tmp_path / "filter.npz")
+
+        bloom.save(path)
+        loaded = BloomFilter.load(path)
+
+        assert loaded.count == 3
+        assert loaded.source_version == "3:xyz"
+        assert all(key in loaded for key in ["a", "b", "c"])
+        assert np.array_equal(loaded.bits, bloom.bits)
+
+
+class TestTieredCache:
+    """Test suite for the memory, disk and database cache tiers"""
+
+    @pytest.fixture
+    def generator(self, tmp_path):
+        generator = EmbeddingGenerator()
+        generator.db = AsyncMock()
+        generator.db.find_one_document.return_value = None
+        generator.embedding_config = {
+            **generator.embedding_config,
+            'cache_dir': str(tmp_path / "cache"),
+            'cache_memory_size': 2,
+            'cache_prewarm': 2
+        }
+        generator._open_disk_cache()
+        yield generator
+        if generator.disk_cache:
+            generator.disk_cache.close()
+
+    def _result(self, value):
+        return EmbeddingResult(
+            success=True,
+            embedding=np.full(4, value, dtype=np.float32),
+            model_used=EmbeddingModel.GEMINI.value,
+            dimensions=4,
+            quality_score=0.9,
+            metadata={}
+        )
+
+    @pytest.mark.asyncio
+    async def test_memory_evictions_are_served_from_disk(self, generator):
+        """Entries dropped from the memory LRU are still found on disk without a database call"""
+        for i in range(3):
+            await generator._cache_embedding(f"text {i}", EmbeddingModel.GEMINI, self._result(i))
+
+        assert len(generator.cache) == 2
+        assert generator._generate_cache_key("text 0", EmbeddingModel.GEMINI) not in generator.cache
+
+        result = await generator._get_cached_embedding("text 0", EmbeddingModel.GEMINI)
+
+        assert np.array_equal(result.embedding, np.zeros(4))
+        assert generator.cache_stats['disk_hits'] == 1
+        generator.db.find_one_document.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_database_hits_are_promoted(self, generator):
+        """A database hit is written to disk so the next lookup avoids the database"""
+        generator.db.find_one_document.return_value = {
+            'embedding': [0.5] * 4, 'quality_score': 0.7, 'metadata': {}
+        }
+
+        await generator._get_cached_embedding("remote", EmbeddingModel.GEMINI)
+        generator.cache.clear()
+        result = await generator._get_cached_embedding("remote", EmbeddingModel.GEMINI)
+
+        assert result.quality_score == pytest.approx(0.7)
+        assert generator.db.find_one_document.call_count == 1
+        assert generator.get_cache_stats()['database_hits'] == 1
+        assert generator.get_cache_stats()['disk_hits'] == 1
+
+    @pytest.mark.asyncio
+    async def test_popular_entries_are_prewarmed(self, generator):
+        """Reopening the disk tier loads the most-hit entries into memory"""
+        for i in range(3):
+            await generator._cache_embedding(f"text {i}", EmbeddingModel.GEMINI, self._result(i))
+        generator.cache.clear()
+        await generator._get_cached_embedding("text 2", EmbeddingModel.GEMINI)
+        generator.disk_cache.close()
+        generator.cache.clear()
+
+        generator._open_disk_cache()
+
+        assert generator._generate_cache_key("text 2", EmbeddingModel.GEMINI) in generator.cache
+        assert len(generator.cache) == 2
+
+    @pytest.mark.asyncio
+    async def test_filter_skips_database_for_unknown_keys(self, generator):
+        """Keys absent from the filter never reach the database; inserted keys do"""
+        known_key = generator._generate_cache_key("known", EmbeddingModel.GEMINI)
+
+        async def stream_documents(collection_name, filter_dict, projection=None, batch_size=1000):
+            yield {'cache_key': known_key}
+
+        generator.db.count_documents.return_value = 1
+        generator.db.stream_documents = stream_documents
+        await generator.rebuild_cache_filter()
+
+        assert await generator._get_cached_embedding("new text", EmbeddingModel.GEMINI) is None
+        generator.db.find_one_document.assert_not_called()
+        assert generator.cache_stats['filter_skips'] == 1
+
+        await generator._get_cached_embedding("known", EmbeddingModel.GEMINI)
+        assert generator.db.find_one_document.call_count == 1
+
+        await generator._cache_embedding("new text", EmbeddingModel.GEMINI, self._result(1))
+        assert generator._generate_cache_key("new text", EmbeddingModel.GEMINI) in generator.known_cache_keys
+
+    @pytest.mark.asyncio
+    async def test_persisted_filter_is_reused_when_current(self, generator):
+        """A saved filter built from the same collection state is loaded instead of rescanning"""
+        bloom = BloomFilter(capacity=100)
+        bloom.add("persisted")
+        bloom.source_version = "1:abc"
+        bloom.save(str(generator._cache_filter_path()))
+        generator.db.count_documents.return_value = 1
+        generator.db.find_documents.return_value = [{'_id': "abc"}]
+        generator.db.stream_documents = None
+
+        await generator.rebuild_cache_filter()
+
+        assert "persisted" in generator.known_cache_keys
+
+    @pytest.mark.asyncio
+    async def test_persisted_filter_is_rebuilt_after_replaced_documents(self, generator):
+        """A delete balanced by an insert keeps the count but changes the newest _id"""
+        bloom = BloomFilter(capacity=100)
+        bloom.add("deleted")
+        bloom.source_version = "1:abc"
+        bloom.save(str(generator._cache_filter_path()))
+
+        async def stream_documents(collection_name, filter_dict, projection=None, batch_size=1000):
+            yield {'cache_key': "inserted"}
+
+        generator.db.count_documents.return_value = 1
+        generator.db.find_documents.return_value = [{'_id': "abd"}]
+        generator.db.stream_documents = stream_documents
+
+        await generator.rebuild_cache_filter()
+
+        assert "inserted" in generator.known_cache_keys
+        assert generator.known_cache_keys.source_version == "1:abd"
+        assert BloomFilter.load(str(generator._cache_filter_path())).source_version == "1:abd"
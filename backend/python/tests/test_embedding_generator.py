@@ -4,6 +4,7 @@ Comprehensive tests for Embedding Generator service
 
 import pytest
 import numpy as np
+from datetime import datetime, timedelta
 from unittest.mock import Mock, AsyncMock, patch
 from typing import List, Dict, Any
 
@@ -13,8 +14,10 @@ from services.embedding_generator import (
     EmbeddingResult, 
     BatchEmbeddingResult,
     EmbeddingQualityValidator,
-    EmbeddingOptimizer
+    EmbeddingOptimizer,
+    EmbeddingRouter
 )
+from services.text_chunker import TextChunker
 from . import SAMPLE_EMBEDDING_TEXT, SAMPLE_EMBEDDING_VECTOR
 
 
@@ -277,6 +280,20 @@ class TestEmbeddingGenerator:
         assert len(reduced_embeddings) == len(embeddings)
         assert all(len(emb) == 50 for emb in reduced_embeddings)
     
+    @pytest.mark.asyncio
+    async def test_reduce_dimensions_reuses_projector(self, embedding_generator, tmp_path):
+        """PCA reduction is fitted once and reused, so later calls are comparable"""
+        from services.projectors import ProjectorRegistry
+        
+        embedding_generator.projectors = ProjectorRegistry(str(tmp_path))
+        embeddings = [np.random.normal(0, 1, 100) for _ in range(60)]
+        
+        first = await embedding_generator.reduce_dimensions(embeddings, target_dimensions=20)
+        second = await embedding_generator.reduce_dimensions(embeddings[:3], target_dimensions=20)
+        
+        assert all(len(emb) == 20 for emb in first)
+        assert np.allclose(first[:3], second, atol=1e-5)
+    
     @pytest.mark.asyncio
     async def test_reduce_dimensions_umap(self, embedding_generator):
         """Test dimension reduction using UMAP"""
@@ -328,6 +345,66 @@ class TestEmbeddingGenerator:
         assert len(processed_with_context) > len(text)
         assert 'Data Type: analytics' in processed_with_context
     
+    @pytest.mark.asyncio
+    async def test_chunked_embeddings(self, embedding_generator):
+        """Long text is embedded per chunk, in order, with a weighted document embedding"""
+        embedding_generator.chunker = TextChunker(chunk_size=30, chunk_overlap=5)
+        text = " ".join(f"Sentence {i} about wallet activity." for i in range(40))
+        
+        async def fake_embedding(chunk_text):
+            return np.array([len(chunk_text), 1.0])
+        
+        with patch.object(embedding_generator, '_generate_gemini_embedding', side_effect=fake_embedding):
+            result = await embedding_generator.generate_chunked_embeddings(
+                text, EmbeddingModel.GEMINI, use_cache=False
+            )
+        
+        assert result.success is True
+        assert len(result.chunks) > 1
+        assert [embedding[0] for embedding in result.embeddings] == [len(chunk.text) for chunk in result.chunks]
+        assert np.isclose(np.linalg.norm(result.document_embedding), 1.0)
+        assert result.metadata['chunk_count'] == len(result.chunks)
+    
+    @pytest.mark.asyncio
+    async def test_finalize_batch_marks_invalid_embeddings(self, embedding_generator):
+        """Batch validation scores fresh embeddings and fails non-finite or zero rows"""
+        texts = ["Valid text for embedding", "Text with NaN", "Text with zeros"]
+        embeddings = [np.random.normal(0, 0.05, 1536), np.full(1536, np.nan), np.zeros(1536)]
+        results = [
+            EmbeddingResult(success=True, embedding=embedding, model_used="gemini", dimensions=1536)
+            for embedding in embeddings
+        ]
+        
+        await embedding_generator._finalize_batch(texts, EmbeddingModel.GEMINI, results, use_cache=False)
+        
+        assert results[0].success is True
+        assert results[0].quality_score > 0.5
+        assert results[1].success is False
+        assert results[2].success is False
+        assert "failed validation" in results[2].error
+    
+    @pytest.mark.asyncio
+    async def test_auto_model_splits_batch_by_route(self, embedding_generator):
+        """AUTO batches are embedded per routed model and merged in input order"""
+        embedding_generator.router.routes = {}
+        
+        async def route(text, context=None):
+            return EmbeddingModel.GEMINI if context['importance'] > 5 else EmbeddingModel.SENTENCE_TRANSFORMER
+        
+        with patch.object(embedding_generator, 'route_model', side_effect=route), \
+             patch.object(embedding_generator, '_generate_gemini_embedding', return_value=np.full(1536, 0.02)), \
+             patch.object(embedding_generator, '_generate_sentence_transformer_embedding', return_value=np.full(384, 0.05)):
+            result = await embedding_generator.generate_batch_embeddings(
+                ["a", "b", "c"],
+                EmbeddingModel.AUTO,
+                context=[{'importance': 9}, {'importance': 1}, {'importance': 9}],
+                use_cache=False
+            )
+        
+        assert result.success is True
+        assert [len(embedding) for embedding in result.embeddings] == [1536, 384, 1536]
+        assert result.metadata['models_used'] == {'gemini': 2, 'sentence_transformer': 1}
+    
     @pytest.mark.asyncio
     async def test_cache_functionality(self, embedding_generator):
         """Test embedding caching functionality"""
@@ -357,6 +434,45 @@ class TestEmbeddingGenerator:
         assert cached_result.success is True
         assert np.array_equal(cached_result.embedding, mock_result.embedding)
 
+    
+    @pytest.mark.asyncio
+    async def test_local_models_load_on_first_use(self, embedding_generator):
+        """Local models should not be loaded until they are needed"""
+        with patch('sentence_transformers.SentenceTransformer') as mock_st:
+            mock_st.return_value = Mock()
+            
+            assert EmbeddingModel.SENTENCE_TRANSFORMER not in embedding_generator.models
+            
+            first = embedding_generator._load_local_model(EmbeddingModel.SENTENCE_TRANSFORMER)
+            second = embedding_generator._load_local_model(EmbeddingModel.SENTENCE_TRANSFORMER)
+            
+            assert first is second
+            assert mock_st.call_count == 1
+    
+    @pytest.mark.asyncio
+    async def test_routed_batch_errors_follow_failed_indices(self, embedding_generator):
+        """Errors of a batch split across models line up with the sorted failed indices"""
+        async def per_model(texts, model, **kwargs):
+            if model == EmbeddingModel.GEMINI:
+                return BatchEmbeddingResult(success=False, errors=["gemini down"])
+            return BatchEmbeddingResult(
+                success=True,
+                embeddings=[np.ones(4), None],
+                failed_indices=[1],
+                quality_scores=[0.9, 0.0],
+                errors=["st failed"]
+            )
+        
+        routed = [EmbeddingModel.SENTENCE_TRANSFORMER, EmbeddingModel.GEMINI, EmbeddingModel.SENTENCE_TRANSFORMER]
+        with patch.object(embedding_generator, 'generate_batch_embeddings', side_effect=per_model):
+            result = await embedding_generator._generate_routed_batch(
+                ["a", "b", "c"], routed, None, None, use_cache=False, max_workers=1
+            )
+        
+        assert result.failed_indices == [1, 2]
+        assert result.errors == ["gemini down", "st failed"]
+        assert result.embeddings[0] is not None
+
 
 class TestEmbeddingQualityValidator:
     """Test suite for EmbeddingQualityValidator class"""
@@ -438,6 +554,108 @@ class TestEmbeddingQualityValidator:
         
         assert quality_score < 0.8  # Should be penalized for zero variance
 
+    
+    @pytest.mark.asyncio
+    async def test_validate_batch_matches_single_validation(self, validator):
+        """Batch scores equal per-vector scores and flag unusable rows"""
+        embeddings = np.vstack([
+            np.random.normal(0, 0.05, 1536),
+            np.full(1536, 0.5),
+            np.full(1536, np.inf),
+            np.zeros(1536)
+        ])
+        texts = ["A reasonably long text", "Short", "Another long enough text", "Zero vector text"]
+        
+        scores, failures = validator.validate_batch(embeddings, texts, EmbeddingModel.GEMINI)
+        
+        for embedding, text, score in zip(embeddings, texts, scores):
+            assert score == pytest.approx(
+                await validator.validate_embedding(embedding, text, EmbeddingModel.GEMINI)
+            )
+        assert failures.tolist() == [False, False, True, True]
+
+
+class TestEmbeddingRouter:
+    """Test suite for EmbeddingRouter"""
+    
+    @pytest.fixture
+    def router(self, mock_database):
+        """Create EmbeddingRouter with a quota on the premium model"""
+        router = EmbeddingRouter({
+            'routing_premium_model': 'gemini',
+            'routing_economy_model': 'sentence_transformer',
+            'routing_importance_threshold': 7,
+            'routing_max_economy_tokens': 50,
+            'routing_max_queue_depth': 4,
+            'routing_min_quota_headroom': 0.5,
+            'provider_quotas': {'gemini': 4}
+        })
+        router.db = mock_database
+        return router
+    
+    async def route(self, router, text, context, in_flight=None):
+        return await router.route(
+            text, context, token_count=lambda t: len(t.split()),
+            in_flight=in_flight or {}, available=lambda model: True
+        )
+    
+    @pytest.mark.asyncio
+    async def test_routes_by_importance_and_length(self, router):
+        """Important or long content gets the premium model, the rest the economy model"""
+        assert await self.route(router, "Tx summary", {'source_type': 'transaction', 'importance': 3}) \
+            == EmbeddingModel.SENTENCE_TRANSFORMER
+        assert await self.route(router, "Session", {'source_type': 'session', 'importance': 8}) \
+            == EmbeddingModel.GEMINI
+        assert await self.route(router, "word " * 60, {'source_type': 'analytics', 'importance': 1}) \
+            == EmbeddingModel.GEMINI
+    
+    @pytest.mark.asyncio
+    async def test_space_stays_pinned(self, router, mock_database):
+        """The first decision for a space is recorded and reused for every later item"""
+        first = await self.route(router, "Tx", {'source_type': 'transaction', 'importance': 2})
+        second = await self.route(router, "word " * 60, {'source_type': 'transaction', 'importance': 10})
+        
+        assert first == second == EmbeddingModel.SENTENCE_TRANSFORMER
+        update = mock_database.update_document.call_args
+        assert update[0][1] == {'space': 'transaction'}
+        assert update[0][2]['$setOnInsert']['model'] == 'sentence_transformer'
+        assert update[1]['upsert'] is True
+        assert router.get_stats()['routes']['transaction']['routed_items'] == 2
+    
+    @pytest.mark.asyncio
+    async def test_pin_from_another_process_wins(self, router, mock_database):
+        """A space already pinned in the database is not re-decided"""
+        mock_database.find_one_document.return_value = {'space': 'session', 'model': 'gemini', 'reason': 'high_importance'}
+        
+        assert await self.route(router, "Tx", {'source_type': 'session', 'importance': 1}) == EmbeddingModel.GEMINI
+        mock_database.update_document.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_low_quota_and_full_queue_use_economy(self, router):
+        """Premium content goes to the economy model without quota headroom or queue space"""
+        for _ in range(3):
+            router.record_request(EmbeddingModel.GEMINI)
+        assert await self.route(router, "Important", {'vector_space': 'a', 'importance': 9}) \
+            == EmbeddingModel.SENTENCE_TRANSFORMER
+        assert router.routes['a'].reason == 'premium_quota_low'
+        
+        router.request_times[EmbeddingModel.GEMINI].clear()
+        assert await self.route(
+            router, "Important", {'vector_space': 'b', 'importance': 9}, in_flight={EmbeddingModel.GEMINI: 4}
+        ) == EmbeddingModel.SENTENCE_TRANSFORMER
+        assert router.routes['b'].reason == 'premium_queue_full'
+    
+    @pytest.mark.asyncio
+    async def test_load_driven_route_is_pinned(self, router, mock_database):
+        """A decision forced by load is persisted, and the space keeps its model once the load is gone"""
+        assert await self.route(
+            router, "Important", {'vector_space': 'a', 'importance': 9}, in_flight={EmbeddingModel.GEMINI: 4}
+        ) == EmbeddingModel.SENTENCE_TRANSFORMER
+        assert mock_database.update_document.call_args[0][2]['$setOnInsert']['model'] == 'sentence_transformer'
+        
+        models = {await self.route(router, "Important", {'vector_space': 'a', 'importance': 9}) for _ in range(3)}
+        assert models == {EmbeddingModel.SENTENCE_TRANSFORMER}
+        assert mock_database.update_document.call_count == 1
 
 class TestEmbeddingOptimizer:
     """Test suite for EmbeddingOptimizer class"""
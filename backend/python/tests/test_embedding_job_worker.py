@@ -0,0 +1,187 @@
+"""
+Tests for the embeddingjobs queue worker
+"""
+
+import asyncio
+import pytest
+import numpy as np
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock
+
+from services.embedding_generator import BatchEmbeddingResult, EmbeddingModel
+from services.vector_migrator import MigrationConfig, VectorMigrator
+from services.embedding_job_worker import JOB_COLLECTION, STATS_COLLECTION, EmbeddingJobWorker
+
+
+def seed(db, jobs, source_ids=()):
+    db.seed(JOB_COLLECTION, jobs)
+    db.seed("sessions", [
+        {'_id': doc_id, 'siteId': "site1", 'pagesViewed': 3, 'duration': 120} for doc_id in source_ids
+    ])
+
+
+def stored_job(db, job_id):
+    return db.collections[JOB_COLLECTION][job_id]
+
+
+def bulk_writes(db, collection_name):
+    return [call.args[1] for call in db.bulk_write.await_args_list if call.args[0] == collection_name]
+
+
+def make_job(job_id, source_ids, priority=5, minutes_ago=1, **fields):
+    job = {
+        '_id': job_id,
+        'jobId': job_id,
+        'sourceType': "session",
+        'sourceIds': source_ids,
+        'teamId': "team1",
+        'priority': priority,
+        'status': "pending",
+        'scheduledFor': datetime.now() - timedelta(minutes=minutes_ago),
+        'config': {'embeddingModel': "gemini-embedding"},
+        'retryConfig': {'maxRetries': 3, 'retryCount': 0, 'backoffMultiplier': 2}
+    }
+    job.update(fields)
+    return job
+
+
+def make_worker(db, fail=False):
+    worker = EmbeddingJobWorker(concurrency=2)
+    worker.db = db
+    worker.provider_batch_size = 4
+    worker.poll_interval = 0.01
+    worker.embedding_generator = MagicMock()
+    worker.embedding_generator.generate_batch_embeddings = AsyncMock(
+        side_effect=lambda texts, model, batch_size=None, context=None: BatchEmbeddingResult(
+            success=not fail,
+            embeddings=[None if fail else np.full(4, 0.5) for _ in texts],
+            quality_scores=[0.9] * len(texts),
+            metadata={'model_used': model.value}
+        )
+    )
+    worker.migrator = VectorMigrator(MigrationConfig(near_duplicate_threshold=None))
+    return worker
+
+
+class TestEmbeddingJobWorker:
+    """Test suite for EmbeddingJobWorker"""
+
+    @pytest.mark.asyncio
+    async def test_claims_by_priority_and_reclaims_expired_leases(self, memory_database):
+        """Jobs are claimed highest priority first, and expired leases become claimable"""
+        seed(memory_database, [
+            make_job("low", ["s1"], priority=2, minutes_ago=10),
+            make_job("high", ["s2"], priority=9),
+            make_job("later", ["s3"], priority=10, minutes_ago=-10),
+            make_job("stale", ["s4"], priority=1, status="processing", workerId="dead",
+                     leaseExpiresAt=datetime.now() - timedelta(seconds=1))
+        ], ["s1", "s2", "s3", "s4"])
+        worker = make_worker(memory_database)
+
+        claimed = await worker.claim_jobs("w1", 10)
+
+        assert [job['_id'] for job in claimed] == ["high", "low", "stale"]
+        assert all(stored_job(memory_database, job['_id'])['workerId'] == "w1" for job in claimed)
+        assert stored_job(memory_database, "stale")['leaseExpiresAt'] > datetime.now()
+        assert stored_job(memory_database, "later")['status'] == "pending"
+
+    @pytest.mark.asyncio
+    async def test_concurrent_consumers_never_share_a_job(self, memory_database):
+        """Each job is claimed by exactly one consumer"""
+        seed(memory_database, [make_job(f"j{i}", [f"s{i}"], priority=i % 10) for i in range(30)])
+        worker = make_worker(memory_database)
+
+        claims = await asyncio.gather(*(worker.claim_jobs(f"w{slot}", 5) for slot in range(4)))
+
+        claimed_ids = [job['_id'] for jobs in claims for job in jobs]
+        assert len(claimed_ids) == len(set(claimed_ids)) == 20
+
+    @pytest.mark.asyncio
+    async def test_records_are_batched_across_jobs(self, memory_database):
+        """Records of several jobs share provider batches and one vector bulk write"""
+        seed(
+            memory_database,
+            [make_job("a", ["s1", "s2", "s3"]), make_job("b", ["s4", "s5", "missing"])],
+            ["s1", "s2", "s3", "s4", "s5"]
+        )
+        memory_database.seed("vectordocuments", [{'documentId': "session_s1", 'content': "old"}])
+        worker = make_worker(memory_database)
+
+        jobs = await worker.claim_jobs("w1", 10)
+        await worker.process_jobs(jobs, "w1")
+
+        calls = worker.embedding_generator.generate_batch_embeddings.await_args_list
+        assert [len(call.args[0]) for call in calls] == [4, 1]
+        vector_writes = bulk_writes(memory_database, "vectordocuments")
+        assert len(vector_writes) == 1 and len(vector_writes[0]) == 5
+        assert len(memory_database.documents("vectordocuments")) == 5
+
+        assert stored_job(memory_database, "a")['status'] == "completed"
+        assert stored_job(memory_database, "a")['results']['documentsCreated'] == 2
+        assert stored_job(memory_database, "a")['results']['documentsUpdated'] == 1
+        assert stored_job(memory_database, "b")['results']['documentsSkipped'] == 1
+        assert stored_job(memory_database, "b")['progress']['percentage'] == 100
+        assert 'leaseExpiresAt' not in stored_job(memory_database, "a")
+
+        stats_ops = bulk_writes(memory_database, STATS_COLLECTION)[0]
+        periods = {(op._filter['period'], op._filter['teamId']) for op in stats_ops}
+        assert periods == {('hourly', "team1"), ('hourly', None), ('daily', "team1"), ('daily', None)}
+        global_hourly = next(
+            doc for doc in memory_database.documents(STATS_COLLECTION)
+            if doc['period'] == 'hourly' and doc['teamId'] is None
+        )
+        assert global_hourly['models']['gemini']['documents'] == 5
+        assert global_hourly['models']['gemini']['apiCalls'] == 2
+        assert global_hourly['processing']['jobsCompleted'] == 2
+        assert worker.get_stats()['documents'] == 5
+
+    @pytest.mark.asyncio
+    async def test_failed_jobs_are_retried_then_failed(self, memory_database):
+        """A job with no successful embeddings backs off, and fails after its last retry"""
+        seed(
+            memory_database,
+            [make_job("a", ["s1"]),
+             make_job("b", ["s2"], retryConfig={'maxRetries': 1, 'retryCount': 1, 'backoffMultiplier': 2})],
+            ["s1", "s2"]
+        )
+        worker = make_worker(memory_database, fail=True)
+
+        jobs = await worker.claim_jobs("w1", 10)
+        await worker.process_jobs(jobs, "w1")
+
+        retried = stored_job(memory_database, "a")
+        assert retried['status'] == "retrying"
+        assert retried['retryConfig']['retryCount'] == 1
+        assert retried['retryConfig']['nextRetryAt'] > datetime.now() + timedelta(seconds=100)
+        assert retried['errors']
+        assert stored_job(memory_database, "b")['status'] == "failed"
+        assert worker.stats['retried'] == 1 and worker.stats['failed'] == 1
+
+    @pytest.mark.asyncio
+    async def test_lost_lease_is_not_overwritten(self, memory_database):
+        """Results are not recorded on a job another consumer has since claimed"""
+        seed(memory_database, [make_job("a", ["s1"])], ["s1"])
+        worker = make_worker(memory_database)
+
+        jobs = await worker.claim_jobs("w1", 1)
+        stored_job(memory_database, "a")['workerId'] = "w2"
+        await worker.process_jobs(jobs, "w1")
+
+        assert stored_job(memory_database, "a")['status'] == "processing"
+
+    @pytest.mark.asyncio
+    async def test_consumers_drain_the_queue(self, memory_database):
+        """Started consumers process every runnable job"""
+        seed(memory_database, [make_job(f"j{i}", [f"s{i}"]) for i in range(6)], [f"s{i}" for i in range(6)])
+        worker = make_worker(memory_database)
+        worker.claim_batch_size = 2
+
+        await worker.start()
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if all(job['status'] == "completed" for job in memory_database.documents(JOB_COLLECTION)):
+                break
+        await worker.stop()
+
+        assert all(job['status'] == "completed" for job in memory_database.documents(JOB_COLLECTION))
+        assert worker.get_stats()['consumers'] == 0
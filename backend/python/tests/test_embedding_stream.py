@@ -0,0 +1,93 @@
+"""
+Tests for streaming NDJSON batch embeddings
+"""
+
+import json
+import pytest
+import numpy as np
+from unittest.mock import AsyncMock, MagicMock
+
+from services.embedding_generator import BatchEmbeddingResult, EmbeddingModel
+from services.embedding_stream import iter_ndjson_texts, spool_ndjson, stream_batch_embeddings
+
+
+async def body(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+def make_generator(fail_texts=()):
+    def embed(texts, model, batch_size=None, use_cache=True):
+        failed = [i for i, text in enumerate(texts) if text in fail_texts]
+        return BatchEmbeddingResult(
+            success=len(failed) < len(texts),
+            embeddings=[None if i in failed else np.full(3, float(len(texts[i]))) for i in range(len(texts))],
+            failed_indices=failed,
+            total_processed=len(texts),
+            errors=[f"provider error for {texts[i]}" for i in failed]
+        )
+
+    generator = MagicMock()
+    generator.generate_batch_embeddings = AsyncMock(side_effect=embed)
+    return generator
+
+
+async def collect(stream):
+    return [json.loads(line) async for line in stream]
+
+
+class TestEmbeddingStream:
+    """Test suite for the NDJSON embedding stream"""
+
+    @pytest.mark.asyncio
+    async def test_spool_moves_to_disk_past_threshold(self):
+        """Bodies larger than the threshold are spooled to a temporary file"""
+        small = await spool_ndjson(body(b'"a"\n'), max_memory_bytes=64)
+        large = await spool_ndjson(body(b'"abc"\n' * 10, b'"abc"\n' * 10), max_memory_bytes=64)
+
+        assert not small._rolled
+        assert large._rolled
+        assert len(list(iter_ndjson_texts(large))) == 20
+        small.close()
+        large.close()
+
+    @pytest.mark.asyncio
+    async def test_parses_strings_objects_and_invalid_lines(self):
+        """Lines may be strings or {"text": ...}; bad lines are reported, blank lines skipped"""
+        spool = await spool_ndjson(body(b'"one"\n{"text": "two", "id": 7}\n\nnot json\n{"text": ""}\n'), 1024)
+
+        entries = list(iter_ndjson_texts(spool))
+
+        assert [(index, text) for index, text, _ in entries] == [(0, "one"), (1, "two"), (2, None), (3, None)]
+        assert entries[2][2].startswith("Invalid line")
+        spool.close()
+
+    @pytest.mark.asyncio
+    async def test_results_stream_per_batch_in_input_order(self):
+        """Each batch is embedded separately and every input line gets a result line"""
+        lines = b"".join(json.dumps(text).encode() + b"\n" for text in ["a", "bb", "bad", "dddd", "eeeee"])
+        spool = await spool_ndjson(body(lines, b"[1]\n"), 1024)
+        generator = make_generator(fail_texts={"bad"})
+
+        results = await collect(stream_batch_embeddings(generator, spool, EmbeddingModel.GEMINI, batch_size=2))
+
+        calls = generator.generate_batch_embeddings.await_args_list
+        assert [call.args[0] for call in calls] == [["a", "bb"], ["bad", "dddd"], ["eeeee"]]
+        assert [result.get('index') for result in results[:-1]] == [0, 1, 2, 3, 4, 5]
+        assert results[1] == {'index': 1, 'status': "ok", 'embedding': [2.0, 2.0, 2.0]}
+        assert results[2] == {'index': 2, 'status': "failed", 'error': "provider error for bad"}
+        assert results[5]['status'] == "invalid"
+        assert results[-1]['status'] == "done"
+        assert results[-1]['successful_count'] == 4 and results[-1]['failed_count'] == 2
+        assert spool.closed
+
+    @pytest.mark.asyncio
+    async def test_spool_is_closed_when_client_disconnects(self):
+        """Abandoning the stream part-way releases the spool"""
+        spool = await spool_ndjson(body(b'"a"\n"b"\n"c"\n'), 1024)
+        stream = stream_batch_embeddings(make_generator(), spool, EmbeddingModel.GEMINI, batch_size=1)
+
+        await stream.__anext__()
+        await stream.aclose()
+
+        assert spool.closed
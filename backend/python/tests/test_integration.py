@@ -2,9 +2,12 @@
 Comprehensive integration tests for API endpoints and service communication
 """
 
+import io
 import pytest
 import json
 import asyncio
+import numpy as np
+import pandas as pd
 from unittest.mock import Mock, AsyncMock, patch
 from fastapi.testclient import TestClient
 from datetime import datetime, timedelta
@@ -489,7 +492,97 @@ class TestAPIEndpoints:
         assert data["segments"] == [0, 1, 2, 0, 1, 2]
         assert data["metadata"]["n_segments"] == 3
         assert len(data["metadata"]["segments"]) == 3
-    
+
+    def test_ml_predict_endpoint_arrow(self, client, mock_services):
+        """Test ML prediction endpoint with an Arrow IPC response"""
+        pa = pytest.importorskip("pyarrow")
+        import pyarrow.ipc
+
+        mock_services['analytics_ml'].predict_user_churn.return_value = MLModelResult(
+            success=True,
+            model_type="classification",
+            prediction_type="churn_prediction",
+            predictions=np.array([0, 1, 0]),
+            probabilities=np.array([0.2, 0.8, 0.3]),
+            row_ids=np.array(["u1", "u2", "u3"], dtype=object),
+            metadata={'total_users': 3, 'churn_rate': np.float64(1 / 3)}
+        )
+
+        response = client.post(
+            "/api/ml/predict?columns=id,probability",
+            json={"site_id": "test_site_123", "prediction_type": "churn"},
+            headers={"Accept": "application/vnd.apache.arrow.stream"}
+        )
+        assert response.status_code == 200
+
+        table = pa.ipc.open_stream(response.content).read_all()
+        assert table.column_names == ["id", "probability"]
+        assert table.column("id").to_pylist() == ["u1", "u2", "u3"]
+        assert json.loads(table.schema.metadata[b"cryptique.metadata"])["metadata"]["total_users"] == 3
+
+    def test_time_series_endpoint_parquet(self, client, mock_services):
+        """Test time series endpoint with a Parquet response of the series rows"""
+        pytest.importorskip("pyarrow")
+        import pyarrow.parquet as pq
+
+        series = pd.DataFrame(
+            {"pageViews": [10, 12, 9]},
+            index=pd.DatetimeIndex(["2024-01-01", "2024-01-02", "2024-01-03"], name="timestamp")
+        )
+        mock_services['data_processor'].perform_time_series_analysis.return_value = ProcessingResult(
+            success=True,
+            data=series,
+            metadata={'trends': {'direction': 'flat'}}
+        )
+
+        response = client.post("/api/process/time-series?site_id=test_site_123&metric=pageViews&format=parquet")
+        assert response.status_code == 200
+
+        table = pq.read_table(io.BytesIO(response.content))
+        assert table.column_names == ["timestamp", "pageViews"]
+        assert table.column("pageViews").to_pylist() == [10, 12, 9]
+
+    def test_columnar_unknown_column(self, client, mock_services):
+        """Test that selecting an unknown column is a client error"""
+        mock_services['analytics_ml'].segment_users.return_value = MLModelResult(
+            success=True,
+            model_type="clustering",
+            prediction_type="user_segmentation",
+            predictions=np.array([0, 1]),
+            metadata={}
+        )
+
+        response = client.post("/api/ml/segment-users?site_id=test_site_123&format=arrow&columns=missing")
+        assert response.status_code == 400
+
+    def test_fit_projector_rejects_unsafe_names(self, client):
+        """Test that projector names which could escape the projector directory are rejected"""
+        response = client.post("/api/projectors/fit", json={"name": "../../etc/x", "target_dimensions": 8})
+        assert response.status_code == 422
+
+    def test_analysis_job_endpoints(self, client):
+        """Test analysis job submission and polling"""
+        job = Mock(job_id="job_1", status="queued")
+        with patch('api.main.analysis_job_manager') as mock_jobs:
+            mock_jobs.submit = AsyncMock(return_value=(job, True))
+            mock_jobs.get_job = AsyncMock(side_effect=lambda job_id: (
+                {"job_id": job_id, "status": "completed", "result": {"success": True}} if job_id == "job_1" else None
+            ))
+
+            response = client.post("/api/analysis-jobs", json={
+                "analysis": "user_segmentation", "site_id": "test_site_123", "n_segments": 4
+            })
+            assert response.status_code == 202
+            assert response.json()["deduplicated"] is True
+            mock_jobs.submit.assert_awaited_once_with("user_segmentation", "test_site_123", time_window=30, n_segments=4)
+
+            assert client.get("/api/analysis-jobs/job_1").json()["result"] == {"success": True}
+            assert client.get("/api/analysis-jobs/unknown").status_code == 404
+
+            mock_jobs.submit.side_effect = asyncio.QueueFull("Analysis job queue is full")
+            response = client.post("/api/analysis-jobs", json={"analysis": "user_journeys", "site_id": "test_site_123"})
+            assert response.status_code == 503
+
     def test_ml_insights_endpoint(self, client, mock_services):
         """Test ML insights endpoint"""
         # Mock successful insights generation
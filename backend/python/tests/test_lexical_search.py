@@ -0,0 +1,86 @@
+"""
+Tests for the BM25 index and hybrid lexical + vector search
+"""
+
+import pytest
+import numpy as np
+from unittest.mock import AsyncMock, patch
+
+from services.lexical_search import BM25Index, HybridSearch, reciprocal_rank_fusion, tokenize
+
+
+DOCS = [
+    ("a", "wallet 0xabc123 swapped tokens on uniswap", "site1"),
+    ("b", "user session from twitter campaign", "site1"),
+    ("c", "wallet 0xdef456 bridged tokens", "site2"),
+    ("d", "pageview from utm_source newsletter", "site2"),
+]
+
+
+class TestBM25Index:
+    """Test suite for BM25Index"""
+
+    def test_tokenize_keeps_identifiers(self):
+        """Hex addresses and snake_case parameters stay single tokens"""
+        assert tokenize("Wallet 0xABC123, utm_source=X") == ["wallet", "0xabc123", "utm_source", "x"]
+
+    @pytest.mark.parametrize("seal_threshold", [1, 3, 100])
+    def test_exact_identifier_ranks_first(self, seal_threshold):
+        """Scores are the same whether postings are sealed or still buffered"""
+        index = BM25Index(seal_threshold=seal_threshold)
+        index.add_many(DOCS)
+
+        results = index.search("0xdef456 tokens", limit=3)
+
+        assert [doc_id for doc_id, _ in results] == ["c", "a"]
+        assert results[0][1] > results[1][1] > 0
+
+    def test_partitions_and_removal(self):
+        """Partition filters and removed documents are applied before the top-k cut"""
+        index = BM25Index(seal_threshold=2)
+        index.add_many(DOCS)
+
+        assert [doc_id for doc_id, _ in index.search("wallet", partitions=["site1"])] == ["a"]
+
+        index.remove("a")
+        index.add("c", "unrelated text", "site2")
+        assert index.search("wallet") == []
+        assert "wallet" not in index.doc_freq
+
+        index.compact()
+        assert len(index.segments) == 1
+        assert index.get_stats()['documents'] == 3
+        assert [doc_id for doc_id, _ in index.search("newsletter")] == ["d"]
+
+
+def test_reciprocal_rank_fusion():
+    """Documents ranked by both lists beat documents ranked highly by one"""
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "d", "a"]], k=60)
+
+    assert [doc_id for doc_id, _ in fused] == ["b", "a", "d", "c"]
+
+
+class TestHybridSearch:
+    """Test suite for HybridSearch"""
+
+    @pytest.mark.asyncio
+    async def test_fuses_lexical_and_vector_rankings(self, mock_database):
+        """One fetch loads the fused candidates, and per-stage timings are reported"""
+        search = HybridSearch()
+        search.db = mock_database
+        search.add_documents([{'_id': doc_id, 'content': text, 'siteId': site} for doc_id, text, site in DOCS])
+        mock_database.vector_search = AsyncMock(return_value=[{'_id': "b", 'score': 0.9}, {'_id': "c", 'score': 0.8}])
+        mock_database.find_documents = AsyncMock(side_effect=lambda collection, filter_dict, projection: [
+            {'_id': doc_id, 'content': text, 'embedding': [0.1]}
+            for doc_id, text, _ in DOCS if doc_id in filter_dict['_id']['$in']
+        ])
+
+        with patch('services.lexical_search.two_stage_search') as two_stage:
+            two_stage.index = None
+            result = await search.search("0xdef456", np.ones(4), limit=2)
+
+        assert result.success
+        assert [hit.document_id for hit in result.hits] == ["c", "b"]
+        assert 'embedding' not in result.hits[0].document
+        assert mock_database.find_documents.await_count == 1
+        assert set(result.timings) == {'lexical', 'vector', 'fuse', 'fetch'}
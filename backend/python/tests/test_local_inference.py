@@ -0,0 +1,238 @@
+"""
+Tests for the local inference worker
+"""
+
+import asyncio
+import pytest
+import numpy as np
+import torch
+
+from services.local_inference import (
+    LocalInferenceWorker,
+    InferenceRequest,
+    HuggingFaceBackend,
+    mean_pool,
+    bucket_length,
+    quantize_dynamic,
+    measure_agreement
+)
+
+
+class FakeBackend:
+    """Whitespace-tokenizing backend that embeds a text as [token_count, batch_size]"""
+
+    def __init__(self):
+        self.batches = []
+
+    def prepare(self, num_threads):
+        self.num_threads = num_threads
+
+    def tokenize(self, texts):
+        return [list(range(len(text.split()))) for text in texts]
+
+    def encode(self, token_ids, pad_to=None):
+        self.pad_to = pad_to
+        self.batches.append([len(ids) for ids in token_ids])
+        return np.array([[len(ids), len(token_ids)] for ids in token_ids], dtype=float)
+
+
+class TestLocalInferenceWorker:
+    """Test suite for LocalInferenceWorker"""
+
+    @pytest.fixture
+    def backend(self):
+        return FakeBackend()
+
+    @pytest.fixture
+    def worker(self, backend):
+        worker = LocalInferenceWorker(
+            name="fake",
+            backend=backend,
+            max_batch_size=16,
+            max_batch_tokens=1000,
+            max_wait_ms=50,
+            num_threads=2
+        )
+        yield worker
+        worker.stop()
+
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_are_batched(self, worker, backend):
+        """Texts submitted together should share a forward pass"""
+        texts = [f"word " * (i + 1) for i in range(8)]
+
+        embeddings = await worker.embed_many(texts)
+
+        assert len(embeddings) == len(texts)
+        for text, embedding in zip(texts, embeddings):
+            assert embedding[0] == len(text.split())
+        assert len(backend.batches) == 1
+        assert backend.num_threads == 2
+
+    @pytest.mark.asyncio
+    async def test_single_embed(self, worker):
+        """A lone request is flushed once the wait window expires"""
+        embedding = await worker.embed("one two three")
+        assert embedding[0] == 3
+        assert embedding[1] == 1
+
+    def test_group_by_length_respects_token_budget(self, backend):
+        """Groups are length-sorted and padded size never exceeds the budget"""
+        worker = LocalInferenceWorker(name="fake", backend=backend, max_batch_tokens=20)
+        items = [(InferenceRequest(text=""), list(range(n))) for n in [9, 1, 5, 2, 10, 3]]
+
+        groups = worker._group_by_length(items)
+
+        lengths = [len(ids) for group in groups for _, ids in group]
+        assert lengths == sorted(lengths)
+        for group in groups:
+            longest = max(len(ids) for _, ids in group)
+            assert longest * len(group) <= 20 or len(group) == 1
+
+    def test_group_by_length_uses_sequence_buckets(self, backend):
+        """Padded length is rounded up to the bucket boundary when bucketing is on"""
+        worker = LocalInferenceWorker(
+            name="fake", backend=backend, max_batch_tokens=64, sequence_buckets=[8, 16, 32]
+        )
+        items = [(InferenceRequest(text=""), list(range(n))) for n in [3, 5, 7, 9]]
+
+        groups = worker._group_by_length(items)
+
+        # Three sequences fit in bucket 8 (3 * 8 <= 64); adding the 9-token one
+        # would pad everything to 16 and still fit (4 * 16 <= 64)
+        assert [len(group) for group in groups] == [4]
+        assert worker._padded_length(9) == 16
+
+    @pytest.mark.asyncio
+    async def test_stats_report_throughput(self, worker):
+        """Per-batch latency and tokens/sec are tracked"""
+        await worker.embed_many(["a b c", "d e"])
+
+        stats = worker.get_stats()
+        assert stats['batches'] >= 1
+        assert stats['texts'] == 2
+        assert stats['tokens'] == 5
+        assert stats['last_batch_latency'] >= 0
+
+    @pytest.mark.asyncio
+    async def test_encode_errors_propagate(self, worker, backend):
+        """Backend failures are raised to every waiting caller"""
+        def failing_encode(token_ids, pad_to=None):
+            raise RuntimeError("model crashed")
+        backend.encode = failing_encode
+
+        with pytest.raises(RuntimeError, match="model crashed"):
+            await worker.embed("some text")
+
+    @pytest.mark.asyncio
+    async def test_cancelled_requests_do_not_stop_worker(self, worker, backend):
+        """A failure for a cancelled request leaves the worker serving later ones"""
+        def failing_encode(token_ids, pad_to=None):
+            raise RuntimeError("model crashed")
+        real_encode = backend.encode
+        backend.encode = failing_encode
+
+        future = worker.submit("abandoned text")
+        future.cancel()
+        with pytest.raises(RuntimeError):
+            await worker.embed("failing text")
+
+        backend.encode = real_encode
+        embedding = await asyncio.wait_for(worker.embed("one two"), timeout=2)
+        assert embedding[0] == 2
+        assert worker.thread.is_alive()
+
+    @pytest.mark.asyncio
+    async def test_cancellation_only_while_queued(self, worker, backend):
+        """Requests cancelled in the queue are skipped; once encoding they cannot be cancelled"""
+        abandoned = worker.submit("x y z")
+        assert abandoned.cancel()
+        assert (await asyncio.wait_for(worker.embed("one two"), timeout=2))[0] == 2
+        assert all(3 not in batch for batch in backend.batches)
+
+        real_encode = backend.encode
+        late = []
+
+        def cancelling_encode(token_ids, pad_to=None):
+            late.append(first.cancel())
+            return real_encode(token_ids, pad_to=pad_to)
+        backend.encode = cancelling_encode
+
+        first = worker.submit("a b")
+        second = await asyncio.wait_for(worker.embed("c d e"), timeout=2)
+        assert late == [False]
+        assert first.result(timeout=2)[0] == 2 and second[0] == 3
+
+
+class TestMeanPool:
+    """Test suite for padding-aware mean pooling"""
+
+    def test_padding_is_ignored(self):
+        """Padded positions must not contribute to the mean"""
+        hidden = torch.tensor([
+            [[1.0, 1.0], [3.0, 3.0], [100.0, 100.0]],
+            [[2.0, 4.0], [0.0, 0.0], [0.0, 0.0]]
+        ])
+        mask = torch.tensor([[1, 1, 0], [1, 0, 0]])
+
+        pooled = mean_pool(hidden, mask)
+
+        assert torch.allclose(pooled, torch.tensor([[2.0, 2.0], [2.0, 4.0]]))
+
+
+class TestQuantizedInference:
+    """Test suite for int8 CPU inference with a tiny randomly initialised encoder"""
+
+    @pytest.fixture
+    def backend(self, tmp_path):
+        from transformers import BertConfig, BertModel, BertTokenizerFast
+
+        words = ["site", "visitors", "session", "wallet", "transaction", "page", "views", "bounce"]
+        vocab_file = tmp_path / "vocab.txt"
+        vocab_file.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words))
+        tokenizer = BertTokenizerFast(vocab_file=str(vocab_file))
+
+        torch.manual_seed(0)
+        model = BertModel(BertConfig(
+            vocab_size=len(words) + 5,
+            hidden_size=64,
+            num_hidden_layers=2,
+            num_attention_heads=2,
+            intermediate_size=128,
+            max_position_embeddings=64
+        ))
+        backend = HuggingFaceBackend(tokenizer, model, max_length=64)
+        backend.prepare(num_threads=1)
+        return backend
+
+    def test_bucket_length(self):
+        """Lengths round up to the next bucket and pass through past the largest"""
+        assert bucket_length(5, [32, 64]) == 32
+        assert bucket_length(33, [32, 64]) == 64
+        assert bucket_length(100, [32, 64]) == 100
+        assert bucket_length(7, None) == 7
+
+    def test_bucket_padding_does_not_change_embeddings(self, backend):
+        """Padding to a bucket must be masked out of the pooled embedding"""
+        token_ids = backend.tokenize(["site visitors", "wallet transaction page views"])
+
+        unpadded = backend.encode(token_ids)
+        bucketed = backend.encode(token_ids, pad_to=32)
+
+        assert np.allclose(unpadded, bucketed, atol=1e-5)
+
+    def test_quantized_outputs_agree_with_fp32(self, backend):
+        """int8 dynamic quantisation should stay close to fp32 outputs"""
+        quantized = HuggingFaceBackend(
+            backend.tokenizer, quantize_dynamic(backend.model), max_length=backend.max_length
+        )
+
+        report = measure_agreement(
+            backend,
+            quantized,
+            ["site visitors page views", "session bounce", "wallet transaction"]
+        )
+
+        assert report['samples'] == 3
+        assert report['mean_cosine'] > 0.9
+        assert report['min_cosine'] <= report['mean_cosine']
@@ -0,0 +1,106 @@
+"""
+Tests for MinHash LSH near-duplicate detection and its use in the migrator
+"""
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from utils.minhash import MinHashLSH, lsh_bands
+from services.embedding_generator import EmbeddingResult
+from services.vector_migrator import MigrationConfig, VectorMigrator
+
+
+SESSION = "Session: {id} | Pages: /home, /pricing, /docs | Duration: 124s | Device: desktop | Country: US"
+
+
+class TestMinHashLSH:
+    """Test suite for MinHashLSH"""
+
+    def test_band_layout_matches_threshold(self):
+        """High thresholds use few, long bands"""
+        assert lsh_bands(128, 0.9) == (8, 16)
+        assert lsh_bands(128, 0.5) == (32, 4)
+
+    def test_near_duplicates_match_and_distinct_texts_do_not(self):
+        """Texts differing in an ID match their representative; unrelated texts do not"""
+        lsh = MinHashLSH(threshold=0.8)
+        lsh.add("first", lsh.signature(SESSION.format(id="a1")))
+
+        match = lsh.query(lsh.signature(SESSION.format(id="b2")))
+        assert match is not None and match[0] == "first"
+        assert match[1] >= 0.8
+
+        assert lsh.query(lsh.signature("Transaction: 0xabc | Value: 5 ETH | Chain: ethereum")) is None
+
+    def test_index_stops_growing_at_max_entries(self):
+        """A full index still answers queries but rejects new representatives"""
+        lsh = MinHashLSH(max_entries=1)
+        assert lsh.add("first", lsh.signature("one text"))
+        assert not lsh.add("second", lsh.signature("another text"))
+        assert len(lsh) == 1
+
+
+class TestMigratorDeduplication:
+    """Near-duplicate reuse in VectorMigrator"""
+
+    def make_migrator(self, threshold):
+        migrator = VectorMigrator(MigrationConfig(near_duplicate_threshold=threshold, chunk_long_content=False))
+        migrator.db = AsyncMock()
+        migrator.embedding_generator = MagicMock()
+        migrator.embedding_generator.generate_embedding = AsyncMock(return_value=EmbeddingResult(
+            success=True, embedding=[0.1] * 8, model_used="gemini", dimensions=8,
+            quality_score=0.9, processing_time=0.1
+        ))
+        return migrator
+
+    async def embed_and_store(self, migrator, i):
+        results = []
+        result, doc = await migrator._embed_or_reuse(
+            {'_id': f"s{i}", 'siteId': "site1"}, SESSION.format(id=f"id{i}"), 'session', {}
+        )
+        results.append(result)
+        with patch('services.vector_migrator.hybrid_search'):
+            await migrator._store_vector_documents(results, [(0, doc)])
+        return results[0], doc
+
+    @pytest.mark.asyncio
+    async def test_near_duplicates_reuse_representative_embedding(self):
+        """Only the first of several near-identical sessions is sent to the provider"""
+        migrator = self.make_migrator(0.8)
+        docs = []
+        for i in range(3):
+            result, doc = await self.embed_and_store(migrator, i)
+            assert result['success']
+            docs.append(doc)
+
+        assert migrator.embedding_generator.generate_embedding.await_count == 1
+        assert migrator.dedupe_stats == {'checked': 3, 'near_duplicates': 2, 'provider_calls_saved': 2}
+        assert docs[1]['metadata']['nearDuplicateOf'] == "session_s0"
+        assert docs[2]['embedding'] == pytest.approx(docs[0]['embedding'])
+        assert docs[2]['content'] == SESSION.format(id="id2")
+
+    @pytest.mark.asyncio
+    async def test_unstored_records_do_not_become_representatives(self):
+        """A record whose insert failed is not reused; the next near duplicate is embedded"""
+        migrator = self.make_migrator(0.8)
+        migrator.db.insert_documents.side_effect = Exception("write failed")
+        result, _ = await self.embed_and_store(migrator, 0)
+        assert not result['success']
+
+        migrator.db.insert_documents.side_effect = None
+        result, doc = await self.embed_and_store(migrator, 1)
+
+        assert result['success'] and 'nearDuplicateOf' not in doc['metadata']
+        assert migrator.embedding_generator.generate_embedding.await_count == 2
+        assert list(migrator.representatives) == ["session_s1"]
+        assert migrator.pending_signatures == {}
+
+    @pytest.mark.asyncio
+    async def test_deduplication_can_be_disabled(self):
+        """With no threshold every record is embedded"""
+        migrator = self.make_migrator(None)
+        for i in range(2):
+            await migrator._embed_or_reuse({'_id': f"s{i}"}, SESSION.format(id=f"id{i}"), 'session', {})
+
+        assert migrator.embedding_generator.generate_embedding.await_count == 2
+        assert migrator.dedupe_stats['checked'] == 0
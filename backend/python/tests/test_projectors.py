@@ -0,0 +1,72 @@
+"""
+Tests for persisted dimensionality-reduction projectors
+"""
+
+import pytest
+import numpy as np
+from sklearn.decomposition import PCA
+
+from services.projectors import ProjectorRegistry
+
+
+def low_rank_embeddings(n=400, dims=64, rank=8, seed=0):
+    rng = np.random.default_rng(seed)
+    return (rng.normal(size=(n, rank)) @ rng.normal(size=(rank, dims)) + rng.normal(scale=0.01, size=(n, dims))).astype(np.float32)
+
+
+class TestProjectorRegistry:
+    """Test suite for ProjectorRegistry"""
+
+    @pytest.fixture
+    def registry(self, tmp_path):
+        return ProjectorRegistry(str(tmp_path / "projectors"))
+
+    def test_transform_matches_pca(self, registry):
+        """The single matmul projection equals sklearn's PCA transform"""
+        embeddings = low_rank_embeddings()
+        projector = registry.fit("test", embeddings, 8)
+
+        expected = PCA(n_components=8, svd_solver='randomized', random_state=0).fit(embeddings).transform(embeddings)
+
+        assert np.allclose(projector.transform(embeddings), expected, atol=1e-3)
+        assert projector.explained_variance_ratio > 0.99
+
+    def test_projector_is_persisted_and_reused(self, registry, tmp_path):
+        """A new registry loads the fitted projector from disk"""
+        embeddings = low_rank_embeddings()
+        projector = registry.fit("test", embeddings, 8)
+
+        reloaded = ProjectorRegistry(str(tmp_path / "projectors")).get("test")
+
+        assert reloaded.target_dimensions == 8
+        assert np.allclose(reloaded.transform(embeddings[:5]), projector.transform(embeddings[:5]))
+        assert [info['name'] for info in registry.list_projectors()] == ["test"]
+        assert registry.get("missing") is None
+
+    def test_names_cannot_escape_the_directory(self, registry, tmp_path):
+        """Names outside the safe character set are rejected before touching the filesystem"""
+        embeddings = low_rank_embeddings(n=50, dims=16)
+
+        for name in ["../../outside", "a/b", "", "x" * 65]:
+            with pytest.raises(ValueError):
+                registry.fit(name, embeddings, 4)
+        assert not (tmp_path / "outside.projector.npz").exists()
+
+    @pytest.mark.asyncio
+    async def test_fit_from_collection_streams_batches(self, registry):
+        """IncrementalPCA over streamed batches recovers the same subspace"""
+        embeddings = low_rank_embeddings(n=250)
+
+        class FakeDB:
+            async def stream_aggregate(self, collection_name, pipeline, batch_size=1000):
+                assert pipeline[1] == {"$sample": {"size": 1000}}
+                for embedding in embeddings:
+                    yield {'embedding': embedding.tolist()}
+
+        registry.db = FakeDB()
+        projector = await registry.fit_from_collection("streamed", 8, sample_size=1000, batch_size=100)
+
+        # The last 50 rows are still enough for 8 components
+        assert projector.samples == 250
+        assert projector.method == "incremental_pca"
+        assert projector.explained_variance_ratio > 0.99
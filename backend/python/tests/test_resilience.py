@@ -0,0 +1,185 @@
+"""
+Tests for latency tracking, circuit breakers and hedged embedding requests
+"""
+
+import asyncio
+import pytest
+import numpy as np
+from unittest.mock import patch
+
+from utils.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    CircuitState,
+    LatencyTracker,
+    hedged_request
+)
+from services.embedding_generator import EmbeddingGenerator, EmbeddingModel
+
+
+class TestLatencyTracker:
+    """Test suite for LatencyTracker"""
+
+    def test_percentile_needs_min_samples(self):
+        """No percentile is reported until enough requests were recorded"""
+        tracker = LatencyTracker(min_samples=5)
+        for duration in (0.1, 0.2, 0.3, 0.4):
+            tracker.record(duration)
+
+        assert tracker.percentile(95) is None
+
+        tracker.record(0.5)
+        assert tracker.percentile(50) == pytest.approx(0.3)
+
+
+class TestCircuitBreaker:
+    """Test suite for CircuitBreaker"""
+
+    def test_opens_after_consecutive_failures(self):
+        """The circuit opens at the failure threshold and rejects requests"""
+        breaker = CircuitBreaker("gemini", failure_threshold=3, reset_timeout=60)
+        for _ in range(2):
+            breaker.record_failure()
+        breaker.record_success()
+        for _ in range(3):
+            breaker.record_failure()
+
+        assert breaker.state == CircuitState.OPEN
+        assert breaker.allow_request() is False
+        assert breaker.rejections == 1
+
+    def test_half_open_trial_closes_or_reopens(self):
+        """After the reset timeout one trial is admitted and its outcome decides"""
+        breaker = CircuitBreaker("gemini", failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+
+        assert breaker.allow_request() is True
+        assert breaker.state == CircuitState.HALF_OPEN
+        breaker.record_failure()
+        assert breaker.state == CircuitState.OPEN
+
+        assert breaker.allow_request() is True
+        breaker.record_success()
+        assert breaker.state == CircuitState.CLOSED
+
+
+class TestHedgedRequest:
+    """Test suite for hedged_request"""
+
+    @pytest.mark.asyncio
+    async def test_fast_primary_is_not_hedged(self):
+        """A primary that finishes within the delay never starts the backup"""
+        async def primary():
+            return "primary"
+
+        def backup():
+            raise AssertionError("backup should not be started")
+
+        assert await hedged_request(primary, backup, delay=1.0) == ("primary", False)
+
+    @pytest.mark.asyncio
+    async def test_backup_wins_and_primary_is_cancelled(self):
+        """A slow primary is raced against the backup and cancelled when it loses"""
+        cancelled = asyncio.Event()
+
+        async def primary():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        async def backup():
+            return "backup"
+
+        result = await hedged_request(primary, backup, delay=0.01)
+        await asyncio.sleep(0)
+
+        assert result == ("backup", True)
+        assert cancelled.is_set()
+
+    @pytest.mark.asyncio
+    async def test_failed_backup_falls_back_to_primary(self):
+        """If the backup fails, the primary's result is still used"""
+        async def primary():
+            await asyncio.sleep(0.05)
+            return "primary"
+
+        async def backup():
+            raise RuntimeError("backup failed")
+
+        assert await hedged_request(primary, backup, delay=0.01) == ("primary", False)
+
+
+class TestEmbeddingFailover:
+    """Hedging and failover in EmbeddingGenerator"""
+
+    @pytest.fixture
+    def generator(self, mock_database):
+        generator = EmbeddingGenerator()
+        generator.db = mock_database
+        return generator
+
+    @pytest.mark.asyncio
+    async def test_slow_request_is_hedged(self, generator):
+        """A request slower than the provider's p95 is answered by the backup"""
+        for _ in range(generator.latency_trackers[EmbeddingModel.GEMINI].min_samples):
+            generator.latency_trackers[EmbeddingModel.GEMINI].record(0.01)
+
+        calls = []
+
+        async def gemini(text):
+            calls.append(text)
+            if len(calls) == 1:
+                await asyncio.sleep(10)
+            return np.full(4, 0.5)
+
+        with patch.object(generator, '_generate_gemini_embedding', side_effect=gemini):
+            embedding, served_by = await generator._generate_with_failover("text", EmbeddingModel.GEMINI)
+
+        assert served_by == EmbeddingModel.GEMINI
+        assert np.allclose(embedding, 0.5)
+        assert len(calls) == 2
+        assert generator.resilience_stats['hedge_wins'] == 1
+
+        # The cancelled primary is recorded as a censored sample at least as slow as the hedge delay
+        await asyncio.sleep(0)
+        durations = list(generator.latency_trackers[EmbeddingModel.GEMINI].durations)
+        assert len(durations) == generator.latency_trackers[EmbeddingModel.GEMINI].min_samples + 2
+        assert max(durations) >= 0.01
+
+    @pytest.mark.asyncio
+    async def test_open_circuit_fails_over(self, generator):
+        """While a provider's circuit is open requests go to its fallback, or fail fast"""
+        breaker = generator.circuit_breakers[EmbeddingModel.GEMINI]
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+
+        with pytest.raises(CircuitOpenError):
+            await generator._generate_with_failover("text", EmbeddingModel.GEMINI)
+
+        generator.fallback_models[EmbeddingModel.GEMINI] = EmbeddingModel.OPENAI
+        with patch.object(generator, '_generate_openai_embedding', return_value=np.ones(4)) as openai_mock:
+            embedding, served_by = await generator._generate_with_failover("text", EmbeddingModel.GEMINI)
+
+        assert served_by == EmbeddingModel.OPENAI
+        openai_mock.assert_called_once()
+        assert generator.resilience_stats['fallback_requests'] == 1
+
+    @pytest.mark.asyncio
+    async def test_fallback_result_is_cached_under_serving_model(self, generator):
+        """A vector served by the fallback is never cached as the requested model's"""
+        breaker = generator.circuit_breakers[EmbeddingModel.GEMINI]
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+        generator.fallback_models[EmbeddingModel.GEMINI] = EmbeddingModel.OPENAI
+
+        with patch.object(generator, '_generate_openai_embedding', return_value=np.ones(4)), \
+                patch.object(generator.quality_validator, 'validate_embedding', return_value=0.9):
+            result = await generator.generate_embedding("text", EmbeddingModel.GEMINI)
+
+        assert result.model_used == EmbeddingModel.OPENAI.value
+        assert generator._generate_cache_key("text", EmbeddingModel.GEMINI) not in generator.cache
+        assert generator._generate_cache_key("text", EmbeddingModel.OPENAI) in generator.cache
+        cached = generator.db.insert_document.await_args.args[1]
+        assert cached['model'] == EmbeddingModel.OPENAI.value
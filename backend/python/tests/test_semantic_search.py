@@ -0,0 +1,77 @@
+"""
+Tests for semantic search with query caching and MMR reranking
+"""
+
+import pytest
+import numpy as np
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from services.embedding_generator import EmbeddingModel, EmbeddingResult
+from services.semantic_search import SemanticSearch, maximal_marginal_relevance
+
+
+def test_mmr_skips_near_duplicates():
+    """A near duplicate of the top hit loses to a less similar but novel candidate"""
+    query = np.array([1.0, 0.0, 0.0])
+    candidates = np.array([
+        [0.99, 0.14, 0.0],
+        [0.98, 0.2, 0.0],
+        [0.8, 0.0, 0.6],
+    ])
+    candidates /= np.linalg.norm(candidates, axis=1, keepdims=True)
+
+    assert maximal_marginal_relevance(query, candidates, 2, diversity=0.0) == [0, 1]
+    assert maximal_marginal_relevance(query, candidates, 2, diversity=0.5) == [0, 2]
+    assert maximal_marginal_relevance(query, candidates, 5) == [0, 2, 1]
+
+
+class TestSemanticSearch:
+    """Test suite for SemanticSearch"""
+
+    @pytest.fixture
+    def search(self, mock_database):
+        search = SemanticSearch()
+        search.db = mock_database
+        search.embedding_generator = MagicMock()
+        search.embedding_generator.generate_embedding = AsyncMock(return_value=EmbeddingResult(
+            success=True, embedding=np.array([2.0, 0.0]), model_used="gemini", dimensions=2,
+            quality_score=1.0, processing_time=0.0
+        ))
+        return search
+
+    @pytest.mark.asyncio
+    async def test_query_vectors_are_cached(self, search):
+        """Repeated queries differing only in whitespace are embedded once"""
+        first = await search.embed_query("top  wallets", EmbeddingModel.GEMINI)
+        second = await search.embed_query(" top wallets ", EmbeddingModel.GEMINI)
+
+        assert search.embedding_generator.generate_embedding.await_count == 1
+        assert np.allclose(first, [1.0, 0.0])
+        assert second is first
+        assert search.get_stats()['hits'] == 1
+
+    @pytest.mark.asyncio
+    async def test_search_returns_compact_diverse_results(self, search, mock_database):
+        """Hits carry only the requested fields, and timings cover each stage"""
+        mock_database.vector_search = AsyncMock(return_value=[
+            {'_id': "a", 'score': 0.99, 'embedding': [1.0, 0.01], 'content': "a", 'metadata': {}},
+            {'_id': "b", 'score': 0.99, 'embedding': [1.0, 0.01], 'content': "b", 'metadata': {}},
+            {'_id': "c", 'score': 0.9, 'embedding': [0.9, -0.44], 'content': "c", 'metadata': {}},
+        ])
+
+        with patch('services.semantic_search.two_stage_search') as two_stage:
+            two_stage.index = None
+            result = await search.search("query", limit=2, filters={'siteId': "site1"}, fields=["content"])
+
+        assert result.success
+        assert [hit.document_id for hit in result.hits] == ["a", "c"]
+        assert result.hits[0].document == {'content': "a"}
+        assert mock_database.vector_search.call_args.kwargs['filters'] == {'siteId': "site1"}
+        assert set(result.timings) == {'embed', 'retrieve', 'rerank'}
+
+    @pytest.mark.asyncio
+    async def test_archive_search_rejects_filters_it_cannot_apply(self, search, mock_database):
+        """With include_archive an unarchived filter field fails instead of leaking unfiltered archived hits"""
+        with pytest.raises(ValueError):
+            await search.search("wallets", filters={'metadata.timeframe': "7d"}, include_archive=True)
+        mock_database.vector_search.assert_not_called()
@@ -0,0 +1,68 @@
+"""
+Tests for token-aware text chunking
+"""
+
+import random
+import pytest
+
+from services.text_chunker import TextChunker, regex_token_spans
+
+
+def make_document(sentence_count=120, seed=7):
+    random.seed(seed)
+    words = ["site", "visitors", "wallet", "session", "bounce", "chain", "token", "page", "views", "campaign"]
+    return [
+        " ".join(random.choice(words) for _ in range(random.randint(4, 20))) + "."
+        for _ in range(sentence_count)
+    ]
+
+
+class TestTextChunker:
+    """Test suite for TextChunker"""
+
+    @pytest.fixture
+    def chunker(self):
+        return TextChunker(chunk_size=60, chunk_overlap=12)
+
+    def test_short_text_is_one_chunk(self, chunker):
+        """Text within the limit is returned unchanged as a single chunk"""
+        chunks = chunker.chunk("Site visitors increased by 20% this week.")
+
+        assert len(chunks) == 1
+        assert chunks[0].text == "Site visitors increased by 20% this week."
+        assert not chunker.needs_chunking(chunks[0].text)
+
+    def test_chunks_respect_token_limit_and_cover_text(self, chunker):
+        """Every chunk fits the limit and together they cover every token"""
+        text = " ".join(make_document())
+        chunks = chunker.chunk(text)
+
+        assert len(chunks) > 1
+        assert all(chunk.token_count <= 60 for chunk in chunks)
+        assert all(chunker.count_tokens(chunk.text) == chunk.token_count for chunk in chunks)
+
+        covered = set()
+        for chunk in chunks:
+            assert text[chunk.start_char:chunk.end_char] == chunk.text
+            covered.update(range(chunk.start_char, chunk.end_char))
+        assert all(start in covered for start, _ in regex_token_spans(text))
+
+    def test_consecutive_chunks_overlap(self, chunker):
+        """Runs without sentence breaks are windowed with the configured overlap"""
+        text = " ".join(f"w{i}" for i in range(200))
+        chunks = chunker.chunk(text)
+
+        assert [chunk.token_count for chunk in chunks[:-1]] == [60] * (len(chunks) - 1)
+        for previous, current in zip(chunks, chunks[1:]):
+            assert current.start_char < previous.end_char
+
+    def test_edit_only_changes_nearby_chunks(self, chunker):
+        """Editing one sentence leaves most chunk hashes (and cache keys) unchanged"""
+        sentences = make_document()
+        original = chunker.chunk(" ".join(sentences))
+
+        sentences[60] = "An entirely different sentence about gas fees."
+        edited = chunker.chunk(" ".join(sentences))
+
+        changed = {chunk.content_hash for chunk in edited} - {chunk.content_hash for chunk in original}
+        assert 1 <= len(changed) <= 3
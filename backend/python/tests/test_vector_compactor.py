@@ -0,0 +1,90 @@
+"""
+Tests for vector index compaction
+"""
+
+import pytest
+import numpy as np
+
+from services.vector_compactor import VectorCompactor
+
+
+def vector_doc(_id, document_id, source_id, embedding=None, source_type='session'):
+    doc = {
+        '_id': _id, 'documentId': document_id, 'sourceType': source_type, 'sourceId': source_id,
+        'siteId': "site1", 'status': "active"
+    }
+    if embedding is not None:
+        doc['embedding'] = embedding
+    return doc
+
+
+def make_compactor(db, **kwargs):
+    compactor = VectorCompactor(**kwargs)
+    compactor.db = db
+    return compactor
+
+
+class TestVectorCompactor:
+    """Test suite for VectorCompactor"""
+
+    @pytest.mark.asyncio
+    async def test_removes_duplicates_and_orphans(self, memory_database):
+        """The newest copy of a documentId survives and vectors of deleted sources go"""
+        memory_database.seed("vectordocuments", [
+            vector_doc(1, "session_a", "a"),
+            vector_doc(2, "session_b", "b"),
+            vector_doc(3, "session_a", "a"),
+            vector_doc(4, "session_gone", "gone"),
+        ])
+        memory_database.seed("sessions", [{'_id': "a"}, {'_id': "b"}])
+        compactor = make_compactor(memory_database, batch_size=2)
+
+        result = await compactor.compact(benchmark_queries=0)
+
+        assert result.success
+        assert (result.scanned, result.duplicates_removed, result.orphans_removed) == (4, 1, 1)
+        assert sorted(doc['_id'] for doc in memory_database.documents("vectordocuments")) == [2, 3]
+        assert result.bytes_reclaimed == 200
+        assert {call.args[0] for call in memory_database.find_documents.await_args_list} == {'sessions'}
+
+    @pytest.mark.asyncio
+    async def test_dry_run_and_near_duplicate_merge(self, memory_database):
+        """Near-duplicate vectors are merged into the first one in one bulk write; a dry run writes nothing"""
+        base = np.ones(32)
+        memory_database.seed("vectordocuments", [
+            vector_doc(1, "session_a", "a", base.tolist()),
+            vector_doc(2, "session_b", "b", (base + 0.001).tolist()),
+            vector_doc(3, "session_c", "c", (-base).tolist()),
+        ])
+        memory_database.seed("sessions", [{'_id': source_id} for source_id in "abc"])
+        compactor = make_compactor(memory_database)
+
+        dry = await compactor.compact(merge_near_duplicates=True, benchmark_queries=0, dry_run=True)
+        assert dry.near_duplicates_merged == 1
+        memory_database.bulk_write.assert_not_called()
+
+        result = await compactor.compact(merge_near_duplicates=True, benchmark_queries=0)
+        assert result.near_duplicates_merged == 1
+        memory_database.bulk_write.assert_awaited_once()
+        merged = memory_database.collections["vectordocuments"][2]
+        assert merged['metadata']['nearDuplicateOf'] == "session_a"
+        assert 'embedding' not in merged
+        assert 'embedding' in memory_database.collections["vectordocuments"][1]
+
+    @pytest.mark.asyncio
+    async def test_search_latency_is_benchmarked(self, memory_database):
+        """Sampled vectors are searched before and after; a failing search leaves the latency unset"""
+        memory_database.seed("vectordocuments", [
+            vector_doc(i, f"session_{i}", str(i), np.full(8, i + 1.0).tolist()) for i in range(3)
+        ])
+        memory_database.seed("sessions", [{'_id': str(i)} for i in range(3)])
+        compactor = make_compactor(memory_database)
+
+        result = await compactor.compact(benchmark_queries=2)
+        assert result.latency_before is not None and result.latency_after is not None
+        assert memory_database.vector_search.await_count == 4
+
+        memory_database.vector_search.side_effect = Exception("vector index unavailable")
+        result = await compactor.compact(benchmark_queries=2)
+        assert result.success
+        assert result.latency_before is None and result.latency_after is None
@@ -5,6 +5,7 @@ Comprehensive tests for Vector Migrator service
 import pytest
 import json
 import tempfile
+import numpy as np
 from datetime import datetime, timedelta
 from unittest.mock import Mock, AsyncMock, patch
 from pathlib import Path
@@ -17,7 +18,8 @@ from services.vector_migrator import (
     MigrationStatus,
     DataSource
 )
-from services.embedding_generator import EmbeddingModel, EmbeddingResult
+from services.embedding_generator import EmbeddingModel, EmbeddingResult, ChunkedEmbeddingResult
+from services.text_chunker import TextChunker
 from . import SAMPLE_ANALYTICS_DATA, SAMPLE_SESSION_DATA, SAMPLE_TRANSACTION_DATA
 
 
@@ -344,6 +346,82 @@ class TestVectorMigrator:
         assert results[0]['success'] is False
         assert "Embedding generation failed" in results[0]['error']
     
+    @pytest.mark.asyncio
+    async def test_batch_validation_rejects_invalid_embeddings(self, vector_migrator):
+        """Invalid vectors are rejected in one batch pass and the rest bulk inserted"""
+        embeddings = [[0.1] * 1536, [float('nan')] * 1536, [0.0] * 1536, [0.1] * 768]
+        vector_migrator.embedding_generator.generate_embedding.side_effect = [
+            EmbeddingResult(success=True, embedding=embedding, model_used="gemini", quality_score=0.85)
+            for embedding in embeddings
+        ]
+        batch_data = [{**SAMPLE_ANALYTICS_DATA, '_id': f'analytics_{i}'} for i in range(4)]
+        # Identical content would otherwise be embedded once and reused
+        vector_migrator.deduplicator = None
+        
+        results = await vector_migrator._process_analytics_batch(batch_data)
+        
+        assert [result['success'] for result in results] == [True, False, False, False]
+        assert 'NaN' in results[1]['error']
+        assert 'zero magnitude' in results[2]['error']
+        assert '1536 dimensions' in results[3]['error']
+        inserted = vector_migrator.db.insert_documents.call_args[0][1]
+        assert [doc['sourceId'] for doc in inserted] == ['analytics_0']
+    
+    @pytest.mark.asyncio
+    async def test_long_content_is_stored_as_chunks(self, vector_migrator):
+        """Content longer than one chunk is stored as a parent plus chunk documents"""
+        vector_migrator.chunker = TextChunker(chunk_size=20, chunk_overlap=5)
+        record = {**SAMPLE_ANALYTICS_DATA, '_id': 'analytics_1'}
+        content = await vector_migrator._extract_analytics_content(record)
+        chunks = vector_migrator.chunker.chunk(content)
+        assert len(chunks) > 1
+        vector_migrator.embedding_generator.generate_chunked_embeddings = AsyncMock(
+            return_value=ChunkedEmbeddingResult(
+                success=True,
+                chunks=chunks,
+                embeddings=[np.full(4, 0.5)] * len(chunks),
+                document_embedding=np.full(4, 0.5),
+                model_used="gemini",
+                quality_score=0.9,
+                processing_time=0.1,
+                metadata={'chunk_count': len(chunks)}
+            )
+        )
+        
+        results = await vector_migrator._process_analytics_batch([record])
+        
+        assert results == [{'success': True, 'record_id': 'analytics_1', 'chunks': len(chunks)}]
+        parent_doc = vector_migrator.db.insert_document.call_args[0][1]
+        chunk_docs = vector_migrator.db.insert_documents.call_args[0][1]
+        assert parent_doc['metadata']['chunkCount'] == len(chunks)
+        assert [doc['metadata']['chunkIndex'] for doc in chunk_docs] == list(range(len(chunks)))
+        assert all(doc['metadata']['parentDocumentId'] == parent_doc['documentId'] for doc in chunk_docs)
+        vector_migrator.embedding_generator.generate_embedding.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_failed_chunked_embedding_fails_only_its_record(self, vector_migrator):
+        """A long record whose chunks fail to embed is reported failed without aborting the batch"""
+        vector_migrator.chunker = TextChunker(chunk_size=20, chunk_overlap=5)
+        batch_data = [{**SAMPLE_ANALYTICS_DATA, '_id': f'analytics_{i}'} for i in range(2)]
+        chunks = vector_migrator.chunker.chunk(await vector_migrator._extract_analytics_content(batch_data[1]))
+        vector_migrator.embedding_generator.generate_chunked_embeddings = AsyncMock(side_effect=[
+            ChunkedEmbeddingResult(success=False, error="quota exceeded"),
+            ChunkedEmbeddingResult(
+                success=True,
+                chunks=chunks,
+                embeddings=[np.full(4, 0.5)] * len(chunks),
+                document_embedding=np.full(4, 0.5),
+                model_used="gemini",
+                quality_score=0.9
+            )
+        ])
+        
+        results = await vector_migrator._process_analytics_batch(batch_data)
+        
+        assert results[0] == {'success': False, 'error': "quota exceeded"}
+        assert results[1]['success'] is True and results[1]['chunks'] == len(chunks)
+        assert vector_migrator.db.insert_document.call_args[0][1]['sourceId'] == 'analytics_1'
+    
     @pytest.mark.asyncio
     async def test_migration_status_tracking(self, vector_migrator):
         """Test migration status tracking"""
@@ -0,0 +1,229 @@
+"""
+Tests for two-stage vector search
+"""
+
+import pytest
+import numpy as np
+from unittest.mock import AsyncMock, patch
+
+from services.vector_search import CompactVectorIndex, PartitionedVectorIndex, TwoStageVectorSearch, top_k
+from utils.database import DatabaseManager, split_vector_filters
+
+
+def clustered_vectors(n=600, dims=128, clusters=30, seed=0):
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dims))
+    labels = rng.integers(0, clusters, size=n)
+    return (centres[labels] + rng.normal(scale=0.3, size=(n, dims))).astype(np.float32)
+
+
+class FakeVectorDB:
+    """In-memory stand-in for the vectordocuments collection"""
+
+    def __init__(self, vectors):
+        self.docs = [
+            {'_id': f"doc{i}", 'embedding': vector.tolist(), 'status': 'active', 'siteId': f"site{i % 3}"}
+            for i, vector in enumerate(vectors)
+        ]
+        self.fetches = []
+
+    async def stream_documents(self, collection_name, filter_dict, projection=None, batch_size=1000):
+        for doc in self.docs:
+            yield doc
+
+    async def find_documents(self, collection_name, filter_dict, projection=None, **kwargs):
+        ids = set(filter_dict['_id']['$in'])
+        self.fetches.append(len(ids))
+        conditions = {key: value for key, value in filter_dict.items() if key != '_id'}
+        return [
+            doc for doc in self.docs
+            if doc['_id'] in ids and all(doc.get(key) == value for key, value in conditions.items())
+        ]
+
+    async def aggregate(self, collection_name, pipeline):
+        size = pipeline[1]['$sample']['size']
+        return [{'_id': doc['_id'], 'embedding': doc['embedding']} for doc in self.docs[:size]]
+
+
+class TestCompactVectorIndex:
+    """Test suite for CompactVectorIndex"""
+
+    def test_quantised_scores_track_exact_cosine(self):
+        """int8 codes over truncated vectors approximate cosine in the reduced space"""
+        vectors = clustered_vectors()
+        index = CompactVectorIndex(dimensions=64)
+        index.add([f"doc{i}" for i in range(len(vectors))], vectors)
+
+        candidates = index.search(vectors[0], 20)
+
+        truncated = vectors[:, :64] / np.linalg.norm(vectors[:, :64], axis=1, keepdims=True)
+        exact_order, _ = top_k(truncated @ truncated[0], 20)
+        assert candidates[0][0] == "doc0"
+        assert len({doc_id for doc_id, _ in candidates} & {f"doc{i}" for i in exact_order}) >= 16
+        assert index.memory_bytes() < vectors.nbytes / 6
+
+    def test_add_replaces_and_remove_swaps(self):
+        """Re-adding an ID updates it in place; removal keeps positions consistent"""
+        vectors = clustered_vectors(n=5)
+        index = CompactVectorIndex(dimensions=32)
+        index.add(["a", "b", "c", "d", "e"], vectors)
+        index.add(["b"], vectors[4:5])
+
+        assert len(index) == 5
+        assert index.remove("a") is True
+        assert index.remove("missing") is False
+        assert index.ids[0] == "e"
+        assert {doc_id for doc_id, _ in index.search(vectors[4], 2)} == {"b", "e"}
+
+
+class TestPartitionedVectorIndex:
+    """Test suite for PartitionedVectorIndex"""
+
+    def test_search_is_scoped_to_partitions(self):
+        """A scoped search only returns documents from the requested partitions"""
+        vectors = clustered_vectors(n=90)
+        ids = [f"doc{i}" for i in range(90)]
+        index = PartitionedVectorIndex(dimensions=32)
+        index.add(ids, vectors, [f"site{i % 3}" for i in range(90)])
+
+        scoped = index.search(vectors[1], 10, partitions=["site1"])
+        unscoped = index.search(vectors[1], 10)
+
+        assert len(index.partitions) == 3
+        assert all(int(doc_id[3:]) % 3 == 1 for doc_id, _ in scoped)
+        assert scoped[0][0] == unscoped[0][0] == "doc1"
+        assert [score for _, score in unscoped] == sorted([score for _, score in unscoped], reverse=True)
+        assert index.search(vectors[1], 10, partitions=["unknown"]) == []
+
+    def test_moving_a_document_between_partitions(self):
+        """Re-adding a document under another partition removes it from the old one"""
+        vectors = clustered_vectors(n=4)
+        index = PartitionedVectorIndex(dimensions=16)
+        index.add(["a", "b", "c", "d"], vectors, ["x", "x", "y", "y"])
+        index.add(["a"], vectors[:1], ["y"])
+
+        assert len(index) == 4
+        assert len(index.partitions["x"]) == 1
+        assert "a" in {doc_id for doc_id, _ in index.search(vectors[0], 4, partitions=["y"])}
+        assert index.remove("a") is True
+        assert len(index) == 3
+
+    def test_partitions_for_filter(self):
+        """Equality and $in filters on the partition field select partitions"""
+        index = PartitionedVectorIndex(partition_field="siteId")
+
+        assert index.partitions_for({'siteId': 's1'}) == ['s1']
+        assert index.partitions_for({'siteId': {'$in': ['s1', 's2']}}) == ['s1', 's2']
+        assert index.partitions_for({'siteId': {'$ne': 's1'}}) is None
+        assert index.partitions_for({'teamId': 't1'}) is None
+
+
+class TestVectorFilterPushDown:
+    """Filter push-down into $vectorSearch"""
+
+    def test_split_vector_filters(self):
+        """Conditions on indexed fields with supported operators are pushed down"""
+        pushdown, residual = split_vector_filters(
+            {
+                'siteId': 's1',
+                'status': {'$in': ['active']},
+                'sourceType': {'$regex': '^tx'},
+                'metadata.importance': {'$gte': 5},
+                '$or': [{'teamId': 't1'}, {'teamId': 't2'}]
+            },
+            ['siteId', 'teamId', 'sourceType', 'status']
+        )
+
+        assert pushdown == {
+            'siteId': 's1',
+            'status': {'$in': ['active']},
+            '$or': [{'teamId': 't1'}, {'teamId': 't2'}]
+        }
+        assert residual == {'sourceType': {'$regex': '^tx'}, 'metadata.importance': {'$gte': 5}}
+
+    @pytest.mark.asyncio
+    async def test_vector_search_pipeline(self):
+        """Indexed filters go into $vectorSearch; the rest runs as $match before $limit"""
+        manager = DatabaseManager()
+        with patch.object(manager, 'aggregate', AsyncMock(return_value=[])) as aggregate:
+            await manager.vector_search(
+                "vectordocuments", [0.1, 0.2], "vector_index", limit=5, filters={'siteId': 's1'}, num_candidates=50
+            )
+            pipeline = aggregate.call_args[0][1]
+            assert pipeline[0]['$vectorSearch']['filter'] == {'siteId': 's1'}
+            assert pipeline[0]['$vectorSearch']['limit'] == 5
+            assert not any('$match' in stage for stage in pipeline)
+
+            await manager.vector_search(
+                "vectordocuments", [0.1, 0.2], "vector_index", limit=5,
+                filters={'siteId': 's1', 'metadata.importance': {'$gte': 5}}, num_candidates=50
+            )
+            pipeline = aggregate.call_args[0][1]
+            assert pipeline[0]['$vectorSearch']['limit'] == pipeline[0]['$vectorSearch']['numCandidates']
+            assert pipeline[1] == {'$match': {'metadata.importance': {'$gte': 5}}}
+            assert pipeline[2] == {'$limit': 5}
+
+
+class TestTwoStageVectorSearch:
+    """Test suite for TwoStageVectorSearch"""
+
+    @pytest.fixture
+    async def search(self):
+        service = TwoStageVectorSearch()
+        service.db = FakeVectorDB(clustered_vectors())
+        service.dimensions = 32
+        await service.build_index()
+        return service
+
+    @pytest.mark.asyncio
+    async def test_build_reports_compression(self, search):
+        """The compact index is several times smaller than the full vectors"""
+        stats = search.get_stats()
+        assert stats['documents'] == 600
+        assert stats['source_dimensions'] == 128
+        assert stats['index_bytes'] * 10 < 600 * 128 * 4
+
+    @pytest.mark.asyncio
+    async def test_rerank_uses_full_vectors_fetched_in_one_batch(self, search):
+        """Candidates are fetched with one query and reranked by exact cosine"""
+        query = np.array(search.db.docs[7]['embedding'])
+
+        result = await search.search(query, limit=5, num_candidates=50)
+
+        assert result.success is True
+        assert result.hits[0].document_id == "doc7"
+        assert result.hits[0].score == pytest.approx(1.0, abs=1e-5)
+        assert [hit.score for hit in result.hits] == sorted([hit.score for hit in result.hits], reverse=True)
+        assert search.db.fetches == [50]
+        assert set(result.timings) == {'recall', 'fetch', 'rerank'}
+
+    @pytest.mark.asyncio
+    async def test_tenant_filter_recalls_within_partition(self, search):
+        """A siteId filter scans only that tenant's partition and returns full results"""
+        query = np.array(search.db.docs[4]['embedding'])
+
+        result = await search.search(query, limit=10, num_candidates=50, filters={'siteId': 'site1'})
+
+        assert result.success is True
+        assert len(result.hits) == 10
+        assert result.hits[0].document_id == "doc4"
+        assert all(int(hit.document_id[3:]) % 3 == 1 for hit in result.hits)
+        assert search.get_stats()['partitions'] == 3
+
+    @pytest.mark.asyncio
+    async def test_evaluate_reports_recall_per_candidate_count(self, search):
+        """Recall improves (or holds) as the candidate set grows"""
+        report = await search.evaluate(query_count=20, limit=5, candidate_counts=[5, 100])
+
+        recalls = [entry['recall'] for entry in report['results']]
+        assert report['queries'] == 20
+        assert recalls[1] >= recalls[0]
+        assert recalls[1] > 0.9
+        assert all(entry['latency_p95'] >= entry['latency_p50'] for entry in report['results'])
+
+    @pytest.mark.asyncio
+    async def test_search_without_index_fails_cleanly(self):
+        """Searching before the index is built returns an error result"""
+        service = TwoStageVectorSearch()
+        result = await service.search(np.ones(4))
+        assert result.success is False
@@ -0,0 +1,106 @@
+"""
+Tests for hot/cold tiering of vector documents
+"""
+
+import pytest
+import numpy as np
+from datetime import datetime
+
+from services.vector_tiering import ArchiveSegment, VectorTiering, check_archive_filters
+
+
+def make_docs(n=50, dims=16, seed=0):
+    rng = np.random.default_rng(seed)
+    return [
+        {
+            '_id': f"doc{i}",
+            'documentId': f"session_{i}",
+            'sourceType': "session",
+            'siteId': f"site{i % 2}",
+            'teamId': f"team{i % 3}",
+            'embedding': rng.normal(size=dims).tolist(),
+            'content': f"session {i}",
+            'createdAt': datetime(2025, 1, 1)
+        }
+        for i in range(n)
+    ]
+
+
+class TestArchiveSegment:
+    """Test suite for ArchiveSegment"""
+
+    def test_memory_mapped_search_matches_exact_cosine(self, tmp_path):
+        """float16 scans find the same top hits as float32 cosine, honouring filters"""
+        docs = make_docs()
+        segment = ArchiveSegment.write(tmp_path, docs)
+        reopened = ArchiveSegment(segment.path)
+        assert isinstance(reopened.embeddings, np.memmap)
+
+        query = np.asarray(docs[3]['embedding'], dtype=np.float32)
+        query /= np.linalg.norm(query)
+        hits = reopened.search(query, 5)
+        assert hits[0][0] == "doc3"
+        assert hits[0][1] == pytest.approx(1.0, abs=1e-2)
+
+        filtered = reopened.search(query, 5, {'siteId': "site0"})
+        assert all(int(doc_id[3:]) % 2 == 0 for doc_id, _ in filtered)
+
+    def test_filters_on_tenant_columns_and_operators(self, tmp_path):
+        """Team filters and $in/$ne/$nin apply to archived rows; segments lacking a column match nothing"""
+        docs = make_docs(30)
+        segment = ArchiveSegment.write(tmp_path, docs)
+        query = np.asarray(docs[0]['embedding'], dtype=np.float32)
+        query /= np.linalg.norm(query)
+
+        team = segment.search(query, 30, {'teamId': "team1"})
+        assert team and all(int(doc_id[3:]) % 3 == 1 for doc_id, _ in team)
+        excluded = segment.search(query, 30, {'teamId': {'$nin': ["team0", "team1"]}, 'siteId': {'$ne': "site0"}})
+        assert excluded and all(int(doc_id[3:]) % 3 == 2 and int(doc_id[3:]) % 2 == 1 for doc_id, _ in excluded)
+        assert {doc_id for doc_id, _ in segment.search(query, 30, {'_id': {'$in': ["doc4", "doc7"]}})} == {"doc4", "doc7"}
+
+        del segment.columns['teamId']
+        assert segment.search(query, 30, {'teamId': "team1"}) == []
+
+    def test_unsupported_filters_are_rejected(self):
+        """Fields that are not archived and range operators fail instead of being ignored"""
+        check_archive_filters({'siteId': "site0", 'teamId': {'$in': ["team1"]}})
+        with pytest.raises(ValueError):
+            check_archive_filters({'metadata.timeframe': "7d"})
+        with pytest.raises(ValueError):
+            check_archive_filters({'siteId': {'$gte': "site0"}})
+
+
+class TestVectorTiering:
+    """Test suite for VectorTiering"""
+
+    @pytest.mark.asyncio
+    async def test_archive_search_and_promote(self, tmp_path, memory_database):
+        """Cold documents leave the hot tier, are searchable in the archive and come back on promotion"""
+        docs = make_docs(20)
+        memory_database.seed("vectordocuments", docs)
+        tiering = VectorTiering(archive_dir=str(tmp_path))
+        tiering.db = memory_database
+
+        result = await tiering.archive_cold(batch_size=8)
+
+        assert result.success
+        assert (result.archived, result.segments) == (20, 3)
+        assert memory_database.documents("vectordocuments") == []
+
+        reloaded = VectorTiering(archive_dir=str(tmp_path))
+        reloaded.db = memory_database
+        reloaded.load_segments()
+        hits = reloaded.search_archive(np.asarray(docs[11]['embedding']), limit=3)
+        assert hits[0].document_id == "doc11"
+        assert hits[0].document['siteId'] == "site1"
+        assert hits[0].document['teamId'] == "team2"
+        with pytest.raises(ValueError):
+            reloaded.search_archive(np.asarray(docs[11]['embedding']), 3, {'createdAt': {'$gte': datetime(2025, 1, 1)}})
+
+        assert await reloaded.promote(["doc11"]) == 1
+        promoted = memory_database.collections["vectordocuments"]["doc11"]
+        assert promoted['content'] == "session 11"
+        assert len(promoted['embedding']) == 16
+        assert reloaded.get_stats()['archived_documents'] == 19
+        assert all(hit.document_id != "doc11" for hit in reloaded.search_archive(np.asarray(docs[11]['embedding']), 3))
+        assert await reloaded.promote(["doc11"]) == 0
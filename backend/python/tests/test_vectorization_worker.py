@@ -0,0 +1,143 @@
+"""
+Tests for the change-stream vectorization worker
+"""
+
+import asyncio
+import pytest
+import numpy as np
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from services.embedding_generator import BatchEmbeddingResult, EmbeddingModel
+from services.vector_migrator import MigrationConfig, VectorMigrator
+from services.vectorization_worker import CHECKPOINT_COLLECTION, DEAD_LETTER_COLLECTION, VectorizationWorker
+
+
+def make_worker(db, debounce=0.05):
+    worker = VectorizationWorker(collections=['sessions'], model=EmbeddingModel.GEMINI)
+    worker.debounce_seconds = debounce
+    worker.max_delay_seconds = 10
+    worker.db = db
+    worker.embedding_generator = MagicMock()
+    worker.embedding_generator.generate_batch_embeddings = AsyncMock(
+        side_effect=lambda texts, model, context=None: BatchEmbeddingResult(
+            success=True,
+            embeddings=[np.full(4, 0.5) for _ in texts],
+            quality_scores=[0.9] * len(texts),
+            metadata={'model_used': "gemini"}
+        )
+    )
+    worker.migrator = VectorMigrator(MigrationConfig(near_duplicate_threshold=None))
+    return worker
+
+
+def checkpoint(db, collection='sessions'):
+    stored = db.collections.get(CHECKPOINT_COLLECTION, {}).get(f"vectorization:{collection}")
+    return stored['resumeToken'] if stored else None
+
+
+def insert_event(seq, doc_id):
+    return {'_id': {'_data': str(seq)}, 'operationType': 'insert', 'documentKey': {'_id': doc_id},
+            'fullDocument': {'_id': doc_id, 'siteId': "site1"}}
+
+
+class TestVectorizationWorker:
+    """Test suite for VectorizationWorker"""
+
+    @pytest.mark.asyncio
+    async def test_updates_are_coalesced_and_upserted(self, memory_database):
+        """Bursts of updates to one document produce a single embedding, upsert and lexical index entry"""
+        memory_database.seed("vectordocuments", [
+            {'_id': "v3", 'documentId': "session_s3", 'sourceType': "session", 'sourceId': "s3", 'content': "old"}
+        ])
+        worker = make_worker(memory_database)
+
+        with patch('services.vectorization_worker.hybrid_search') as lexical:
+            lexical.partition_field = "siteId"
+            await worker.start()
+            for pages in (1, 2, 3):
+                await memory_database.emit('sessions', 'update', "s1", {'_id': "s1", 'siteId': "site1", 'pagesViewed': pages})
+            await memory_database.emit('sessions', 'insert', "s2", {'_id': "s2", 'siteId': "site1"})
+            last = await memory_database.emit('sessions', 'delete', "s3")
+
+            for _ in range(100):
+                await asyncio.sleep(0.02)
+                if worker.stats['upserted'] + worker.stats['deleted'] >= 3:
+                    break
+            await worker.stop()
+
+        call = worker.embedding_generator.generate_batch_embeddings.await_args_list
+        assert len(call) == 1 and len(call[0].args[0]) == 2
+        assert worker.stats['coalesced'] == 2
+        stored = {doc['documentId']: doc for doc in memory_database.documents("vectordocuments")}
+        assert set(stored) == {"session_s1", "session_s2"}
+        assert stored["session_s1"]['metadata']['originalRecord']['pagesViewed'] == 3
+        assert checkpoint(memory_database) == last
+        assert worker.get_stats()['lag_seconds']['sessions'] > 0
+
+        lexical.index.remove.assert_called_once_with("v3")
+        indexed = lexical.add_documents.call_args.args[0]
+        assert {doc['_id'] for doc in indexed} == {stored["session_s1"]['_id'], stored["session_s2"]['_id']}
+
+    @pytest.mark.asyncio
+    async def test_checkpoint_stops_before_unwritten_changes(self, memory_database):
+        """The resume token never moves past a change that is still pending"""
+        worker = make_worker(memory_database, debounce=60)
+
+        first, second = insert_event(1, "a"), insert_event(2, "b")
+        worker.handle_event('sessions', first)
+        worker.handle_event('sessions', second)
+        worker.pending[('sessions', "a")].last_seen -= 120
+
+        assert await worker.flush() == 1
+        assert checkpoint(memory_database) == first['_id']
+
+        assert await worker.flush(force=True) == 1
+        assert checkpoint(memory_database) == second['_id']
+
+    @pytest.mark.asyncio
+    async def test_failed_write_stays_pending(self, memory_database):
+        """A failed bulk write keeps changes pending and the checkpoint unchanged"""
+        memory_database.bulk_write.side_effect = RuntimeError("not primary")
+        worker = make_worker(memory_database)
+        worker.handle_event('sessions', {'_id': {'_data': "1"}, 'operationType': 'delete', 'documentKey': {'_id': "a"}})
+
+        assert await worker.flush(force=True) == 0
+        assert len(worker.pending) == 1
+        assert checkpoint(memory_database) is None
+
+    @pytest.mark.asyncio
+    async def test_failed_embeddings_are_retried_then_dead_lettered(self, memory_database):
+        """Changes that fail to embed back off without moving the checkpoint, and are dead-lettered in the end"""
+        worker = make_worker(memory_database)
+        worker.max_attempts = 2
+        worker.embedding_generator.generate_batch_embeddings.side_effect = None
+        worker.embedding_generator.generate_batch_embeddings.return_value = BatchEmbeddingResult(
+            success=False, errors=["quota exceeded"]
+        )
+        first, second = insert_event(1, "a"), insert_event(2, "b")
+        worker.handle_event('sessions', first)
+        worker.handle_event('sessions', second)
+
+        assert await worker.flush(force=True) == 0
+        assert len(worker.pending) == 2
+        assert all(change.attempts == 1 and change.retry_at > 0 for change in worker.pending.values())
+        assert checkpoint(memory_database) is None
+
+        # Backing off: not retried until retry_at has passed
+        assert await worker.flush(force=True) == 0
+        assert worker.embedding_generator.generate_batch_embeddings.await_count == 1
+
+        worker.embedding_generator.generate_batch_embeddings.return_value = BatchEmbeddingResult(
+            success=True, embeddings=[None, np.full(4, 0.5)], failed_indices=[0],
+            quality_scores=[0.0, 0.9], errors=["invalid content"], metadata={'model_used': "gemini"}
+        )
+        for change in worker.pending.values():
+            change.retry_at = 0.0
+        assert await worker.flush(force=True) == 1
+
+        assert worker.pending == {}
+        assert [doc['documentId'] for doc in memory_database.documents("vectordocuments")] == ["session_b"]
+        dead = memory_database.documents(DEAD_LETTER_COLLECTION)
+        assert [(doc['documentId'], doc['error'], doc['attempts']) for doc in dead] == [("a", "invalid content", 2)]
+        assert worker.get_stats()['dead_lettered'] == 1
+        assert checkpoint(memory_database) == second['_id']
@@ -0,0 +1,90 @@
+"""
+Tests for embedding response wire formats
+"""
+
+import base64
+import json
+import pytest
+import numpy as np
+
+from utils.wire_format import benchmark_wire_formats, dumps_json, negotiate_wire_format, render_embeddings
+
+
+@pytest.fixture
+def batch_payload():
+    return {
+        'success': True,
+        'embeddings': [np.array([0.5, -1.25, 3.0], dtype=np.float32), None, np.array([1.0, 2.0, 4.0])],
+        'total_processed': 3,
+        'successful_count': 2,
+        'failed_count': 1,
+        'errors': ["quota exceeded é"]
+    }
+
+
+class TestWireFormat:
+    """Test suite for wire format negotiation and rendering"""
+
+    def test_negotiation(self):
+        """Accept header media types win over encoding_format"""
+        assert negotiate_wire_format(None) == "json"
+        assert negotiate_wire_format("application/json", "base64") == "base64"
+        assert negotiate_wire_format("text/html, application/msgpack;q=0.9") == "msgpack"
+        assert negotiate_wire_format("application/octet-stream", "base64") == "binary"
+        with pytest.raises(ValueError):
+            negotiate_wire_format(None, "float16")
+
+    def test_json_matches_plain_encoding(self, batch_payload):
+        """Fast JSON produces the same document as tolist() plus json"""
+        response = render_embeddings(batch_payload, 'embeddings', "json")
+
+        body = json.loads(response.body)
+        assert body['embeddings'] == [[0.5, -1.25, 3.0], None, [1.0, 2.0, 4.0]]
+        assert body['failed_count'] == 1
+        assert json.loads(dumps_json({'score': np.float32(0.25), 'count': np.int64(3)})) == {'score': 0.25, 'count': 3}
+
+    def test_base64_round_trip(self, batch_payload):
+        """base64 vectors decode to the original little-endian float32 values"""
+        body = json.loads(render_embeddings(batch_payload, 'embeddings', "base64").body)
+
+        decoded = np.frombuffer(base64.b64decode(body['embeddings'][0]), dtype='<f4')
+        assert np.array_equal(decoded, batch_payload['embeddings'][0])
+        assert body['embeddings'][1] is None
+        assert body['encoding'] == "base64" and body['dtype'] == "float32"
+
+    def test_single_vector_base64(self):
+        """A single vector field is encoded as one string"""
+        payload = {'success': True, 'embedding': np.arange(4, dtype=np.float32), 'dimensions': 4}
+        body = json.loads(render_embeddings(payload, 'embedding', "base64").body)
+
+        assert np.array_equal(np.frombuffer(base64.b64decode(body['embedding']), dtype='<f4'), np.arange(4))
+
+    def test_binary_matrix_with_metadata_header(self, batch_payload):
+        """Raw format is a row-major float32 matrix with NaN rows for failures"""
+        response = render_embeddings(batch_payload, 'embeddings', "binary")
+
+        count = int(response.headers['X-Embedding-Count'])
+        dimensions = int(response.headers['X-Embedding-Dimensions'])
+        matrix = np.frombuffer(response.body, dtype='<f4').reshape(count, dimensions)
+        assert np.array_equal(matrix[2], [1.0, 2.0, 4.0])
+        assert np.isnan(matrix[1]).all()
+        metadata = json.loads(response.headers['X-Embedding-Metadata'])
+        assert metadata['errors'] == ["quota exceeded é"]
+        assert 'embeddings' not in metadata
+
+    def test_msgpack_packed_arrays(self, batch_payload):
+        """msgpack carries each vector as one float32 bin"""
+        msgpack = pytest.importorskip("msgpack")
+        body = msgpack.unpackb(render_embeddings(batch_payload, 'embeddings', "msgpack").body)
+
+        assert np.array_equal(np.frombuffer(body['embeddings'][0], dtype='<f4'), batch_payload['embeddings'][0])
+        assert body['embeddings'][1] is None
+        assert body['successful_count'] == 2
+
+    def test_benchmark_reports_every_format(self):
+        """The benchmark covers each format, and binary formats are smaller than JSON lists"""
+        results = benchmark_wire_formats(dimensions=64, count=10, repeats=1)
+
+        assert {'json_list', 'json', 'base64', 'binary'} <= set(results)
+        assert results['binary']['bytes_per_vector'] == 64 * 4
+        assert results['base64']['bytes_per_vector'] < results['json_list']['bytes_per_vector']
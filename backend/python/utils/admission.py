@@ -0,0 +1,344 @@
+"""
+Admission control and request deadlines for the API
+Bounds concurrent work per endpoint class, sheds excess load early and cancels requests past their deadline
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from starlette.responses import JSONResponse
+
+from config import config
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+# Paths that bypass admission control and deadlines: health checks and long-lived event streams
+EXEMPT_PATHS = ("/health",)
+EXEMPT_SUFFIXES = ("/events",)
+
+# Paths whose requests train models, scan collections or embed in bulk
+HEAVY_PATH_PREFIXES = (
+    "/api/process/",
+    "/api/ml/",
+    "/api/migration/start",
+    "/api/migration/validate",
+    "/api/projectors/fit",
+    "/api/vector-index/build",
+    "/api/vector-index/evaluate",
+    "/api/vector-index/compact",
+    "/api/vector-tiering/",
+    "/api/lexical-index/build",
+    "/api/embeddings/batch",
+    "/api/embeddings/wire-formats/benchmark"
+)
+
+# Header a caller (e.g. a gateway) uses to pass down a shorter timeout, in seconds
+TIMEOUT_HEADER = b"x-request-timeout"
+
+class Deadline:
+    """Point in time by which a request must have started its response"""
+
+    def __init__(self, timeout: float):
+        self.expires_at: Optional[float] = time.monotonic() + timeout
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left, or None when the deadline no longer applies"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def clear(self):
+        """Lift the deadline, e.g. once the response has started"""
+        self.expires_at = None
+
+_current_deadline: ContextVar[Optional[Deadline]] = ContextVar("request_deadline", default=None)
+
+@contextmanager
+def deadline_scope(timeout: float) -> Iterator[Deadline]:
+    """
+    Run the enclosed code under a deadline
+
+    Args:
+        timeout: Seconds from now
+
+    Yields:
+        The deadline; tasks created inside the scope share it
+    """
+    deadline = Deadline(timeout)
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+def remaining_time() -> Optional[float]:
+    """Seconds left before the current request's deadline, or None outside a request"""
+    deadline = _current_deadline.get()
+    return deadline.remaining() if deadline is not None else None
+
+def max_time_ms() -> Optional[int]:
+    """
+    Server-side time limit for a database operation under the current deadline
+
+    Returns:
+        Milliseconds (at least 1), or None when no deadline applies
+    """
+    remaining = remaining_time()
+    return None if remaining is None else max(1, int(remaining * 1000))
+
+class AdmissionRejected(Exception):
+    """A request shed before it started"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+@dataclass
+class _EndpointClass:
+    """Concurrency limit and wait queue of one endpoint class"""
+    limit: int
+    queue_size: int
+    semaphore: asyncio.Semaphore
+    active: int = 0
+    waiting: int = 0
+    stats: Dict[str, int] = field(default_factory=lambda: {
+        'admitted': 0, 'queued': 0, 'shed_queue_full': 0, 'shed_wait_timeout': 0,
+        'deadline_exceeded': 0, 'client_disconnected': 0
+    })
+
+class AdmissionController:
+    """
+    Per endpoint class concurrency limits with a bounded wait queue.
+
+    Requests run at once while their class has a free slot. Otherwise up to
+    queue_size of them wait, each for at most max_wait seconds (503 after
+    that); beyond queue_size they are refused immediately with 429. Heavy ML
+    and bulk endpoints share a small pool so they cannot starve cheap reads,
+    which share max_concurrent_requests.
+    """
+
+    def __init__(
+        self,
+        max_concurrent_requests: Optional[int] = None,
+        heavy_concurrent_requests: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        max_wait: Optional[float] = None
+    ):
+        queue_size = queue_size if queue_size is not None else config.service.admission_queue_size
+        self.max_wait = max_wait if max_wait is not None else config.service.admission_max_wait
+        limits = {
+            'default': max_concurrent_requests or config.service.max_concurrent_requests,
+            'heavy': heavy_concurrent_requests or config.service.heavy_concurrent_requests
+        }
+        self.classes = {
+            name: _EndpointClass(limit=limit, queue_size=queue_size, semaphore=asyncio.Semaphore(limit))
+            for name, limit in limits.items()
+        }
+
+    def classify(self, path: str) -> Optional[str]:
+        """
+        Endpoint class of a request path
+
+        Args:
+            path: Request path
+
+        Returns:
+            "heavy", "default", or None for paths exempt from admission control
+        """
+        if path in EXEMPT_PATHS or path.endswith(EXEMPT_SUFFIXES):
+            return None
+        if path.startswith(HEAVY_PATH_PREFIXES):
+            return 'heavy'
+        return 'default'
+
+    @asynccontextmanager
+    async def admit(self, name: str):
+        """
+        Hold a slot of an endpoint class for the enclosed request
+
+        Args:
+            name: Endpoint class
+
+        Raises:
+            AdmissionRejected: The wait queue is full (429) or no slot freed up in time (503)
+        """
+        endpoint_class = self.classes[name]
+        if endpoint_class.semaphore.locked():
+            if endpoint_class.waiting >= endpoint_class.queue_size:
+                endpoint_class.stats['shed_queue_full'] += 1
+                raise AdmissionRejected(429, f"Too many {name} requests queued", retry_after=1)
+
+            endpoint_class.stats['queued'] += 1
+            endpoint_class.waiting += 1
+            remaining = remaining_time()
+            wait = self.max_wait if remaining is None else min(self.max_wait, remaining)
+            try:
+                await asyncio.wait_for(endpoint_class.semaphore.acquire(), timeout=wait)
+            except asyncio.TimeoutError:
+                endpoint_class.stats['shed_wait_timeout'] += 1
+                raise AdmissionRejected(503, f"No capacity for {name} requests", retry_after=max(1, int(self.max_wait)))
+            finally:
+                endpoint_class.waiting -= 1
+        else:
+            await endpoint_class.semaphore.acquire()
+
+        endpoint_class.stats['admitted'] += 1
+        endpoint_class.active += 1
+        try:
+            yield
+        finally:
+            endpoint_class.active -= 1
+            endpoint_class.semaphore.release()
+
+    def record(self, name: str, outcome: str):
+        """Count a deadline_exceeded or client_disconnected outcome"""
+        self.classes[name].stats[outcome] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get admission statistics per endpoint class"""
+        return {
+            name: {**endpoint_class.stats, 'limit': endpoint_class.limit, 'active': endpoint_class.active,
+                   'waiting': endpoint_class.waiting, 'queue_size': endpoint_class.queue_size}
+            for name, endpoint_class in self.classes.items()
+        }
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware applying admission control and a deadline to every request.
+
+    The deadline (request_timeout, or a shorter X-Request-Timeout from the
+    caller) covers queueing and handling up to the start of the response.
+    When it expires, or the client disconnects first, the handler task is
+    cancelled, which cancels the Mongo query or queued executor job it is
+    awaiting; database reads also carry the remaining time as maxTimeMS so
+    the server abandons them too. Streaming responses are bounded only by
+    the client staying connected, and background tasks that run after the
+    response are left alone.
+    """
+
+    def __init__(self, app, controller: Optional[AdmissionController] = None, request_timeout: Optional[float] = None):
+        self.app = app
+        self.controller = controller or admission_controller
+        self.request_timeout = request_timeout or config.service.request_timeout
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        name = self.controller.classify(scope["path"])
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        with deadline_scope(self._timeout(scope)) as deadline:
+            try:
+                async with self.controller.admit(name):
+                    await self._run(name, deadline, scope, receive, send)
+            except AdmissionRejected as e:
+                response = JSONResponse(
+                    {"detail": e.detail}, status_code=e.status_code, headers={"Retry-After": str(e.retry_after)}
+                )
+                await response(scope, receive, send)
+
+    # Private methods
+
+    def _timeout(self, scope) -> float:
+        for key, value in scope.get("headers", []):
+            if key == TIMEOUT_HEADER:
+                try:
+                    requested = float(value)
+                except ValueError:
+                    break
+                if requested > 0:
+                    return min(requested, self.request_timeout)
+        return self.request_timeout
+
+    async def _run(self, name: str, deadline: Deadline, scope, receive, send):
+        started = asyncio.Event()
+        completed = asyncio.Event()
+        disconnected = asyncio.Event()
+        # One message of read-ahead keeps upload backpressure while watching for a disconnect
+        messages: asyncio.Queue = asyncio.Queue(maxsize=1)
+
+        async def listen():
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    disconnected.set()
+                await messages.put(message)
+                if message["type"] == "http.disconnect":
+                    return
+
+        async def receive_message():
+            if disconnected.is_set() and messages.empty():
+                return {"type": "http.disconnect"}
+            return await messages.get()
+
+        async def send_message(message):
+            if message["type"] == "http.response.start":
+                deadline.clear()
+                started.set()
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                completed.set()
+            await send(message)
+
+        app_task = asyncio.create_task(self.app(scope, receive_message, send_message))
+        listener = asyncio.create_task(listen())
+        try:
+            outcome = await self._supervise(app_task, deadline, started, completed, disconnected)
+        except asyncio.CancelledError:
+            app_task.cancel()
+            raise
+        finally:
+            listener.cancel()
+
+        if outcome is None:
+            app_task.result()
+            return
+
+        app_task.cancel()
+        await asyncio.gather(app_task, return_exceptions=True)
+        self.controller.record(name, outcome)
+        logger.warning(f"Cancelled {scope['method']} {scope['path']}: {outcome.replace('_', ' ')}")
+        if outcome == 'deadline_exceeded' and not started.is_set():
+            response = JSONResponse({"detail": "Request deadline exceeded"}, status_code=504)
+            await response(scope, receive, send)
+
+    async def _supervise(
+        self,
+        app_task: asyncio.Task,
+        deadline: Deadline,
+        started: asyncio.Event,
+        completed: asyncio.Event,
+        disconnected: asyncio.Event
+    ) -> Optional[str]:
+        """Wait for the handler; returns why it must be cancelled, or None once it may finish"""
+        waiters: Tuple[asyncio.Task, ...] = tuple(
+            asyncio.create_task(event.wait()) for event in (started, completed, disconnected)
+        )
+        try:
+            while not app_task.done():
+                if completed.is_set():
+                    # Only background tasks remain
+                    await asyncio.wait({app_task})
+                    break
+                if disconnected.is_set():
+                    return 'client_disconnected'
+                pending = {app_task, *(waiter for waiter in waiters if not waiter.done())}
+                done, _ = await asyncio.wait(pending, timeout=deadline.remaining(), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    return 'deadline_exceeded'
+            return None
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+
+# Global admission controller instance
+admission_controller = AdmissionController()
@@ -0,0 +1,90 @@
+"""
+Bloom filter for Cryptique Python services
+Probabilistic set membership with no false negatives
+"""
+
+import hashlib
+import math
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+import numpy as np
+
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+class BloomFilter:
+    """
+    Bloom filter sized for a target capacity and false positive rate.
+    Uses double hashing over a 128-bit BLAKE2 digest.
+    """
+
+    def __init__(self, capacity: int = 1000000, error_rate: float = 0.01):
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(math.ceil(-self.capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / self.capacity * math.log(2))))
+        self.bits = np.zeros((self.num_bits + 7) // 8, dtype=np.uint8)
+        self.count = 0
+        # Identifies the state of the source data the filter was built from
+        self.source_version: Optional[str] = None
+
+    def add(self, key: str):
+        """Add a key"""
+        positions = self._positions(key)
+        # ufunc.at so that positions sharing a byte all get their bit set
+        np.bitwise_or.at(self.bits, positions >> 3, (1 << (positions & 7)).astype(np.uint8))
+        self.count += 1
+
+    def add_many(self, keys: Iterable[str]):
+        """Add several keys"""
+        for key in keys:
+            self.add(key)
+
+    def __contains__(self, key: str) -> bool:
+        positions = self._positions(key)
+        return bool(np.all(self.bits[positions >> 3] & (1 << (positions & 7)).astype(np.uint8)))
+
+    def estimated_error_rate(self) -> float:
+        """Expected false positive rate at the current fill level"""
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+    def save(self, path: str):
+        """Persist the filter to an .npz file"""
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'wb') as f:
+            np.savez(
+                f,
+                bits=self.bits,
+                params=np.array([self.capacity, self.num_bits, self.num_hashes, self.count], dtype=np.int64),
+                error_rate=np.array([self.error_rate]),
+                source_version=np.array(self.source_version or "")
+            )
+
+    @classmethod
+    def load(cls, path: str) -> 'BloomFilter':
+        """Load a filter saved with save()"""
+        with np.load(path) as data:
+            capacity, num_bits, num_hashes, count = (int(value) for value in data['params'])
+            bloom = cls.__new__(cls)
+            bloom.capacity = capacity
+            bloom.error_rate = float(data['error_rate'][0])
+            bloom.num_bits = num_bits
+            bloom.num_hashes = num_hashes
+            bloom.bits = data['bits'].copy()
+            bloom.count = count
+            source_version = str(data['source_version']) if 'source_version' in data.files else ""
+            bloom.source_version = source_version or None
+        return bloom
+
+    def _positions(self, key: str) -> np.ndarray:
+        h1, h2 = self._hash(key)
+        return (h1 + np.arange(self.num_hashes, dtype=np.uint64) * h2) % np.uint64(self.num_bits)
+
+    @staticmethod
+    def _hash(key: str) -> Tuple[np.uint64, np.uint64]:
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        return (
+            np.uint64(int.from_bytes(digest[:8], 'little')),
+            np.uint64(int.from_bytes(digest[8:], 'little') | 1)
+        )
@@ -0,0 +1,170 @@
+"""
+Adaptive numCandidates control for approximate vector search
+Tunes the candidate budget per index, filter selectivity and limit to a recall target
+"""
+
+import math
+import random
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from .logger import get_logger
+from .metrics import get_metrics_collector
+
+logger = get_logger(__name__)
+
+BudgetKey = Tuple[str, str, int, bool]
+
+# Upper bound Atlas accepts for numCandidates
+MAX_NUM_CANDIDATES = 10000
+
+# Filters matching at least this fraction of documents all share the "broad" budget
+BROAD_SELECTIVITY = 0.1
+
+@dataclass
+class CandidateBudget:
+    """Candidate budget and observed trade-off for one query class"""
+    multiplier: float
+    calibrations: int = 0
+    recall: Optional[float] = None
+    latency: Optional[float] = None
+
+class CandidateBudgetController:
+    """
+    Chooses numCandidates as limit * multiplier, with one multiplier per query
+    class: index, filter selectivity bucket, limit bucket and whether a residual
+    $match runs after the search. A sample of searches is repeated as exact
+    searches; the measured recall raises the multiplier when below target and
+    slowly lowers it when comfortably above, so easy queries stop paying for
+    candidates they do not need and selective ones get enough.
+    """
+
+    # Recall above target + margin lets the budget shrink
+    RECALL_MARGIN = 0.02
+    GROWTH = 1.5
+    DECAY = 0.9
+    # Weight of the newest observation in the recall/latency moving averages
+    SMOOTHING = 0.2
+
+    def __init__(
+        self,
+        target_recall: float = 0.95,
+        initial_multiplier: float = 10.0,
+        min_multiplier: float = 1.5,
+        max_candidates: int = MAX_NUM_CANDIDATES,
+        calibration_rate: float = 0.02
+    ):
+        self.target_recall = target_recall
+        self.initial_multiplier = initial_multiplier
+        self.min_multiplier = min_multiplier
+        self.max_candidates = min(max_candidates, MAX_NUM_CANDIDATES)
+        self.calibration_rate = calibration_rate
+        self.budgets: Dict[BudgetKey, CandidateBudget] = {}
+        self.metrics = get_metrics_collector()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def selectivity_bucket(selectivity: Optional[float]) -> str:
+        """Order-of-magnitude bucket for the fraction of documents a filter matches"""
+        if selectivity is None or selectivity >= BROAD_SELECTIVITY:
+            return "broad"
+        if selectivity >= 0.01:
+            return "1-10%"
+        if selectivity >= 0.001:
+            return "0.1-1%"
+        return "<0.1%"
+
+    def key(self, index_name: str, limit: int, selectivity: Optional[float], residual: bool) -> BudgetKey:
+        """Query class of a search"""
+        limit_bucket = 2 ** math.ceil(math.log2(max(limit, 1)))
+        return (index_name, self.selectivity_bucket(selectivity), limit_bucket, residual)
+
+    def num_candidates(self, key: BudgetKey, limit: int) -> int:
+        """
+        Candidate budget for a search
+
+        Args:
+            key: Query class from key()
+            limit: Number of results requested
+
+        Returns:
+            numCandidates, at least limit and at most max_candidates
+        """
+        with self._lock:
+            budget = self.budgets.setdefault(key, CandidateBudget(self.initial_multiplier))
+            multiplier = budget.multiplier
+        return int(min(max(math.ceil(limit * multiplier), limit), self.max_candidates))
+
+    def should_calibrate(self) -> bool:
+        """Whether to measure this search against exact search"""
+        return random.random() < self.calibration_rate
+
+    def record_latency(self, key: BudgetKey, duration: float):
+        """Record the latency of a search"""
+        with self._lock:
+            budget = self.budgets.setdefault(key, CandidateBudget(self.initial_multiplier))
+            budget.latency = self._smooth(budget.latency, duration)
+        self.metrics.record_timer("vector_search.latency", duration, tags=self._tags(key))
+
+    def record_recall(self, key: BudgetKey, recall: float):
+        """
+        Record the recall of a search measured against exact search and adjust the budget
+
+        Args:
+            key: Query class from key()
+            recall: Fraction of exact top results the approximate search returned
+        """
+        with self._lock:
+            budget = self.budgets.setdefault(key, CandidateBudget(self.initial_multiplier))
+            budget.calibrations += 1
+            budget.recall = self._smooth(budget.recall, recall)
+
+            if recall < self.target_recall:
+                budget.multiplier *= self.GROWTH
+            elif budget.recall > self.target_recall + self.RECALL_MARGIN:
+                budget.multiplier *= self.DECAY
+            # Enough for the smallest limit in the bucket to reach max_candidates
+            max_multiplier = self.max_candidates / max(key[2] // 2, 1)
+            budget.multiplier = min(max(budget.multiplier, self.min_multiplier), max_multiplier)
+            multiplier = budget.multiplier
+
+        tags = self._tags(key)
+        self.metrics.set_gauge("vector_search.recall", budget.recall, tags=tags)
+        self.metrics.set_gauge("vector_search.candidate_multiplier", multiplier, tags=tags)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get the budget and recall/latency trade-off per query class"""
+        with self._lock:
+            return {
+                'target_recall': self.target_recall,
+                'classes': [
+                    {
+                        'index': key[0],
+                        'selectivity': key[1],
+                        'limit_bucket': key[2],
+                        'residual_filter': key[3],
+                        'num_candidates': int(min(math.ceil(key[2] * budget.multiplier), self.max_candidates)),
+                        'multiplier': budget.multiplier,
+                        'recall': budget.recall,
+                        'latency': budget.latency,
+                        'calibrations': budget.calibrations
+                    }
+                    for key, budget in self.budgets.items()
+                ]
+            }
+
+    # Private methods
+
+    def _smooth(self, previous: Optional[float], value: float) -> float:
+        if previous is None:
+            return value
+        return (1 - self.SMOOTHING) * previous + self.SMOOTHING * value
+
+    def _tags(self, key: BudgetKey) -> Dict[str, str]:
+        return {
+            'index': key[0],
+            'selectivity': key[1],
+            'limit': str(key[2]),
+            'residual': str(key[3]).lower()
+        }
@@ -0,0 +1,148 @@
+"""
+Columnar (Arrow IPC stream / Parquet) responses for per-row API results
+"""
+
+import io
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Union
+import pandas as pd
+from fastapi.responses import Response
+
+from .logger import get_logger
+from .wire_format import dumps_json
+
+if TYPE_CHECKING:
+    import pyarrow as pa
+
+logger = get_logger(__name__)
+
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+
+# Accept header media types -> columnar format
+COLUMNAR_MEDIA_TYPES = {
+    ARROW_STREAM_MEDIA_TYPE: "arrow",
+    PARQUET_MEDIA_TYPE: "parquet",
+    "application/x-parquet": "parquet"
+}
+
+# Schema metadata key holding the response's non-row fields as JSON
+METADATA_KEY = b"cryptique.metadata"
+
+@dataclass
+class ColumnarRequest:
+    """Requested columnar output"""
+    format: str  # "arrow" or "parquet"
+    columns: Optional[List[str]] = None
+
+def negotiate_columnar_format(
+    accept: Optional[str],
+    format: Optional[str] = None,
+    columns: Optional[str] = None
+) -> Optional[ColumnarRequest]:
+    """
+    Pick a columnar response format
+
+    Args:
+        accept: Accept request header
+        format: Explicit format ("json", "arrow" or "parquet"), preferred over Accept
+        columns: Comma-separated columns to return
+
+    Returns:
+        ColumnarRequest, or None for a JSON response
+    """
+    if format:
+        format = format.lower()
+        if format not in ("json", "arrow", "parquet"):
+            raise ValueError(f"Unsupported format: {format}")
+    else:
+        media_types = [media_range.split(';')[0].strip().lower() for media_range in (accept or "").split(',')]
+        format = next((COLUMNAR_MEDIA_TYPES[media] for media in media_types if media in COLUMNAR_MEDIA_TYPES), "json")
+
+    if format == "json":
+        return None
+    _pyarrow()
+    selected = [column.strip() for column in columns.split(',') if column.strip()] if columns else None
+    return ColumnarRequest(format=format, columns=selected)
+
+def to_arrow_table(
+    rows: Union[pd.DataFrame, Dict[str, Any]],
+    columns: Optional[List[str]] = None,
+    metadata: Optional[Dict[str, Any]] = None
+) -> "pa.Table":
+    """
+    Build an Arrow table from a DataFrame or a mapping of column name to values
+
+    Numeric numpy columns are wrapped without copying. Columns Arrow cannot
+    type (ObjectIds, mixed objects) are sent as strings.
+
+    Args:
+        rows: DataFrame (a non-default index becomes a column) or columns
+        columns: Columns to keep, in order
+        metadata: Non-row response fields stored as JSON in the schema metadata
+
+    Returns:
+        Arrow table
+    """
+    if isinstance(rows, pd.DataFrame):
+        if not isinstance(rows.index, pd.RangeIndex):
+            rows = rows.reset_index()
+        rows = {str(name): rows[name] for name in rows.columns}
+    rows = {name: values for name, values in rows.items() if values is not None}
+
+    if columns:
+        unknown = [column for column in columns if column not in rows]
+        if unknown:
+            raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+        rows = {column: rows[column] for column in columns}
+
+    pa = _pyarrow()
+    arrays = {name: _to_arrow_array(pa, values) for name, values in rows.items()}
+    table = pa.table(arrays)
+    if metadata:
+        table = table.replace_schema_metadata({METADATA_KEY: dumps_json(metadata)})
+    return table
+
+def render_table(
+    rows: Union[pd.DataFrame, Dict[str, Any]],
+    request: ColumnarRequest,
+    metadata: Optional[Dict[str, Any]] = None
+) -> Response:
+    """
+    Render per-row results as an Arrow IPC stream or a Parquet file
+
+    Args:
+        rows: DataFrame or mapping of column name to values
+        request: Negotiated columnar request
+        metadata: Non-row response fields, stored in the schema metadata
+
+    Returns:
+        Response with the encoded table
+    """
+    pa = _pyarrow()
+    table = to_arrow_table(rows, request.columns, metadata)
+    sink = io.BytesIO()
+    if request.format == "arrow":
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        media_type = ARROW_STREAM_MEDIA_TYPE
+    else:
+        pa.parquet.write_table(table, sink, compression="zstd")
+        media_type = PARQUET_MEDIA_TYPE
+    return Response(sink.getvalue(), media_type=media_type, headers={'X-Row-Count': str(table.num_rows)})
+
+def _pyarrow():
+    """Import pyarrow on first use, so JSON-only deployments never load it"""
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:  # pragma: no cover - pyarrow is listed in requirements.txt
+        raise ValueError("Columnar responses require pyarrow")
+    return pa
+
+def _to_arrow_array(pa, values: Any) -> "pa.Array":
+    try:
+        return pa.array(values, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        return pa.array([None if value is None else str(value) for value in values], type=pa.string())
@@ -3,19 +3,58 @@ Database utility for MongoDB operations
 """
 
 import asyncio
-from typing import Dict, List, Optional, Any, AsyncGenerator
+from typing import Dict, List, Optional, Any, AsyncGenerator, Tuple
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase, AsyncIOMotorCollection
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
 from pymongo.errors import ConnectionFailure, OperationFailure
 from bson import ObjectId
 import time
 from contextlib import asynccontextmanager
+from collections import OrderedDict
+import json
 
 from config import config
 from utils.logger import get_logger
+from utils.candidate_budget import BROAD_SELECTIVITY, CandidateBudgetController
+from utils.admission import max_time_ms
 
 logger = get_logger(__name__)
 
+# Operators accepted inside the $vectorSearch filter clause
+VECTOR_FILTER_OPERATORS = {"$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$in", "$nin"}
+
+def split_vector_filters(
+    filters: Optional[Dict[str, Any]],
+    indexed_fields: List[str]
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Split a query filter into the part $vectorSearch can apply while it searches
+    and the part that has to run as a $match afterwards
+    
+    Args:
+        filters: MongoDB query filter
+        indexed_fields: Fields indexed with type "filter" in the vector index
+        
+    Returns:
+        Tuple of (push-down filter, residual filter)
+    """
+    def pushable(key: str, value: Any) -> bool:
+        if key in ("$and", "$or"):
+            return isinstance(value, list) and all(
+                isinstance(clause, dict) and all(pushable(k, v) for k, v in clause.items())
+                for clause in value
+            )
+        if key not in indexed_fields:
+            return False
+        if isinstance(value, dict):
+            return bool(value) and all(operator in VECTOR_FILTER_OPERATORS for operator in value)
+        return not isinstance(value, list)
+    
+    pushdown, residual = {}, {}
+    for key, value in (filters or {}).items():
+        (pushdown if pushable(key, value) else residual)[key] = value
+    return pushdown, residual
+
 class DatabaseManager:
     """
     Async MongoDB database manager with connection pooling and error handling
@@ -27,6 +66,14 @@ class DatabaseManager:
         self.sync_client: Optional[MongoClient] = None
         self.sync_db = None
         self.is_connected = False
+        self.candidate_budget = CandidateBudgetController(
+            target_recall=config.database.vector_target_recall,
+            min_multiplier=config.database.vector_min_candidates_multiplier,
+            max_candidates=config.database.vector_max_candidates,
+            calibration_rate=config.database.vector_calibration_rate
+        )
+        self._selectivity_cache: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._calibration_tasks = set()
         
     async def connect(self) -> None:
         """
@@ -124,7 +171,7 @@ class DatabaseManager:
         """
         try:
             collection = self.get_collection(collection_name)
-            cursor = collection.find(filter_dict, projection)
+            cursor = collection.find(filter_dict, projection, max_time_ms=max_time_ms())
             
             if sort:
                 cursor = cursor.sort(sort)
@@ -140,6 +187,35 @@ class DatabaseManager:
             logger.error(f"Error finding documents in {collection_name}: {e}")
             raise
     
+    async def stream_documents(
+        self,
+        collection_name: str,
+        filter_dict: Dict[str, Any],
+        projection: Optional[Dict[str, int]] = None,
+        batch_size: int = 1000
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Iterate over documents without loading them all into memory
+        
+        Args:
+            collection_name: Name of the collection
+            filter_dict: MongoDB filter dictionary
+            projection: Fields to include/exclude
+            batch_size: Cursor batch size
+            
+        Yields:
+            Documents
+        """
+        try:
+            collection = self.get_collection(collection_name)
+            cursor = collection.find(filter_dict, projection, max_time_ms=max_time_ms()).batch_size(batch_size)
+            async for document in cursor:
+                yield document
+                
+        except Exception as e:
+            logger.error(f"Error streaming documents from {collection_name}: {e}")
+            raise
+    
     async def find_one_document(
         self,
         collection_name: str,
@@ -159,7 +235,7 @@ class DatabaseManager:
         """
         try:
             collection = self.get_collection(collection_name)
-            document = await collection.find_one(filter_dict, projection)
+            document = await collection.find_one(filter_dict, projection, max_time_ms=max_time_ms())
             return document
             
         except Exception as e:
@@ -268,6 +344,41 @@ class DatabaseManager:
             logger.error(f"Error updating documents in {collection_name}: {e}")
             raise
     
+    async def find_one_and_update(
+        self,
+        collection_name: str,
+        filter_dict: Dict[str, Any],
+        update_dict: Dict[str, Any],
+        sort: Optional[List[Tuple[str, int]]] = None,
+        projection: Optional[Dict[str, Any]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Atomically update the first matching document and return it
+        
+        Args:
+            collection_name: Name of the collection
+            filter_dict: Filter to find the document
+            update_dict: Update operations
+            sort: Sort deciding which matching document is updated
+            projection: Fields to return
+            
+        Returns:
+            The document after the update, or None if nothing matched
+        """
+        try:
+            collection = self.get_collection(collection_name)
+            return await collection.find_one_and_update(
+                filter_dict,
+                update_dict,
+                sort=sort,
+                projection=projection,
+                return_document=ReturnDocument.AFTER
+            )
+            
+        except Exception as e:
+            logger.error(f"Error in find-and-update on {collection_name}: {e}")
+            raise
+    
     async def delete_document(
         self,
         collection_name: str,
@@ -333,7 +444,7 @@ class DatabaseManager:
         """
         try:
             collection = self.get_collection(collection_name)
-            cursor = collection.aggregate(pipeline)
+            cursor = collection.aggregate(pipeline, **self._time_limit())
             results = await cursor.to_list(length=None)
             return results
             
@@ -341,6 +452,102 @@ class DatabaseManager:
             logger.error(f"Error running aggregation in {collection_name}: {e}")
             raise
     
+    async def stream_aggregate(
+        self,
+        collection_name: str,
+        pipeline: List[Dict[str, Any]],
+        batch_size: int = 1000
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Iterate over aggregation results without loading them all into memory
+        
+        Args:
+            collection_name: Name of the collection
+            pipeline: Aggregation pipeline
+            batch_size: Cursor batch size
+            
+        Yields:
+            Result documents
+        """
+        try:
+            collection = self.get_collection(collection_name)
+            async for document in collection.aggregate(pipeline, batchSize=batch_size, allowDiskUse=True, **self._time_limit()):
+                yield document
+                
+        except Exception as e:
+            logger.error(f"Error streaming aggregation from {collection_name}: {e}")
+            raise
+    
+    async def watch(
+        self,
+        collection_name: str,
+        pipeline: Optional[List[Dict[str, Any]]] = None,
+        resume_after: Optional[Dict[str, Any]] = None,
+        full_document: str = "updateLookup",
+        max_await_ms: int = 1000
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Tail a change stream (requires a replica set)
+        
+        Args:
+            collection_name: Name of the collection
+            pipeline: Change stream pipeline, e.g. a $match on operationType
+            resume_after: Resume token of the last processed event
+            full_document: fullDocument option; "updateLookup" includes the current document on updates
+            max_await_ms: Longest time the server waits for new events per getMore
+            
+        Yields:
+            Change events
+        """
+        try:
+            collection = self.get_collection(collection_name)
+            async with collection.watch(
+                pipeline or [],
+                full_document=full_document,
+                resume_after=resume_after,
+                max_await_time_ms=max_await_ms
+            ) as stream:
+                async for change in stream:
+                    yield change
+                    
+        except Exception as e:
+            logger.error(f"Error watching {collection_name}: {e}")
+            raise
+    
+    async def bulk_write(
+        self,
+        collection_name: str,
+        operations: List[Any],
+        ordered: bool = False
+    ) -> Dict[str, int]:
+        """
+        Run write operations (pymongo InsertOne, UpdateOne, DeleteMany, ...) in one round trip
+        
+        Args:
+            collection_name: Name of the collection
+            operations: Write operations
+            ordered: Stop at the first error instead of applying the rest
+            
+        Returns:
+            Counts of inserted, matched, modified, upserted and deleted documents
+        """
+        try:
+            if not operations:
+                return {'inserted': 0, 'matched': 0, 'modified': 0, 'upserted': 0, 'deleted': 0}
+            collection = self.get_collection(collection_name)
+            result = await collection.bulk_write(operations, ordered=ordered)
+            return {
+                'inserted': result.inserted_count,
+                'matched': result.matched_count,
+                'modified': result.modified_count,
+                'upserted': result.upserted_count,
+                'deleted': result.deleted_count
+            }
+            
+        except Exception as e:
+            logger.error(f"Error in bulk write to {collection_name}: {e}")
+            raise
+    
     async def count_documents(
         self,
         collection_name: str,
@@ -358,7 +565,7 @@ class DatabaseManager:
         """
         try:
             collection = self.get_collection(collection_name)
-            count = await collection.count_documents(filter_dict)
+            count = await collection.count_documents(filter_dict, **self._time_limit())
             return count
             
         except Exception as e:
@@ -398,10 +605,17 @@ class DatabaseManager:
         query_vector: List[float],
         index_name: str,
         limit: int = 10,
-        filters: Optional[Dict[str, Any]] = None
+        filters: Optional[Dict[str, Any]] = None,
+        num_candidates: Optional[int] = None
     ) -> List[Dict[str, Any]]:
         """
-        Perform vector similarity search
+        Perform vector similarity search. Filters on indexed filter fields are
+        pushed into $vectorSearch so selective filters still return up to limit
+        hits; any other conditions run as a $match over all candidates.
+        
+        Unless num_candidates is given, the candidate budget comes from the
+        adaptive controller for this index, filter selectivity and limit, and a
+        sample of searches is checked against exact search in the background.
         
         Args:
             collection_name: Name of the collection
@@ -409,28 +623,37 @@ class DatabaseManager:
             index_name: Vector search index name
             limit: Maximum number of results
             filters: Additional filters
+            num_candidates: Fixed candidate budget
             
         Returns:
             Search results with similarity scores
         """
         try:
-            collection = self.get_collection(collection_name)
-            
-            pipeline = [
-                {
-                    "$vectorSearch": {
-                        "index": index_name,
-                        "path": "embedding",
-                        "queryVector": query_vector,
-                        "numCandidates": limit * 10,
-                        "limit": limit
-                    }
-                }
-            ]
-            
-            # Add filters if provided
-            if filters:
-                pipeline.append({"$match": filters})
+            start_time = time.time()
+            pushdown, residual = split_vector_filters(filters, config.database.vector_filter_fields)
+            
+            budget_key = None
+            if num_candidates is None:
+                selectivity = await self._filter_selectivity(collection_name, pushdown) if pushdown else None
+                budget_key = self.candidate_budget.key(index_name, limit, selectivity, bool(residual))
+                num_candidates = self.candidate_budget.num_candidates(budget_key, limit)
+            
+            vector_stage = {
+                "index": index_name,
+                "path": "embedding",
+                "queryVector": query_vector,
+                "numCandidates": num_candidates,
+                # Keep every candidate when a residual $match will discard some
+                "limit": num_candidates if residual else limit
+            }
+            if pushdown:
+                vector_stage["filter"] = pushdown
+            
+            pipeline = [{"$vectorSearch": vector_stage}]
+            
+            if residual:
+                pipeline.append({"$match": residual})
+                pipeline.append({"$limit": limit})
             
             # Add score field
             pipeline.append({
@@ -440,12 +663,101 @@ class DatabaseManager:
             })
             
             results = await self.aggregate(collection_name, pipeline)
+            
+            if budget_key is not None:
+                self.candidate_budget.record_latency(budget_key, time.time() - start_time)
+                if self.candidate_budget.should_calibrate():
+                    task = asyncio.create_task(self._calibrate_candidates(
+                        collection_name, query_vector, index_name, limit, pushdown, residual, num_candidates, budget_key
+                    ))
+                    self._calibration_tasks.add(task)
+                    task.add_done_callback(self._calibration_tasks.discard)
+            
             return results
             
         except Exception as e:
             logger.error(f"Error performing vector search in {collection_name}: {e}")
             raise
     
+    @staticmethod
+    def _time_limit() -> Dict[str, int]:
+        """maxTimeMS option for the remaining time of the current request's deadline, if any"""
+        limit = max_time_ms()
+        return {"maxTimeMS": limit} if limit is not None else {}
+    
+    async def _filter_selectivity(self, collection_name: str, filter_dict: Dict[str, Any]) -> Optional[float]:
+        """
+        Fraction of documents matching a filter, cached for a few minutes per filter.
+        The count stops once the filter is known to be broad and is cut off after
+        vector_selectivity_max_time_ms; a filter that cannot be counted in time
+        is treated as broad (None).
+        """
+        cache_key = f"{collection_name}:{json.dumps(filter_dict, sort_keys=True, default=str)}"
+        cached = self._selectivity_cache.get(cache_key)
+        if cached and time.time() - cached[1] < config.database.vector_selectivity_ttl:
+            self._selectivity_cache.move_to_end(cache_key)
+            return cached[0]
+        
+        collection = self.get_collection(collection_name)
+        time_limit = config.database.vector_selectivity_max_time_ms
+        request_limit = max_time_ms()
+        if request_limit is not None:
+            time_limit = min(time_limit, request_limit)
+        try:
+            total = await collection.estimated_document_count(maxTimeMS=time_limit)
+            # Counting past the broad bucket boundary cannot change the query class
+            matched = await collection.count_documents(
+                filter_dict, limit=max(1, int(total * BROAD_SELECTIVITY)), maxTimeMS=time_limit
+            )
+            selectivity = matched / total if total else 1.0
+        except Exception as e:
+            logger.warning(f"Could not estimate filter selectivity in {collection_name}: {e}")
+            selectivity = None
+        
+        self._selectivity_cache[cache_key] = (selectivity, time.time())
+        if len(self._selectivity_cache) > 1024:
+            self._selectivity_cache.popitem(last=False)
+        return selectivity
+    
+    async def _calibrate_candidates(
+        self,
+        collection_name: str,
+        query_vector: List[float],
+        index_name: str,
+        limit: int,
+        pushdown: Dict[str, Any],
+        residual: Dict[str, Any],
+        num_candidates: int,
+        budget_key
+    ):
+        """Measure recall@limit of the approximate search against exact search, both after the residual filter"""
+        try:
+            def stage(search_limit: int, **options) -> List[Dict[str, Any]]:
+                vector_stage = {"index": index_name, "path": "embedding", "queryVector": query_vector}
+                if pushdown:
+                    vector_stage["filter"] = pushdown
+                pipeline = [{"$vectorSearch": {**vector_stage, "limit": search_limit, **options}}]
+                if residual:
+                    pipeline += [{"$match": residual}, {"$limit": limit}]
+                return pipeline + [{"$project": {"_id": 1}}]
+            
+            # As in vector_search, a residual filter keeps every candidate until the $match
+            approximate = await self.aggregate(
+                collection_name, stage(num_candidates if residual else limit, numCandidates=num_candidates)
+            )
+            exact = await self.aggregate(
+                collection_name, stage(self.candidate_budget.max_candidates if residual else limit, exact=True)
+            )
+            if not exact:
+                return
+            
+            found = {doc['_id'] for doc in approximate}
+            recall = sum(doc['_id'] in found for doc in exact) / len(exact)
+            self.candidate_budget.record_recall(budget_key, recall)
+            
+        except Exception as e:
+            logger.error(f"Error calibrating vector search candidates in {collection_name}: {e}")
+    
     @asynccontextmanager
     async def transaction(self):
         """
@@ -0,0 +1,125 @@
+"""
+MinHash locality-sensitive hashing for Cryptique Python services
+Finds near-duplicate texts by estimated Jaccard similarity of character shingles
+"""
+
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+# Mersenne prime modulus of the universal hash family; a * x stays below 2**62
+MERSENNE_PRIME = (1 << 31) - 1
+
+def lsh_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """
+    Number of bands and rows per band with the highest candidate threshold
+    (1/b)^(1/r) not above the similarity threshold, so that pairs at the
+    threshold are likely to share a band
+
+    Args:
+        num_perm: Signature length
+        threshold: Jaccard similarity threshold
+
+    Returns:
+        Tuple of (bands, rows)
+    """
+    options = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+    below = [option for option in options if (1 / option[0]) ** (1 / option[1]) <= threshold]
+    return max(below or options[-1:], key=lambda option: (1 / option[0]) ** (1 / option[1]))
+
+class MinHashLSH:
+    """
+    Near-duplicate index over MinHash signatures. Signatures are split into
+    bands; texts sharing any band bucket are candidates, and a candidate is a
+    near duplicate when the fraction of equal signature values (the Jaccard
+    estimate) reaches the threshold. Only representatives are stored, up to
+    max_entries, after which the index keeps matching but stops growing.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.9,
+        num_perm: int = 128,
+        shingle_size: int = 5,
+        max_entries: int = 10000,
+        seed: int = 1
+    ):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.max_entries = max_entries
+        self.bands, self.rows = lsh_bands(num_perm, threshold)
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.buckets: List[Dict[bytes, List[Any]]] = [{} for _ in range(self.bands)]
+        self.signatures: Dict[Any, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def signature(self, text: str) -> np.ndarray:
+        """
+        MinHash signature of a text's character shingles
+
+        Args:
+            text: Text to sign
+
+        Returns:
+            uint64 array of num_perm minimum hash values
+        """
+        text = " ".join(text.lower().split())
+        size = self.shingle_size
+        shingles = {text[i:i + size] for i in range(max(len(text) - size + 1, 1))}
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode('utf-8')) for shingle in shingles), dtype=np.uint64, count=len(shingles)
+        ) % MERSENNE_PRIME
+        return ((np.outer(self._a, hashes) + self._b[:, None]) % MERSENNE_PRIME).min(axis=1)
+
+    def query(self, signature: np.ndarray) -> Optional[Tuple[Any, float]]:
+        """
+        Most similar stored text at or above the threshold
+
+        Args:
+            signature: Signature from signature()
+
+        Returns:
+            Tuple of (key, estimated similarity), or None
+        """
+        candidates = set()
+        for band, bucket in zip(self._band_keys(signature), self.buckets):
+            candidates.update(bucket.get(band, ()))
+
+        best = None
+        for key in candidates:
+            similarity = float(np.mean(self.signatures[key] == signature))
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (key, similarity)
+        return best
+
+    def add(self, key: Any, signature: np.ndarray) -> bool:
+        """
+        Store a text's signature
+
+        Args:
+            key: Key returned by query() for texts similar to this one
+            signature: Signature from signature()
+
+        Returns:
+            False when the index is full
+        """
+        if len(self.signatures) >= self.max_entries:
+            return False
+        self.signatures[key] = signature
+        for band, bucket in zip(self._band_keys(signature), self.buckets):
+            bucket.setdefault(band, []).append(key)
+        return True
+
+    # Private methods
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [band.tobytes() for band in signature[:self.bands * self.rows].reshape(self.bands, self.rows)]
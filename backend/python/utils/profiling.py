@@ -0,0 +1,92 @@
+"""
+Startup profiling utilities for Cryptique Python services
+"""
+
+import time
+import psutil
+from typing import Dict, List, Optional, Any
+from dataclasses import dataclass
+from contextlib import contextmanager
+
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+@dataclass
+class StartupStage:
+    """Timing and memory cost of one startup stage"""
+    component: str
+    phase: str
+    duration: float
+    rss_delta_mb: float
+    error: Optional[str] = None
+
+class StartupProfiler:
+    """
+    Records import and initialisation time per component during service startup
+    """
+
+    def __init__(self):
+        self.stages: List[StartupStage] = []
+        self.process = psutil.Process()
+        self.created_at = time.time()
+
+    @contextmanager
+    def stage(self, component: str, phase: str = "init"):
+        """
+        Time a startup stage
+
+        Args:
+            component: Component name (e.g. "embedding_generator")
+            phase: Stage phase ("import", "init", "warmup")
+        """
+        start_time = time.time()
+        start_rss = self._rss_mb()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            stage = StartupStage(
+                component=component,
+                phase=phase,
+                duration=time.time() - start_time,
+                rss_delta_mb=self._rss_mb() - start_rss,
+                error=error
+            )
+            self.stages.append(stage)
+            logger.info(
+                f"Startup {phase} of {component} took {stage.duration:.3f}s "
+                f"(RSS {stage.rss_delta_mb:+.1f} MB)"
+            )
+
+    def get_report(self) -> Dict[str, Any]:
+        """Get the startup profile as a dictionary"""
+        components: Dict[str, Dict[str, float]] = {}
+        for stage in self.stages:
+            entry = components.setdefault(stage.component, {})
+            entry[f"{stage.phase}_seconds"] = entry.get(f"{stage.phase}_seconds", 0.0) + stage.duration
+            entry[f"{stage.phase}_rss_mb"] = entry.get(f"{stage.phase}_rss_mb", 0.0) + stage.rss_delta_mb
+
+        return {
+            'total_seconds': sum(stage.duration for stage in self.stages),
+            'rss_mb': self._rss_mb(),
+            'components': components,
+            'stages': [stage.__dict__ for stage in self.stages]
+        }
+
+    def _rss_mb(self) -> float:
+        """Current resident set size in MB"""
+        try:
+            return self.process.memory_info().rss / 1024 / 1024
+        except Exception:
+            return 0.0
+
+# Global startup profiler instance
+startup_profiler = StartupProfiler()
+
+def get_startup_profiler() -> StartupProfiler:
+    """Get global startup profiler instance"""
+    return startup_profiler
@@ -0,0 +1,173 @@
+"""
+Resilience utilities for Cryptique Python services
+Latency tracking, circuit breakers and hedged requests for remote providers
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from enum import Enum
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+import numpy as np
+
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+class CircuitState(Enum):
+    """Circuit breaker states"""
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+class CircuitOpenError(Exception):
+    """Raised when a request is rejected because its circuit is open"""
+
+class LatencyTracker:
+    """
+    Rolling window of request latencies. Thread-safe, since batch embedding
+    runs requests on several event loops at once.
+    """
+
+    def __init__(self, window: int = 500, min_samples: int = 20):
+        self.durations = deque(maxlen=window)
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def record(self, duration: float):
+        """Record a completed request's duration in seconds"""
+        with self._lock:
+            self.durations.append(duration)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """
+        Get a latency percentile
+
+        Args:
+            q: Percentile in 0-100
+
+        Returns:
+            Latency in seconds, or None until min_samples requests were recorded
+        """
+        with self._lock:
+            if len(self.durations) < self.min_samples:
+                return None
+            samples = np.fromiter(self.durations, dtype=np.float64, count=len(self.durations))
+        return float(np.percentile(samples, q))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'samples': len(self.durations),
+            'p50': self.percentile(50),
+            'p95': self.percentile(95)
+        }
+
+class CircuitBreaker:
+    """
+    Fails fast while a provider is degraded. After failure_threshold consecutive
+    failures the circuit opens and requests are rejected; once reset_timeout has
+    passed one trial request is let through per reset period (half-open), and the
+    first success closes the circuit again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CircuitState.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.rejections = 0
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """Whether a request may be sent now"""
+        with self._lock:
+            if self.state == CircuitState.CLOSED:
+                return True
+
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Admit a single trial; the next one waits for another reset period
+                self.state = CircuitState.HALF_OPEN
+                self.opened_at = time.monotonic()
+                return True
+
+            self.rejections += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CircuitState.CLOSED:
+                logger.info(f"Circuit {self.name} closed")
+            self.state = CircuitState.CLOSED
+            self.consecutive_failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == CircuitState.HALF_OPEN or (
+                self.state == CircuitState.CLOSED and self.consecutive_failures >= self.failure_threshold
+            ):
+                logger.warning(f"Circuit {self.name} opened after {self.consecutive_failures} consecutive failures")
+                self.state = CircuitState.OPEN
+                self.opened_at = time.monotonic()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'state': self.state.value,
+            'consecutive_failures': self.consecutive_failures,
+            'rejections': self.rejections
+        }
+
+async def hedged_request(
+    primary: Callable[[], Awaitable[T]],
+    backup: Callable[[], Optional[Awaitable[T]]],
+    delay: float
+) -> Tuple[T, bool]:
+    """
+    Run primary and, if it has not finished after delay seconds, start a backup.
+    Whichever succeeds first wins and the other is cancelled; if one fails the
+    other is still awaited.
+
+    Args:
+        primary: Factory for the primary request
+        backup: Factory for the backup request, called only when the delay passes;
+            may return None to skip hedging
+        delay: Seconds to wait before hedging
+
+    Returns:
+        Tuple of (result, whether the backup won)
+    """
+    first = asyncio.ensure_future(primary())
+    tasks = [first]
+
+    try:
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result(), False
+
+        backup_request = backup()
+        if backup_request is None:
+            return await first, False
+
+        second = asyncio.ensure_future(backup_request)
+        tasks.append(second)
+
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result(), task is second
+                error = task.exception()
+        raise error
+
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
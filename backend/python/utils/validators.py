@@ -240,6 +240,77 @@ class DataValidator:
                 'errors': [str(e)]
             }
     
+    def validate_embedding_batch(
+        self,
+        embeddings: Union[List[List[float]], List[np.ndarray], np.ndarray],
+        expected_dim: int = 1536
+    ) -> Dict[str, Any]:
+        """
+        Validate many embedding vectors in one vectorised pass
+        
+        Args:
+            embeddings: Embedding matrix of shape (n, d), or a list of vectors
+            expected_dim: Expected number of dimensions
+            
+        Returns:
+            Validation result with a per-row 'valid' mask, per-row 'errors',
+            per-row magnitudes and failure counts
+        """
+        try:
+            count = len(embeddings)
+            valid = np.zeros(count, dtype=bool)
+            magnitudes = np.zeros(count)
+            errors: List[List[str]] = [[] for _ in range(count)]
+            
+            # Rows with the wrong shape cannot be stacked; check them individually
+            rows = [np.asarray(embedding, dtype=np.float64) for embedding in embeddings]
+            shaped = np.array([row.ndim == 1 and row.shape[0] == expected_dim for row in rows], dtype=bool)
+            for i in np.flatnonzero(~shaped):
+                errors[i].append(
+                    'Embedding must be a 1D array' if rows[i].ndim != 1 else
+                    f'Embedding must have {expected_dim} dimensions, got {rows[i].shape[0]}'
+                )
+            
+            shaped_indices = np.flatnonzero(shaped)
+            if len(shaped_indices):
+                matrix = np.vstack([rows[i] for i in shaped_indices])
+                has_nan = np.isnan(matrix).any(axis=1)
+                has_inf = np.isinf(matrix).any(axis=1)
+                row_magnitudes = np.linalg.norm(np.where(np.isfinite(matrix), matrix, 0.0), axis=1)
+                zero = ~has_nan & ~has_inf & (row_magnitudes == 0)
+                
+                for mask, message in (
+                    (has_nan, 'Embedding contains NaN values'),
+                    (has_inf, 'Embedding contains infinite values'),
+                    (zero, 'Embedding has zero magnitude')
+                ):
+                    for i in shaped_indices[mask]:
+                        errors[i].append(message)
+                
+                valid[shaped_indices] = ~(has_nan | has_inf | zero)
+                magnitudes[shaped_indices] = row_magnitudes
+            
+            return {
+                'valid': valid,
+                'errors': errors,
+                'magnitudes': magnitudes,
+                'statistics': {
+                    'total': count,
+                    'valid': int(valid.sum()),
+                    'wrong_shape': int((~shaped).sum()),
+                    'invalid_values': int(count - valid.sum() - (~shaped).sum())
+                }
+            }
+            
+        except Exception as e:
+            logger.error(f"Error validating embedding batch: {e}")
+            return {
+                'valid': np.zeros(len(embeddings), dtype=bool),
+                'errors': [[str(e)] for _ in range(len(embeddings))],
+                'magnitudes': np.zeros(len(embeddings)),
+                'statistics': {'total': len(embeddings), 'valid': 0}
+            }
+    
     def validate_site_id(self, site_id: str) -> bool:
         """Validate site ID format"""
         if not isinstance(site_id, str):
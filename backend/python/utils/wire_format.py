@@ -0,0 +1,191 @@
+"""
+Wire formats for embedding API responses
+Fast JSON for ordinary fields, and base64, raw float32 or msgpack encodings for vectors
+"""
+
+import base64
+import json
+import time
+from typing import Any, Callable, Dict, List, Optional
+import numpy as np
+from fastapi.responses import Response
+
+from .logger import get_logger
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is listed in requirements.txt
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - msgpack is listed in requirements.txt
+    msgpack = None
+
+logger = get_logger(__name__)
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+BINARY_MEDIA_TYPE = "application/octet-stream"
+
+# Vector element type on the wire: little-endian float32
+WIRE_DTYPE = np.dtype('<f4')
+
+# Accept header media types -> wire format
+ACCEPTED_MEDIA_TYPES = {
+    MSGPACK_MEDIA_TYPE: "msgpack",
+    "application/x-msgpack": "msgpack",
+    BINARY_MEDIA_TYPE: "binary"
+}
+
+def dumps_json(payload: Any) -> bytes:
+    """
+    Encode a payload as JSON, with numpy arrays and scalars serialised natively
+
+    Args:
+        payload: JSON-compatible data, which may contain numpy values
+
+    Returns:
+        UTF-8 JSON bytes
+    """
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS, default=_json_default)
+    return json.dumps(payload, separators=(',', ':'), default=_json_default).encode('utf-8')
+
+def negotiate_wire_format(accept: Optional[str], encoding_format: str = "float") -> str:
+    """
+    Pick the response wire format
+
+    Args:
+        accept: Accept request header
+        encoding_format: "float" (JSON number lists) or "base64" (base64 float32 in JSON)
+
+    Returns:
+        One of "json", "base64", "msgpack" or "binary"
+    """
+    for media_range in (accept or "").split(','):
+        media_type = media_range.split(';')[0].strip().lower()
+        if media_type in ACCEPTED_MEDIA_TYPES:
+            wire_format = ACCEPTED_MEDIA_TYPES[media_type]
+            if wire_format == "msgpack" and msgpack is None:
+                logger.warning("msgpack requested but not installed; falling back to JSON")
+                continue
+            return wire_format
+    if encoding_format not in ("float", "base64"):
+        raise ValueError(f"Unsupported encoding_format: {encoding_format}")
+    return "base64" if encoding_format == "base64" else "json"
+
+def render_embeddings(payload: Dict[str, Any], vector_field: str, wire_format: str) -> Response:
+    """
+    Render an embedding response
+
+    Args:
+        payload: Response fields; payload[vector_field] is a vector or a list of
+            vectors (None for failed rows)
+        vector_field: Name of the vector field
+        wire_format: Format from negotiate_wire_format
+
+    Returns:
+        Response in the requested format. "binary" sends the vectors as a
+        row-major float32 matrix (NaN rows for failures) with the other fields
+        JSON-encoded in the X-Embedding-Metadata header
+    """
+    vectors = payload.get(vector_field)
+    single = vectors is not None and not isinstance(vectors, list)
+    rows = [vectors] if single else list(vectors or [])
+
+    if wire_format == "json":
+        return Response(dumps_json(payload), media_type=JSON_MEDIA_TYPE)
+
+    if wire_format == "base64":
+        encoded = [None if row is None else base64.b64encode(_to_wire(row)).decode('ascii') for row in rows]
+        body = {**payload, vector_field: encoded[0] if single else encoded, 'encoding': "base64", 'dtype': "float32"}
+        return Response(dumps_json(body), media_type=JSON_MEDIA_TYPE)
+
+    if wire_format == "msgpack":
+        packed = [None if row is None else _to_wire(row) for row in rows]
+        body = {**payload, vector_field: packed[0] if single else packed, 'dtype': "float32"}
+        return Response(msgpack.packb(body, default=_msgpack_default), media_type=MSGPACK_MEDIA_TYPE)
+
+    if wire_format == "binary":
+        dimensions = next((len(row) for row in rows if row is not None), 0)
+        matrix = np.full((len(rows), dimensions), np.nan, dtype=WIRE_DTYPE)
+        for i, row in enumerate(rows):
+            if row is not None:
+                matrix[i] = row
+        metadata = {key: value for key, value in payload.items() if key != vector_field}
+        return Response(
+            matrix.tobytes(),
+            media_type=BINARY_MEDIA_TYPE,
+            headers={
+                'X-Embedding-Count': str(len(rows)),
+                'X-Embedding-Dimensions': str(dimensions),
+                'X-Embedding-Dtype': "float32-le",
+                # ASCII-escaped, as header values are latin-1
+                'X-Embedding-Metadata': json.dumps(metadata, separators=(',', ':'), default=_json_default)
+            }
+        )
+
+    raise ValueError(f"Unsupported wire format: {wire_format}")
+
+def benchmark_wire_formats(
+    dimensions: int = 1536,
+    count: int = 100,
+    repeats: int = 5,
+    extra: Optional[Dict[str, Callable[[List[np.ndarray]], bytes]]] = None
+) -> Dict[str, Dict[str, float]]:
+    """
+    Time serialisation of a batch response in every wire format
+
+    Args:
+        dimensions: Vector dimensions
+        count: Vectors per response
+        repeats: Timed repetitions; the fastest is reported
+        extra: Additional named encoders of a vector list, e.g. a pydantic baseline
+
+    Returns:
+        Per format: microseconds and bytes per vector
+    """
+    rng = np.random.default_rng(0)
+    vectors = list(rng.normal(size=(count, dimensions)).astype(np.float32))
+    payload = {'success': True, 'total_processed': count, 'successful_count': count, 'failed_count': 0}
+
+    encoders: Dict[str, Callable[[List[np.ndarray]], bytes]] = {
+        'json_list': lambda rows: json.dumps({**payload, 'embeddings': [row.tolist() for row in rows]}).encode('utf-8'),
+        'json': lambda rows: render_embeddings({**payload, 'embeddings': rows}, 'embeddings', "json").body,
+        'base64': lambda rows: render_embeddings({**payload, 'embeddings': rows}, 'embeddings', "base64").body,
+        'binary': lambda rows: render_embeddings({**payload, 'embeddings': rows}, 'embeddings', "binary").body
+    }
+    if msgpack is not None:
+        encoders['msgpack'] = lambda rows: render_embeddings({**payload, 'embeddings': rows}, 'embeddings', "msgpack").body
+    encoders.update(extra or {})
+
+    results = {}
+    for name, encode in encoders.items():
+        best = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            body = encode(vectors)
+            best = min(best, time.perf_counter() - start)
+        results[name] = {
+            'microseconds_per_vector': best / count * 1e6,
+            'bytes_per_vector': len(body) / count
+        }
+    return results
+
+def _to_wire(vector: Any) -> bytes:
+    return np.asarray(vector, dtype=WIRE_DTYPE).tobytes()
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+def _msgpack_default(value: Any) -> Any:
+    if isinstance(value, np.ndarray):
+        return _to_wire(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)